@@ -6,7 +6,7 @@
 #-------------------------------------------------------------------------------
 import  collections, exceptions, subprocess, math, os
 
-from  MolarisTools.Utilities  import TokenizeLine
+from  MolarisTools.Utilities  import TokenizeLine, TableList
 from  MolarisTools.Parser     import PDBFile, PDBResidue, PDBAtom, GaussianOutputFile
 from  MolarisTools.Library    import ParametersLibrary
 
@@ -47,17 +47,54 @@ class AminoComponent (object):
 
     def __contains__ (self, label):
         """Check if an atom is present in a component."""
-        for atom in self.atoms:
-            if (atom.atomLabel == label):
-                return True
-        return False
+        (index, types) = self._GetAtomTable ()
+        return index.has_key (label)
 
     def __getitem__ (self, label):
         """Get an atom from a component."""
-        for atom in self.atoms:
-            if (atom.atomLabel == label):
-                return atom
-        raise exceptions.StandardError ("Atom %s not found." % label)
+        return self.atoms[self._FindAtom (label)]
+
+    @property
+    def atoms (self):
+        return self._atoms
+
+    @atoms.setter
+    def atoms (self, new):
+        """Atoms are kept in a copy of the given list, changes to the original list do not affect the component."""
+        self._atoms = new if isinstance (new, TableList) else TableList (new)
+
+    def _SetAtom (self, index, atom):
+        """Replace an atom in place."""
+        self._atoms[index] = atom
+
+    def _GetAtomTable (self):
+        """Get a dictionary of labels to indices of atoms (first atom wins) and a dictionary of labels to types (last atom wins).
+
+        The table is kept by the list of atoms and cleared whenever the list is changed (including atoms[i] = atom)."""
+        atoms = self._atoms
+        if atoms.table is None:
+            index = {}
+            types = {}
+            for (i, atom) in enumerate (atoms):
+                index.setdefault (atom.atomLabel, i)
+                types[atom.atomLabel] = atom.atomType
+            atoms.table = (index, types)
+        return atoms.table
+
+    def _FindAtom (self, label):
+        """Get the index of an atom."""
+        (index, types) = self._GetAtomTable ()
+        if not index.has_key (label):
+            raise exceptions.StandardError ("Atom %s not found." % label)
+        return index[label]
+
+    def _LabelsToTypes (self, terms):
+        """Convert terms made of atom labels to terms made of atom types."""
+        (index, types) = self._GetAtomTable ()
+        try:
+            return [tuple ([types[label] for label in term]) for term in terms]
+        except exceptions.KeyError as error:
+            raise exceptions.StandardError ("Atom %s not found." % error.args[0])
 
     @property
     def natoms (self):
@@ -83,6 +120,12 @@ class AminoComponent (object):
             return len (self.torsions)
         return 0
 
+    @property
+    def nimpropers (self):
+        if hasattr (self, "impropers"):
+            return len (self.impropers)
+        return 0
+
     @property
     def ngroups (self):
         if hasattr (self, "groups"):
@@ -303,14 +346,11 @@ class AminoComponent (object):
     def KillAtom (self, label, correctCharges=False):
         """Delete an atom from the component."""
         # . Remove from the list of atoms
+        self._FindAtom (label)
         newAtoms   = []
         for atom in self.atoms:
             if not atom.atomLabel == label:
                 newAtoms.append (atom)
-            else:
-                charge = atom.atomCharge
-        if len (newAtoms) == len (self.atoms):
-            raise exceptions.StandardError ("Atom %s not found." % label)
         self.atoms = newAtoms
         # . Add the charge of the killed atom to other charges in the same group
         if correctCharges:
@@ -352,18 +392,15 @@ class AminoComponent (object):
     def ReplaceAtom (self, label, newLabel, newType, newCharge):
         """Replace the label, type and charge of an atom."""
         # . Replace in the list of atoms
-        found    = False
+        self._FindAtom (label)
         newAtoms = []
         for atom in self.atoms:
             if atom.atomLabel == label:
-                found = True
                 atom  = AminoAtom (
                     atomLabel   =   newLabel   ,
                     atomType    =   newType    ,
                     atomCharge  =   newCharge  , )
             newAtoms.append (atom)
-        if not found:
-            raise exceptions.StandardError ("Atom %s not found." % label)
         self.atoms = newAtoms
         # . Replace in the list of bonds
         newBonds = []
@@ -530,15 +567,31 @@ class AminoComponent (object):
                 print line
 
 
+    def _GetBondGraph (self):
+        """Get a dictionary of atom labels and sorted indices of their bonds."""
+        graph = {}
+        for (i, (labela, labelb)) in enumerate (self.bonds):
+            graph.setdefault (labela, []).append (i)
+            if labelb != labela:
+                graph.setdefault (labelb, []).append (i)
+        return graph
+
+
     def GenerateAngles (self, logging=True):
-        """Automatically generate a list of angles."""
+        """Automatically generate a list of angles.
+
+        Only bonds that share an atom are compared, in the order of bonds. Of the two orientations
+        of an angle, the one found first is kept."""
         if not hasattr (self, "angles"):
             self.angles = []
-            # . Outer loop
+            graph  = self._GetBondGraph ()
+            unique = set ()
             for i, (bonda, bondb) in enumerate (self.bonds):
-                # . Inner loop
-                for j, (othera, otherb) in enumerate (self.bonds):
+                others = set (graph[bonda])
+                others.update (graph[bondb])
+                for j in sorted (others):
                     if i != j:
+                        (othera, otherb) = self.bonds[j]
                         angle = None
                         #   (a, b)
                         #      (c, d)
@@ -557,24 +610,33 @@ class AminoComponent (object):
                         elif bonda == othera:
                             angle = (otherb, bonda, bondb)
                         if angle:
-                            (a, b, c) = angle
-                            elgna = (c, b, a)
-                            if (angle not in self.angles) and (elgna not in self.angles):
+                            key = min (angle, angle[::-1])
+                            if key not in unique:
+                                unique.add (key)
                                 self.angles.append (angle)
             if logging:
                 print ("# . %s> Generated %d angles" % (_MODULE_LABEL, self.nangles))
 
 
     def GenerateTorsions (self, logging=True):
-        """Automatically generate a list of torsions (=dihedral angles)."""
+        """Automatically generate a list of torsions (=dihedral angles).
+
+        Only angles that share a bond are compared, in the order of angles."""
         if not hasattr (self, "torsions"):
             if hasattr (self, "angles"):
                 self.torsions = []
-                # . Outer loop
+                # . Indices of angles for each bond of their two bonds
+                graph  = {}
+                for (i, (anglea, angleb, anglec)) in enumerate (self.angles):
+                    for pair in ((anglea, angleb), (angleb, anglec)):
+                        graph.setdefault (min (pair, pair[::-1]), []).append (i)
+                unique = set ()
                 for i, (anglea, angleb, anglec) in enumerate (self.angles):
-                    # . Inner loop
-                    for j, (otherd, othere, otherf) in enumerate (self.angles):
+                    others = set (graph[min ((anglea, angleb), (angleb, anglea))])
+                    others.update (graph[min ((angleb, anglec), (anglec, angleb))])
+                    for j in sorted (others):
                         if i != j:
+                            (otherd, othere, otherf) = self.angles[j]
                             torsion = None
                             #   (a, b, c)
                             #      (d, e, f)
@@ -593,81 +655,60 @@ class AminoComponent (object):
                             elif (anglea == othere) and (angleb == otherd):
                                 torsion = (otherf, anglea, angleb, anglec)
                             if torsion:
-                                (a, b, c, d) = torsion
-                                noisrot = (d, c, b, a)
-                                if (torsion not in self.torsions) and (noisrot not in self.torsions):
+                                key = min (torsion, torsion[::-1])
+                                if key not in unique:
+                                    unique.add (key)
                                     self.torsions.append (torsion)
             if logging:
                 print ("# . %s> Generated %d torsions" % (_MODULE_LABEL, self.ntorsions))
 
 
-    def _BondsToTypes (self):
-        types  = []
-        for (bonda, bondb) in self.bonds:
+    def GenerateImpropers (self, logging=True):
+        """Automatically generate a list of improper torsions.
+
+        An improper torsion is generated for every atom bonded to exactly three other atoms,
+        as (central atom, first, second, third neighbor) with neighbors in the order of bonds."""
+        if not hasattr (self, "impropers"):
+            self.GenerateConnectivities ()
+            self.impropers = []
+            visited = set ()
             for atom in self.atoms:
-                if   atom.atomLabel == bonda:
-                    typea = atom.atomType
-                elif atom.atomLabel == bondb:
-                    typeb = atom.atomType
-            pair = (typea, typeb)
-            types.append (pair)
-        unique = []
-        for (typea, typeb) in types:
-            if (typea, typeb) not in unique:
-                if (typeb, typea) not in unique:
-                    pair = (typea, typeb)
-                    unique.append (pair)
-        return (types, unique)
+                label = atom.atomLabel
+                if label not in visited:
+                    visited.add (label)
+                    neighbors = self.connectivity[label]
+                    if len (set (neighbors)) == 3 and len (neighbors) == 3:
+                        self.impropers.append (tuple ([label, ] + neighbors))
+            if logging:
+                print ("# . %s> Generated %d impropers" % (_MODULE_LABEL, self.nimpropers))
+
+
+    def _UniqueTypes (self, types):
+        """Remove duplicate terms made of atom types, a term and its reverse are the same. The first occurrence wins."""
+        unique  = []
+        visited = set ()
+        for term in types:
+            key = min (term, term[::-1])
+            if key not in visited:
+                visited.add (key)
+                unique.append (term)
+        return unique
+
+
+    def _BondsToTypes (self):
+        types  = self._LabelsToTypes (self.bonds)
+        return (types, self._UniqueTypes (types))
 
 
     def _AnglesToTypes (self):
-        types  = []
-        for (anglea, angleb, anglec) in self.angles:
-            for atom in self.atoms:
-                if   atom.atomLabel == anglea:
-                    typea = atom.atomType
-                elif atom.atomLabel == angleb:
-                    typeb = atom.atomType
-                elif atom.atomLabel == anglec:
-                    typec = atom.atomType
-            triplet = (typea, typeb, typec)
-            types.append (triplet)
-        unique = []
-        for (typea, typeb, typec) in types:
-            if (typea, typeb, typec) not in unique:
-                if (typec, typeb, typea) not in unique:
-                    triplet = (typea, typeb, typec)
-                    unique.append (triplet)
-        return (types, unique)
+        types  = self._LabelsToTypes (self.angles)
+        return (types, self._UniqueTypes (types))
 
 
     def _TorsionsToTypes (self):
-        types   = []
-        for (torsiona, torsionb, torsionc, torsiond) in self.torsions:
-            for atom in self.atoms:
-                if   atom.atomLabel == torsiona:
-                    typea = atom.atomType
-                elif atom.atomLabel == torsionb:
-                    typeb = atom.atomType
-                elif atom.atomLabel == torsionc:
-                    typec = atom.atomType
-                elif atom.atomLabel == torsiond:
-                    typed = atom.atomType
-            quadruplet = (typea, typeb, typec, typed)
-            types.append (quadruplet)
-        unique  = []
-        for (typea, typeb, typec, typed) in types:
-            if (typea, typeb, typec, typed) not in unique:
-                if (typed, typec, typeb, typea) not in unique:
-                    quadruplet = (typea, typeb, typec, typed)
-                    unique.append (quadruplet)
-        general = []
-        for (typea, typeb, typec, typed) in types:
-            if (typeb, typec) not in general:
-                if (typec, typeb) not in general:
-                    pair = (typeb, typec)
-                    general.append (pair)
-        return (types, unique, general)
+        types   = self._LabelsToTypes (self.torsions)
+        general = self._UniqueTypes ([(typeb, typec) for (typea, typeb, typec, typed) in types])
+        return (types, self._UniqueTypes (types), general)
 
 
     def WriteTopology (self, writeTypes=False, filename=""):
@@ -770,11 +811,8 @@ class AminoComponent (object):
                 lines.append ("%3d    %-4s    %-4s    %-4s    %-4s%s" % (i, "@@", typeb, typec, "@@", par))
 
         lines.append ("*** Van der Waals and mass types ***")
-        atomUnique = []
-        for atom in self.atoms:
-            if atom.atomType not in atomUnique:
-                atomUnique.append (atom.atomType)
-        for i, atomType in enumerate (atomUnique, 1):
+        atomUnique = self._UniqueTypes ([(atom.atomType, ) for atom in self.atoms])
+        for i, (atomType, ) in enumerate (atomUnique, 1):
             par = ""
             if includeParameters:
                 vdw = parameters.GetVDW (atomType)
@@ -792,6 +830,19 @@ class AminoComponent (object):
             fo.close ()
 
 
+    def _CollectCoordinates (self, pdbResidue):
+        """Get PDB atoms in the order of atoms of the component."""
+        atomsPDB = {}
+        for atomPDB in pdbResidue.atoms:
+            atomsPDB.setdefault (atomPDB.label, atomPDB)
+        coordinates = []
+        for atom in self.atoms:
+            if not atomsPDB.has_key (atom.atomLabel):
+                raise exceptions.StandardError ("Atom %s not found in PDB file." % atom.atomLabel)
+            coordinates.append (atomsPDB[atom.atomLabel])
+        return coordinates
+
+
     def CalculateCharges (self, 
                           pdbResidue, 
                           ncpu=1, memory=1, 
@@ -813,16 +864,7 @@ class AminoComponent (object):
             raise exceptions.StandardError ("Wrong number of atoms.")
 
         # . Collect atomic coordinates
-        coordinates = []
-        for atom in self.atoms:
-            found = False
-            for atomPDB in pdbResidue.atoms:
-                if atom.atomLabel == atomPDB.label:
-                    found = True
-                    break
-            if not found:
-                raise exceptions.StandardError ("Atom %s not found in PDB file." % atom.atomLabel)
-            coordinates.append (atomPDB)
+        coordinates = self._CollectCoordinates (pdbResidue)
     
         # . Prepare filenames
         fError       =  os.path.join (workdir if (workdir != "") else ".", "job_%s.err" % self.label)
@@ -982,16 +1024,7 @@ class AminoComponent (object):
             raise exceptions.StandardError ("Wrong number of atoms.")
 
         # . Collect atomic coordinates
-        coordinates = []
-        for atom in self.atoms:
-            found = False
-            for atomPDB in pdbResidue.atoms:
-                if atom.atomLabel == atomPDB.label:
-                    found = True
-                    break
-            if not found:
-                raise exceptions.StandardError ("Atom %s not found in PDB file." % atom.atomLabel)
-            coordinates.append (atomPDB)
+        coordinates = self._CollectCoordinates (pdbResidue)
 
         # . Iterate groups
         results = []
@@ -1160,7 +1193,7 @@ class AminoComponent (object):
             atomType    =   atom.atomType   ,
             atomCharge  =   (atom.atomCharge + correction)  ,
             )
-        self.atoms[atomIndex] = atomNew
+        self._SetAtom (atomIndex, atomNew)
         if logging:
             print ("# . %s> Total charge of %s after correction is %f" % (_MODULE_LABEL, self.label, self.charge))
 
@@ -1307,11 +1340,10 @@ class AminoComponent (object):
             for label in group.labels:
                 # . Exclude dummy atoms
                 if (label[0] != "X"):
-                    for (i, atom) in enumerate (self.atoms):
-                        if (atom.atomLabel == label):
-                            pair = (i, atom)
-                            collect.append (pair)
-                            break
+                    if (label in self):
+                        i    = self._FindAtom (label)
+                        pair = (i, self.atoms[i])
+                        collect.append (pair)
             charges = []
             for (i, atom) in collect:
                 charges.append (atom.atomCharge)
@@ -1336,7 +1368,7 @@ class AminoComponent (object):
                     atomLabel   =   atom.atomLabel  ,
                     atomType    =   atom.atomType   ,
                     atomCharge  =   charge          , )
-                self.atoms[i] = newAtom
+                self._SetAtom (i, newAtom)
             if logging:
                 charge  = sum (charges)
                 prepare = "%%%d.%df" % (ndigits + 3, ndigits)
@@ -1384,13 +1416,12 @@ class AminoComponent (object):
         """Generate a table of bonds for every atom."""
         if not hasattr (self, "connectivity"):
             self.connectivity = {}
+            graph = self._GetBondGraph ()
             for atom in self.atoms:
                 table = []
-                for (labela, labelb) in self.bonds:
-                    if (atom.atomLabel == labela):
-                        table.append (labelb)
-                    elif (atom.atomLabel == labelb):
-                        table.append (labela)
+                for i in graph.get (atom.atomLabel, ()):
+                    (labela, labelb) = self.bonds[i]
+                    table.append (labelb if (atom.atomLabel == labela) else labela)
                 self.connectivity[atom.atomLabel] = table
 
 
@@ -17,7 +17,7 @@
 #
 import  exceptions, os
 
-from  MolarisTools.Utilities  import TokenizeLine
+from  MolarisTools.Utilities  import TokenizeLine, GetLibraryCache, RestoreFromCache, StoreInCache
 from  MolarisTools.Units      import DEFAULT_AMINO_LIB
 from  MolarisTools.Library    import AminoComponent, AminoGroup, AminoAtom, InternalCoordinate
 
@@ -31,15 +31,34 @@ class AminoLibrary (object):
 
     Can also read CHARMM topology files."""
 
-    def __init__ (self, filename=DEFAULT_AMINO_LIB, logging=True, reorder=True, unique=False, verbose=False, topologyFormat=_DEFAULT_TOPOLOGY_FORMAT, cutType=True):
-        """Constructor."""
+    # . Increase whenever parsing changes, so that old cache files are discarded
+    _PARSER_VERSION = 5
+
+    def __init__ (self, filename=DEFAULT_AMINO_LIB, logging=True, reorder=True, unique=False, verbose=False, topologyFormat=_DEFAULT_TOPOLOGY_FORMAT, cutType=True, cache=False, lazy=False):
+        """Constructor.
+
+        Parameter cache can be False (no caching, default), True (shared cache of libraries, see GetLibraryCache) or a ParseCache object.
+
+        With lazy, the library is only scanned for positions of components, which are parsed when first accessed.
+        Verbose parsing, which writes out every component, always reads the whole library."""
         self.filename = filename
-        if   topologyFormat == "Molaris":
-            self._Parse (reorder=reorder, unique=unique, logging=logging, verbose=verbose)
-        elif topologyFormat == "CHARMM":
-            self._ParseCHARMM (cutType=cutType, logging=logging, verbose=verbose)
-        else:
+        if topologyFormat not in ("Molaris", "CHARMM"):
             raise exceptions.StandardError ("Unknown topology format.")
+        logFlag  = (logging and verbose)
+        cache    = GetLibraryCache (False if logFlag else cache)
+        self._options = {"reorder" : reorder, "unique" : unique, "topologyFormat" : topologyFormat, "cutType" : cutType, }
+        if not RestoreFromCache (self, filename, cache, options=self._options):
+            if logging:
+                print ("# . %s> Parsing file \"%s\"" % (_MODULE_LABEL, self.filename))
+            if topologyFormat == "Molaris":
+                self._ScanMolaris (unique=unique)
+            else:
+                self._ScanCHARMM ()
+            if logFlag or (not lazy):
+                self._LoadAll (logFlag)
+                StoreInCache (self, filename, cache, options=self._options)
+        elif logging:
+            print ("# . %s> Loaded file \"%s\" from cache" % (_MODULE_LABEL, self.filename))
         if logging:
             print ("# . %s> Found %d component%s" % (_MODULE_LABEL, self.ncomponents, "s" if self.ncomponents != 1 else ""))
             if not verbose:
@@ -65,24 +84,26 @@ class AminoLibrary (object):
             raise exceptions.StopIteration ()
         else:
             self._i += 1
-        return self.components[self._i - 1]
+        return self._GetComponent (self._i - 1)
 
 
-    def _FindComponent (self, key):
+    def _FindPosition (self, key):
+        """Find the position of a component without parsing it (None if not found)."""
         if isinstance (key, int):
             # . Search by serial
-            for component in self.components:
-                if component.serial == key:
-                    return component
+            return self._serialIndex.get (key)
         elif isinstance (key, str):
             # . Search by name
-            for component in self.components:
-                if component.name == key:
-                    return component
-        else:
-            raise exceptions.StandardError ("Unknown type of key.")
-        # . Component not found
-        return None
+            return self._nameIndex.get (key)
+        raise exceptions.StandardError ("Unknown type of key.")
+
+
+    def _FindComponent (self, key):
+        position = self._FindPosition (key)
+        if position is None:
+            # . Component not found
+            return None
+        return self._GetComponent (position)
 
 
     def has_key (self, key):
@@ -91,11 +112,8 @@ class AminoLibrary (object):
 
 
     def __contains__ (self, key):
-        """Checks for a component in the library."""
-        component = self._FindComponent (key)
-        if component:
-            return True
-        return False
+        """Checks for a component in the library (components are not parsed)."""
+        return (self._FindPosition (key) is not None)
 
 
     def __getitem__ (self, key):
@@ -106,10 +124,17 @@ class AminoLibrary (object):
         return component
 
 
+    @property
+    def components (self):
+        """List of all components (components that were not accessed yet are parsed)."""
+        self._LoadAll ()
+        return self._components
+
+
     @property
     def ncomponents (self):
-        if hasattr (self, "components"):
-            return len (self.components)
+        if hasattr (self, "_keys"):
+            return len (self._keys)
         else:
             return 0
 
@@ -118,8 +143,7 @@ class AminoLibrary (object):
     def lastSerial (self):
         serial = 1
         if self.ncomponents > 1:
-            for component in self.components:
-                serial = component.serial
+            (serial, name) = self._keys[-1]
         return serial
 
 
@@ -141,16 +165,91 @@ class AminoLibrary (object):
         return (text, comment)
 
 
-    def _ParseCHARMM (self, cutType, logging, verbose):
-        data       = open (self.filename)
-        if logging:
-            print ("# . %s> Parsing file \"%s\"" % (_MODULE_LABEL, self.filename))
+    def _SetBlocks (self, offsets, keys):
+        """Set up positions of components in the file and indexes of their serials and names.
+
+        Components with repeated serials or names are found by the first occurrence."""
+        self._offsets     = offsets
+        self._keys        = keys
+        self._components  = [None, ] * len (keys)
+        self._serialIndex = {}
+        self._nameIndex   = {}
+        for (position, (serial, name)) in enumerate (keys):
+            self._serialIndex.setdefault (serial, position)
+            self._nameIndex.setdefault   (name  , position)
+
+
+    def _GetComponent (self, position):
+        """Get a component, parsing it on first access."""
+        component = self._components[position]
+        if component is None:
+            data      = open (self.filename)
+            component = self._ReadComponent (data, position)
+            data.close ()
+            self._components[position] = component
+        return component
+
+
+    def _LoadAll (self, logFlag=False):
+        """Parse all components that were not accessed yet."""
+        missing = [position for (position, component) in enumerate (self._components) if component is None]
+        if missing:
+            data = open (self.filename)
+            for position in missing:
+                self._components[position] = self._ReadComponent (data, position, logFlag=logFlag)
+            data.close ()
+
+
+    def _ReadComponent (self, data, position, logFlag=False):
+        data.seek (self._offsets[position])
+        if self._options["topologyFormat"] == "Molaris":
+            return self._ReadMolaris (data, reorder=self._options["reorder"], unique=self._options["unique"], logFlag=logFlag)
+        return self._ReadCHARMM (data, serial=(position + 1), cutType=self._options["cutType"], logFlag=logFlag)
+
+
+    def _ScanCHARMM (self):
+        """Find positions of components in a CHARMM topology file.
+
+        Components without atoms are skipped and serial numbers are given in order."""
+        data    = open (self.filename)
+        offsets = []
+        keys    = []
+        (offset, start, label, current, internal) = (0, None, None, False, False)
+        for line in data:
+            lineClean = line[:line.find ("!")].strip ()
+            if internal:
+                # . The line after a block of internal coordinates is not interpreted
+                internal = lineClean.startswith ("IC")
+            elif lineClean[:4] in ("RESI", "PRES", ):
+                if current and (start is not None):
+                    offsets.append (start)
+                    keys.append ((len (keys) + 1, label))
+                tokens  = TokenizeLine (lineClean, converters=[None, None, float])
+                (start, label, current) = (offset, tokens[1], False)
+            elif lineClean.startswith ("GROUP"):
+                current  = False
+            elif lineClean.startswith ("ATOM" ):
+                current  = True
+            elif lineClean.startswith ("IC"):
+                internal = True
+            offset += len (line)
+        data.close ()
+        if current and (start is not None):
+            offsets.append (start)
+            keys.append ((len (keys) + 1, label))
+        self._SetBlocks (offsets, keys)
+
+
+    def _ReadCHARMM (self, data, serial, cutType, logFlag):
+        # . Read the line that begins the component
+        line       = self._GetCleanLine (data)
+        tokens     = TokenizeLine (line, converters=[None, None, float])
+        (componentLabel, componentCharge) = tokens[1:]
         # . Initialize
         bonds      = []
         group      = []
         groups     = []
         internal   = []
-        components = []
         try:
             while True:
                 line = self._GetCleanLine (data)
@@ -169,19 +268,8 @@ class AminoLibrary (object):
                 #
                 # . Treat patches as components
                 if line[:4] in ("RESI", "PRES", ):
-                    if group:
-                        groups.append (group)
-                        # . Create a temporary component
-                        component = (componentLabel, componentCharge, groups, bonds, internal)
-                        components.append (component)
-                    # . Component begins
-                    tokens    = TokenizeLine (line, converters=[None, None, float])
-                    (componentLabel, componentCharge) = tokens[1:]
-                    # . Reinitialize
-                    bonds     = []
-                    group     = []
-                    groups    = []
-                    internal  = []
+                    # . Next component begins
+                    break
                 elif line.startswith ("GROUP"):
                     if group:
                         groups.append (group)
@@ -225,172 +313,176 @@ class AminoLibrary (object):
                         line = self._GetCleanLine (data)
         except StopIteration:
             pass
-        # . Finish up
-        data.close ()
         if group:
             groups.append (group)
-            component = (componentLabel, componentCharge, groups, bonds, internal)
-            components.append (component)
-        # . Set up actual amino components from temporary components
-        aminoComponents = []
-        for componentSerial, (componentLabel, componentCharge, groups, bonds, internalCoordinates) in enumerate (components, 1):
-            # . Merge atoms
-            aminoAtoms  = []
-            for group in groups:
-                for atom in group:
-                    aminoAtoms.append (atom)
-            aminoGroups = []
-            # . Iterate temporary groups
-            for igroup, group in enumerate (groups):
-                # . Merge atom labels
-                labels = []
-                for atom in group:
-                    labels.append (atom.atomLabel)
-                # . Create a group
-                natoms = len (group) 
-                aminoGroup = AminoGroup (
-                    radius      =   5.       ,
-                    natoms      =   natoms   ,
-                    labels      =   labels   ,
-                    symbol      =   chr (ord (_GROUP_START) + igroup) ,
-                    centralAtom =   group[natoms / 2].atomLabel       ,
-                    )
-                aminoGroups.append (aminoGroup)
-            # . Create a component
-            component = AminoComponent (
-                serial   =  componentSerial     ,
-                label    =  componentLabel      ,
-                groups   =  aminoGroups         ,
-                atoms    =  aminoAtoms          ,
-                bonds    =  bonds               ,
-                internal =  internalCoordinates ,
-                connect  =  ("",    "")         ,
-                logging  =  True if (logging and verbose) else False ,
-                title    =  "Generated from CHARMM topology"  ,
+        # . Merge atoms
+        aminoAtoms  = []
+        for group in groups:
+            for atom in group:
+                aminoAtoms.append (atom)
+        aminoGroups = []
+        # . Iterate temporary groups
+        for igroup, group in enumerate (groups):
+            # . Merge atom labels
+            labels = []
+            for atom in group:
+                labels.append (atom.atomLabel)
+            # . Create a group
+            natoms = len (group) 
+            aminoGroup = AminoGroup (
+                radius      =   5.       ,
+                natoms      =   natoms   ,
+                labels      =   labels   ,
+                symbol      =   chr (ord (_GROUP_START) + igroup) ,
+                centralAtom =   group[natoms / 2].atomLabel       ,
                 )
-            aminoComponents.append (component)
-        self.components = aminoComponents
+            aminoGroups.append (aminoGroup)
+        # . Create a component
+        component = AminoComponent (
+            serial   =  serial              ,
+            label    =  componentLabel      ,
+            groups   =  aminoGroups         ,
+            atoms    =  aminoAtoms          ,
+            bonds    =  bonds               ,
+            internal =  internal            ,
+            connect  =  ("",    "")         ,
+            logging  =  logFlag             ,
+            title    =  "Generated from CHARMM topology"  ,
+            )
+        return component
 
 
-    def _Parse (self, logging, reorder, unique, verbose):
-        components = []
-        names      = []
-        data       = open (self.filename)
-        if logging:
-            print ("# . %s> Parsing file \"%s\"" % (_MODULE_LABEL, self.filename))
-        try:
-            while True:
-                line = self._GetCleanLine (data)
-                # . Check if a new residue starts
-                if line.startswith ("---"):
-                    # . Get serial and name
-                    line, title  = self._GetLineWithComment (data)
-                    entry = TokenizeLine (line, converters=[None, ])[0]
-                    # . Remove spaces
-                    entry = entry.replace (" ", "")
-                    # . Check if last residue found
-                    if entry == "0":
-                        break
-                    for i, char in enumerate (entry):
-                        if not char.isdigit ():
-                            break
-                    componentSerial, name = int (entry[:i]), entry[i:]
-                    # . Check if the component label is unique
-                    if unique:
-                        if name in names:
-                            raise exceptions.StandardError ("Component label %s is not unique." % name)
-                        names.append (name)
-                    # . Get number of atoms
-                    line    = self._GetCleanLine (data)
-                    natoms  = int (line)
-                    # . Initiate conversion table serial->label
-                    convert = {}
-                    # . Read atoms
-                    atoms   = []
-                    labels  = []
-                    for i in range (natoms):
-                        line = self._GetCleanLine (data)
-                        atomNumber, atomLabel, atomType, atomCharge = TokenizeLine (line, converters=[int, None, None, float])
-                        if unique:
-                            # . Check if the atom label is unique
-                            if atomLabel in labels:
-                                raise exceptions.StandardError ("Component %s %d: Atom label %s is not unique." % (name, serial, atomLabel))
-                            labels.append (atomLabel)
-                        # . Create atom
-                        atom = AminoAtom (atomLabel=atomLabel, atomType=atomType, atomCharge=atomCharge)
-                        atoms.append (atom)
-                        # . Update conversion table serial->label
-                        convert[atomNumber] = atomLabel
-                    # . Get number of bonds
-                    line   = self._GetCleanLine (data)
-                    nbonds = int (line)
-                    # . Read bonds
-                    bonds  = []
-                    for i in range (nbonds):
-                        line = self._GetCleanLine (data)
-                        atoma, atomb = TokenizeLine (line, converters=[int, int])
-                        if reorder:
-                            # . Keep the lower number first
-                            if atoma > atomb:
-                                atoma, atomb = atomb, atoma
-                        bonds.append ((atoma, atomb))
-                    if reorder:
-                        # . Sort bonds
-                        bonds.sort (key=lambda bond: bond[0])
-                    # . Convert numerical bonds to labeled bonds
-                    labeledBonds = []
-                    for atoma, atomb in bonds:
-                        # . FIXME: Workaround for invalid entries in the amino file
-                        try:
-                            pair = (convert[atoma], convert[atomb])
-                            labeledBonds.append (pair)
-                        except:
-                            pass
-                    bonds = labeledBonds
-                    # . Read connecting atoms
-                    line  = self._GetCleanLine (data)
-                    seriala, serialb = TokenizeLine (line, converters=[int, int])
-                    # . Convert serials of connecting atoms to labels
-                    connecta, connectb = "", ""
-                    if seriala > 0:
-                        connecta = convert[seriala]
-                    if serialb > 0:
-                        connectb = convert[serialb]
-                    # . Read number of electroneutral groups
-                    line    = self._GetCleanLine (data)
-                    ngroups = int (line)
-                    # . Read groups
-                    groups  = []
-                    for i in range (ngroups):
-                        line     = self._GetCleanLine (data)
-                        nat, central, radius = TokenizeLine (line, converters=[int, int, float])
-                        line     = self._GetCleanLine (data)
-                        serials  = TokenizeLine (line, converters=[int] * nat)
-                        # . Convert central atom's serial to a label
-                        # . FIXME: Workaround for invalid entries in the amino file
-                        try:
-                            central  = convert[central]
-                            # . Convert serials to labels
-                            labels   = []
-                            for serial in serials:
-                                labels.append (convert[serial])
-                            symbol   = chr (ord (_GROUP_START) + i)
-                            group    = AminoGroup (natoms=nat, centralAtom=central, radius=radius, labels=labels, symbol=symbol)
-                            groups.append (group)
-                        except:
-                            pass
-                    # . Create a component and add it to the list
-                    logFlag = False
-                    if logging:
-                        if verbose:
-                            logFlag = True
-                    component = AminoComponent (serial=componentSerial, name=name, atoms=atoms, bonds=bonds, groups=groups, connect=(connecta, connectb), logging=logFlag, title=title)
-                    components.append (component)
-        except StopIteration:
-            pass
-        # . Finish up
+    def _SplitEntry (self, line):
+        """Get the serial and name of a component (an empty name if the library ends)."""
+        entry = TokenizeLine (line, converters=[None, ])[0]
+        # . Remove spaces
+        entry = entry.replace (" ", "")
+        # . Check if last residue found
+        if entry == "0":
+            return (0, "")
+        for i, char in enumerate (entry):
+            if not char.isdigit ():
+                break
+        return (int (entry[:i]), entry[i:])
+
+
+    def _ScanMolaris (self, unique):
+        """Find positions of components in a Molaris library."""
+        data    = open (self.filename)
+        offsets = []
+        keys    = []
+        names   = set ()
+        (offset, start) = (0, None)
+        for line in data:
+            if start is not None:
+                # . Get serial and name
+                (componentSerial, name) = self._SplitEntry (line[:line.find ("!")] if line.count ("!") else line)
+                if not name:
+                    break
+                # . Check if the component label is unique
+                if unique:
+                    if name in names:
+                        raise exceptions.StandardError ("Component label %s is not unique." % name)
+                    names.add (name)
+                offsets.append (start)
+                keys.append ((componentSerial, name))
+                start = None
+            # . Check if a new residue starts
+            elif line[:line.find ("!")].strip ().startswith ("---"):
+                start = offset
+            offset += len (line)
         data.close ()
-        self.components = components
+        self._SetBlocks (offsets, keys)
+
+
+    def _ReadMolaris (self, data, reorder, unique, logFlag):
+        # . Skip the line that begins the component
+        self._GetCleanLine (data)
+        # . Get serial and name
+        line, title  = self._GetLineWithComment (data)
+        (componentSerial, name) = self._SplitEntry (line)
+        # . Get number of atoms
+        line    = self._GetCleanLine (data)
+        natoms  = int (line)
+        # . Initiate conversion table serial->label
+        convert = {}
+        # . Read atoms
+        atoms   = []
+        labels  = set ()
+        for i in range (natoms):
+            line = self._GetCleanLine (data)
+            atomNumber, atomLabel, atomType, atomCharge = TokenizeLine (line, converters=[int, None, None, float])
+            if unique:
+                # . Check if the atom label is unique
+                if atomLabel in labels:
+                    raise exceptions.StandardError ("Component %s %d: Atom label %s is not unique." % (name, componentSerial, atomLabel))
+                labels.add (atomLabel)
+            # . Create atom
+            atom = AminoAtom (atomLabel=atomLabel, atomType=atomType, atomCharge=atomCharge)
+            atoms.append (atom)
+            # . Update conversion table serial->label
+            convert[atomNumber] = atomLabel
+        # . Get number of bonds
+        line   = self._GetCleanLine (data)
+        nbonds = int (line)
+        # . Read bonds
+        bonds  = []
+        for i in range (nbonds):
+            line = self._GetCleanLine (data)
+            atoma, atomb = TokenizeLine (line, converters=[int, int])
+            if reorder:
+                # . Keep the lower number first
+                if atoma > atomb:
+                    atoma, atomb = atomb, atoma
+            bonds.append ((atoma, atomb))
+        if reorder:
+            # . Sort bonds
+            bonds.sort (key=lambda bond: bond[0])
+        # . Convert numerical bonds to labeled bonds
+        labeledBonds = []
+        for atoma, atomb in bonds:
+            # . FIXME: Workaround for invalid entries in the amino file
+            try:
+                pair = (convert[atoma], convert[atomb])
+                labeledBonds.append (pair)
+            except:
+                pass
+        bonds = labeledBonds
+        # . Read connecting atoms
+        line  = self._GetCleanLine (data)
+        seriala, serialb = TokenizeLine (line, converters=[int, int])
+        # . Convert serials of connecting atoms to labels
+        connecta, connectb = "", ""
+        if seriala > 0:
+            connecta = convert[seriala]
+        if serialb > 0:
+            connectb = convert[serialb]
+        # . Read number of electroneutral groups
+        line    = self._GetCleanLine (data)
+        ngroups = int (line)
+        # . Read groups
+        groups  = []
+        for i in range (ngroups):
+            line     = self._GetCleanLine (data)
+            nat, central, radius = TokenizeLine (line, converters=[int, int, float])
+            line     = self._GetCleanLine (data)
+            serials  = TokenizeLine (line, converters=[int] * nat)
+            # . Convert central atom's serial to a label
+            # . FIXME: Workaround for invalid entries in the amino file
+            try:
+                central  = convert[central]
+                # . Convert serials to labels
+                labels   = []
+                for serial in serials:
+                    labels.append (convert[serial])
+                symbol   = chr (ord (_GROUP_START) + i)
+                group    = AminoGroup (natoms=nat, centralAtom=central, radius=radius, labels=labels, symbol=symbol)
+                groups.append (group)
+            except:
+                pass
+        # . Create a component
+        component = AminoComponent (serial=componentSerial, name=name, atoms=atoms, bonds=bonds, groups=groups, connect=(connecta, connectb), logging=logFlag, title=title)
+        return component
 
 
     def WriteAll (self, showGroups=False, showLabels=False):
@@ -406,11 +498,11 @@ class AminoLibrary (object):
     def WriteLabels (self, rowl=14, serials=False):
         """Write labels of all components."""
         line = ""
-        for (i, component) in enumerate (self.components, 1):
+        for (i, (serial, label)) in enumerate (self._keys, 1):
             if serials:
-                line = "%s   %3d %-3s" % (line, component.serial, component.label)
+                line = "%s   %3d %-3s" % (line, serial, label)
             else:
-                line = "%s  %3s" % (line, component.label)
+                line = "%s  %3s" % (line, label)
             if (i % rowl == 0):
                 print line
                 line = ""
@@ -6,7 +6,7 @@
 #-------------------------------------------------------------------------------
 import  collections, exceptions, math, os
 
-from MolarisTools.Utilities  import TokenizeLine
+from MolarisTools.Utilities  import TokenizeLine, GetLibraryCache, RestoreFromCache, StoreInCache, TableList
 from MolarisTools.Units      import DEFAULT_EVB_LIB
 
 
@@ -26,14 +26,47 @@ EVBScreenPair = collections.namedtuple ("EVBScreenPair" ,  "typea  typeb  mus")
 _MODULE_LABEL     = "EVBLib"
 _COMMENT_CHARS    = ("!", "#")
 
+# . Parameters of Morse pairs made from one-atom parameters by combination rules
+_DEFAULT_BETA            = 1.8
+_DEFAULT_FORCE_HARMONIC  = 400.
+_DEFAULT_RADIUS_HARMONIC = 1.4
+
+
+def _PairKey (parameter):
+    return tuple (sorted ((parameter.typea, parameter.typeb)))
+
+def _TypeKey (parameter):
+    return parameter.evbType
+
+# . Indexed parameters, with keys and whether the first of repeated entries is indexed
+# . (of repeated one-atom Morse parameters, the last ones were used)
+_INDEXES = {
+    "pairs"     :   (_PairKey , True ) ,
+    "morse"     :   (_TypeKey , False) ,
+    "angles"    :   (_TypeKey , True ) ,
+    "torsions"  :   (_PairKey , True ) ,
+    "solvdw"    :   (_TypeKey , True ) ,
+    "vdwevb"    :   (_TypeKey , True ) , }
+
 
 class EVBLibrary (object):
     """A class to represent a collection of EVB paramters."""
 
-    def __init__ (self, filename=DEFAULT_EVB_LIB, logging=True):
-        """Constructor."""
+    # . Increase whenever parsing changes, so that old cache files are discarded
+    _PARSER_VERSION = 1
+
+    def __init__ (self, filename=DEFAULT_EVB_LIB, logging=True, cache=False):
+        """Constructor.
+
+        Parameter cache can be False (no caching, default), True (shared cache of libraries, see GetLibraryCache) or a ParseCache object."""
         self.filename = filename
-        self._Parse (logging=logging)
+        cache = GetLibraryCache (cache)
+        if RestoreFromCache (self, filename, cache):
+            if logging:
+                print ("# . %s> Loaded %d parameters of file \"%s\" from cache" % (_MODULE_LABEL, self.nparameters, self.filename))
+        else:
+            self._Parse (logging=logging)
+            StoreInCache (self, filename, cache)
 
 
     def _GetLineWithComment (self, data):
@@ -429,6 +462,30 @@ class EVBLibrary (object):
             print ("# . %s> Total %d parameters read" % (_MODULE_LABEL, npar))
 
 
+    def _GetIndex (self, label):
+        """Get a dictionary of parameters with keys of atom types.
+
+        The dictionary is kept by the list of parameters and built again whenever the list is changed or replaced.
+        Keys of pairs are sorted, so that both orientations are found. Where the library has
+        repeated entries, the entry found first by a linear search is indexed."""
+        parameters = getattr (self, label, None)
+        if parameters is None:
+            return {}
+        if not isinstance (parameters, TableList):
+            parameters = TableList (parameters)
+            setattr (self, label, parameters)
+        if parameters.table is None:
+            (Key, first) = _INDEXES[label]
+            index = {}
+            for parameter in parameters:
+                if first:
+                    index.setdefault (Key (parameter), parameter)
+                else:
+                    index[Key (parameter)] = parameter
+            parameters.table = index
+        return parameters.table
+
+
     def PurgeTypes (self, types):
         """Purge library leaving only selected atom types."""
         if hasattr (self, "pairs"):
@@ -619,63 +676,87 @@ class EVBLibrary (object):
 
 
     def GetSolVDW (self, atomType):
-        if hasattr (self, "solvdw"):
-            for vdw in self.solvdw:
-                if vdw.evbType == atomType:
-                    return (vdw.repulsive, vdw.attractive)
+        vdw = self._GetIndex ("solvdw").get (atomType)
+        if vdw:
+            return (vdw.repulsive, vdw.attractive)
         return None
 
 
     def GetEvbVDW (self, atomType):
-        if hasattr (self, "vdwevb"):
-            for vdw in self.vdwevb:
-                if vdw.evbType == atomType:
-                    return (vdw.repulsive, vdw.attractive)
+        vdw = self._GetIndex ("vdwevb").get (atomType)
+        if vdw:
+            return (vdw.repulsive, vdw.attractive)
         return None
 
 
     def GetBond (self, typea, typeb):
+        """Get an EVBMorsePair or, if there is none, a tuple of two EVBMorseAtoms for combination rules."""
         # . Parameters for Morse pairs take precedence
-        if hasattr (self, "pairs"):
-            for pair in self.pairs:
-                if (pair.typea == typea and pair.typeb == typeb) or (pair.typea == typeb and pair.typeb == typea):
-                    (morseD, r0) = pair.morseAB, pair.rab
-                    # return (morseD, r0)
-                    return pair
+        pair = self._GetIndex ("pairs").get ((typea, typeb) if (typea <= typeb) else (typeb, typea))
+        if pair:
+            return pair
         # . No pairs found, search one-atom parameters
-        if hasattr (self, "morse"):
-            morsea = None
-            morseb = None
-            for morse in self.morse:
-                if   morse.evbType == typea:
-                    morsea = morse
-                elif morse.evbType == typeb:
-                    morseb = morse
-            if morsea and morseb:
-                # . Apply combination rules
-                morseD = math.sqrt (morsea.morseD * morseb.morseD)
-                r0     = morsea.radius + morseb.radius
-                # return (morseD, r0)
-                return (morsea, morseb)
+        morseIndex = self._GetIndex ("morse")
+        (morsea, morseb) = (morseIndex.get (typea), morseIndex.get (typeb))
+        if morsea and morseb:
+            return (morsea, morseb)
         return None
 
 
     def GetAngle (self, typea, typeb, typec):
-        if hasattr (self, "angles"):
-            for angle in self.angles:
-                if (angle.evbType == typeb):
-                    # return (angle.force, angle.angle0)
-                    return angle
-        return None
+        return self._GetIndex ("angles").get (typeb)
 
 
     def GetTorsion (self, typeb, typec):
-        if hasattr (self, "torsions"):
-            for torsion in self.torsions:
-                if (torsion.typea == typeb and torsion.typeb == typec) or (torsion.typea == typec and torsion.typeb == typeb):
-                    # return (torsion.force, torsion.periodicity, torsion.phase)
-                    return torsion
-        return None
+        return self._GetIndex ("torsions").get ((typeb, typec) if (typeb <= typec) else (typec, typeb))
+
+
+    def _CombineMorse (self, typea, typeb):
+        """Make an EVBMorsePair from one-atom parameters with combination rules, morseAB = sqrt (morseDa * morseDb) and rab = radiusa + radiusb."""
+        morseIndex = self._GetIndex ("morse")
+        (morsea, morseb) = (morseIndex[typea], morseIndex[typeb])
+        pair = EVBMorsePair (
+            typea           =  typea                                                  ,
+            typeb           =  typeb                                                  ,
+            morseAB         =  math.sqrt (morsea.morseD) * math.sqrt (morseb.morseD)  ,
+            rab             =  morsea.radius + morseb.radius                          ,
+            beta            =  _DEFAULT_BETA                                          ,
+            forceHarmonic   =  _DEFAULT_FORCE_HARMONIC                                ,
+            radiusHarmonic  =  _DEFAULT_RADIUS_HARMONIC                               , )
+        return pair
+
+
+    def Resolve (self, terms, logging=False):
+        """Get parameters of many terms at once.
+
+        Terms are tuples of atom types: pairs for bonds, triplets for angles and quartets for torsions.
+        Returns a list of parameters in the same order, with None for terms without parameters.
+        Bonds without an EVBMorsePair in the library get an EVBMorsePair made with combination rules.
+        Each unique term is looked up only once."""
+        found = {}
+        (pairIndex, morseIndex, angleIndex, torsionIndex) = map (self._GetIndex, ("pairs", "morse", "angles", "torsions"))
+        for term in terms:
+            term = tuple (term)
+            if term in found:
+                continue
+            nterm = len (term)
+            if   nterm == 2:
+                (typea, typeb) = term
+                key       = (typea, typeb) if (typea <= typeb) else (typeb, typea)
+                parameter = pairIndex.get (key)
+                if (not parameter) and (typea in morseIndex) and (typeb in morseIndex):
+                    parameter = self._CombineMorse (typea, typeb)
+                    if logging:
+                        print ("# . %s> Applying combination rules for atom types (%s, %s)" % (_MODULE_LABEL, typea, typeb))
+            elif nterm == 3:
+                parameter = angleIndex.get (term[1])
+            elif nterm == 4:
+                (typeb, typec) = term[1:3]
+                parameter = torsionIndex.get ((typeb, typec) if (typeb <= typec) else (typec, typeb))
+            else:
+                raise exceptions.StandardError ("Terms must have two, three or four atom types.")
+            found[term] = parameter
+        return [found[tuple (term)] for term in terms]
 
 
 #===============================================================================
@@ -6,7 +6,7 @@
 #-------------------------------------------------------------------------------
 import  collections, os
 
-from MolarisTools.Utilities  import TokenizeLine
+from MolarisTools.Utilities  import TokenizeLine, GetLibraryCache, RestoreFromCache, StoreInCache
 
 
 Bond        = collections.namedtuple ("Bond"        , "typea  typeb  k  r0")
@@ -23,10 +23,21 @@ _DEFAULT_PARM_LIB = os.path.join (os.environ["HOME"], "DNA_polymerase", "libs",
 class ParametersLibrary (object):
     """A class to represent parameters of the ENZYMIX force field."""
 
-    def __init__ (self, filename=_DEFAULT_PARM_LIB, logging=True):
-        """Constructor."""
+    # . Increase whenever parsing changes, so that old cache files are discarded
+    _PARSER_VERSION = 1
+
+    def __init__ (self, filename=_DEFAULT_PARM_LIB, logging=True, cache=False):
+        """Constructor.
+
+        Parameter cache can be False (no caching, default), True (shared cache of libraries, see GetLibraryCache) or a ParseCache object."""
         self.filename = filename
-        self._Parse (logging=logging)
+        cache = GetLibraryCache (cache)
+        if RestoreFromCache (self, filename, cache):
+            if logging:
+                print ("# . %s> Loaded parameters of file \"%s\" from cache" % (_MODULE_LABEL, self.filename))
+        else:
+            self._Parse (logging=logging)
+            StoreInCache (self, filename, cache)
 
     @property
     def nhbonds (self):
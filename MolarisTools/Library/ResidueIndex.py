@@ -0,0 +1,265 @@
+#-------------------------------------------------------------------------------
+# . File      : ResidueIndex.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+# . Fingerprints of bond graphs are calculated by refining colors of atoms
+# . (Weisfeiler-Lehman), starting from elements and, optionally, atom types.
+# . Graphs of the same fingerprint are checked atom by atom before matching.
+#
+import  collections, hashlib
+
+from  MolarisTools.Utilities  import GetLibraryCache, RestoreFromCache, StoreInCache
+from  MolarisTools.Library    import AminoComponent
+
+
+ResidueMatch = collections.namedtuple ("ResidueMatch", "component  mapping  indices  alternatives")
+_Graph       = collections.namedtuple ("_Graph"      , "labels  neighbors  colors  fingerprint")
+
+_MODULE_LABEL    = "ResidueIndex"
+_TWO_LETTERS     = ("CL", "BR", )
+
+
+def _Element (label):
+    """Guess the element of an atom from its label, leading digits (as in 1HB) are skipped."""
+    label = label.upper ().lstrip ("0123456789")
+    if label[:2] in _TWO_LETTERS:
+        return label[:2]
+    return label[:1]
+
+
+def _Hash (text):
+    return hashlib.md5 (text).hexdigest ()
+
+
+def _MakeGraph (labels, pairs, types=None):
+    """Make a graph from atom labels and pairs of indices of bonded atoms."""
+    natoms    = len (labels)
+    neighbors = [[] for i in range (natoms)]
+    for (i, j) in pairs:
+        neighbors[i].append (j)
+        neighbors[j].append (i)
+    if types is None:
+        colors = [_Hash (_Element (label)) for label in labels]
+    else:
+        colors = [_Hash ("%s/%s" % (_Element (label), atomType)) for (label, atomType) in zip (labels, types)]
+    # . Refine colors until the partition of atoms stops changing
+    nclasses = len (set (colors))
+    for step in range (natoms):
+        colors = [_Hash ("%s:%s" % (color, ",".join (sorted ([colors[j] for j in bonded])))) for (color, bonded) in zip (colors, neighbors)]
+        ncurrent = len (set (colors))
+        if ncurrent == nclasses:
+            break
+        nclasses = ncurrent
+    fingerprint = _Hash ("%d:%d:%s" % (natoms, len (pairs), ",".join (sorted (colors))))
+    return _Graph (labels=labels, neighbors=neighbors, colors=colors, fingerprint=fingerprint)
+
+
+def _ComponentGraph (component, useTypes=False):
+    labels = [atom.atomLabel for atom in component.atoms]
+    index  = {}
+    for (i, label) in enumerate (labels):
+        index.setdefault (label, i)
+    # . Bonds to atoms of neighboring residues are skipped
+    pairs  = [(index[labela], index[labelb]) for (labela, labelb) in component.bonds if (index.has_key (labela) and index.has_key (labelb))]
+    types  = [atom.atomType for atom in component.atoms] if useTypes else None
+    return _MakeGraph (labels, pairs, types)
+
+
+def _ResidueGraph (residue, bonds=None):
+    """Make a graph of a residue, either a component or a PDB residue.
+
+    Bonds of PDB residues are given as by PDBResidue.GetBonds or BondsFromDistances."""
+    if isinstance (residue, AminoComponent):
+        return _ComponentGraph (residue)
+    labels = [atom.label for atom in residue.atoms]
+    if bonds is None:
+        bonds = residue.GetBonds ()
+    pairs  = [(i, j) for ((i, seriala, labela), (j, serialb, labelb)) in bonds]
+    return _MakeGraph (labels, pairs)
+
+
+def _MapGraphs (graph, other):
+    """Find a one-to-one mapping of atoms of a graph to atoms of another graph that keeps all bonds, or None.
+
+    Atoms are only mapped to atoms of the same color. Among equivalent atoms, atoms of the same label are preferred."""
+    natoms = len (graph.labels)
+    if (len (other.labels) != natoms) or (sorted (graph.colors) != sorted (other.colors)):
+        return None
+    byColor = {}
+    for (j, color) in enumerate (other.colors):
+        byColor.setdefault (color, []).append (j)
+    # . Visit atoms in a breadth-first order, starting from the rarest colors, so that bonds restrict choices early
+    order   = []
+    visited = set ()
+    for start in sorted (range (natoms), key=lambda i: (len (byColor[graph.colors[i]]), i)):
+        if start in visited:
+            continue
+        visited.add (start)
+        queue = [start, ]
+        while queue:
+            i = queue.pop (0)
+            order.append (i)
+            for j in graph.neighbors[i]:
+                if j not in visited:
+                    visited.add (j)
+                    queue.append (j)
+    candidates = []
+    for i in order:
+        pool = byColor[graph.colors[i]]
+        candidates.append ([j for j in pool if other.labels[j] == graph.labels[i]] + [j for j in pool if other.labels[j] != graph.labels[i]])
+    # . Backtracking without recursion
+    assigned = {}
+    used     = set ()
+    cursors  = [0] * natoms
+    k        = 0
+    while 0 <= k < natoms:
+        i = order[k]
+        found = False
+        while cursors[k] < len (candidates[k]):
+            j = candidates[k][cursors[k]]
+            cursors[k] += 1
+            if j in used:
+                continue
+            if all ((assigned[n] in other.neighbors[j]) for n in graph.neighbors[i] if assigned.has_key (n)):
+                found = True
+                break
+        if found:
+            assigned[i] = j
+            used.add (j)
+            k += 1
+        else:
+            cursors[k] = 0
+            k -= 1
+            if k >= 0:
+                used.discard (assigned.pop (order[k]))
+    if k < 0:
+        return None
+    return assigned
+
+
+class _LibraryFingerprints (object):
+    """Fingerprints of all components of a library, kept in the cache of libraries next to the library itself."""
+
+    # . Increase whenever fingerprints change, so that old cache files are discarded
+    _PARSER_VERSION = 1
+
+    def __init__ (self, library, cache=False):
+        """Constructor."""
+        cache   = GetLibraryCache (cache)
+        options = dict (library._options, libraryVersion=library._PARSER_VERSION)
+        if not RestoreFromCache (self, library.filename, cache, options=options):
+            self.fingerprints      = []
+            self.typedFingerprints = []
+            for component in library.components:
+                self.fingerprints.append      (_ComponentGraph (component).fingerprint)
+                self.typedFingerprints.append (_ComponentGraph (component, useTypes=True).fingerprint)
+            StoreInCache (self, library.filename, cache, options=options)
+
+
+class ResidueIndex (object):
+    """An index of components of amino libraries by fingerprints of their bond graphs.
+
+    Fingerprints depend only on elements (guessed from atom labels) and bonds, so that residues
+    can be matched to components regardless of the labels and the order of their atoms."""
+
+    def __init__ (self, libraries=(), cache=False, logging=True):
+        """Constructor.
+
+        With cache, fingerprints of libraries are stored in the cache of libraries (see GetLibraryCache)."""
+        self.libraries = []
+        self.logging   = logging
+        self._cache    = cache
+        self._index    = {}
+        self._typed    = {}
+        for library in libraries:
+            self.Add (library)
+
+
+    def Add (self, library):
+        """Add all components of a library to the index."""
+        table  = _LibraryFingerprints (library, cache=self._cache)
+        serial = len (self.libraries)
+        self.libraries.append (library)
+        for (position, (fingerprint, typed)) in enumerate (zip (table.fingerprints, table.typedFingerprints)):
+            self._index.setdefault (fingerprint, []).append ((serial, position))
+            self._typed.setdefault (typed, []).append ((serial, position))
+        if self.logging:
+            print ("# . %s> Indexed %d components of library \"%s\"" % (_MODULE_LABEL, len (table.fingerprints), library.filename))
+
+
+    def _GetComponent (self, entry):
+        (serial, position) = entry
+        return self.libraries[serial]._GetComponent (position)
+
+
+    def Match (self, residue, bonds=None):
+        """Find a component that has the same bond graph as a residue (a PDBResidue or an AminoComponent).
+
+        For PDB residues without CONECT records, bonds can be given (for example, from BondsFromDistances).
+
+        Components of the same bond graph may differ in atom types or charges (for example, protonation states).
+        Of all matching components, the one of the same atom types (for components), then of the same label as the residue,
+        then with the fewest renamed atoms is used. The others are listed as alternatives and reported when logging.
+
+        Returns a ResidueMatch or None. Its mapping converts atom labels of the residue to atom labels of the component,
+        its indices give the index of the matching atom of the component for each atom of the residue."""
+        graph   = _ResidueGraph (residue, bonds)
+        typed   = self._typed.get (GraphFingerprint (residue, useTypes=True), ()) if isinstance (residue, AminoComponent) else ()
+        matches = []
+        for entry in self._index.get (graph.fingerprint, ()):
+            component = self._GetComponent (entry)
+            assigned  = _MapGraphs (graph, _ComponentGraph (component))
+            if assigned is not None:
+                indices = [assigned[i] for i in range (len (graph.labels))]
+                renamed = len ([label for (label, j) in zip (graph.labels, indices) if (component.atoms[j].atomLabel != label)])
+                rank    = (entry not in typed, component.label != residue.label, renamed)
+                matches.append ((rank, component, indices))
+        if not matches:
+            return None
+        matches.sort (key=lambda match: match[0])
+        (rank, component, indices) = matches[0]
+        mapping      = dict ((label, component.atoms[j].atomLabel) for (label, j) in zip (graph.labels, indices))
+        alternatives = [match[1] for match in matches[1:]]
+        if alternatives and self.logging:
+            labels = ", ".join ([other.label for other in alternatives])
+            print ("# . %s> Warning: Residue %s also matches component%s %s, using component %s" % (_MODULE_LABEL, residue.label, "s" if len (alternatives) > 1 else "", labels, component.label))
+        return ResidueMatch (component=component, mapping=mapping, indices=indices, alternatives=alternatives)
+
+
+    def FindDuplicates (self, useTypes=True):
+        """Find groups of components that have the same bond graph (and atom types), for example in different libraries.
+
+        Returns a list of groups, each group is a list of pairs (filename of library, label of component)."""
+        index      = self._typed if useTypes else self._index
+        duplicates = []
+        for fingerprint in sorted (index):
+            entries = index[fingerprint]
+            if len (entries) < 2:
+                continue
+            # . Split entries into groups of graphs that can be mapped onto each other
+            groups = []
+            for entry in entries:
+                graph = _ComponentGraph (self._GetComponent (entry), useTypes=useTypes)
+                for (representative, members) in groups:
+                    if _MapGraphs (graph, representative) is not None:
+                        members.append (entry)
+                        break
+                else:
+                    groups.append ((graph, [entry, ]))
+            for (representative, members) in groups:
+                if len (members) > 1:
+                    duplicates.append ([(self.libraries[serial].filename, self._GetComponent ((serial, position)).label) for (serial, position) in members])
+        return duplicates
+
+
+def GraphFingerprint (component, useTypes=False):
+    """Calculate a fingerprint of the bond graph of a component, optionally including atom types."""
+    return _ComponentGraph (component, useTypes=useTypes).fingerprint
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if __name__ == "__main__": pass
@@ -6,6 +6,7 @@
 #-------------------------------------------------------------------------------
 from AminoComponent      import AminoComponent, AminoGroup, AminoAtom, InternalCoordinate, MergeComponents
 from AminoLibrary        import AminoLibrary
+from ResidueIndex        import ResidueIndex, ResidueMatch, GraphFingerprint
 
 from EVBLibrary          import EVBLibrary, EVBMorseAtom, EVBMorsePair
 from ParametersLibrary   import ParametersLibrary
@@ -4,79 +4,147 @@
 # . Copyright : USC, Mikolaj Feliks (2015-2018)
 # . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
 #-------------------------------------------------------------------------------
+import  exceptions
+
+import  numpy
+
 from  MolarisTools.Utilities  import TokenizeLine
 
 
+class _PairView (object):
+    """A read-only mapping from pairs of atoms (in both orders) to columns of distances."""
+
+    def __init__ (self, distances, pairIndex):
+        self._distances = distances
+        self._pairIndex = pairIndex
+
+    def _Find (self, key):
+        if self._pairIndex.has_key (key):
+            return self._pairIndex[key]
+        (keya, keyb) = key
+        return self._pairIndex[(keyb, keya)]
+
+    def __getitem__ (self, key):
+        return self._distances[:, self._Find (key)]
+
+    def has_key (self, key):
+        try:
+            self._Find (key)
+        except exceptions.KeyError:
+            return False
+        return True
+
+    __contains__ = has_key
+
+    def keys (self):
+        keys = []
+        for (keya, keyb) in self._pairIndex.keys ():
+            keys.extend (((keya, keyb), (keyb, keya)))
+        return keys
+
+    def __iter__ (self):
+        return iter (self.keys ())
+
+    def __len__ (self):
+        return len (self._pairIndex) * 2
+
+    def values (self):
+        return [self[key] for key in self.keys ()]
+
+    def items (self):
+        return [(key, self[key]) for key in self.keys ()]
+
+
 class DistanceFile (object):
-    """A class to represent data from a dist.dat file."""
+    """A class to represent data from a dist.dat file.
+
+    Distances are kept in an array of shape (nsteps, npairs). Column of each pair of atoms is found in pairIndex."""
 
     def __init__ (self, filename):
         self.filename = filename
-        self.Parse_ToList ()
-        self.Parse_ToDictionary ()
+        self._Parse ()
 
     @property
     def npairs (self):
-        # . Do not include swapped pairs
-        return len (self.pairs) / 2
+        return self.distances.shape[1]
 
     @property
     def nsteps (self):
-        return len (self.steps)
+        return self.distances.shape[0]
 
+    @property
+    def steps (self):
+        """Distances of each step (rows of the distances array)."""
+        return self.distances
 
-    def Parse_ToList (self):
-        data  = open (self.filename)
-        steps = []
-        try:
-            while True:
-                line = data.next ()
-                if line.count ("steps"):
-                    pairs = []
-                    while True:
-                        line = data.next ()
-                        if not (line.count ("average distance") or line.strip () == ""):
-                            tokens = TokenizeLine (line, reverse=True, converters=[float, float, int, int, int])
-                            electro, distance, pairb, paira, step = tokens
-                            if step:
-                                if pairs:
-                                    steps.append (pairs)
-                                    pairs = []
-                            pairs.append (distance)
-        except StopIteration:
-            pass
-        data.close ()
-        if pairs:
-            steps.append (pairs)
-        self.steps  = steps
+    @property
+    def pairs (self):
+        """Distances of each pair, in both orders of atoms (columns of the distances array)."""
+        return _PairView (self.distances, self.pairIndex)
 
 
-    def Parse_ToDictionary (self):
-        data  = open (self.filename)
-        pairs = {}
+    def _Parse (self):
+        data   = open (self.filename)
+        values = []
+        keys   = []
+        nsteps = 0
         try:
             while True:
-                line = data.next ()
+                line = next (data)
                 if line.count ("steps"):
                     while True:
-                        line = data.next ()
+                        line = next (data)
                         if not (line.count ("average distance") or line.strip () == ""):
                             tokens = TokenizeLine (line, reverse=True, converters=[float, float, int, int, int])
                             electro, distance, pairb, paira, step = tokens
-                            key = (paira, pairb)
-                            if not pairs.has_key (key):
-                                pairs[key] = []
-                            distances = pairs[key]
-                            distances.append (distance)
+                            if step or (nsteps < 1):
+                                nsteps += 1
+                            # . Pairs are collected from the first step only
+                            if nsteps == 1:
+                                keys.append ((paira, pairb))
+                            values.append (distance)
         except StopIteration:
             pass
         data.close ()
-        # . Also create swapped pairs
-        for key in pairs.keys ():
-            keya, keyb = key
-            swap = (keyb, keya)
-            pairs[swap] = pairs[key]
-        self.pairs = pairs
+        npairs = len (keys)
+        if (npairs > 0) and (len (values) != (nsteps * npairs)):
+            raise exceptions.StandardError ("Steps in file %s have different numbers of pairs." % self.filename)
+        self.distances = numpy.array (values, dtype=numpy.float64).reshape ((nsteps, npairs))
+        self.pairIndex = {}
+        for (index, key) in enumerate (keys):
+            if not self.pairIndex.has_key (key):
+                self.pairIndex[key] = index
+
+
+    def GetDistances (self, paira, pairb):
+        """Get distances between two atoms in all steps (atoms can be given in any order)."""
+        return self.pairs[(paira, pairb)]
+
+
+    def Averages (self):
+        """Calculate average distances of all pairs."""
+        return self.distances.mean (axis=0)
+
+
+    def Fluctuations (self):
+        """Calculate fluctuations (standard deviations) of distances of all pairs."""
+        return self.distances.std (axis=0)
+
+
+    def Histograms (self, nbins=20, limits=None):
+        """Count distances of all pairs in common bins.
+
+        Returns a tuple (edges, counts), where counts has the shape (npairs, nbins).
+        As in numpy.histogram, the last bin includes its right edge and distances outside limits are not counted."""
+        if limits is None:
+            limits = (self.distances.min (), self.distances.max ())
+        edges   = numpy.linspace (limits[0], limits[1], nbins + 1)
+        indices = numpy.searchsorted (edges, self.distances, side="right") - 1
+        indices[self.distances == edges[-1]] = nbins - 1
+        inside  = (indices >= 0) & (indices < nbins)
+        columns = numpy.nonzero (inside)[1]
+        counts  = numpy.bincount (columns * nbins + indices[inside], minlength=(self.npairs * nbins))
+        return (edges, counts.reshape ((self.npairs, nbins)))
 
 
 #===============================================================================
@@ -4,14 +4,17 @@
 # . Copyright : USC, Mikolaj Feliks (2015-2018)
 # . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
 #-------------------------------------------------------------------------------
-import  collections, exceptions, os, math
+import  collections, exceptions, os
 
-from  MolarisTools.Utilities  import TokenizeLine
+import  numpy
+
+from  MolarisTools.Utilities  import TokenizeLine, MeasureDistances, MeasureAngles, MeasureDihedrals
 from  MolarisTools.Units      import DEFAULT_EVB_LIB
 from  MolarisTools.Parser     import MolarisInputFile
 
 
 EVBContainer = collections.namedtuple ("EVBContainer", "serials  types  exist")
+EVBTerms     = collections.namedtuple ("EVBTerms"    , "serials  types  exist")
 EVBBond     = collections.namedtuple ("EVBBond"    , "r0  alpha  diss  f_harm  r_harm  ptype")
 EVBAngle    = collections.namedtuple ("EVBAngle"   , "angle0  force  gausD  gausig  ptype")
 EVBTorsion  = collections.namedtuple ("EVBTorsion" , "force  n  phase  ptype")
@@ -20,6 +23,9 @@ _DEFAULT_FILENAME = os.path.join ("evb_heat_01", "evb.dat")
 _MODULE_LABEL     = "EVBDat"
 _ATOMS_PER_LINE   = 10
 _VMD_DIR          = "vmd"
+# . Attributes holding arrays of terms and their parameters
+_TERMS            = {"bonds" : "bondTerms", "angles" : "angleTerms", "torsions" : "torsionTerms", }
+_PARAMETERS       = {"bonds" : "parBonds" , "angles" : "parAngles" , "torsions" : "parTorsions" , }
 
 
 class EVBDatFile (object):
@@ -27,19 +33,64 @@ class EVBDatFile (object):
 
     def __init__ (self, filename=_DEFAULT_FILENAME, logging=True):
         """Constructor."""
-        self.filename = filename
+        self.filename    = filename
+        self._containers = {}
         self._Parse (logging=logging)
 
 
-    def _GetContainer (self, data, ntokens):
-        serials   = TokenizeLine (next (data), converters=([int, ] * ntokens    ))
-        types     = TokenizeLine (next (data), converters=([int, ] * self.nforms))
-        exist     = TokenizeLine (next (data), converters=([int, ] * self.nforms))
-        container = EVBContainer (
-            serials =   serials ,
-            types   =   types   ,
-            exist   =   exist   , )
-        return container
+    def _ReadTerms (self, data, nterms, natomsTerm):
+        """Read bonds, angles or torsions into integer arrays.
+
+        Each term takes three lines: serial numbers of atoms, parameter types in each form and exist flags in each form."""
+        lines   = [next (data) for i in range (nterms * 3)]
+        ncolumns = natomsTerm + 2 * self.nforms
+        tokens  = " ".join (lines).split ()
+        if len (tokens) != (nterms * ncolumns):
+            # . Lines have extra columns, read them one by one
+            tokens = []
+            for (i, line) in enumerate (lines):
+                tokens.extend (line.split ()[:(natomsTerm if (i % 3) == 0 else self.nforms)])
+        values  = numpy.array (tokens, dtype=numpy.int64).reshape ((nterms, ncolumns))
+        terms   = EVBTerms (
+            serials =   values[:, :natomsTerm]                                   ,
+            types   =   values[:, natomsTerm:natomsTerm + self.nforms]           ,
+            exist   =   values[:, natomsTerm + self.nforms:]                     , )
+        return terms
+
+
+    def _GetContainers (self, label):
+        # . Lists of EVBContainer tuples are built from arrays on first use, for compatibility
+        if not self._containers.has_key (label):
+            terms = self.__dict__.get (label)
+            if terms is None:
+                raise exceptions.AttributeError (label)
+            self._containers[label] = [EVBContainer (serials=serials, types=types, exist=exist) for (serials, types, exist) in zip (terms.serials.tolist (), terms.types.tolist (), terms.exist.tolist ())]
+        return self._containers[label]
+
+    @property
+    def bonds (self):
+        return self._GetContainers ("bondTerms")
+
+    @property
+    def angles (self):
+        return self._GetContainers ("angleTerms")
+
+    @property
+    def torsions (self):
+        return self._GetContainers ("torsionTerms")
+
+
+    def GetTerms (self, label, state=None):
+        """Get arrays of bonds, angles or torsions (label is "bonds", "angles" or "torsions").
+
+        If state is given, only terms that exist in this state are returned."""
+        terms = self.__dict__.get (_TERMS[label])
+        if terms is None:
+            return None
+        if state is not None:
+            select = (terms.exist[:, (state - 1)] != 0)
+            terms  = EVBTerms (serials=terms.serials[select], types=terms.types[select], exist=terms.exist[select])
+        return terms
 
 
     def _Parse (self, logging):
@@ -94,31 +145,19 @@ class EVBDatFile (object):
 
                 elif line.count ("bonds(atoms,types,exist)"):
                     (nbonds, foo) = TokenizeLine (line, converters=[int, None])
-                    bonds = []
-                    for i in range (nbonds):
-                        bond = self._GetContainer (data, 2)
-                        bonds.append (bond)
-                    self.bonds = bonds
+                    self.bondTerms = self._ReadTerms (data, nbonds, 2)
                     if logging:
                         print ("# . %s> Found %d EVB bonds" % (_MODULE_LABEL, nbonds))
 
                 elif line.count ("angles(atoms,types,exist)"):
                     (nangles, foo) = TokenizeLine (line, converters=[int, None])
-                    angles = []
-                    for i in range (nangles):
-                        angle = self._GetContainer (data, 3)
-                        angles.append (angle)
-                    self.angles = angles
+                    self.angleTerms = self._ReadTerms (data, nangles, 3)
                     if logging:
                         print ("# . %s> Found %d EVB angles" % (_MODULE_LABEL, nangles))
 
                 elif line.count (" torsions(atoms,types,exist)"):
                     (ntorsions, foo) = TokenizeLine (line, converters=[int, None])
-                    torsions = []
-                    for i in range (ntorsions):
-                        torsion = self._GetContainer (data, 4)
-                        torsions.append (torsion)
-                    self.torsions = torsions
+                    self.torsionTerms = self._ReadTerms (data, ntorsions, 4)
                     if logging:
                         print ("# . %s> Found %d EVB torsions" % (_MODULE_LABEL, ntorsions))
 
@@ -185,8 +224,24 @@ class EVBDatFile (object):
         return convert
 
 
+    def _GetParameterTable (self, label):
+        """Get parameters of bonds, angles or torsions as an array of floats, angles are converted to degrees.
+
+        The last column is the type of parameter."""
+        parameters = getattr (self, _PARAMETERS[label], [])
+        ncolumns   = len (EVBBond._fields if (label == "bonds") else EVBAngle._fields if (label == "angles") else EVBTorsion._fields)
+        table      = numpy.array (parameters, dtype=numpy.float64).reshape ((len (parameters), ncolumns))
+        if   label == "angles":
+            table[:, 0] = numpy.degrees (table[:, 0])
+        elif label == "torsions":
+            table[:, 2] = numpy.degrees (table[:, 2])
+        return table
+
+
     def Decode (self, filenameInput, state=1, digits=1, showOnly=(), extended=False, logging=True):
-        """Translate a DAT file into a list of parameters."""
+        """Translate a DAT file into a list of parameters.
+
+        Labels, atom types and parameters of all terms are looked up at once in arrays indexed by serial numbers and parameter types."""
         template = {
             "bonds"         :   "%4s  %4s  %X.Yf    %X.Yf    %X.Yf    %X.Yf    %X.Yf      (%d)"  ,
             "angles"        :   "%4s  %4s  %4s  %X.Yf    %X.Yf    %X.Yf    %X.Yf      (%d)"  ,
@@ -198,75 +253,42 @@ class EVBDatFile (object):
         for (key, string) in template.iteritems ():
             formats[key] = string.replace ("X", "%d" % (6 + digits)).replace ("Y", "%d" % digits)
         convert = self._GetConvert (filenameInput, state, logging, purify=False)
-    
-        print ("\n-- EVB bonds --")
-        for bond in self.bonds:
-            if bond.exist[(state - 1)]:
-                found = True
-                try:
-                    (i, j) = bond.serials
-                    (labela, typea), (labelb, typeb) = convert[i], convert[j]
-                except:
-                    found = False
+        # . Tables of labels and atom types indexed by serial numbers
+        size    = (max (convert) if convert else 0) + 1
+        known   = numpy.zeros (size, dtype=numpy.bool_)
+        labels  = numpy.empty (size, dtype=object)
+        atypes  = numpy.empty (size, dtype=object)
+        for (serial, (label, atype)) in convert.iteritems ():
+            (known[serial], labels[serial], atypes[serial]) = (True, label, atype)
+
+        for (label, title) in (("bonds", "Bond"), ("angles", "Angle"), ("torsions", "Torsion")):
+            print ("\n-- EVB %s --" % label)
+            terms = self.GetTerms (label, state=state)
+            if terms is None:
+                continue
+            serials = terms.serials
+            found   = ((serials > 0) & (serials < size))
+            found[found] = known[serials[found]]
+            found   = found.all (axis=1)
+            table   = self._GetParameterTable (label)
+            # . Terms with non-EVB atoms are only reported, so that they do not need parameters
+            rows    = numpy.zeros ((len (found), table.shape[1]))
+            rows[found] = table[terms.types[found, (state - 1)] - 1]
+            shown   = numpy.in1d (rows[:, -1], showOnly) if showOnly else numpy.ones (len (found), dtype=numpy.bool_)
+            lookup  = numpy.where (found[:, numpy.newaxis], serials, 0)
+            (format, formatExtended) = (formats[label], formats["%s_ext" % label])
+            for (isFound, isShown, row, name, atype, missing) in zip (found.tolist (), shown.tolist (), rows.tolist (), labels[lookup].tolist (), atypes[lookup].tolist (), serials.tolist ()):
+                if not isFound:
                     if logging:
-                        (seriala, serialb) = bond.serials
-                        print ("# . %s> Warning: Bond (%d, %d) involves non-EVB atoms" % (_MODULE_LABEL, seriala, serialb))
-                if found:
-                    select   = bond.types[(state - 1)]
-                    parBond  = self.parBonds[(select - 1)]
-                    if showOnly:
-                        if parBond.ptype not in showOnly:
-                            continue
-                    if extended:
-                        print (formats["bonds_ext"] % (labela, labelb, parBond.r0, parBond.alpha, parBond.diss, parBond.f_harm, parBond.r_harm, parBond.ptype, typea, typeb))
-                    else:
-                        print (formats["bonds"]     % (labela, labelb, parBond.r0, parBond.alpha, parBond.diss, parBond.f_harm, parBond.r_harm, parBond.ptype))
-    
-        print ("\n-- EVB angles --")
-        for angle in self.angles:
-            if angle.exist[(state - 1)]:
-                found = True
-                try:
-                    (i, j, k) = angle.serials
-                    (labela, typea), (labelb, typeb), (labelc, typec) = convert[i], convert[j], convert[k]
-                except:
-                    found = False
-                    if logging:
-                        (seriala, serialb, serialc) = angle.serials
-                        print ("# . %s> Warning: Angle (%d, %d, %d) involves non-EVB atoms" % (_MODULE_LABEL, seriala, serialb, serialc))
-                if found:
-                    select   = angle.types[(state - 1)]
-                    parAngle = self.parAngles[(select - 1)]
-                    if showOnly:
-                        if parAngle.ptype not in showOnly:
-                            continue
-                    if extended:
-                        print (formats["angles_ext"] % (labela, labelb, labelc, (parAngle.angle0 * 180. / math.pi), parAngle.force, parAngle.gausD, parAngle.gausig, parAngle.ptype, typea, typeb, typec))
-                    else:
-                        print (formats["angles"]     % (labela, labelb, labelc, (parAngle.angle0 * 180. / math.pi), parAngle.force, parAngle.gausD, parAngle.gausig, parAngle.ptype))
-    
-        print ("\n-- EVB torsions --")
-        for torsion in self.torsions:
-            if torsion.exist[(state - 1)]:
-                found = True
-                try:
-                    (i, j, k, l) = torsion.serials
-                    (labela, typea), (labelb, typeb), (labelc, typec), (labeld, typed) = convert[i], convert[j], convert[k], convert[l]
-                except:
-                    found = False
-                    if logging:
-                        (seriala, serialb, serialc, seriald) = torsion.serials
-                        print ("# . %s> Warning: Torsion (%d, %d, %d, %d) involves non-EVB atoms" % (_MODULE_LABEL, seriala, serialb, serialc, seriald))
-                if found:
-                    select     = torsion.types[(state - 1)]
-                    parTorsion = self.parTorsions[(select - 1)]
-                    if showOnly:
-                        if parTorsion.ptype not in showOnly:
-                            continue
-                    if extended:
-                        print (formats["torsions_ext"] % (labela, labelb, labelc, labeld, parTorsion.force, parTorsion.n, (parTorsion.phase * 180. / math.pi), parTorsion.ptype, typea, typeb, typec, typed))
-                    else:
-                        print (formats["torsions"]     % (labela, labelb, labelc, labeld, parTorsion.force, parTorsion.n, (parTorsion.phase * 180. / math.pi), parTorsion.ptype))
+                        print ("# . %s> Warning: %s (%s) involves non-EVB atoms" % (_MODULE_LABEL, title, ", ".join (map (str, missing))))
+                    continue
+                if not isShown:
+                    continue
+                row[-1] = int (row[-1])
+                if extended:
+                    print (formatExtended % tuple (name + row + atype))
+                else:
+                    print (format         % tuple (name + row))
 
 
     def GenerateVMDCommands (self, location=_VMD_DIR, state=1, filenameInput="", useLabels=False, logging=True):
@@ -378,6 +400,27 @@ class EVBDatFile (object):
                     self.torsionsValues.append (values)
 
 
+    def MeasureTrajectory (self, trajectory, state=1, wrapTorsions=False, logging=True):
+        """Measure bonds, angles and torsions of a state in all steps of a trajectory, without going through VMD.
+
+        The trajectory can be an XYZTrajectory, an FVXFile or any object with an array of coordinates of shape (nsteps, natoms, 3),
+        or the array itself. As in GenerateVMDCommands, serial numbers of EVB atoms are positions of atoms in the trajectory.
+
+        Results are stored in bondsValues, anglesValues and torsionsValues (as by ReadVMDFiles), as arrays of shape (nterms, nsteps).
+        Distances are in Angstroms and angles in degrees."""
+        coordinates = getattr (trajectory, "coordinates", trajectory)
+        for (attribute, measure, extra) in (
+                ("bonds"    , MeasureDistances , {}                       ),
+                ("angles"   , MeasureAngles    , {}                       ),
+                ("torsions" , MeasureDihedrals , {"wrap" : wrapTorsions}  ), ):
+            terms = self.GetTerms (attribute, state=state)
+            if terms is not None:
+                values  = measure (coordinates, terms.serials - 1, **extra)
+                setattr (self, "%sValues" % attribute, values.T)
+                if logging:
+                    print ("# . %s> Measured %d %s in %d steps" % (_MODULE_LABEL, len (terms.serials), attribute, values.shape[0]))
+
+
 #===============================================================================
 # . Main program
 #===============================================================================
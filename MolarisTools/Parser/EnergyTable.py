@@ -0,0 +1,192 @@
+#-------------------------------------------------------------------------------
+# . File      : EnergyTable.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+import  collections, exceptions
+
+import  numpy
+
+
+WindowSummary = collections.namedtuple ("WindowSummary", "window  nsteps  mean  std  drift")
+
+_MODULE_LABEL  = "EnergyTable"
+# . Arrays of an archive that are not energy families
+_KEY_OFFSETS   = "offsets"
+_KEY_NCOMPLETE = "ncomplete"
+_KEY_ORDER     = "order"
+
+
+class EnergyTable (object):
+    """A class to hold energies of MD steps in columns.
+
+    Each energy family (protein, water, evb, system, ...) is stored as a NumPy structured array
+    with one column per energy term and one row per MD step. MD steps of all FEP steps (windows)
+    are stored one after another, offsets[i]:offsets[i + 1] are the rows of the i-th window."""
+
+    def __init__ (self, families, offsets, ncomplete=None):
+        """Constructor."""
+        self.families  = families
+        self.offsets   = numpy.asarray (offsets, dtype=numpy.int64)
+        self.ncomplete = self.nwindows if (ncomplete is None) else ncomplete
+
+
+    @classmethod
+    def FromMDSteps (cls, fepSteps, energyFamilies, ncomplete=None):
+        """Create a table from a list of FEP steps, each being a list of MDStep objects.
+
+        energyFamilies is a sequence of (attribute, namedtuple) pairs.
+        Families that are missing in all steps are skipped, missing rows are filled with NaN."""
+        mdSteps = []
+        offsets = [0, ]
+        for fepStep in fepSteps:
+            mdSteps.extend (fepStep)
+            offsets.append (len (mdSteps))
+        nsteps   = len (mdSteps)
+        families = collections.OrderedDict ()
+        for (attribute, family) in energyFamilies:
+            rows = [getattr (mdStep, attribute, None) for mdStep in mdSteps]
+            if not any (rows):
+                continue
+            dtype  = [(field, numpy.float64) for field in family._fields]
+            table  = numpy.empty (nsteps, dtype=dtype)
+            blank  = (numpy.nan, ) * len (family._fields)
+            table[:] = [blank if (row is None) else tuple (row) for row in rows]
+            families[attribute] = table
+        return cls (families, offsets, ncomplete=ncomplete)
+
+
+    @property
+    def nsteps (self):
+        return int (self.offsets[-1])
+
+    @property
+    def nwindows (self):
+        return len (self.offsets) - 1
+
+    @property
+    def windows (self):
+        """Index of the window of each row."""
+        return numpy.repeat (numpy.arange (self.nwindows), numpy.diff (self.offsets))
+
+
+    def _GetRows (self, family, window=None):
+        if not self.families.has_key (family):
+            raise exceptions.StandardError ("Energy family %s not found." % family)
+        table = self.families[family]
+        if window is not None:
+            if (window < 0) or (window >= self.nwindows):
+                raise exceptions.StandardError ("Window %d out of range." % window)
+            table = table[self.offsets[window]:self.offsets[window + 1]]
+        return table
+
+
+    def Column (self, family, term, window=None):
+        """Get an energy term for all MD steps or MD steps of one window."""
+        table = self._GetRows (family, window)
+        if term not in table.dtype.names:
+            raise exceptions.StandardError ("Energy term %s not found in family %s." % (term, family))
+        return table[term]
+
+
+    def Average (self, family, term, window=None, skip=0):
+        """Calculate the average of an energy term, optionally skipping the first MD steps."""
+        column = self.Column (family, term, window)[skip:]
+        if column.size < 1:
+            return numpy.nan
+        return numpy.nanmean (column)
+
+
+    def RunningMean (self, family, term, window=None):
+        """Calculate the running (cumulative) average of an energy term.
+
+        As in Average, missing (NaN) values are skipped. Values before the first finite one are NaN."""
+        column = self.Column (family, term, window)
+        counts = numpy.cumsum (numpy.isfinite (column))
+        with numpy.errstate (invalid="ignore", divide="ignore"):
+            return numpy.nancumsum (column) / counts
+
+
+    def Drift (self, family, term, window=None):
+        """Calculate the drift of an energy term as the slope of a linear fit (energy per MD step)."""
+        column = self.Column (family, term, window)
+        mask   = numpy.isfinite (column)
+        if numpy.count_nonzero (mask) < 2:
+            return 0.
+        steps  = numpy.arange (column.size)
+        return numpy.polyfit (steps[mask], column[mask], 1)[0]
+
+
+    def Summarize (self, family, term, skip=0):
+        """Calculate the average, standard deviation and drift of an energy term for each window."""
+        summaries = []
+        for window in range (self.nwindows):
+            column = self.Column (family, term, window)[skip:]
+            nsteps = column.size
+            if nsteps > 0:
+                mean = numpy.nanmean (column)
+                std  = numpy.nanstd  (column)
+            else:
+                mean = std = numpy.nan
+            summary = WindowSummary (
+                window  =   window                              ,
+                nsteps  =   nsteps                              ,
+                mean    =   mean                                ,
+                std     =   std                                 ,
+                drift   =   self.Drift (family, term, window)   , )
+            summaries.append (summary)
+        return summaries
+
+
+    def WriteCSV (self, filename, families=None, logging=True):
+        """Write energy terms to a CSV file, one row per MD step."""
+        if families is None:
+            families = self.families.keys ()
+        labels  = ["step", "window", ]
+        columns = [numpy.arange (self.nsteps), self.windows, ]
+        for family in families:
+            table = self._GetRows (family)
+            for term in table.dtype.names:
+                labels.append ("%s.%s" % (family, term))
+                columns.append (table[term])
+        data    = numpy.column_stack (columns)
+        formats = ["%d", "%d", ] + ["%.4f", ] * (len (labels) - 2)
+        numpy.savetxt (filename, data, fmt=formats, delimiter=",", header=",".join (labels), comments="")
+        if logging:
+            print ("# . %s> Wrote %d MD steps to file %s" % (_MODULE_LABEL, self.nsteps, filename))
+
+
+    def WriteNPZ (self, filename, logging=True):
+        """Write the table to a NumPy archive, one array per energy family."""
+        arrays = dict (self.families)
+        arrays[_KEY_OFFSETS  ] = self.offsets
+        arrays[_KEY_NCOMPLETE] = numpy.array (self.ncomplete)
+        arrays[_KEY_ORDER    ] = numpy.array (self.families.keys (), dtype=str)
+        numpy.savez (filename, **arrays)
+        if logging:
+            print ("# . %s> Wrote %d MD steps to file %s" % (_MODULE_LABEL, self.nsteps, filename))
+
+
+    @classmethod
+    def FromNPZ (cls, filename):
+        """Read a table written by WriteNPZ."""
+        archive  = numpy.load (filename)
+        if _KEY_ORDER in archive.files:
+            order = archive[_KEY_ORDER].tolist ()
+        else:
+            # . Archives of older versions
+            order = sorted ([key for key in archive.files if key not in (_KEY_OFFSETS, _KEY_NCOMPLETE)])
+        families = collections.OrderedDict ()
+        for key in order:
+            families[key] = archive[key]
+        offsets   = archive[_KEY_OFFSETS]
+        ncomplete = int (archive[_KEY_NCOMPLETE]) if (_KEY_NCOMPLETE in archive.files) else None
+        archive.close ()
+        return cls (families, offsets, ncomplete=ncomplete)
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if __name__ == "__main__": pass
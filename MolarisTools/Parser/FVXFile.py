@@ -4,72 +4,212 @@
 # . Copyright : USC, Mikolaj Feliks (2015-2018)
 # . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
 #-------------------------------------------------------------------------------
-import collections, math
+import collections, exceptions, os
 
-from MolarisTools.Utilities  import TokenizeLine
+import numpy
 
 
 FVXAtom = collections.namedtuple ("Atom"  , "serial  charge  fx  fy  fz  vx  vy  vz  x  y  z  fm  vm")
 
+_MODULE_LABEL = "FVXFile"
+# . Serial, charge, force, velocity and coordinates of an atom
+_NVALUES      = 11
+_STORE_ARRAYS = ("serials", "charges", "forces", "velocities", "coordinates")
+
+
+class _FVXSteps (object):
+    """A sequence of steps of a fvx.dat file, built from arrays one step at a time."""
+
+    def __init__ (self, parent):
+        self.parent = parent
+
+
+    def __len__ (self):
+        return self.parent.nsteps
+
+
+    def _Build (self, istep):
+        parent     = self.parent
+        forces     = parent.forces     [istep]
+        velocities = parent.velocities [istep]
+        fms        = numpy.sqrt ((forces     ** 2).sum (axis=1))
+        vms        = numpy.sqrt ((velocities ** 2).sum (axis=1))
+        rows       = numpy.column_stack ((parent.charges[istep], forces, velocities, parent.coordinates[istep], fms, vms)).tolist ()
+        return [FVXAtom (int (serial), *row) for (serial, row) in zip (parent.serials.tolist (), rows)]
+
+
+    def __getitem__ (self, index):
+        if isinstance (index, slice):
+            return [self._Build (i) for i in range (*index.indices (len (self)))]
+        nsteps = len (self)
+        if index < 0:
+            index += nsteps
+        if (index < 0) or (index >= nsteps):
+            raise exceptions.IndexError ("Step index out of range.")
+        return self._Build (index)
+
+
+    def __iter__ (self):
+        for i in range (len (self)):
+            yield self._Build (i)
+
+
 class FVXFile (object):
-    """A class to represent data from a fvx.dat file."""
+    """A class to represent data from a fvx.dat file.
 
-    def __init__ (self, filename="fvx.dat"):
+    Data are kept in arrays of shape (nsteps, natoms) for charges and (nsteps, natoms, 3) for forces, velocities and coordinates.
+    If store is a directory, the arrays are written there as NPY files and memory-mapped, so that files larger than
+    the available memory can be read. The store can be opened later with FVXFile.FromStore."""
+
+    def __init__ (self, filename="fvx.dat", store=None, logging=False):
         """Constructor."""
         self.filename = filename
-        self._Parse ()
+        self.store    = store
+        self._Parse (logging=logging)
+
+
+    @classmethod
+    def FromStore (cls, store):
+        """Open arrays written to a store by a previous run, without parsing."""
+        new = cls.__new__ (cls)
+        new.filename = None
+        new.store    = store
+        for name in _STORE_ARRAYS:
+            setattr (new, name, numpy.load (os.path.join (store, "%s.npy" % name), mmap_mode="r"))
+        return new
 
 
     @property
     def nsteps (self):
-        return len (self.steps)
+        return self.charges.shape[0]
 
+    @property
+    def natoms (self):
+        return self.charges.shape[1]
 
-    def _Parse (self):
-        data  = open (self.filename)
-        steps = []
-        step  = []
+    @property
+    def forceMagnitudes (self):
+        """Magnitudes of forces, array of shape (nsteps, natoms)."""
+        return numpy.sqrt ((self.forces ** 2).sum (axis=2))
+
+    @property
+    def velocityMagnitudes (self):
+        """Magnitudes of velocities, array of shape (nsteps, natoms)."""
+        return numpy.sqrt ((self.velocities ** 2).sum (axis=2))
+
+    @property
+    def steps (self):
+        """Steps as lists of FVXAtom tuples (for compatibility), each step is built only when it is accessed."""
+        return _FVXSteps (self)
+
+
+    def _Scan (self):
+        """Count steps and atoms without converting any numbers."""
+        data   = open (self.filename)
+        counts = []
+        natoms = 0
+        for line in data:
+            if line.count ("trajec"):
+                if natoms > 0:
+                    counts.append (natoms)
+                natoms = 0
+            elif line.count ("atom"):
+                natoms += 1
+                # . Skip forces, velocities and coordinates
+                for i in range (3):
+                    next (data, None)
+        data.close ()
+        if natoms > 0:
+            counts.append (natoms)
+        if not counts:
+            return (0, 0)
+        if min (counts) != max (counts):
+            raise exceptions.StandardError ("Steps in file %s have different numbers of atoms." % self.filename)
+        return (len (counts), counts[0])
+
+
+    def _Allocate (self, name, shape, dtype=numpy.float64):
+        if self.store is None:
+            return numpy.empty (shape, dtype=dtype)
+        if not os.path.exists (self.store):
+            os.makedirs (self.store)
+        return numpy.lib.format.open_memmap (os.path.join (self.store, "%s.npy" % name), mode="w+", dtype=dtype, shape=shape)
+
+
+    def _Parse (self, logging=False):
+        (nsteps, natoms) = self._Scan ()
+        self.serials     = self._Allocate ("serials"     , (natoms, ), dtype=numpy.int64)
+        self.charges     = self._Allocate ("charges"     , (nsteps, natoms))
+        self.forces      = self._Allocate ("forces"      , (nsteps, natoms, 3))
+        self.velocities  = self._Allocate ("velocities"  , (nsteps, natoms, 3))
+        self.coordinates = self._Allocate ("coordinates" , (nsteps, natoms, 3))
+        data   = open (self.filename)
+        istep  = 0
+        values = []
         try:
             while True:
-                line   = data.next ()
+                line   = next (data)
                 if line.count ("trajec"):
-                    # . Found a new step
-                    tokens   = TokenizeLine (line, converters=[int, None])
-                    trajStep = tokens[0]
-                    if step:
-                        # . Save the previous step
-                        steps.append (step)
-                        step = []
+                    # . Found a new step, save the previous one
+                    if values:
+                        self._Store (istep, values)
+                        istep += 1
+                        values = []
                 elif line.count ("atom"):
-                    tokens     = TokenizeLine (line, converters=[None, None, int, float])
-                    serial, charge = tokens[2], tokens[3]
-                    # . Read forces
-                    line       = data.next ()
-                    tokens     = TokenizeLine (line, converters=[None, float, float, float])
-                    fx, fy, fz = tokens[1:]
-                    # . Read velocities
-                    line       = data.next ()
-                    tokens     = TokenizeLine (line, converters=[None, float, float, float])
-                    vx, vy, vz = tokens[1:]
-                    # . Read coordinates
-                    line       = data.next ()
-                    tokens     = TokenizeLine (line, converters=[None, float, float, float])
-                    x, y, z    = tokens[1:]
-                    # . Calculate the force    magnitude
-                    fm = math.sqrt (fx * fx + fy * fy + fz * fz)
-                    # . Calculate the velocity magnitude
-                    vm = math.sqrt (vx * vx + vy * vy + vz * vz)
-                    # . Create an atom and add it to the current step
-                    atom = FVXAtom (serial=serial, charge=charge, fx=fx, fy=fy, fz=fz, vx=vx, vy=vy, vz=vz, x=x, y=y, z=z, fm=fm, vm=vm)
-                    step.append (atom)
+                    # . Collect serial and charge, then forces, velocities and coordinates
+                    tokens = line.split ()
+                    values.extend (tokens[2:4])
+                    for i in range (3):
+                        tokens = next (data).split ()
+                        values.extend (tokens[1:4])
         except StopIteration:
             pass
         # . Close the file
         data.close ()
         # . Are there any steps left?
-        if step:
-            steps.append (step)
-        self.steps = steps
+        if values:
+            self._Store (istep, values)
+        if self.store is not None:
+            for name in _STORE_ARRAYS:
+                getattr (self, name).flush ()
+        if logging:
+            print ("# . %s> Read %d steps of %d atoms" % (_MODULE_LABEL, nsteps, natoms))
+
+
+    def _Store (self, istep, values):
+        # . Strings are converted to numbers in one call for the whole step
+        try:
+            data = numpy.array (values, dtype=numpy.float64).reshape ((-1, _NVALUES))
+        except exceptions.ValueError:
+            raise exceptions.StandardError ("Unable to read step %d of file %s." % (istep + 1, self.filename))
+        if istep == 0:
+            self.serials[:] = data[:, 0]
+        self.charges    [istep] = data[:, 1]
+        self.forces     [istep] = data[:, 2:5]
+        self.velocities [istep] = data[:, 5:8]
+        self.coordinates[istep] = data[:, 8:11]
+
+
+    def _FindAtom (self, serial):
+        if not hasattr (self, "_indices"):
+            self._indices = dict ((int (atomSerial), index) for (index, atomSerial) in enumerate (self.serials))
+        if not self._indices.has_key (serial):
+            raise exceptions.StandardError ("Atom %d not found." % serial)
+        return self._indices[serial]
+
+
+    # . Accessors return views of time series of one atom (no data are copied)
+    def GetCharge (self, serial):
+        return self.charges[:, self._FindAtom (serial)]
+
+    def GetForce (self, serial):
+        return self.forces[:, self._FindAtom (serial)]
+
+    def GetVelocity (self, serial):
+        return self.velocities[:, self._FindAtom (serial)]
+
+    def GetPosition (self, serial):
+        return self.coordinates[:, self._FindAtom (serial)]
 
 
 #===============================================================================
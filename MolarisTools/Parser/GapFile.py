@@ -4,44 +4,143 @@
 # . Copyright : USC, Mikolaj Feliks (2015-2018)
 # . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
 #-------------------------------------------------------------------------------
-import  collections
+import  collections, exceptions
 
-from MolarisTools.Utilities  import TokenizeLine
+import  numpy
+
+from MolarisTools.Utilities  import TokenizeLine, RestoreFromCache, StoreInCache, LogFollower
 
 
 GapStep = collections.namedtuple ("GapStep", "reference  target")
 
 _MODULE_LABEL = "GapFile"
 
+# . Number of lines of one step in a gap file from a regular EVB simulation
+_EVB_STEP_LINES = 5
+# . Number of energy terms of each state in a gap file from a regular EVB simulation
+_EVB_NTERMS     = 24
+# . Term used as the energy of a state
+_EVB_ENERGY     = 16
+
+
+def _ReadGapStep (line):
+    """Read a step of a gap file from an evb_to_qm_map type of simulation.
+
+    Returns a tuple (index, step)."""
+    tokens = TokenizeLine (line, converters=[int, float, float])
+    index, potentialReference, potentialTarget = tokens
+    step   = GapStep (
+        target    = potentialTarget     ,
+        reference = potentialReference  , )
+    return (index, step)
+
+
+def _ReadGapStepEVB (lines):
+    """Read a step of a gap file from a regular evb simulation.
+
+    Returns a tuple (index, step)."""
+    # . Read each step's header
+    line   = next (lines)
+    tokens = TokenizeLine (line, converters=[int, ])
+    index  = tokens[0]
+    # . Read data for state I
+    line   = next (lines)
+    tokens = TokenizeLine (line, converters=[float, ] * _EVB_NTERMS)
+    Ea     = tokens[_EVB_ENERGY]
+    line   = next (lines)
+    # . Read data for state II
+    line   = next (lines)
+    tokens = TokenizeLine (line, converters=[float, ] * _EVB_NTERMS)
+    Eb     = tokens[_EVB_ENERGY]
+    line   = next (lines)
+    step   = GapStep (
+        target    = Ea ,
+        reference = Eb , )
+    return (index, step)
+
+
+def _ToArray (lines, ncolumns):
+    """Convert lines of numbers to an array of shape (nlines, ncolumns) in one call.
+
+    Lines with more columns are truncated, which needs a slower conversion line by line."""
+    tokens = " ".join (lines).split ()
+    if len (tokens) != (len (lines) * ncolumns):
+        tokens = []
+        for line in lines:
+            columns = line.split ()[:ncolumns]
+            if len (columns) < ncolumns:
+                raise exceptions.StandardError ("Line has fewer than %d columns: %s" % (ncolumns, line.strip ()))
+            tokens.extend (columns)
+    return numpy.array (tokens, dtype=numpy.float64).reshape ((len (lines), ncolumns))
+
 
 class _GapFile (object):
     """Base class to represent a gap file.
 
+    Energies of the target and reference potentials are kept in arrays (one element per step).
     This class should not be used directly."""
 
-    def __init__ (self, filename, logging=True, ignoreStepZero=True):
-        """Constructor."""
+    # . Increase whenever parsing changes, so that old cache files are discarded
+    _PARSER_VERSION = 2
+
+    def __init__ (self, filename, logging=True, ignoreStepZero=True, cache=False):
+        """Constructor.
+
+        Parameter cache can be False (no caching), True (cache next to the file, to be trusted like code, see ParseCache) or a ParseCache object."""
         self.logging        = logging
         self.ignoreStepZero = ignoreStepZero
-        self._Parse (filename)
+        options = {"ignoreStepZero" : ignoreStepZero, }
+        if not RestoreFromCache (self, filename, cache, options=options):
+            self._Parse (filename)
+            StoreInCache (self, filename, cache, options=options)
 
 
     @property
     def nsteps (self):
-        if hasattr (self, "steps"):
-            return len (self.steps)
+        if hasattr (self, "target"):
+            return len (self.target)
         return 0
 
+    @property
+    def gaps (self):
+        """Energy gaps (target - reference) of all steps."""
+        return self.target - self.reference
+
+    @property
+    def steps (self):
+        """Steps as a list of GapStep tuples (for compatibility), built on first use."""
+        if getattr (self, "_steps", None) is None:
+            self._steps = map (GapStep._make, zip (self.reference.tolist (), self.target.tolist ()))
+        return self._steps
+
+
+    # . Names of arrays that are concatenated when files are merged
+    _ARRAYS = ("reference", "target")
+
+    def _Append (self, collect):
+        """Concatenate arrays of one or more sources (dictionaries of arrays) to the existing arrays."""
+        for name in self._ARRAYS:
+            arrays = [source[name] for source in collect]
+            if hasattr (self, name):
+                arrays = [getattr (self, name)] + arrays
+            setattr (self, name, numpy.concatenate (arrays))
+        self._steps = None
+
 
     def Extend (self, filename):
         """Extend with data from another file."""
         self._Parse (filename)
 
 
-    def CalculateLRATerm (self, skip=None, trim=None):
-        """Calculate an LRA term, eg. <Eqmmm - Eevb>qmmm  or  <Eqmmm - Eevb>evb.
+    def Merge (self, *others):
+        """Extend with data from other, already parsed gap files (arrays are concatenated only once)."""
+        for other in others:
+            if not isinstance (other, self.__class__):
+                raise exceptions.StandardError ("Cannot merge gap files of different types.")
+        self._Append ([dict ((name, getattr (other, name)) for name in self._ARRAYS) for other in others])
 
-        Skip and trim can be either numbers (absolute) or fractions (relative) of initial or final configurations to exclude from the calculation, respectively."""
+
+    def _GetBounds (self, skip, trim):
         collect = []
         for (parameter, comment) in ((skip, "first"), (trim, "last")):
             if   isinstance (parameter, int  ):
@@ -49,23 +148,30 @@ class _GapFile (object):
                     print ("# . %s> Skipping %s %d configurations" % (_MODULE_LABEL, comment, parameter))
                 nsteps = parameter
             elif isinstance (parameter, float):
+                nsteps = int (self.nsteps * parameter)
                 if self.logging:
                     percent = int (parameter * 100.)
-                    print ("# . %s> Skipping %s %d%% (%d) of configurations" % (_MODULE_LABEL, comment, percent, nparameter))
-                nsteps = int (self.nsteps * parameter)
+                    print ("# . %s> Skipping %s %d%% (%d) of configurations" % (_MODULE_LABEL, comment, percent, nsteps))
             else:
-                nsteps = -1
-            collect.append (nsteps)
+                nsteps = 0
+            collect.append (max (nsteps, 0))
         (nskip, ntrim) = collect
-        steps = self.steps
-        if nskip > 0:
-            steps = steps[nskip:]
-        if ntrim > 0:
-            steps = steps[:ntrim]
-        collect = 0.
-        for (n, step) in enumerate (steps):
-            collect += (step.target - step.reference)
-        return (collect / n)
+        return (nskip, self.nsteps - ntrim)
+
+
+    def CalculateLRATerm (self, skip=None, trim=None):
+        """Calculate an LRA term, eg. <Eqmmm - Eevb>qmmm  or  <Eqmmm - Eevb>evb.
+
+        Skip and trim can be either numbers (absolute) or fractions (relative) of initial or final configurations to exclude from the calculation, respectively."""
+        return float (self.SelectGaps (skip=skip, trim=trim).mean ())
+
+
+    def SelectGaps (self, skip=None, trim=None):
+        """Get energy gaps of configurations left after skipping and trimming (same parameters as in CalculateLRATerm)."""
+        (start, stop) = self._GetBounds (skip, trim)
+        if stop <= start:
+            raise exceptions.StandardError ("No configurations left after skipping and trimming.")
+        return self.gaps[start:stop]
 
 
     def _Parse (self, filename):
@@ -82,45 +188,31 @@ class GapFile (_GapFile):
 
 
     def _Parse (self, filename):
-        lines  = open (filename)
-        steps  = []
+        #                   0  0.00100000 0.00    2 0.0000 0.0000   0   0.0000000  -1.0000000
+        #       0       -7215.96    -1601300.60
+        #       1       -7230.30    -1601303.26
+        #   (...)
         if self.logging:
             print ("# . %s> Parsing file \"%s\"" % (_MODULE_LABEL, filename))
-        try:
-            #                   0  0.00100000 0.00    2 0.0000 0.0000   0   0.0000000  -1.0000000
-            #       0       -7215.96    -1601300.60
-            #       1       -7230.30    -1601303.26
-            #   (...)
-            # . Read and ignore header
-            line   = next (lines)
-            # . Read steps
-            while True:
-                line   = next (lines)
-                tokens = TokenizeLine (line, converters=[int, float, float])
-                index, potentialReference, potentialTarget = tokens
-                step   = GapStep (
-                    target    = potentialTarget     ,
-                    reference = potentialReference  , )
-                if index < 1:
-                    if self.ignoreStepZero:
-                        continue
-                steps.append (step)
-        except StopIteration:
-            pass
-        # . Finalize
-        lines.close ()
-        if hasattr (self, "steps"):
-            self.steps.extend (steps)
-        else:
-            self.steps = steps
+        lines = open (filename).readlines ()
+        # . Ignore the header and empty lines
+        lines = [line for line in lines[1:] if line.strip ()]
+        data  = _ToArray (lines, 3)
+        if self.ignoreStepZero:
+            data = data[data[:, 0] >= 1]
+        self._Append ([{"reference" : data[:, 1], "target" : data[:, 2], }, ])
         if self.logging:
-            nsteps = len (steps)
+            nsteps = len (data)
             print ("# . %s> Read %d steps" % (_MODULE_LABEL, nsteps))
 
 
 #-------------------------------------------------------------------------------
 class GapFileEVB (_GapFile):
-    """A class to represent a gap file from a regular evb simulation."""
+    """A class to represent a gap file from a regular evb simulation.
+
+    All energy terms of states I and II are kept in arrays termsI and termsII of shape (nsteps, 24)."""
+
+    _ARRAYS = ("reference", "target", "termsI", "termsII")
 
     def __init__ (self, filename, **keywordArguments):
         """Constructor."""
@@ -128,53 +220,83 @@ class GapFileEVB (_GapFile):
 
 
     def _Parse (self, filename):
-        lines  = open (filename)
-        steps  = []
+        #                   0  0.00100000 0.00    2 0.0000 1.0000   0   0.0000000  -1.0000000
+        # -233.01     0.00    0.03      0.10    0.00  -251.70    0.00    18.55    0.00  -214.51    0.00    0.00    0.22   -18.86    0.00    0.00    1.76  -9648.77    0.00    0.00    0.00    0.00    6.96    0.00
+        #    0.00     0.00    0.00 0  0
+        #    0.00  -233.01    0.03      0.10    0.00  -251.70    0.00    18.55    0.00  -214.51    0.00    0.00    0.22   -18.86    0.00    0.00   10.08  -9648.77    0.00    0.00    0.00    0.00    6.96    0.00
+        #    0.00     0.00    0.00 0  0
         if self.logging:
             print ("# . %s> Parsing file \"%s\"" % (_MODULE_LABEL, filename))
-        try:
-            #                   0  0.00100000 0.00    2 0.0000 1.0000   0   0.0000000  -1.0000000
-            # -233.01     0.00    0.03      0.10    0.00  -251.70    0.00    18.55    0.00  -214.51    0.00    0.00    0.22   -18.86    0.00    0.00    1.76  -9648.77    0.00    0.00    0.00    0.00    6.96    0.00
-            #    0.00     0.00    0.00 0  0
-            #    0.00  -233.01    0.03      0.10    0.00  -251.70    0.00    18.55    0.00  -214.51    0.00    0.00    0.22   -18.86    0.00    0.00   10.08  -9648.77    0.00    0.00    0.00    0.00    6.96    0.00
-            #    0.00     0.00    0.00 0  0
-            while True:
-                # . Read each step's header
-                line   = next (lines)
-                tokens = TokenizeLine (line, converters=[int, ])
-                index  = tokens[0]
-                # . Read data for state I
-                line   = next (lines)
-                tokens = TokenizeLine (line, converters=[float, ] * 24)
-                # TODO: Include other terms too
-                Ea     = tokens[16]
-                line   = next (lines)
-                # . Read data for state II
-                line   = next (lines)
-                tokens = TokenizeLine (line, converters=[float, ] * 24)
-                # TODO: Include other terms too
-                Eb     = tokens[16]
-                line   = next (lines)
-                step   = GapStep (
-                    target    = Ea ,
-                    reference = Eb , )
-                if index < 1:
-                    if self.ignoreStepZero:
-                        continue
-                steps.append (step)
-        except StopIteration:
-            pass
-        # . Finalize
-        lines.close ()
-        if hasattr (self, "steps"):
-            self.steps.extend (steps)
-        else:
-            self.steps = steps
+        lines   = [line for line in open (filename).readlines () if line.strip ()]
+        # . An incomplete last step is ignored
+        nsteps  = len (lines) / _EVB_STEP_LINES
+        lines   = lines[:nsteps * _EVB_STEP_LINES]
+        indices = _ToArray (lines[0::_EVB_STEP_LINES], 1)[:, 0]
+        termsI  = _ToArray (lines[1::_EVB_STEP_LINES], _EVB_NTERMS)
+        termsII = _ToArray (lines[3::_EVB_STEP_LINES], _EVB_NTERMS)
+        if self.ignoreStepZero:
+            mask    = (indices >= 1)
+            termsI  = termsI [mask]
+            termsII = termsII[mask]
+        self._Append ([{"reference" : termsII[:, _EVB_ENERGY], "target" : termsI[:, _EVB_ENERGY], "termsI" : termsI, "termsII" : termsII, }, ])
         if self.logging:
-            nsteps = len (steps)
+            nsteps = len (termsI)
             print ("# . %s> Read %d steps" % (_MODULE_LABEL, nsteps))
 
 
+#-------------------------------------------------------------------------------
+class GapFileFollower (LogFollower):
+    """A class for reading a growing gap file.
+
+    Each call to Poll returns a list of GapStep tuples written since the previous call.
+    Set evb to True for gap files from regular evb simulations."""
+
+    def __init__ (self, filename, evb=False, ignoreStepZero=True, logging=False):
+        """Constructor."""
+        self.evb            = evb
+        self.ignoreStepZero = ignoreStepZero
+        super (GapFileFollower, self).__init__ (filename, logging=logging)
+
+
+    def Reset (self):
+        """Start reading again from the beginning of the file."""
+        super (GapFileFollower, self).Reset ()
+        self.nsteps     = 0
+        self._header    = False
+
+
+    @property
+    def ncompleted (self):
+        return self.nsteps
+
+
+    def _AddStep (self, index, step):
+        self.nsteps += 1
+        if (index < 1) and self.ignoreStepZero:
+            return
+        self._items.append (step)
+
+
+    def _ProcessLine (self, line):
+        if not line.strip ():
+            return
+        if self.evb:
+            if self._block is None:
+                self._block = []
+            self._block.append (line)
+            if len (self._block) == _EVB_STEP_LINES:
+                (index, step) = _ReadGapStepEVB (iter (self._block))
+                self._AddStep (index, step)
+                self._block = None
+        else:
+            if not self._header:
+                # . Skip the header
+                self._header = True
+            else:
+                (index, step) = _ReadGapStep (line)
+                self._AddStep (index, step)
+
+
 #===============================================================================
 # . Main program
 #===============================================================================
@@ -7,7 +7,7 @@
 import collections, exceptions
 
 from  MolarisTools.Units     import atomicNumberToSymbol, HARTREE_TO_KCAL_MOL, HARTREE_BOHR_TO_KCAL_MOL_ANGSTROM
-from  MolarisTools.Utilities import TokenizeLine, WriteData
+from  MolarisTools.Utilities import TokenizeLine, WriteData, RestoreFromCache, StoreInCache
 
 Atom        = collections.namedtuple ("Atom"     , "symbol  x  y  z  charge")
 Force       = collections.namedtuple ("Force"    , "x  y  z")
@@ -24,10 +24,17 @@ ElectricProperty = collections.namedtuple ("ElectricProperty" , "x  y  z  ex  ey
 class GaussianOutputFile (object):
     """A class to read a Gaussian output file."""
 
-    def __init__ (self, filename="run_gauss.out"):
-        """Constructor."""
+    # . Increase whenever parsing changes, so that old cache files are discarded
+    _PARSER_VERSION = 1
+
+    def __init__ (self, filename="run_gauss.out", cache=False):
+        """Constructor.
+
+        Parameter cache can be False (no caching), True (cache next to the file, to be trusted like code, see ParseCache) or a ParseCache object."""
         self.inputfile = filename
-        self._Parse ()
+        if not RestoreFromCache (self, filename, cache):
+            self._Parse ()
+            StoreInCache (self, filename, cache)
 
 
     def _Parse (self):
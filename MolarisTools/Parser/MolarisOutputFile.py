@@ -7,9 +7,12 @@
 #
 # . This module needs a clean-up
 #
-import exceptions, collections, math
+import exceptions, collections, math, re
 
-from MolarisTools.Utilities  import TokenizeLine
+import numpy
+
+from MolarisTools.Utilities  import TokenizeLine, RestoreFromCache, StoreInCache, LogFollower
+from EnergyTable             import EnergyTable
 
 
 Protein   =  collections.namedtuple ("Protein"  ,  " ebond    ethet     ephi    eitor    evdw     emumu     ehb_pp  ")
@@ -32,23 +35,205 @@ Residue   = collections.namedtuple ("Residue" ,   "label  serial  atoms")
 
 EVBComponents = collections.namedtuple ("EVBComponents", "density  Etotal  Egas  Ebond  Eangle  Etorsion  Eqmu  Eind  Evdw  Ebulk")
 QMMMComponents = collections.namedtuple ("QMMMComponents", "Eevb  Eclassical  Equantum  Eqmmm")
+MolarisUpdate  = collections.namedtuple ("MolarisUpdate" , "mdSteps  qmmmComponentsI  qmmmComponentsII  nfepSteps")
+
+# . Attributes of MDStep and the corresponding energy terms
+_ENERGY_FAMILIES = (
+    ("protein"  ,   Protein   ),
+    ("water"    ,   Water     ),
+    ("prowat"   ,   Prowat    ),
+    ("elong"    ,   Long      ),
+    ("ac"       ,   Ac        ),
+    ("evb"      ,   Evb       ),
+    ("induce"   ,   Induce    ),
+    ("const"    ,   Const     ),
+    ("langevin" ,   Langevin  ),
+    ("classic"  ,   Classic   ),
+    ("system"   ,   System    ), )
+
+# . Prefixes of attributes that hold energies of MD steps in cache files
+_CACHE_ENERGIES = "_cacheEnergies_"
+_CACHE_PRESENT  = "_cachePresent_"
+
+_ENERGY_TERM = re.compile (r"(\w+)\s*:\s*(\S+)")
+
+
+def _ReadEnergyTerms (family, line, lines, nextra):
+    """Read energy terms written as "label : value" pairs in a line and nextra lines that follow it.
+
+    Terms that are not found are set to zero."""
+    text = line
+    for i in range (nextra):
+        text += next (lines)
+    terms = {}
+    for (label, value) in _ENERGY_TERM.findall (text):
+        if label in family._fields:
+            terms[label] = float (value)
+    for label in family._fields:
+        if label not in terms:
+            terms[label] = 0.
+    return family (**terms)
 
 
 class MDStep (object):
     """A class to hold energies of an MD step."""
 
-    def __init___ (self):
-        for att in ("protein", "water", "prowat", "elong", "ac", "evb", "induce", "const", "langevin", "classic", "system", ):
+    def __init__ (self):
+        for (att, family) in _ENERGY_FAMILIES:
             setattr (self, att, None)
 
 
+def _ReadMDStep (lines):
+    """Read energies of an MD step that follow the line "Energies for the system at step"."""
+    mdStep = MDStep ()
+    while True:
+        line = next (lines)
+
+        #  protein - ebond    :      2.57 ethet    :      4.29
+        #            ephi     :      0.00 eitor    :      0.00
+        #            evdw     :     -0.24 emumu    :      0.00
+        #            ehb_pp   :      0.00
+        #
+        if   line.startswith ( " protein"  ):
+            toka = line.split ()
+            tokb = next (lines).split ()
+            tokc = next (lines).split ()
+            tokd = next (lines).split ()
+            protein = Protein (
+                    ebond  = float ( toka[4] ) ,
+                    ethet  = float ( toka[7] ) ,
+                    ephi   = float ( tokb[2] ) ,
+                    eitor  = float ( tokb[5] ) ,
+                    evdw   = float ( tokc[2] ) ,
+                    emumu  = float ( tokc[5] ) ,
+                    ehb_pp = float ( tokd[2] ) ,)
+            mdStep.protein = protein
+
+
+        #  water   - ebond    :    674.31 ethet    :    414.66
+        #            evdw     :    949.15 emumu    :  -8517.96
+        #            ehb_ww   :      0.00
+        #
+        elif line.startswith ( " water"    ):
+            mdStep.water = _ReadEnergyTerms (Water, line, lines, 2)
+        #  pro-wat - evdw     :     -5.33 emumu    :      0.00
+        #            ehb_pw   :      0.00
+        #
+        elif line.startswith ( " pro-wat"  ):
+            mdStep.prowat = _ReadEnergyTerms (Prowat, line, lines, 1)
+        #  long    - elong    :     89.62
+        #
+        elif line.startswith ( " long"     ):
+            mdStep.elong = _ReadEnergyTerms (Long, line, lines, 0)
+        #  ac      - evd_ac   :      0.00 emumuac  :      0.00
+        #            evd_acw  :      0.00 emumuacw :      0.00
+        #            ehb_ac   :      0.00
+        #            ehb_acw  :      0.00
+        #
+        elif line.startswith ( " ac"       ):
+            mdStep.ac = _ReadEnergyTerms (Ac, line, lines, 3)
+        #  evb     - ebond    :      0.00 ethet    :      0.00 ephi     :      0.00
+        #            evdw     :     11.93 emumu    :      0.00 eoff     :      0.00
+        #            egashift :      0.00 eindq    :      0.00 ebulk    :    -99.57
+        #
+        elif line.startswith ( " evb"      ):
+            toka = line.split ()
+            tokb = next (lines).split ()
+            tokc = next (lines).split ()
+            evb  = Evb (
+                ebond    = float (toka[4] )    ,
+                ethet    = float (toka[7] )    ,
+                ephi     = float (toka[10])    ,
+                evdw     = float (tokb[2] )    ,
+                emumu    = float (tokb[5] )    ,
+                eoff     = float (tokb[8] )    ,
+                egashift = float (tokc[2] )    ,
+                eindq    = float (tokc[5] )    ,
+                ebulk    = float (tokc[8] )    ,)
+            mdStep.evb = evb
+
+        #  induce  - eindp    :      0.00 eindw    :      0.00
+        #
+        elif line.startswith ( " induce"   ):
+            mdStep.induce = _ReadEnergyTerms (Induce, line, lines, 0)
+        #  const.  - ewatc    :     27.05 eproc    :      1.45 edistc   :     45.08
+        #
+        elif line.startswith ( " const."   ):
+            mdStep.const = _ReadEnergyTerms (Const, line, lines, 0)
+        #  langevin- elgvn    :    -33.50 evdw_lgv :     81.45 eborn    :    -33.07
+        #
+        elif line.startswith ( " langevin" ):
+            mdStep.langevin = _ReadEnergyTerms (Langevin, line, lines, 0)
+        #  classic - epot     :  -6518.24 equantum :   -199.94
+        #
+# FIXME
+#        elif line.startswith ( " classic"  ):
+#            toka     = line.split (":")
+#            tokb     = toka[1].split ()
+#            tokc     = toka[2].split ()
+#            energies = Classic (
+#                    classic = float ( tokb[0] ) ,
+#                    quantum = float ( tokc[0] ) ,)
+#            mdStep.classic = energies
+
+
+        #  system  - epot     :  -6718.18 ekin     :   2140.90 etot     :  -4577.28
+        #  _____________________________________________________________________________
+        elif line.startswith ( " system"   ):
+            toka   = line.split ()
+            system = System (
+                    epot = float ( toka[4]  ) ,
+                    ekin = float ( toka[7]  ) ,
+                    etot = float ( toka[10] ) ,)
+            mdStep.system = system
+            break
+    return mdStep
+
+
+def _ReadQMMMComponents (line, lines):
+    """Read QM/MM energies that follow the line "Now running quantum program ...".
+
+    Returns a tuple (state, components)."""
+    tokens = TokenizeLine (line, converters=[int, ], reverse=True)
+    state  = tokens[0]
+    while True:
+        line = next (lines)
+        if   line.startswith (" E_evb(eminus)="):
+            tokens     = TokenizeLine (line, converters=[float, ], reverse=True)
+            Eevb       = tokens[0]
+        elif line.startswith (" E_classical"):
+            tokens     = TokenizeLine (line, converters=[float, ], reverse=True)
+            Eclassical = tokens[0]
+        elif line.startswith (" Equantum"):
+            tokens     = TokenizeLine (line, converters=[float, ], reverse=True)
+            Equantum   = tokens[0]
+        elif line.startswith (" e_qmmm"):
+            tokens     = TokenizeLine (line, converters=[float, ], reverse=True)
+            Eqmmm      = tokens[0]
+            break
+    components = QMMMComponents (
+        Eevb        =   Eevb        ,
+        Eqmmm       =   Eqmmm       ,
+        Equantum    =   Equantum    ,
+        Eclassical  =   Eclassical  ,
+        )
+    return (state, components)
+
+
 class MolarisOutputFile (object):
     """A class for reading output files from Molaris."""
 
-    def __init__ (self, filename="rs_fep.out", logging=False):
-        """Constructor."""
+    # . Increase whenever parsing changes, so that old cache files are discarded
+    _PARSER_VERSION = 3
+
+    def __init__ (self, filename="rs_fep.out", logging=False, cache=False):
+        """Constructor.
+
+        Parameter cache can be False (no caching), True (cache next to the file, to be trusted like code, see ParseCache) or a ParseCache object."""
         self.filename = filename
-        self._Parse (logging=logging)
+        if not RestoreFromCache (self, filename, cache):
+            self._Parse (logging=logging)
+            StoreInCache (self, filename, cache)
 
 
     # . Returns the number of FEP steps (lambda 0 ... 1)
@@ -91,6 +276,66 @@ class MolarisOutputFile (object):
             return self._fileOK
         return False
 
+    # . Returns energies of MD steps as an EnergyTable (one structured array per energy family)
+    @property
+    def energyTable (self):
+        if not hasattr (self, "_energyTable"):
+            fepSteps = getattr (self, "fepSteps", [])[:]
+            if hasattr (self, "mdSteps"):
+                fepSteps.append (self.mdSteps)
+            self._energyTable = EnergyTable.FromMDSteps (fepSteps, _ENERGY_FAMILIES, ncomplete=self.nfepSteps)
+        return self._energyTable
+
+
+    def _GetCacheState (self):
+        """Attributes to be cached, with MD steps stored as arrays of the energy table rather than as objects."""
+        state = {}
+        for (attribute, value) in self.__dict__.iteritems ():
+            if attribute not in ("fepSteps", "mdSteps", "currentMDStep", "_energyTable"):
+                state[attribute] = value
+        table   = self.energyTable
+        mdSteps = []
+        for fepStep in getattr (self, "fepSteps", []):
+            mdSteps.extend (fepStep)
+        mdSteps.extend (getattr (self, "mdSteps", []))
+        for (attribute, family) in _ENERGY_FAMILIES:
+            if table.families.has_key (attribute):
+                state[_CACHE_ENERGIES + attribute] = table.families[attribute]
+                state[_CACHE_PRESENT  + attribute] = numpy.array ([getattr (mdStep, attribute) is not None for mdStep in mdSteps], dtype=numpy.bool_)
+        state["_cacheOffsets"]   = table.offsets
+        state["_cacheHasMDSteps"] = hasattr (self, "mdSteps")
+        return state
+
+
+    def _SetCacheState (self, state):
+        """Set attributes from the cache and rebuild MD steps from arrays of the energy table."""
+        families = collections.OrderedDict ()
+        present  = {}
+        for (attribute, family) in _ENERGY_FAMILIES:
+            if state.has_key (_CACHE_ENERGIES + attribute):
+                families[attribute] = state.pop (_CACHE_ENERGIES + attribute)
+                present[attribute]  = state.pop (_CACHE_PRESENT  + attribute)
+        offsets     = state.pop ("_cacheOffsets")
+        hasMDSteps  = state.pop ("_cacheHasMDSteps")
+        for (attribute, value) in state.iteritems ():
+            if not hasattr (self, attribute):
+                setattr (self, attribute, value)
+        nsteps  = int (offsets[-1])
+        mdSteps = [MDStep () for i in range (nsteps)]
+        for (attribute, family) in _ENERGY_FAMILIES:
+            if families.has_key (attribute):
+                for (mdStep, row, isPresent) in zip (mdSteps, families[attribute].tolist (), present[attribute]):
+                    if isPresent:
+                        setattr (mdStep, attribute, family._make (row))
+        windows = [mdSteps[start:stop] for (start, stop) in zip (offsets[:-1], offsets[1:])]
+        if hasMDSteps:
+            self.mdSteps = windows.pop ()
+        if windows:
+            self.fepSteps = windows
+        if mdSteps:
+            self.currentMDStep = mdSteps[-1]
+        self._energyTable = EnergyTable (families, offsets, ncomplete=self.nfepSteps)
+
 
     def _Parse (self, logging=False):
         # . fepSteps are the FEP steps (usually 11), each consisting of many MD steps (usually 500)
@@ -110,108 +355,7 @@ class MolarisOutputFile (object):
                 #  Energies for the system at step          0:
                 #  ------------------------------------------------------------------------
                 elif line.startswith (" Energies for the system at step"):
-                    currentMDStep = MDStep ()
-                    while True:
-                        line = lines.next ()
-
-                        #  protein - ebond    :      2.57 ethet    :      4.29
-                        #            ephi     :      0.00 eitor    :      0.00
-                        #            evdw     :     -0.24 emumu    :      0.00
-                        #            ehb_pp   :      0.00
-                        #
-                        if   line.startswith ( " protein"  ):
-                            toka = line.split ()
-                            tokb = lines.next ().split ()
-                            tokc = lines.next ().split ()
-                            tokd = lines.next ().split ()
-                            protein = Protein (
-                                    ebond  = float ( toka[4] ) ,
-                                    ethet  = float ( toka[7] ) ,
-                                    ephi   = float ( tokb[2] ) ,
-                                    eitor  = float ( tokb[5] ) ,
-                                    evdw   = float ( tokc[2] ) ,
-                                    emumu  = float ( tokc[5] ) ,
-                                    ehb_pp = float ( tokd[2] ) ,)
-                            currentMDStep.protein = protein
-
-
-                        #  water   - ebond    :    674.31 ethet    :    414.66
-                        #            evdw     :    949.15 emumu    :  -8517.96
-                        #            ehb_ww   :      0.00
-                        #
-                        elif line.startswith ( " water"    ):
-                            pass
-                        #  pro-wat - evdw     :     -5.33 emumu    :      0.00
-                        #            ehb_pw   :      0.00
-                        #
-                        elif line.startswith ( " pro-wat"  ):
-                            pass
-                        #  long    - elong    :     89.62
-                        #
-                        elif line.startswith ( " long"     ):
-                            pass
-                        #  ac      - evd_ac   :      0.00 emumuac  :      0.00
-                        #            evd_acw  :      0.00 emumuacw :      0.00
-                        #            ehb_ac   :      0.00
-                        #            ehb_acw  :      0.00
-                        #
-                        elif line.startswith ( " ac"       ):
-                            pass
-                        #  evb     - ebond    :      0.00 ethet    :      0.00 ephi     :      0.00
-                        #            evdw     :     11.93 emumu    :      0.00 eoff     :      0.00
-                        #            egashift :      0.00 eindq    :      0.00 ebulk    :    -99.57
-                        #
-                        elif line.startswith ( " evb"      ):
-                            toka = line.split ()
-                            tokb = lines.next ().split ()
-                            tokc = lines.next ().split ()
-                            evb  = Evb (
-                                ebond    = float (toka[4] )    ,
-                                ethet    = float (toka[7] )    ,
-                                ephi     = float (toka[10])    ,
-                                evdw     = float (tokb[2] )    ,
-                                emumu    = float (tokb[5] )    ,
-                                eoff     = float (tokb[8] )    ,
-                                egashift = float (tokc[2] )    ,
-                                eindq    = float (tokc[5] )    ,
-                                ebulk    = float (tokc[8] )    ,)
-                            currentMDStep.evb = evb
-
-                        #  induce  - eindp    :      0.00 eindw    :      0.00
-                        #
-                        elif line.startswith ( " induce"   ):
-                            pass
-                        #  const.  - ewatc    :     27.05 eproc    :      1.45 edistc   :     45.08
-                        #
-                        elif line.startswith ( " const."   ):
-                            pass
-                        #  langevin- elgvn    :    -33.50 evdw_lgv :     81.45 eborn    :    -33.07
-                        #
-                        elif line.startswith ( " langevin" ):
-                            pass
-                        #  classic - epot     :  -6518.24 equantum :   -199.94
-                        #
-# FIXME
-#                        elif line.startswith ( " classic"  ):
-#                            toka     = line.split (":")
-#                            tokb     = toka[1].split ()
-#                            tokc     = toka[2].split ()
-#                            energies = Classic (
-#                                    classic = float ( tokb[0] ) ,
-#                                    quantum = float ( tokc[0] ) ,)
-#                            currentMDStep.classic = energies
-
-
-                        #  system  - epot     :  -6718.18 ekin     :   2140.90 etot     :  -4577.28
-                        #  _____________________________________________________________________________
-                        elif line.startswith ( " system"   ):
-                            toka   = line.split ()
-                            system = System (
-                                    epot = float ( toka[4]  ) ,
-                                    ekin = float ( toka[7]  ) ,
-                                    etot = float ( toka[10] ) ,)
-                            currentMDStep.system = system
-                            break
+                    currentMDStep = _ReadMDStep (lines)
                     mdSteps.append (currentMDStep)
                     if logging:
                         nsteps = len (mdSteps)
@@ -282,29 +426,7 @@ class MolarisOutputFile (object):
                 #  Equantum =  -1595163.80
                 #  e_qmmm = E_tot-E_evb+Equantum =  -1601411.16
                 elif line.startswith (" Now running quantum program ..."):
-                    tokens = TokenizeLine (line, converters=[int, ], reverse=True)
-                    state  = tokens[0]
-                    while True:
-                        line = next (lines)
-                        if   line.startswith (" E_evb(eminus)="):
-                            tokens     = TokenizeLine (line, converters=[float, ], reverse=True)
-                            Eevb       = tokens[0]
-                        elif line.startswith (" E_classical"):
-                            tokens     = TokenizeLine (line, converters=[float, ], reverse=True)
-                            Eclassical = tokens[0]
-                        elif line.startswith (" Equantum"):
-                            tokens     = TokenizeLine (line, converters=[float, ], reverse=True)
-                            Equantum   = tokens[0]
-                        elif line.startswith (" e_qmmm"):
-                            tokens     = TokenizeLine (line, converters=[float, ], reverse=True)
-                            Eqmmm      = tokens[0]
-                            break
-                    components = QMMMComponents (
-                        Eevb        =   Eevb        ,
-                        Eqmmm       =   Eqmmm       ,
-                        Equantum    =   Equantum    ,
-                        Eclassical  =   Eclassical  ,
-                        )
+                    (state, components) = _ReadQMMMComponents (line, lines)
                     if state == 1:
                         if not hasattr (self, "qmmmComponentsI"):
                             self.qmmmComponentsI = []
@@ -485,12 +607,85 @@ class MolarisOutputFile (object):
         # . Finish up
         if fepSteps != []:
             self.fepSteps = fepSteps
+        if mdSteps != []:
+            # . MD steps of an FEP step that is not finished yet
+            self.mdSteps = mdSteps
         if currentMDStep != None:
             self.currentMDStep = currentMDStep
         if residues != []:
             self.residues = residues
 
 
+#-------------------------------------------------------------------------------
+class MolarisOutputFollower (LogFollower):
+    """A class for reading a growing output file from Molaris.
+
+    Each call to Poll returns a MolarisUpdate with the MD steps and QM/MM energies written since the previous call.
+    Blocks that are still being written are read on one of the next calls."""
+
+    def Reset (self):
+        """Start reading again from the beginning of the file."""
+        super (MolarisOutputFollower, self).Reset ()
+        self.nfepSteps     = 0
+        self.nmdSteps      = 0
+        self.isFinished    = False
+        self._blockType    = None
+        self._lastStep     = 0
+        self._stepOffset   = 0
+        self._qmmmI        = []
+        self._qmmmII       = []
+
+
+    @property
+    def ncompleted (self):
+        """Number of MD steps done, taken from headers of energy printouts."""
+        return self._stepOffset + self._lastStep
+
+
+    def _ProcessLine (self, line):
+        if self._block is None:
+            if   line.startswith (" Energies for the system at step"):
+                (self._block, self._blockType) = ([line, ], "md")
+            elif line.startswith (" Now running quantum program ..."):
+                (self._block, self._blockType) = ([line, ], "qmmm")
+            elif line.startswith (" Average energies for the system at the step"):
+                self.nfepSteps += 1
+            elif line.startswith ("  NORMAL TERMINATION OF MOLARIS") or line.startswith (" Molaris has completed this run successfully without any warning"):
+                self.isFinished = True
+        else:
+            self._block.append (line)
+            if   (self._blockType == "md") and line.startswith (" system"):
+                header = self._block[0]
+                step   = int (header.split ()[-1].rstrip (":"))
+                # . Step numbers start over in each FEP step
+                if step < self._lastStep:
+                    self._stepOffset += self._lastStep
+                self._lastStep = step
+                mdStep = _ReadMDStep (iter (self._block[1:]))
+                self._items.append (mdStep)
+                self.nmdSteps += 1
+                self._block = None
+            elif (self._blockType == "qmmm") and line.startswith (" e_qmmm"):
+                (state, components) = _ReadQMMMComponents (self._block[0], iter (self._block[1:]))
+                if state == 1:
+                    self._qmmmI.append (components)
+                else:
+                    self._qmmmII.append (components)
+                self._block = None
+
+
+    def Poll (self):
+        """Read new data and return a MolarisUpdate."""
+        mdSteps = super (MolarisOutputFollower, self).Poll ()
+        update  = MolarisUpdate (
+            mdSteps          =  mdSteps         ,
+            qmmmComponentsI  =  self._qmmmI     ,
+            qmmmComponentsII =  self._qmmmII    ,
+            nfepSteps        =  self.nfepSteps  , )
+        (self._qmmmI, self._qmmmII) = ([], [])
+        return update
+
+
 #-------------------------------------------------------------------------------
 class MolarisOutputFile2 (object):
     """Alternative class for reading output files from Molaris used in defining constrained atoms."""
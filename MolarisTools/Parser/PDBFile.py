@@ -6,47 +6,117 @@
 #-------------------------------------------------------------------------------
 import  collections, exceptions
 
+import  numpy
+
+from    MolarisTools.Utilities  import CellList
+
 PDBChain   = collections.namedtuple ("PDBChain"   , "label  residues")
 PDBAtom    = collections.namedtuple ("PDBAtom"    , "label  serial  x  y  z")
 
 _MODULE_LABEL      = "PDBFile"
 _DEFAULT_LOG_LEVEL = 1
 _PDB_FORMAT_ATOM   = "%-6s%5d %-4s %3s %1s%4s%1s   %8.3f%8.3f%8.3f%22s\n"
+_DEFAULT_CELL_SIZE = 4.
+_SPACE             = ord (" ")
+_ZERO              = ord ("0")
+
+
+class _ResidueAtoms (list):
+    """A list of the atoms of a residue read from a PDB file.
+
+    Atoms are built from the arrays of the parent file when the list is made. Changes to the list are written back to the residue."""
+
+    def __init__ (self, residue):
+        if residue._pending is not None:
+            atoms = residue._pending
+        else:
+            atoms = residue.parent._MakeAtoms (slice (residue.start, residue.stop))
+        list.__init__ (self, atoms)
+        self.residue = residue
+
+
+def _WritingBack (name):
+    method = getattr (list, name)
+    def WriteBack (self, *arguments, **keywordArguments):
+        result = method (self, *arguments, **keywordArguments)
+        self.residue.atoms = self
+        return result
+    WriteBack.__name__ = name
+    return WriteBack
+
+for name in ("__setitem__", "__delitem__", "__setslice__", "__delslice__", "__iadd__", "__imul__", "append", "extend", "insert", "pop", "remove", "reverse", "sort"):
+    setattr (_ResidueAtoms, name, _WritingBack (name))
+del name
 
 
 class PDBResidue (object):
-    """A class to represent a PDB residue."""
+    """A class to represent a PDB residue.
 
-    # label  serial  chain  atoms  parent
+    Atoms of a residue read from a PDB file are kept in the arrays of the parent file, between start and stop.
+    Atoms of an edited residue are kept in a list, until the parent file merges them back into its arrays."""
+    _pending = None
+
+    # label  serial  chain  atoms  parent  start  stop
     def __init__ (self, **keywordArguments):
         """Constructor."""
+        atoms = keywordArguments.pop ("atoms", None)
         for (key, value) in keywordArguments.iteritems ():
             setattr (self, key, value)
+        if atoms is not None:
+            self.atoms = atoms
+
+    @property
+    def _attached (self):
+        return hasattr (self, "start")
+
+    @property
+    def atoms (self):
+        """A list of atoms. For residues of a PDB file, a new list that writes changes back to the file."""
+        if not self._attached:
+            return self._atoms
+        return _ResidueAtoms (self)
+
+    @atoms.setter
+    def atoms (self, new):
+        if self._attached:
+            self.parent._SpliceAtoms (self, new)
+        else:
+            self._atoms = list (new)
+
+    @property
+    def natoms (self):
+        if not self._attached:
+            return len (self._atoms)
+        if self._pending is not None:
+            return len (self._pending)
+        return (self.stop - self.start)
+
+    @property
+    def coordinates (self):
+        """An array of coordinates of shape (natoms, 3)."""
+        if self._attached and (self._pending is None):
+            return self.parent._coordinates[self.start:self.stop]
+        atoms = self._atoms if not self._attached else self._pending
+        return numpy.array ([(atom.x, atom.y, atom.z) for atom in atoms], dtype=numpy.float64).reshape ((-1, 3))
 
 
     def GetBonds (self):
         """Return a list of bonds for a residue."""
-        pairs = []
         pdb   = self.parent
-        if pdb.bonds != []:
-            for (seriala, serialb) in pdb.bonds:
-                found = False
-                for i, atoma in enumerate (self.atoms):
-                    if atoma.serial == seriala:
-                        found = True
-                        break
-                if not found:
-                    continue
-                paira = (i, atoma.serial, atoma.label)
-                found = False
-                for j, atomb in enumerate (self.atoms):
-                    if atomb.serial == serialb:
-                        found = True
-                        break
-                if not found:
-                    continue
-                pairb = (j, atomb.serial, atomb.label)
-                pair  = (paira, pairb)
+        if pdb.bonds == []:
+            return []
+        if self._attached and (self._pending is None):
+            table = pdb._GetBondTable ()
+            return list (table.get ((self.start, self.stop), ()))
+        # . Residues that are not a part of a PDB file or that were edited
+        pairs   = []
+        indices = {}
+        atoms   = self._atoms if not self._attached else self._pending
+        for (i, atom) in enumerate (atoms):
+            indices.setdefault (atom.serial, (i, atom.serial, atom.label))
+        for (seriala, serialb) in pdb.bonds:
+            if indices.has_key (seriala) and indices.has_key (serialb):
+                pair = (indices[seriala], indices[serialb])
                 pairs.append (pair)
         return pairs
 
@@ -54,46 +124,40 @@ class PDBResidue (object):
     def ReplaceAtom (self, label, newLabel):
         """Replace an atom."""
         found = False
-        for (i, atom) in enumerate (self.atoms):
+        atoms = list (self.atoms)
+        for (i, atom) in enumerate (atoms):
             if atom.label == label:
-                new = PDBAtom (
-                    label   =   newLabel    ,
-                    serial  =   atom.serial ,
-                    x       =   atom.x      ,
-                    y       =   atom.y      ,
-                    z       =   atom.z      , )
-                self.atoms[i] = new
-                found = True
+                atoms[i] = atom._replace (label=newLabel)
+                found    = True
         if not found:
             raise exceptions.StandardError ("Atom %s not found." % label)
+        self.atoms = atoms
 
 
     def KillAtom (self, label):
         """Replace an atom."""
-        new   = []
-        found = False
+        new     = []
+        killed  = set ()
+        serials = set ()
         for atom in self.atoms:
+            serials.add (atom.serial)
             if atom.label == label:
-                found = True
+                killed.add (atom.serial)
                 continue
             new.append (atom)
-        if not found:
+        if not killed:
             raise exceptions.StandardError ("Atom %s not found." % label)
         self.atoms = new
-        # . Remove bonds that involve removed atom
-        remove = []
-        for (paira, pairb) in self.bonds:
-            if (paira == label) or (pairb == label):
-                pair = (paira, pairb)
-                remove.append (pair)
+        # . Remove bonds within the residue that involve removed atom
         pdb    = self.parent
         update = []
         for (paira, pairb) in pdb.bonds:
-            if ((paira, pairb) in remove) or ((pairb, paira) in remove):
+            if ((paira in killed) or (pairb in killed)) and (paira in serials) and (pairb in serials):
                 continue
             pair = (paira, pairb)
             update.append (pair)
-        pdb.bonds = update
+        if len (update) != len (pdb.bonds):
+            pdb.bonds = update
 
 
     @property
@@ -108,33 +172,22 @@ class PDBResidue (object):
 
 #===============================================================================
 class PDBFile (object):
-    """A class to read a PDB file."""
+    """A class to read a PDB file.
+
+    Coordinates, serials and labels of all atoms are kept in arrays. Residues refer to slices of these arrays.
+    Atoms of edited residues are merged into the arrays in one pass, when the arrays are needed next."""
 
 
     def CenterMolecule (self, residueSerial, atomSerial):
         """Move a selected atom to the origin of the coordinate system."""
-        found = False
-        for residue in self.residues:
-            if (residue.serial == residueSerial):
-                for atom in residue.atoms:
-                    if (atom.serial == atomSerial):
-                        (ax, ay, az) = (atom.x, atom.y, atom.z)
-                        found = True
-                        break
-                break
+        residue = self._FindResidue (residueSerial)
+        found   = False
+        if residue is not None:
+            indices = numpy.flatnonzero (self.serials[residue.start:residue.stop] == atomSerial)
+            found   = (indices.size > 0)
         if not found:
             raise exceptions.StandardError ("Residue or atom not found.")
-        for residue in self.residues:
-            newAtoms = []
-            for atom in residue.atoms:
-                newAtom = PDBAtom (
-                    label   =  atom.label     ,
-                    serial  =  atom.serial    ,
-                    x       =  (atom.x - ax)  ,
-                    y       =  (atom.y - ay)  ,
-                    z       =  (atom.z - az)  , )
-                newAtoms.append (newAtom)
-            residue.atoms = newAtoms
+        self.coordinates -= self.coordinates[residue.start + indices[0]].copy ()
 
 
     def __init__ (self, filename, logLevel=_DEFAULT_LOG_LEVEL):
@@ -144,135 +197,139 @@ class PDBFile (object):
         self._Parse ()
 
 
+    @property
+    def coordinates (self):
+        self._Consolidate ()
+        return self._coordinates
+
+    @coordinates.setter
+    def coordinates (self, new):
+        self._Consolidate ()
+        self._coordinates = new
+        self._cellList    = None
+
+    @property
+    def serials (self):
+        self._Consolidate ()
+        return self._serials
+
+    @serials.setter
+    def serials (self, new):
+        self._Consolidate ()
+        self._serials   = new
+        self._bondTable = None
+
+    @property
+    def labels (self):
+        self._Consolidate ()
+        return self._labels
+
+    @labels.setter
+    def labels (self, new):
+        self._Consolidate ()
+        self._labels    = new
+        self._bondTable = None
+
+    @property
+    def bonds (self):
+        return self._bonds
+
+    @bonds.setter
+    def bonds (self, new):
+        self._bonds     = new
+        self._bondTable = None
+
+
     def _Parse (self):
         lines    = open (self.inputfile)
         if self.logLevel > 1:
             print ("# . %s> Parsing file \"%s\"" % (_MODULE_LABEL, self.inputfile))
-        # . Initialize
-        bonds          = []
-        atoms          = []
-        residues       = []
-        prevResLabel   = ""
-        prevChainLabel = ""
-        prevResSerial  = ""
-        try:
-            while True:
-                line = next (lines)
-
-                # . Taken from: http://deposit.rcsb.org/adit/docs/pdb_atom_format.html
-                #    1 -  6        Record name     "ATOM  "
-                #    7 - 11        Integer         Atom serial number.
-                #   13 - 16        Atom            Atom name.
-                #   17             Character       Alternate location indicator.
-                #   18 - 20        Residue name    Residue name.
-                #   22             Character       Chain identifier.
-                #   23 - 26        Integer         Residue sequence number.
-                #   27             AChar           Code for insertion of residues.
-                #   31 - 38        Real(8.3)       Orthogonal coordinates for X in Angstroms.
-                #   39 - 46        Real(8.3)       Orthogonal coordinates for Y in Angstroms.
-                #   47 - 54        Real(8.3)       Orthogonal coordinates for Z in Angstroms.
-                #   55 - 60        Real(6.2)       Occupancy.
-                #   61 - 66        Real(6.2)       Temperature factor (Default = 0.0).
-                #   73 - 76        LString(4)      Segment identifier, left-justified.
-                #   77 - 78        LString(2)      Element symbol, right-justified.
-                #   79 - 80        LString(2)      Charge on the atom.
-                if line.startswith ("ATOM") or line.startswith ("HETATM"):
-                    resLabel   =      line[17:20].strip ()
-                    chainLabel =      line[21   ]
-                    resSerial  = int (line[22:26])
-                    if prevResSerial != resSerial:
-                        if prevResSerial != "":
-                            residue = PDBResidue (
-                                label   =   prevResLabel    ,
-                                serial  =   prevResSerial   ,
-                                chain   =   prevChainLabel  ,
-                                atoms   =   atoms           ,
-                                parent  =   self            ,
-                                )
-                            residues.append (residue)
-                            atoms = []
-                            if self.logLevel > 1:
-                                print ("# . %s> Added residue %s %s %d" % (_MODULE_LABEL, prevChainLabel, prevResLabel, prevResSerial))
-                    atom = PDBAtom (
-                        label   =          line[12:16].strip () ,
-                        serial  =     int (line[6 :11]) ,
-                        x       =   float (line[30:38]) ,
-                        y       =   float (line[38:46]) ,
-                        z       =   float (line[46:54]) ,
-                        )
-                    atoms.append (atom)
-                    prevResLabel   = resLabel
-                    prevChainLabel = chainLabel
-                    prevResSerial  = resSerial
-
-
-                #  COLUMNS         DATA TYPE        FIELD           DEFINITION
-                #  ---------------------------------------------------------------------------------
-                #   1 -  6         Record name      "CONECT"
-                #  
-                #   7 - 11         Integer          serial          Atom serial number
-                #  
-                #  12 - 16         Integer          serial          Serial number of bonded atom
-                #  
-                #  17 - 21         Integer          serial          Serial number of bonded atom
-                #  
-                #  22 - 26         Integer          serial          Serial number of bonded atom
-                #  
-                #  27 - 31         Integer          serial          Serial number of bonded atom
-                #  
-                #  32 - 36         Integer          serial          Serial number of hydrogen bonded
-                #                                                   atom
-                #  
-                #  37 - 41         Integer          serial          Serial number of hydrogen bonded
-                #                                                   atom
-                #  
-                #  42 - 46         Integer          serial          Serial number of salt bridged
-                #                                                   atom
-                #  
-                #  47 - 51         Integer          serial          Serial number of hydrogen bonded
-                #                                                   atom
-                #  
-                #  52 - 56         Integer          serial          Serial number of hydrogen bonded
-                #                                                   atom
-                #  
-                #  57 - 61         Integer          serial          Serial number of salt bridged
-                #                                                   atom
-                elif line.startswith ("CONECT"):
-                    token   =  line[ 6:11]
-                    serial  =  int (token)
-                    tokens  =  line[11:16], line[16:21], line[21:26], line[26:31]
-                    serialsBonded = []
-                    for token in tokens:
-                        token = token.strip ()
-                        if token.isdigit ():
-                            serialsBonded.append (int (token))
-                    if len (serialsBonded) > 0:
-                        for serialBonded in serialsBonded:
-                            pair    = (serial       , serialBonded)
-                            pairRev = (serialBonded , serial      )
-                            if pair not in bonds:
-                                if pairRev not in bonds:
-                                    seriala, serialb = pair
-                                    if seriala > serialb:
-                                        seriala, serialb = serialb, seriala
-                                        pair = (seriala, serialb)
-                                    bonds.append (pair)
-        except StopIteration:
-            pass
+        # . Collect atom and CONECT lines
+        atomLines   = []
+        conectLines = []
+        for line in lines:
+            if line.startswith (("ATOM", "HETATM")):
+                atomLines.append (line)
+            #  COLUMNS         DATA TYPE        FIELD           DEFINITION
+            #  ---------------------------------------------------------------------------------
+            #   1 -  6         Record name      "CONECT"
+            #  
+            #   7 - 11         Integer          serial          Atom serial number
+            #  
+            #  12 - 16         Integer          serial          Serial number of bonded atom
+            #  
+            #  17 - 21         Integer          serial          Serial number of bonded atom
+            #  
+            #  22 - 26         Integer          serial          Serial number of bonded atom
+            #  
+            #  27 - 31         Integer          serial          Serial number of bonded atom
+            #  
+            #  32 - 36         Integer          serial          Serial number of hydrogen bonded
+            #                                                   atom
+            #  
+            #  37 - 41         Integer          serial          Serial number of hydrogen bonded
+            #                                                   atom
+            #  
+            #  42 - 46         Integer          serial          Serial number of salt bridged
+            #                                                   atom
+            #  
+            #  47 - 51         Integer          serial          Serial number of hydrogen bonded
+            #                                                   atom
+            #  
+            #  52 - 56         Integer          serial          Serial number of hydrogen bonded
+            #                                                   atom
+            #  
+            #  57 - 61         Integer          serial          Serial number of salt bridged
+            #                                                   atom
+            elif line.startswith ("CONECT"):
+                conectLines.append (line)
         # . Close the file
         lines.close ()
-        # . Finish up
-        if atoms:
+        # . Taken from: http://deposit.rcsb.org/adit/docs/pdb_atom_format.html
+        #    1 -  6        Record name     "ATOM  "
+        #    7 - 11        Integer         Atom serial number.
+        #   13 - 16        Atom            Atom name.
+        #   17             Character       Alternate location indicator.
+        #   18 - 20        Residue name    Residue name.
+        #   22             Character       Chain identifier.
+        #   23 - 26        Integer         Residue sequence number.
+        #   27             AChar           Code for insertion of residues.
+        #   31 - 38        Real(8.3)       Orthogonal coordinates for X in Angstroms.
+        #   39 - 46        Real(8.3)       Orthogonal coordinates for Y in Angstroms.
+        #   47 - 54        Real(8.3)       Orthogonal coordinates for Z in Angstroms.
+        #   55 - 60        Real(6.2)       Occupancy.
+        #   61 - 66        Real(6.2)       Temperature factor (Default = 0.0).
+        #   73 - 76        LString(4)      Segment identifier, left-justified.
+        #   77 - 78        LString(2)      Element symbol, right-justified.
+        #   79 - 80        LString(2)      Charge on the atom.
+        bonds  = _ParseBonds (conectLines)
+        # . Parse fixed columns of all atom lines at once
+        natoms = len (atomLines)
+        table  = _CharacterTable (atomLines, 80)
+        self._npending    = 0
+        self._coordinates = _Floats (table[:, 30:54], 8)
+        self._serials     = _Integers (table[:, 6:11], fillGaps=True)
+        self._labels      = numpy.char.strip (_Columns (table, 12, 16))
+        resSerials       = _Integers (table[:, 22:26])
+        # . A new residue starts whenever the residue serial changes
+        starts   = numpy.flatnonzero (numpy.concatenate (([True, ], resSerials[1:] != resSerials[:-1])))[:natoms]
+        stops    = numpy.append (starts[1:], natoms)[:starts.shape[0]]
+        lasts    = table[stops - 1]
+        resLabels      = numpy.char.strip (_Columns (lasts, 17, 20)).tolist ()
+        chainLabels    = _Columns (lasts, 21, 22).tolist ()
+        residues = []
+        for (start, stop, resLabel, chainLabel, resSerial) in zip (starts.tolist (), stops.tolist (), resLabels, chainLabels, resSerials[stops - 1].tolist ()):
             residue = PDBResidue (
-                label   =   prevResLabel    ,
-                serial  =   prevResSerial   ,
-                chain   =   prevChainLabel  ,
-                atoms   =   atoms           ,
-                parent  =   self            ,
+                label   =   resLabel    ,
+                serial  =   resSerial   ,
+                chain   =   chainLabel  ,
+                parent  =   self        ,
+                start   =   start       ,
+                stop    =   stop        ,
                 )
             residues.append (residue)
             if self.logLevel > 1:
-                print ("# . %s> Added residue %s %s %d" % (_MODULE_LABEL, prevChainLabel, prevResLabel, prevResSerial))
+                print ("# . %s> Added residue %s %s %d" % (_MODULE_LABEL, chainLabel, resLabel, resSerial))
         if self.logLevel > 0:
             nresidues = len (residues)
             print ("# . %s> Found %d residues" % (_MODULE_LABEL, nresidues))
@@ -280,14 +337,184 @@ class PDBFile (object):
             print ("# . %s> Found %d bonds" % (_MODULE_LABEL, nbonds))
         self.residues = residues
         self.bonds    = bonds
+        self._residueIndex = None
+        self._cellList     = None
+
+
+    def _SpliceAtoms (self, residue, atoms):
+        """Replace the atoms of a residue.
+
+        The atoms are kept by the residue until the next call to _Consolidate, so that editing many residues is not quadratic."""
+        if residue._pending is None:
+            self._npending += 1
+        residue._pending = list (atoms)
+        self._cellList   = None
+
+
+    def _Consolidate (self):
+        """Merge atoms of edited residues into the arrays of atoms and update start and stop of all residues."""
+        if not self._npending:
+            return
+        (coordinates, serials, labels) = ([], [], [])
+        position = 0
+        for residue in self.residues:
+            atoms = residue._pending
+            if atoms is None:
+                (start, stop) = (residue.start, residue.stop)
+                coordinates.append (self._coordinates[start:stop])
+                serials.append (self._serials[start:stop])
+                labels.append (self._labels[start:stop])
+                natoms = stop - start
+            else:
+                natoms = len (atoms)
+                coordinates.append (numpy.array ([(atom.x, atom.y, atom.z) for atom in atoms], dtype=numpy.float64).reshape ((natoms, 3)))
+                serials.append (numpy.array ([atom.serial for atom in atoms], dtype=numpy.int64))
+                labels.append (numpy.array ([atom.label for atom in atoms], dtype=str) if natoms else self._labels[:0])
+                residue._pending = None
+            (residue.start, residue.stop) = (position, position + natoms)
+            position += natoms
+        self._coordinates = numpy.concatenate (coordinates) if coordinates else self._coordinates[:0]
+        self._serials     = numpy.concatenate (serials) if serials else self._serials[:0]
+        self._labels      = numpy.concatenate (labels) if labels else self._labels[:0]
+        self._npending    = 0
+        self._bondTable   = None
+        self._cellList    = None
+
+
+    def _MakeAtoms (self, selection):
+        """Make a list of atoms from a slice or an array of indices of atoms.
+
+        Reads the arrays as they are, so that reading residues that were not edited does not merge edited ones."""
+        (xs, ys, zs) = self._coordinates[selection].reshape ((-1, 3)).T.tolist ()
+        return map (PDBAtom._make, zip (self._labels[selection].tolist (), self._serials[selection].tolist (), xs, ys, zs))
+
+
+    def _Owners (self, indices):
+        """Get indices of residues that own atoms of given indices."""
+        starts = numpy.array ([residue.start for residue in self.residues], dtype=numpy.int64)
+        return numpy.searchsorted (starts, indices, side="right") - 1
+
+
+    def _GetBondTable (self):
+        """Get a dictionary of (start, stop) of residues to lists of bonds within the residues.
+
+        Entries of edited residues are not used, until the arrays are merged and the table is rebuilt."""
+        if self._bondTable is None:
+            table = {}
+            if self.bonds:
+                pairs    = numpy.array (self.bonds, dtype=numpy.int64).reshape ((-1, 2))
+                indices  = numpy.flatnonzero (numpy.in1d (self._serials, pairs))
+                owners   = self._Owners (indices)
+                # . For every residue, index the first atom of each serial
+                locals   = {}
+                owned    = {}
+                serials  = self._serials[indices].tolist ()
+                for (index, owner, serial) in zip (indices.tolist (), owners.tolist (), serials):
+                    key = (owner, serial)
+                    if not locals.has_key (key):
+                        locals[key] = index
+                        owned.setdefault (serial, []).append (owner)
+                for (seriala, serialb) in self.bonds:
+                    for owner in owned.get (seriala, ()):
+                        key = (owner, serialb)
+                        if locals.has_key (key):
+                            (i, j)  = (locals[(owner, seriala)], locals[key])
+                            residue = self.residues[owner]
+                            pair    = ((i - residue.start, seriala, str (self._labels[i])), (j - residue.start, serialb, str (self._labels[j])))
+                            table.setdefault ((residue.start, residue.stop), []).append (pair)
+            self._bondTable = table
+        return self._bondTable
+
+
+    def _FindResidue (self, serial, chain=None):
+        """Find the first residue of a given serial (and chain), or None."""
+        if self._residueIndex is None:
+            index = {}
+            for residue in self.residues:
+                index.setdefault ((residue.chain, residue.serial), residue)
+                index.setdefault ((None, residue.serial), residue)
+            self._residueIndex = index
+        return self._residueIndex.get ((chain, serial), None)
+
+
+    def GetResidue (self, serial, chain=None):
+        """Get the first residue of a given serial and, optionally, chain."""
+        residue = self._FindResidue (serial, chain)
+        if residue is None:
+            raise exceptions.StandardError ("Residue %d%s not found." % (serial, (" in chain %s" % chain) if chain else ""))
+        return residue
+
+
+    def GetAtom (self, serial):
+        """Get the first atom of a given serial."""
+        indices = numpy.flatnonzero (self.serials == serial)
+        if indices.size < 1:
+            raise exceptions.StandardError ("Atom %d not found." % serial)
+        index = indices[0]
+        (x, y, z) = self.coordinates[index].tolist ()
+        return PDBAtom (label=str (self.labels[index]), serial=int (self.serials[index]), x=x, y=y, z=z)
+
+
+    def _GetCellList (self):
+        if self._cellList is None:
+            self._cellList = CellList (self.coordinates, cellSize=_DEFAULT_CELL_SIZE)
+        return self._cellList
+
+
+    def _QueryPoints (self, point=None, serials=None, residue=None):
+        """Get coordinates of a point, of atoms of given serials or of atoms of a residue."""
+        if [point, serials, residue].count (None) != 2:
+            raise exceptions.StandardError ("Use exactly one of point, serials or residue.")
+        if point is not None:
+            return numpy.asarray (point, dtype=numpy.float64).reshape ((-1, 3))
+        if serials is not None:
+            mask = numpy.in1d (self.serials, list (serials))
+            if not mask.any ():
+                raise exceptions.StandardError ("Atoms not found.")
+            return self.coordinates[mask]
+        return residue.coordinates
+
+
+    def _IndicesWithin (self, radius, point=None, serials=None, residue=None):
+        points    = self._QueryPoints (point=point, serials=serials, residue=residue)
+        (i, j, d) = self._GetCellList ().Within (points, radius)
+        return numpy.unique (j)
+
+
+    def AtomsWithin (self, radius, point=None, serials=None, residue=None):
+        """Find atoms within a radius of a point (or points), of atoms of given serials or of atoms of a residue.
+
+        Returns a list of atoms in the order of the PDB file."""
+        indices = self._IndicesWithin (radius, point=point, serials=serials, residue=residue)
+        return self._MakeAtoms (indices)
+
+
+    def ResiduesWithin (self, radius, point=None, serials=None, residue=None):
+        """Find residues that have at least one atom within a radius of a point, of atoms of given serials or of atoms of a residue.
+
+        Returns a list of residues in the order of the PDB file."""
+        indices = self._IndicesWithin (radius, point=point, serials=serials, residue=residue)
+        owners  = numpy.unique (self._Owners (indices))
+        return [self.residues[owner] for owner in owners.tolist ()]
+
+
+    def NearestAtoms (self, point, k=1):
+        """Find k atoms nearest to a point, sorted by distance."""
+        (indices, distances) = self._GetCellList ().Nearest (point, k)
+        return self._MakeAtoms (indices)
 
 
     def Write (self, filename="protein.pdb"):
         """Write all residues to one file."""
+        self.WriteResidues (self.residues, filename=filename)
+
+
+    def WriteResidues (self, residues, filename="residues.pdb", segLabel="PRTA"):
+        """Write a list of residues (for example, from ResiduesWithin) to one file."""
         output     = []
         atomSerial = 1
-        for residue in self.residues:
-            (atomSerial, lines) = self.WriteResidue (residue.serial, terminate=False, startSerial=atomSerial)
+        for residue in residues:
+            (atomSerial, lines) = self._WriteResidueLines (residue, segLabel=segLabel, startSerial=atomSerial)
             output.extend (lines)
         output.append ("TER\n")
         output.append ("END\n")
@@ -298,48 +525,54 @@ class PDBFile (object):
             fo.close ()
 
 
-    def WriteResidue (self, resSerial, filename="residue.pdb", segLabel="PRTA", terminate=True, startSerial=1):
-        """Write a residue to a separate PDB file."""
+    def _WriteResidueLines (self, residue, segLabel="PRTA", startSerial=1):
         output = []
-        for residue in self.residues:
-            if residue.serial == resSerial:
-                for iatom, atom in enumerate (residue.atoms):
-                    atomLabel  = atom.label if len (atom.label) > 3 else (" %s" % atom.label)
-                    atomSerial = iatom + startSerial
-                    output.append (_PDB_FORMAT_ATOM % ("ATOM", atomSerial, atomLabel, residue.label, residue.chain, residue.serial, "", atom.x, atom.y, atom.z, segLabel))
-                if terminate:
-                    output.append ("TER\n")
-                    output.append ("END\n")
-                break
+        for iatom, atom in enumerate (residue.atoms):
+            atomLabel  = atom.label if len (atom.label) > 3 else (" %s" % atom.label)
+            atomSerial = iatom + startSerial
+            output.append (_PDB_FORMAT_ATOM % ("ATOM", atomSerial, atomLabel, residue.label, residue.chain, residue.serial, "", atom.x, atom.y, atom.z, segLabel))
+        return (startSerial + len (output), output)
+
+
+    def WriteResidue (self, resSerial, filename="residue.pdb", segLabel="PRTA", terminate=True, startSerial=1):
+        """Write a residue (given by its serial or as a residue) to a separate PDB file."""
+        output  = []
+        residue = resSerial if isinstance (resSerial, PDBResidue) else self._FindResidue (resSerial)
+        if residue is not None:
+            (atomSerial, output) = self._WriteResidueLines (residue, segLabel=segLabel, startSerial=startSerial)
+            if terminate:
+                output.append ("TER\n")
+                output.append ("END\n")
         if output:
             if terminate:
                 fo = open (filename, "w")
                 for line in output:
                     fo.write (line)
                 fo.close ()
-        return (atomSerial + 1, output)
+            return (atomSerial, output)
+        return (startSerial, output)
 
 
-    def CheckForMissingAtoms (self, library, includeHydrogens=False):
-        """Check all residues if they are missing any atoms."""
+    def CheckForMissingAtoms (self, library, includeHydrogens=False, index=None):
+        """Check all residues if they are missing any atoms.
+
+        Residues not found in the library by their labels can be matched by their bonds, if a ResidueIndex is given."""
         for residue in self.residues:
             if library.has_key (residue.label):
                 # . Collect labels from the library
                 component     = library[residue.label]
-                libraryLabels = []
-                for atom in component.atoms:
-                    libraryLabels.append (atom.atomLabel)
+                libraryLabels = [atom.atomLabel for atom in component.atoms]
+                libraryKnown  = set (libraryLabels)
                 # . Collect labels from PDB atoms
-                pdbLabels     = []
-                for atom in residue.atoms:
-                    pdbLabels.append (atom.label)
+                pdbLabels     = [atom.label for atom in residue.atoms]
+                pdbKnown      = set (pdbLabels)
                 # . Check if all labels are present in the PDB file
                 missing   = []
                 for libraryLabel in libraryLabels:
                     if not includeHydrogens:
                         if libraryLabel[0] == "H":
                             continue
-                    if libraryLabel not in pdbLabels:
+                    if libraryLabel not in pdbKnown:
                         missing.append (libraryLabel)
                 if self.logLevel > 0:
                     if missing:
@@ -352,7 +585,7 @@ class PDBFile (object):
                     if not includeHydrogens:
                         if pdbLabel[0] == "H":
                             continue
-                    if pdbLabel not in libraryLabels:
+                    if pdbLabel not in libraryKnown:
                         redundant.append (pdbLabel)
                 if self.logLevel > 0:
                     if redundant:
@@ -360,8 +593,12 @@ class PDBFile (object):
                         atoms      = " ".join (redundant)
                         print ("Residue %s %s %d has %d redundant atom%s: %s" % (residue.chain, residue.label, residue.serial, nredundant, "s" if nredundant > 1 else "", atoms))
             else:
+                match = index.Match (residue) if (index is not None) else None
                 if self.logLevel > 0:
-                    print ("Residue %s %s %d not found in the library." % (residue.chain, residue.label, residue.serial))
+                    if match:
+                        print ("Residue %s %s %d not found in the library, but it matches component %s." % (residue.chain, residue.label, residue.serial, match.component.label))
+                    else:
+                        print ("Residue %s %s %d not found in the library." % (residue.chain, residue.label, residue.serial))
 
 
     @property
@@ -372,11 +609,8 @@ class PDBFile (object):
 
     @property
     def natoms (self):
-        if hasattr (self, "residues"):
-            natoms = 0
-            for residue in self.residues:
-                natoms += len (residue.atoms)
-            return natoms
+        if hasattr (self, "_serials"):
+            return self.serials.shape[0]
         return 0
 
     @property
@@ -386,6 +620,89 @@ class PDBFile (object):
         return 0
 
 
+#===============================================================================
+# . Helper functions
+#===============================================================================
+def _CharacterTable (lines, width):
+    """Convert lines to a table of characters of shape (nlines, width), padded with spaces."""
+    nlines = len (lines)
+    table  = numpy.array (lines, dtype=("S%d" % width)).view (numpy.uint8).reshape ((nlines, width))
+    # . Nulls of padding, newlines and other control characters become spaces
+    table[table < _SPACE] = _SPACE
+    return table
+
+
+def _Columns (table, start, stop):
+    """Cut fixed columns from a table of characters into an array of strings."""
+    return table[:, start:stop].copy ().view ("S%d" % (stop - start)).reshape (-1)
+
+
+def _Digits (chars):
+    """Read fields of characters of shape (..., width) as unsigned integers.
+
+    Returns the integers and a mask of valid fields, that is fields made of digits with optional spaces around them."""
+    digit   = (chars >= _ZERO) & (chars <= (_ZERO + 9))
+    space   = (chars == _SPACE)
+    starts  = digit.copy ()
+    starts[..., 1:] &= ~digit[..., :-1]
+    valid   = numpy.all (digit | space, axis=-1) & (starts.sum (axis=-1) == 1)
+    # . The power of ten of a digit is the number of digits to its right
+    powers  = numpy.cumsum (digit[..., ::-1], axis=-1)[..., ::-1] - digit
+    values  = ((chars.astype (numpy.int64) - _ZERO) * digit * (10 ** powers)).sum (axis=-1)
+    return (values, valid)
+
+
+def _Integers (chars, fillGaps=False):
+    """Read fields of characters of shape (nlines, width) as integers.
+
+    With fillGaps, fields that are not integers (for example, "*****" in large files) become the previous integer plus one."""
+    (integers, valid) = _Digits (chars)
+    if not valid.all ():
+        # . Slow path, for example for negative numbers
+        fields = _Columns (chars, 0, chars.shape[1]).tolist ()
+        for i in numpy.flatnonzero (~valid).tolist ():
+            try:
+                integers[i] = int (fields[i])
+            except exceptions.ValueError:
+                if not fillGaps:
+                    raise
+                integers[i] = (integers[i - 1] + 1) if (i > 0) else 1
+    return integers
+
+
+def _Floats (chars, width):
+    """Read fixed-width fields of real numbers from characters of shape (nlines, nfields * width).
+
+    Returns an array of shape (nlines, nfields)."""
+    (nlines, ncolumns) = chars.shape
+    nvalues = nlines * (ncolumns / width)
+    # . Separate the fields with spaces, since numbers may touch each other
+    padded  = numpy.empty ((nvalues, width + 1), dtype=numpy.uint8)
+    padded[:, :width] = chars.reshape ((nvalues, width))
+    padded[:,  width] = _SPACE
+    values  = numpy.fromstring (padded.tostring (), dtype=numpy.float64, sep=" ") if nvalues else numpy.zeros (0)
+    if values.shape[0] != nvalues:
+        # . Slow path, that raises an exception for invalid fields
+        values = _Columns (padded, 0, width).astype (numpy.float64)
+    return values.reshape ((nlines, ncolumns / width))
+
+
+def _ParseBonds (lines):
+    """Convert CONECT lines into a list of unique pairs of serials (lower serial first), in the order of appearance."""
+    nlines  = len (lines)
+    table   = _CharacterTable (lines, 31)
+    serials = _Integers (table[:, 6:11])
+    (bonded, valid) = _Digits (table[:, 11:31].reshape ((nlines, 4, 5)))
+    rows    = numpy.nonzero (valid)[0]
+    pairs   = numpy.column_stack ((serials[rows], bonded[valid]))
+    pairs.sort (axis=1)
+    # . Keep the first occurrence of each pair
+    keys    = (pairs[:, 0] << 32) + pairs[:, 1]
+    (unique, first) = numpy.unique (keys, return_index=True)
+    pairs   = pairs[numpy.sort (first)]
+    return map (tuple, pairs.tolist ())
+
+
 #===============================================================================
 # . Main program
 #===============================================================================
@@ -4,9 +4,11 @@
 # . Copyright : USC, Mikolaj Feliks (2015-2018)
 # . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
 #-------------------------------------------------------------------------------
-import  exceptions, collections
+import  exceptions, collections, mmap, os
 
-from  MolarisTools.Utilities import TokenizeLine
+import  numpy
+
+from  MolarisTools.Utilities import TokenizeLine, RestoreFromCache, StoreInCache, AssignBins, MakeBins, WelfordAccumulator, HistogramAccumulator, LoadFiles, CheckBatchErrors
 
 
 _FORMAT_SIMPLE    = "%2s   %8.3f   %8.3f   %8.3f\n"
@@ -20,15 +22,241 @@ TrajAtomExtended = collections.namedtuple ("TrajAtomExtended"  , "label  x  y  z
 
 _MAX_ATOMS       = 1000
 _MAX_STEPS       = 1000000
+_BATCH_STEPS     = 1000
+
+_MODULE_LABEL    = "XYZTraj"
+_INDEX_PREFIX    = "."
+_INDEX_SUFFIX    = ".index.npz"
+_INDEX_FORMAT    = 1
+
+
+def _ReadAtom (line):
+    """Read an atom in the simple or extended (with forces and charges) format."""
+    tokens = line.split ()
+    if len (tokens) < 5:
+        # . Simple format
+        (label, x, y, z) = tokens[:4]
+        return TrajAtom (label=label, x=float (x), y=float (y), z=float (z))
+    # . Extended format with forces and charges
+    (label, x, y, z, fx, fy, fz, fm, charge) = tokens[:9]
+    return TrajAtomExtended (label=label, x=float (x), y=float (y), z=float (z), fx=float (fx), fy=float (fy), fz=float (fz), fm=float (fm), charge=float (charge))
+
+
+def _ReadStep (lines):
+    """Read a step (number of atoms, comment and atoms) from an iterator over lines."""
+    line    = next (lines)
+    # . Read number of atoms
+    natoms  = TokenizeLine (line, converters=[int])[0]
+    # . Read comment
+    line    = next (lines)
+    comment = line.rstrip ("\r\n")
+    # . Read atoms
+    atoms   = []
+    for i in range (natoms):
+        atoms.append (_ReadAtom (next (lines)))
+    return TrajStep (atoms=atoms, comment=comment)
+
+
+def _IndexFilename (filename):
+    (dirname, basename) = os.path.split (os.path.abspath (filename))
+    return os.path.join (dirname, "%s%s%s" % (_INDEX_PREFIX, basename, _INDEX_SUFFIX))
+
+
+def _BuildIndex (data, size):
+    """Find the beginning of each step in a memory-mapped XYZ file.
+
+    Returns two arrays: offsets (of length nsteps + 1) and numbers of atoms.
+    A step at the end of the file that is not complete is not included."""
+    offsets  = [0, ]
+    counts   = []
+    position = 0
+    while position < size:
+        end = data.find ("\n", position)
+        if end < 0:
+            break
+        header = data[position:end].strip ()
+        if not header:
+            # . Skip empty lines between steps
+            position = end + 1
+            offsets[-1] = position
+            continue
+        natoms = int (header)
+        # . Skip the comment and atoms
+        for i in range (natoms + 1):
+            end = data.find ("\n", end + 1)
+            if end < 0:
+                break
+        if end < 0:
+            break
+        position = end + 1
+        counts.append (natoms)
+        offsets.append (position)
+    return (numpy.array (offsets, dtype=numpy.int64), numpy.array (counts, dtype=numpy.int32))
+
+
+class _LazySteps (object):
+    """A sequence of steps of a memory-mapped XYZ file that are read only when accessed."""
+
+    def __init__ (self, filename, logging=False):
+        self.filename = filename
+        self.charges  = None
+        info = os.stat (filename)
+        self._file = open (filename, "rb")
+        if info.st_size > 0:
+            self._data = mmap.mmap (self._file.fileno (), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = ""
+        if not self._LoadIndex (info):
+            (self.offsets, self.natoms) = _BuildIndex (self._data, info.st_size)
+            self._SaveIndex (info)
+            if logging:
+                print ("# . %s> Indexed %d steps of file %s" % (_MODULE_LABEL, len (self.natoms), filename))
+
+
+    def _Signature (self, info):
+        return (float (_INDEX_FORMAT), float (info.st_size), info.st_mtime)
+
+
+    def _LoadIndex (self, info):
+        indexFilename = _IndexFilename (self.filename)
+        if not os.path.exists (indexFilename):
+            return False
+        try:
+            archive = numpy.load (indexFilename)
+            try:
+                if tuple (archive["signature"]) != self._Signature (info):
+                    return False
+                self.offsets = archive["offsets"]
+                self.natoms  = archive["natoms"]
+            finally:
+                archive.close ()
+        except exceptions.Exception:
+            return False
+        return True
+
+
+    def _SaveIndex (self, info):
+        # . The index is only a shortcut, so failures to write it are ignored
+        try:
+            numpy.savez (_IndexFilename (self.filename), offsets=self.offsets, natoms=self.natoms, signature=numpy.array (self._Signature (info), dtype=numpy.float64))
+        except exceptions.EnvironmentError:
+            pass
+
+
+    def __len__ (self):
+        return len (self.natoms)
+
+
+    def _Decode (self, index):
+        (start, stop) = self.offsets[index:index + 2]
+        # . Skip empty lines between steps
+        lines = iter (self._data[start:stop].lstrip ().splitlines ())
+        step  = _ReadStep (lines)
+        if self.charges is not None:
+            # . Charges changed after reading the file (for example, by merging link atoms)
+            for (iatom, (atom, charge)) in enumerate (zip (step.atoms, self.charges[index].tolist ())):
+                step.atoms[iatom] = atom._replace (charge=charge)
+        return step
+
+
+    def __getitem__ (self, index):
+        if isinstance (index, slice):
+            return [self._Decode (i) for i in range (*index.indices (len (self)))]
+        nsteps = len (self)
+        if index < 0:
+            index += nsteps
+        if (index < 0) or (index >= nsteps):
+            raise exceptions.IndexError ("Step index out of range.")
+        return self._Decode (index)
+
+
+    def __iter__ (self):
+        for i in range (len (self)):
+            yield self._Decode (i)
+
+
+def _WriteLines (lines, filename):
+    """Write lines to a file or print them if no filename is given."""
+    if filename != "":
+        output = open (filename, "w")
+        for line in lines:
+            output.write (line + "\n")
+        output.close ()
+    else:
+        for line in lines:
+            print (line)
+
+
+def _WriteAverageCharges (atoms, averageCharges, filename=""):
+    lines = []
+    for atomSerial, (atom, averageCharge) in enumerate (zip (atoms, averageCharges), 1):
+        lines.append ("%3d  %4s    %5.2f" % (atomSerial, atom.label, averageCharge))
+    _WriteLines (lines, filename)
+
+
+def _WriteAveragePositions (atoms, averagePositions, filename=""):
+    lines = ["%d" % len (atoms), "Average positions", ]
+    for atomSerial, (atom, averagePosition) in enumerate (zip (atoms, averagePositions), 1):
+        (x, y, z) = averagePosition
+        lines.append ("%4s    %7.3f    %7.3f    %7.3f" % (atom.label, x, y, z))
+    _WriteLines (lines, filename)
+
+
+def _WriteBins (atoms, bins, binsInfo, filename):
+    (boundaries, atomData) = bins
+    (natoms, minc, maxc, spread, nbins, sampling) = binsInfo
+    # . Write header
+    message = "natoms=%d, minc=%.3f, maxc=%.3f, spread=%.3f, nbins=%d, sampling=%f" % (natoms, minc, maxc, spread, nbins, sampling)
+    lines   = ["# %s" % message, ]
+    line    = "#" + 9 * " "
+    for (serial, atom) in enumerate (atoms, 1):
+        label = "%s%d" % (atom.label, serial)
+        line  = "%s %5s" % (line, label.center (5))
+    lines.append (line)
+    # . Write histogram
+    for iboundary, (left, right) in enumerate (boundaries):
+        charge = (left + right) / 2.
+        line   = "%7.3f  " % charge
+        for counts in atomData:
+            line   = "%s  %4d" % (line, counts[iboundary])
+        lines.append (line)
+    _WriteLines (lines, filename)
+
+
+def _AssignFromBins (atoms, bins):
+    (boundaries, atomData) = bins
+    for atomSerial, (ad, atom) in enumerate (zip (atomData, atoms), 1):
+        maxCount = 0
+        for (i, count) in enumerate (ad):
+            if count > maxCount:
+                maxCount = count
+                maxi     = i
+        (left, right) = boundaries[maxi]
+        charge = (left + right) / 2.
+        print ("%3d  %4s    %5.2f" % (atomSerial, atom.label, charge))
 
 
 class XYZTrajectory (object):
-    """A class to handle trajectories in the XYZ format (with varying number of atoms)."""
+    """A class to handle trajectories in the XYZ format (with varying number of atoms).
 
-    def __init__ (self, filename="qm.xyz"):
-        """Constructor."""
+    In lazy mode, the file is memory-mapped and steps are read only when they are accessed.
+    Beginnings of steps are found in one scan of the file and kept in an index file next to the XYZ file."""
+
+    # . Increase whenever parsing changes, so that old cache files are discarded
+    _PARSER_VERSION = 2
+
+    def __init__ (self, filename="qm.xyz", cache=False, lazy=False, logging=False):
+        """Constructor.
+
+        Parameter cache can be False (no caching), True (cache next to the file, to be trusted like code, see ParseCache) or a ParseCache object.
+        Caching is not used in lazy mode."""
         self.filename = filename
-        self._Parse ()
+        self.lazy     = lazy
+        if lazy:
+            self.steps = _LazySteps (filename, logging=logging)
+        elif not RestoreFromCache (self, filename, cache):
+            self._Parse ()
+            StoreInCache (self, filename, cache)
 
 
     def __getitem__ (self, index):
@@ -53,6 +281,62 @@ class XYZTrajectory (object):
             return len (atoms)
         return 0
 
+    # . Arrays are created from steps on first use and require the same number of atoms in each step
+    @property
+    def coordinates (self):
+        """Coordinates of atoms, array of shape (nsteps, natoms, 3)."""
+        self._BuildArrays ()
+        return self._coordinates
+
+    @property
+    def forces (self):
+        """Forces on atoms, array of shape (nsteps, natoms, 3)."""
+        self._BuildArrays ()
+        if self._forces is None:
+            raise exceptions.StandardError ("Atom has no force property.")
+        return self._forces
+
+    @property
+    def forceMagnitudes (self):
+        """Magnitudes of forces on atoms, array of shape (nsteps, natoms)."""
+        self._BuildArrays ()
+        if self._forceMagnitudes is None:
+            raise exceptions.StandardError ("Atom has no force property.")
+        return self._forceMagnitudes
+
+    @property
+    def charges (self):
+        """Charges of atoms, array of shape (nsteps, natoms)."""
+        self._BuildArrays ()
+        if self._charges is None:
+            raise exceptions.StandardError ("Atom has no charge property.")
+        return self._charges
+
+
+    def _BuildArrays (self):
+        if hasattr (self, "_coordinates"):
+            return
+        (nsteps, natoms) = (self.nsteps, self.natoms)
+        if nsteps < 1:
+            raise exceptions.StandardError ("Trajectory has no steps.")
+        extended = isinstance (self.steps[0].atoms[0], TrajAtomExtended)
+        ncolumns = 8 if extended else 3
+        data     = numpy.empty ((nsteps, natoms, ncolumns), dtype=numpy.float64)
+        for (istep, step) in enumerate (self.steps):
+            if len (step.atoms) != natoms:
+                raise exceptions.StandardError ("Step %d has %d atoms instead of %d." % (istep + 1, len (step.atoms), natoms))
+            try:
+                data[istep] = [atom[1:ncolumns + 1] for atom in step.atoms]
+            except exceptions.ValueError:
+                raise exceptions.StandardError ("Atoms in step %d are in a different format." % (istep + 1))
+        self._coordinates = numpy.ascontiguousarray (data[:, :, 0:3])
+        if extended:
+            self._forces          = numpy.ascontiguousarray (data[:, :, 3:6])
+            self._forceMagnitudes = numpy.ascontiguousarray (data[:, :, 6])
+            self._charges         = numpy.ascontiguousarray (data[:, :, 7])
+        else:
+            self._forces = self._forceMagnitudes = self._charges = None
+
 
     def _Parse (self):
         """Parse an XYZ file."""
@@ -60,29 +344,7 @@ class XYZTrajectory (object):
         steps = []
         try:
             while True:
-                line    = lines.next ()
-                # . Read number of atoms
-                natoms  = TokenizeLine (line, converters=[int])[0]
-                # . Read comment
-                line    = lines.next ()
-                comment = line[:-1]
-                # . Read atoms
-                atoms   = []
-                for i in range (natoms):
-                    line   = lines.next ()
-                    # . Detect format first
-                    tokens = TokenizeLine (line)
-                    if len (tokens) < 5:
-                        # . Simple format
-                        tokens = TokenizeLine (line, converters=[None, ] + [float, ] * 3)
-                        atom   = TrajAtom (label=tokens[0], x=tokens[1], y=tokens[2], z=tokens[3])
-                    else:
-                        # . Extended format with forces and charges
-                        tokens = TokenizeLine (line, converters=[None, ] + [float, ] * 8)
-                        atom   = TrajAtomExtended (label=tokens[0], x=tokens[1], y=tokens[2], z=tokens[3], fx=tokens[4], fy=tokens[5], fz=tokens[6], fm=tokens[7], charge=tokens[8])
-                    atoms.append (atom)
-                # . Create a step and add it to the list of steps
-                step = TrajStep (atoms=atoms, comment=comment)
+                step = _ReadStep (lines)
                 steps.append (step)
         except StopIteration:
             pass
@@ -101,9 +363,9 @@ class XYZTrajectory (object):
             openfile.write ("%d\n%s\n" % (natoms, step.comment))
             for atom in step.atoms:
                 if   isinstance (atom, TrajAtom):
-                    openfile.write (_FORMAT_SIMPLE   % atom.label, atom.x, atom.y, atom.z)
+                    openfile.write (_FORMAT_SIMPLE   % (atom.label, atom.x, atom.y, atom.z))
                 elif isinstance (atom, TrajAtomExtended):
-                    openfile.write (_FORMAT_EXTENDED % atom.label, atom.x, atom.y, atom.z, atom.fx, atom.fy, atom.fz, atom.fm, atom.charge)
+                    openfile.write (_FORMAT_EXTENDED % (atom.label, atom.x, atom.y, atom.z, atom.fx, atom.fy, atom.fz, atom.fm, atom.charge))
         # . Close the file
         openfile.close ()
 
@@ -122,24 +384,19 @@ class XYZTrajectory (object):
 
 
     def _WriteAtomicProperty (self, atomicProperty, filename, rangeAtoms, rangeSteps):
+        if   atomicProperty == "charge":
+            values = self.charges
+        elif atomicProperty == "force" :
+            values = self.forceMagnitudes
+        else:
+            raise exceptions.StandardError ("Unknown atomic property: %s" % atomicProperty)
         convert, header = self._GetHeader (rangeAtoms)
         output      = open (filename, "w")
         output.write ("%s\n" % header)
-        start, stop = rangeSteps
-        steps       = self.steps[start:stop]
-        start, stop = rangeAtoms
-        for istep, step in enumerate (steps, 1):
-            line    = "%4d" % istep
-            for iatom, atom in enumerate (step.atoms[start:stop]):
-                if isinstance (atom, TrajAtomExtended):
-                    if   atomicProperty == "charge":
-                        line     = "%s  %7.3f" % (line, atom.charge)
-                    elif atomicProperty == "force" :
-                        line     = "%s  %7.3f" % (line, atom.fm)
-                    else:
-                        raise exceptions.StandardError ("Unknown atomic property: %s" % atomicProperty)
-                else:
-                    raise exceptions.StandardError ("Atom has no properties.")
+        (start, stop) = rangeSteps
+        (first, last) = rangeAtoms
+        for istep, row in enumerate (values[start:stop, first:last], 1):
+            line    = "%4d" % istep + "".join (["  %7.3f" % value for value in row])
             output.write ("%s\n" % line)
         output.close ()
         return convert
@@ -157,237 +414,279 @@ class XYZTrajectory (object):
 
     def BinCharges (self, rangeAtoms=(0, _MAX_ATOMS), rangeSteps=(0, _MAX_STEPS), sampling=0.1, limits=None):
         """For each atom, calculate the distribution of its charge."""
-        start, stop = rangeSteps
-        steps       = self.steps[start:stop]
-        nsteps      = len (steps)
-        step        = steps[0]
-        start, stop = rangeAtoms
-        natoms      = len (step.atoms[start:stop])
-        # . For each atom, collect its charges throughout the trajectory
-        atoms       = []
-        for i in range (natoms):
-            charges = []
-            for step in steps:
-                atom = step.atoms[start + i]
-                if isinstance (atom, TrajAtomExtended):
-                    charges.append (atom.charge)
-                else:
-                    raise exceptions.StandardError ("Atom has no charge property.")
-            atoms.append (charges)
+        (start, stop) = rangeSteps
+        (first, last) = rangeAtoms
+        charges       = self.charges[start:stop, first:last]
+        natoms        = charges.shape[1]
         # . Find extreme charges
         if limits:
             (minc, maxc) = limits
         else:
-            minc =  999.
-            maxc = -999.
-            for atom in atoms:
-                charges = atom
-                mint    = min (charges)
-                maxt    = max (charges)
-                if mint < minc:
-                    minc = mint
-                if maxt > maxc:
-                    maxc = maxt
-        # . Calculate the number of bins and recalculate the sampling parameter
+            minc = min ( 999., float (charges.min ()))
+            maxc = max (-999., float (charges.max ()))
+        # . Calculate the number of bins, their boundaries and recalculate the sampling parameter
+        (lefts, rights, sampling) = MakeBins ((minc, maxc), sampling)
         spread   = maxc - minc
-        nbins    = int (spread / sampling)
-        sampling = spread / nbins
-        # . For each bin, calculate its boundaries
-        boundaries = []
-        for i in range (nbins):
-            left     = i * sampling + minc
-            right    = left + sampling
-            boundary = (left, right)
-            boundaries.append (boundary)
+        nbins    = len (lefts)
+        # . Assign charges to bins
+        indices  = AssignBins (charges, lefts, rights)
         # . For each atom, calculate counts in each bin
-        atomData = []
-        for atom in atoms:
-            charges = atom
-            bins    = [0] * nbins
-            for charge in charges:
-                for iboundary, (left, right) in enumerate (boundaries):
-                    if   iboundary < 1:
-                        if charge >= left and charge <  right:
-                            break
-                    elif iboundary > (nbins - 2):
-                        if charge >  left and charge <= right:
-                            break
-                    else:
-                        if charge >  left and charge <  right:
-                            break
-                bins[iboundary] += 1
-            atomData.append (bins)
+        offsets  = numpy.arange (natoms) * nbins
+        counts   = numpy.bincount ((indices + offsets).ravel (), minlength=(natoms * nbins))
+        atomData = counts.reshape ((natoms, nbins)).tolist ()
         # . Finish up
+        boundaries    = zip (lefts.tolist (), rights.tolist ())
         self.binsInfo = (natoms, minc, maxc, spread, nbins, sampling)
         self.bins     = (boundaries, atomData)
 
 
     def BinsWrite (self, filename="histogram.dat"):
         """Write histogram data to a file in a format suitable for Gnuplot."""
-        if hasattr (self, "bins"):
-            (boundaries, atomData) = self.bins
-            (natoms, minc, maxc, spread, nbins, sampling) = self.binsInfo
-        else:
+        if not hasattr (self, "bins"):
             raise exceptions.StandardError ("First calculate bins.")
-        # . Write header
-        message = "natoms=%d, minc=%.3f, maxc=%.3f, spread=%.3f, nbins=%d, sampling=%f" % (natoms, minc, maxc, spread, nbins, sampling)
-        lines   = ["# %s" % message, ]
-        line    = "#" + 9 * " "
-        for (serial, atom) in enumerate (self.steps[0].atoms, 1):
-            label = "%s%d" % (atom.label, serial)
-            line  = "%s %5s" % (line, label.center (5))
-        lines.append (line)
-        # . Write histogram
-        for iboundary, (left, right) in enumerate (boundaries):
-            charge = (left + right) / 2.
-            line   = "%7.3f  " % charge
-            for atom in atomData:
-                counts = atom
-                count  = counts[iboundary]
-                line   = "%s  %4d" % (line, count)
-            lines.append (line)
-        # . Write file
-        fo = open (filename, "w")
-        for line in lines:
-            fo.write (line + "\n")
-        fo.close ()
+        _WriteBins (self.steps[0].atoms, self.bins, self.binsInfo, filename)
 
 
     def BinsAssign (self):
         """For each atom, get a charge from the most populous bin."""
-        if hasattr (self, "bins"):
-            (boundaries, atomData) = self.bins
-            (natoms, minc, maxc, spread, nbins, sampling) = self.binsInfo
-        else:
+        if not hasattr (self, "bins"):
             raise exceptions.StandardError ("First calculate bins.")
-        # . Iterate atoms
-        for atomSerial, (ad, atom) in enumerate (zip (atomData, self.steps[0].atoms), 1):
-            maxCount = 0
-            for (i, count) in enumerate (ad):
-                if count > maxCount:
-                    maxCount = count
-                    maxi     = i
-            (left, right) = boundaries[maxi]
-            charge = (left + right) / 2.
-            print ("%3d  %4s    %5.2f" % (atomSerial, atom.label, charge))
+        _AssignFromBins (self.steps[0].atoms, self.bins)
 
 
     def MergeLinkAtomCharges (self, pairs):
         """Add charges of link atoms to the charges of their parent heavy atoms.
 
-        Pairs have the following format: ((serialOfLinkAtom, serialOfParentAtom), ...)"""
-        indices = []
+        Pairs have the following format: ((serialOfLinkAtom, serialOfParentAtom), ...)
+
+        Both the charges array and atoms in steps are changed."""
+        charges = self.charges
+        changed = set ()
         for (serialLink, serialParent) in pairs:
-            pair = (serialLink - 1, serialParent - 1)
-            indices.append (pair)
-        for step in self.steps:
-            for (indexLink, indexParent) in indices:
-                link      = step.atoms[indexLink  ]
-                parent    = step.atoms[indexParent]
-                newParent = TrajAtomExtended (
-                    label   =   parent.label  ,
-                    x       =   parent.x      ,
-                    y       =   parent.y      ,
-                    z       =   parent.z      ,
-                    fx      =   parent.fx     ,
-                    fy      =   parent.fy     ,
-                    fz      =   parent.fz     ,
-                    fm      =   parent.fm     ,
-                    charge  =   (parent.charge + link.charge) , )
-                step.atoms[indexParent] = newParent
-                newLink = TrajAtomExtended (
-                    label  =   link.label  ,
-                    x      =   link.x      ,
-                    y      =   link.y      ,
-                    z      =   link.z      ,
-                    fx     =   link.fx     ,
-                    fy     =   link.fy     ,
-                    fz     =   link.fz     ,
-                    fm     =   link.fm     ,
-                    charge =   0.          , )
-                step.atoms[indexLink] = newLink
+            (indexLink, indexParent) = (serialLink - 1, serialParent - 1)
+            charges[:, indexParent] += charges[:, indexLink]
+            charges[:, indexLink  ]  = 0.
+            changed.update ((indexLink, indexParent))
+        if self.lazy:
+            # . Steps are read from the file again on each access, so they take charges from the array
+            self.steps.charges = charges
+        else:
+            for (istep, step) in enumerate (self.steps):
+                for index in changed:
+                    step.atoms[index] = step.atoms[index]._replace (charge=float (charges[istep, index]))
 
 
     def AverageCharges (self):
         """For each atom, calculate its average charge from the trajectory."""
-        nsteps = len (self.steps)
+        nsteps = self.nsteps
         if nsteps > 0:
-            natoms   = len (self.steps[0].atoms)
-            averages = []
-            for i in range (natoms):
-                collect = []
-                for step in self.steps:
-                    atom = step.atoms[i]
-                    collect.append (atom.charge)
-                averages.append (sum (collect) / nsteps)
-            self.averageCharges = averages
+            # . Summing over steps (the outer axis) adds rows one by one, as in a loop over steps
+            self.averageCharges = (self.charges.sum (axis=0) / nsteps).tolist ()
 
 
     def AverageChargesWrite (self, filename=""):
         """Write average charges."""
         if not hasattr (self, "averageCharges"):
             self.AverageCharges ()
-        toFile = False
-        if filename != "":
-            output = open (filename, "w")
-            toFile = True
-        step   = self.steps[0]
-        for atomSerial, (atom, averageCharge) in enumerate (zip (step.atoms, self.averageCharges), 1):
-            line = "%3d  %4s    %5.2f" % (atomSerial, atom.label, averageCharge)
-            if toFile:
-                output.write (line + "\n")
-            else:
-                print (line)
-        if toFile:
-            output.close ()
+        _WriteAverageCharges (self.steps[0].atoms, self.averageCharges, filename)
 
 
     def AveragePositions (self):
         """Calculate an average position of each atom."""
         if self.nsteps > 0:
-            coordinates = [0., 0., 0.]
-            averages    = [coordinates] * self.natoms
-            for step in self.steps:
-                for (i, atom) in enumerate (step.atoms):
-                    (x, y, z) = averages[i]
-                    x += atom.x
-                    y += atom.y
-                    z += atom.z
-                    averages[i] = [x, y, z]
-            atoms     = self.steps[0].atoms
             scale     = 1. / self.nsteps
-            positions = []
-            for (atom, (ax, ay, az)) in zip (atoms, averages):
-                ax *= scale
-                ay *= scale
-                az *= scale
-                positions.append ((ax, ay, az))
-            self.averagePositions = positions
+            averages  = self.coordinates.sum (axis=0) * scale
+            self.averagePositions = map (tuple, averages.tolist ())
 
 
     def AveragePositionsWrite (self, filename=""):
         """Write average positions."""
         if not hasattr (self, "averagePositions"):
             self.AveragePositions ()
-        toFile = False
-        if filename != "":
-            output = open (filename, "w")
-            toFile = True
-        header = "%d\nAverage positions" % self.natoms
-        if toFile:
-            output.write (header + "\n")
-        else:
-            print (header)
-        step   = self.steps[0]
-        for atomSerial, (atom, averagePosition) in enumerate (zip (step.atoms, self.averagePositions), 1):
-            (x, y, z) = averagePosition
-            line = "%4s    %7.3f    %7.3f    %7.3f" % (atom.label, x, y, z)
-            if toFile:
-                output.write (line + "\n")
-            else:
-                print (line)
-        if toFile:
-            output.close ()
+        _WriteAveragePositions (self.steps[0].atoms, self.averagePositions, filename)
+
+
+#-------------------------------------------------------------------------------
+class XYZStatistics (object):
+    """A class to calculate statistics of an XYZ trajectory in one pass without keeping steps in memory.
+
+    Per-atom means and variances of positions, force magnitudes and charges are calculated with Welford updates.
+    Charges are also counted in fixed bins defined by limits and sampling (as in XYZTrajectory.BinCharges with limits).
+    Statistics calculated for parts of a trajectory can be merged."""
+
+    def __init__ (self, limits=(-1., 1.), sampling=0.1):
+        """Constructor."""
+        self.limits    = limits
+        self.sampling  = sampling
+        self.nsteps    = 0
+        self.atoms     = None
+        self._batch    = []
+
+
+    @property
+    def natoms (self):
+        if self.atoms is not None:
+            return len (self.atoms)
+        return 0
+
+
+    def _Initialize (self, atoms):
+        natoms         = len (atoms)
+        self.atoms     = atoms
+        self.extended  = isinstance (atoms[0], TrajAtomExtended)
+        self.positions = WelfordAccumulator ((natoms, 3))
+        if self.extended:
+            self.forceMagnitudes = WelfordAccumulator ((natoms, ))
+            self.charges         = WelfordAccumulator ((natoms, ))
+            self.histogram       = HistogramAccumulator (natoms, limits=self.limits, sampling=self.sampling)
+
+
+    def Add (self, step):
+        """Add a step (TrajStep)."""
+        if self.atoms is None:
+            self._Initialize (step.atoms)
+        if len (step.atoms) != self.natoms:
+            raise exceptions.StandardError ("Step has %d atoms instead of %d." % (len (step.atoms), self.natoms))
+        ncolumns = 8 if self.extended else 3
+        self._batch.append ([atom[1:ncolumns + 1] for atom in step.atoms])
+        self.nsteps += 1
+        # . Steps are collected in small batches to use array operations
+        if len (self._batch) >= _BATCH_STEPS:
+            self._Flush ()
+
+
+    def _Flush (self):
+        if self._batch:
+            try:
+                data = numpy.array (self._batch, dtype=numpy.float64)
+            except exceptions.ValueError:
+                raise exceptions.StandardError ("Atoms are in different formats.")
+            self._batch = []
+            self.positions.AddBatch (data[:, :, 0:3])
+            if self.extended:
+                self.forceMagnitudes.AddBatch (data[:, :, 6])
+                self.charges.AddBatch         (data[:, :, 7])
+                self.histogram.AddBatch       (data[:, :, 7])
+
+
+    def Merge (self, other):
+        """Add statistics calculated for another part of the trajectory."""
+        self._Flush ()
+        other._Flush ()
+        if other.atoms is None:
+            return
+        if self.atoms is None:
+            self._Initialize (other.atoms)
+        if other.natoms != self.natoms:
+            raise exceptions.StandardError ("Cannot merge statistics for different numbers of atoms.")
+        self.positions.Merge (other.positions)
+        if self.extended:
+            self.forceMagnitudes.Merge (other.forceMagnitudes)
+            self.charges.Merge         (other.charges)
+            self.histogram.Merge       (other.histogram)
+        self.nsteps += other.nsteps
+
+
+    def ReadFile (self, filename, start=0, stop=None):
+        """Add steps from a file, optionally only from the bytes start:stop (which have to be beginnings of steps)."""
+        data  = open (filename)
+        data.seek (start)
+        if stop is None:
+            stop = os.path.getsize (filename)
+        # . Reading with readline keeps tell () exact
+        lines = iter (data.readline, "")
+        try:
+            while data.tell () < stop:
+                self.Add (_ReadStep (lines))
+        except StopIteration:
+            pass
+        data.close ()
+        self._Flush ()
+
+
+    def _CheckSteps (self):
+        self._Flush ()
+        if self.atoms is None:
+            raise exceptions.StandardError ("No steps were read.")
+
+    def _CheckCharges (self):
+        self._CheckSteps ()
+        if not self.extended:
+            raise exceptions.StandardError ("Atom has no charge property.")
+
+    @property
+    def averageCharges (self):
+        self._CheckCharges ()
+        return self.charges.mean.tolist ()
+
+    @property
+    def averagePositions (self):
+        self._CheckSteps ()
+        return map (tuple, self.positions.mean.tolist ())
+
+    @property
+    def bins (self):
+        self._CheckCharges ()
+        boundaries = zip (self.histogram.lefts.tolist (), self.histogram.rights.tolist ())
+        return (boundaries, self.histogram.counts.tolist ())
+
+    @property
+    def binsInfo (self):
+        self._CheckCharges ()
+        (minc, maxc) = self.limits
+        return (self.natoms, minc, maxc, maxc - minc, self.histogram.nbins, self.histogram.sampling)
+
+
+    def AverageChargesWrite (self, filename=""):
+        """Write average charges (as XYZTrajectory.AverageChargesWrite)."""
+        _WriteAverageCharges (self.atoms, self.averageCharges, filename)
+
+
+    def AveragePositionsWrite (self, filename=""):
+        """Write average positions (as XYZTrajectory.AveragePositionsWrite)."""
+        _WriteAveragePositions (self.atoms, self.averagePositions, filename)
+
+
+    def BinsWrite (self, filename="histogram.dat"):
+        """Write histogram data (as XYZTrajectory.BinsWrite)."""
+        _WriteBins (self.atoms, self.bins, self.binsInfo, filename)
+
+
+    def BinsAssign (self):
+        """For each atom, get a charge from the most populous bin (as XYZTrajectory.BinsAssign)."""
+        _AssignFromBins (self.atoms, self.bins)
+
+
+def _ReadChunk (chunk, limits=(-1., 1.), sampling=0.1):
+    """Calculate statistics for a part of a file, chunk is (filename, start, stop)."""
+    (filename, start, stop) = chunk
+    statistics = XYZStatistics (limits=limits, sampling=sampling)
+    statistics.ReadFile (filename, start=start, stop=stop)
+    return statistics
+
+
+def CalculateXYZStatistics (filename, limits=(-1., 1.), sampling=0.1, nprocs=1, nchunks=None, logging=False):
+    """Calculate statistics of an XYZ trajectory in one pass.
+
+    For nprocs > 1, the file is divided into chunks (by default, one for each process) that are read in parallel and merged."""
+    if nchunks is None:
+        nchunks = nprocs
+    if nchunks < 2:
+        return _ReadChunk ((filename, 0, None), limits=limits, sampling=sampling)
+    # . Beginnings of steps are taken from the (persistent) index of the lazy mode
+    steps   = _LazySteps (filename, logging=logging)
+    nsteps  = len (steps)
+    bounds  = numpy.linspace (0, nsteps, nchunks + 1).astype (numpy.int64)
+    chunks  = []
+    for (first, last) in zip (bounds[:-1], bounds[1:]):
+        if last > first:
+            chunks.append ((filename, int (steps.offsets[first]), int (steps.offsets[last])))
+    results = LoadFiles (chunks, _ReadChunk, nprocs=nprocs, keywordArguments={"limits" : limits, "sampling" : sampling}, logging=logging)
+    CheckBatchErrors (results)
+    statistics = XYZStatistics (limits=limits, sampling=sampling)
+    for batchResult in results:
+        statistics.Merge (batchResult.result)
+    return statistics
 
 
 #===============================================================================
@@ -16,17 +16,18 @@ from MopacOutputFile     import MopacOutputFile
 from MopacInputFile      import MopacInputFile
 
 # . Structure
-from XYZTrajectory       import XYZTrajectory
+from XYZTrajectory       import XYZTrajectory, XYZStatistics, CalculateXYZStatistics
 from PDBFile             import PDBFile, PDBAtom, PDBResidue, PDBChain
 
 # . Molaris
 from MolarisResidue      import MolarisResidue
 from MolarisAtomsFile    import MolarisAtomsFile
 from MolarisInputFile    import MolarisInputFile
-from MolarisOutputFile   import MolarisOutputFile, MolarisOutputFile2, MolarisOutputFile3
+from MolarisOutputFile   import MolarisOutputFile, MolarisOutputFile2, MolarisOutputFile3, MolarisOutputFollower
+from EnergyTable         import EnergyTable, WindowSummary
 from DetermineAtoms      import DetermineAtoms
 from DistanceFile        import DistanceFile
 from FVXFile             import FVXFile
-from GapFile             import GapFile, GapFileEVB
+from GapFile             import GapFile, GapFileEVB, GapFileFollower
 from EVBDatFile          import EVBDatFile
 
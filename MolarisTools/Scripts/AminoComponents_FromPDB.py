@@ -4,11 +4,14 @@
 # . Copyright : USC, Mikolaj Feliks (2015-2018)
 # . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
 #-------------------------------------------------------------------------------
-import math
+import copy
 
-from MolarisTools.Units    import typicalBonds
-from MolarisTools.Parser   import PDBFile
-from MolarisTools.Library  import AminoComponent, AminoGroup, AminoAtom
+import numpy
+
+from MolarisTools.Units      import typicalBonds
+from MolarisTools.Utilities  import CellList
+from MolarisTools.Parser     import PDBFile
+from MolarisTools.Library    import AminoComponent, AminoGroup, AminoAtom, AminoLibrary, ResidueIndex
 
 
 _DEFAULT_FORCE          = 5.
@@ -19,81 +22,105 @@ _DEFAULT_TOLERANCE_LOW  = 0.85
 _SCALE_TOLERANCE        = 1.2
 
 
-def GetBondTolerance (atoma, atomb, defaultTolerance, labels=("CL", "BR", ), logging=True):
-    """Get a typical bond length between two atoms."""
-    templ = atoma.label.upper ()[:2]
+def _BondElement (label, labels=("CL", "BR", )):
+    """Get the element of an atom from its label, as used in the table of typical bonds."""
+    templ = label.upper ()[:2]
     if templ in labels:
-        labela = templ
-    else:
-        labela = templ[:1]
-    templ = atomb.label.upper ()[:2]
-    if templ in labels:
-        labelb = templ
-    else:
-        labelb = templ[:1]
-    key = (labela, labelb)
+        return templ
+    return templ[:1]
+
+
+def _TypicalBond (elementa, elementb):
+    """Get a typical bond length between two elements, or None."""
+    key = (elementa, elementb)
     if typicalBonds.has_key (key):
-        tolerance = typicalBonds[key]
-    else:
-        yek = (labelb, labela)
-        if typicalBonds.has_key (yek):
-            tolerance = typicalBonds[yek]
-        else:
-            tolerance = defaultTolerance / _SCALE_TOLERANCE
-            if logging:
-                print ("# . Warning: Using default tolerance for atom pair (%s, %s)" % (atoma.label, atomb.label))
+        return typicalBonds[key]
+    yek = (elementb, elementa)
+    if typicalBonds.has_key (yek):
+        return typicalBonds[yek]
+    return None
+
+
+def GetBondTolerance (atoma, atomb, defaultTolerance, labels=("CL", "BR", ), logging=True):
+    """Get a typical bond length between two atoms."""
+    tolerance = _TypicalBond (_BondElement (atoma.label, labels), _BondElement (atomb.label, labels))
+    if tolerance is None:
+        tolerance = defaultTolerance / _SCALE_TOLERANCE
+        if logging:
+            print ("# . Warning: Using default tolerance for atom pair (%s, %s)" % (atoma.label, atomb.label))
     return (tolerance * _SCALE_TOLERANCE)
 
 
-def BondsFromDistances (atoms, tolerance=_DEFAULT_TOLERANCE, toleranceLow=_DEFAULT_TOLERANCE_LOW, logging=True):
-    """Generate a list of bonds based on distances between atoms."""
-    # . Construct a distance matrix
-    rows   = []
-    for i, (label, serial, x, y, z) in enumerate (atoms):
-        columns = []
-        for j, (otherLabel, otherSerial, otherX, otherY, otherZ) in enumerate (atoms):
-            if j < i:
-                distance = math.sqrt ((x - otherX) ** 2 + (y - otherY) ** 2 + (z - otherZ) ** 2)
-                columns.append (distance)
-            elif j == i:
-                columns.append (0.)
-            else:
-                break
-        rows.append (columns)
-    if logging:
-        print ("# . Distance matrix")
-        line = " " * 8
-        for atom in atoms:
-            line = "%s%6d" % (line, atom.serial)
-        print line
-        line = " " * 8
-        for atom in atoms:
-            line = "%s%6s" % (line, atom.label)
+def _ToleranceTable (elements, defaultTolerance, logging=True):
+    """Calculate a table of bond tolerances for all pairs of elements."""
+    nelements = len (elements)
+    table     = numpy.zeros ((nelements, nelements))
+    for (i, elementa) in enumerate (elements):
+        for (j, elementb) in enumerate (elements):
+            tolerance = _TypicalBond (elementa, elementb)
+            if tolerance is None:
+                tolerance = defaultTolerance / _SCALE_TOLERANCE
+                if logging and (i <= j):
+                    print ("# . Warning: Using default tolerance for element pair (%s, %s)" % (elementa, elementb))
+            table[i, j] = tolerance * _SCALE_TOLERANCE
+    return table
+
+
+def _WriteDistanceMatrix (atoms, coordinates, tolerances, toleranceLow):
+    """Print a lower-triangular distance matrix, bonds are marked with asterisks."""
+    print ("# . Distance matrix")
+    line = " " * 8
+    for atom in atoms:
+        line = "%s%6d" % (line, atom.serial)
+    print line
+    line = " " * 8
+    for atom in atoms:
+        line = "%s%6s" % (line, atom.label)
+    print line
+    for (i, atom) in enumerate (atoms):
+        line      = "%8s" % ("%3d %4s" % (atom.serial, atom.label))
+        vectors   = coordinates[:(i + 1)] - coordinates[i]
+        distances = numpy.sqrt ((vectors * vectors).sum (axis=1))
+        for (j, distance) in enumerate (distances):
+            mark = ""
+            if i != j:
+                if distance <= tolerances[i, j]:
+                    if distance <= toleranceLow:
+                        mark = "!"
+                    else:
+                        mark = "*"
+            line = "%s%6s" % (line, "%s%.2f" % (mark, distance))
         print line
-        for i, (atom, row) in enumerate (zip (atoms, rows)):
-            line = "%8s" % ("%3d %4s" % (atom.serial, atom.label))
-            for j, column in enumerate (row):
-                mark = ""
-                if i != j:
-                    if column <= GetBondTolerance (atoms[i], atoms[j], tolerance, logging=False):
-                        if column <= toleranceLow:
-                            mark = "!"
-                        else:
-                            mark = "*"
-                line = "%s%6s" % (line, "%s%.2f" % (mark, column))
-            print line
-    # . Search the distance matrix for bonds
+
+
+def BondsFromDistances (atoms, tolerance=_DEFAULT_TOLERANCE, toleranceLow=_DEFAULT_TOLERANCE_LOW, logging=True, debug=False):
+    """Generate a list of bonds based on distances between atoms.
+
+    Only pairs of atoms within the largest bond tolerance are compared, using a grid of cells.
+    With debug, the full distance matrix is printed (only practical for small molecules)."""
+    natoms      = len (atoms)
+    coordinates = numpy.array ([(atom.x, atom.y, atom.z) for atom in atoms], dtype=numpy.float64).reshape ((natoms, 3))
+    # . Convert atoms to elements and precompute tolerances for all pairs of elements
+    elements    = {}
+    codes       = numpy.array ([elements.setdefault (_BondElement (atom.label), len (elements)) for atom in atoms], dtype=numpy.int64)
+    elements    = sorted (elements, key=elements.get)
+    table       = _ToleranceTable (elements, tolerance, logging=logging)
+    if debug:
+        _WriteDistanceMatrix (atoms, coordinates, table[codes[:, numpy.newaxis], codes], toleranceLow)
+    # . Search pairs of atoms within the largest tolerance for bonds
     bonds = []
-    for i, row in enumerate (rows):
-        for j, column in enumerate (row):
-            if i != j:
-                if column <= GetBondTolerance (atoms[i], atoms[j], tolerance, logging=logging):
-                    if column <= toleranceLow:
-                        if logging:
-                            print ("# . Warning: Atoms (%s, %s) are too close to each other" % (atoma.label, atomb.label))
-                    (atoma, atomb) = (atoms[i], atoms[j])
-                    pair  = ((i, atoma.serial, atoma.label), (j, atomb.serial, atomb.label))
-                    bonds.append (pair)
+    if natoms > 1:
+        cutoff    = table.max ()
+        (i, j, d) = CellList (coordinates, cellSize=cutoff).Pairs ()
+        keep      = (d <= table[codes[i], codes[j]])
+        (i, j, d) = (i[keep], j[keep], d[keep])
+        for (indexa, indexb, distance) in zip (i.tolist (), j.tolist (), d.tolist ()):
+            (atoma, atomb) = (atoms[indexa], atoms[indexb])
+            if distance <= toleranceLow:
+                if logging:
+                    print ("# . Warning: Atoms (%s, %s) are too close to each other" % (atoma.label, atomb.label))
+            pair  = ((indexa, atoma.serial, atoma.label), (indexb, atomb.serial, atomb.label))
+            bonds.append (pair)
     if logging:
         nbonds = len (bonds)
         print ("# . Found %d bonds" % nbonds)
@@ -102,11 +129,18 @@ def BondsFromDistances (atoms, tolerance=_DEFAULT_TOLERANCE, toleranceLow=_DEFAU
     return bonds
 
 
-def AminoComponents_FromPDB (filename, tolerance=_DEFAULT_TOLERANCE, toleranceLow=_DEFAULT_TOLERANCE_LOW, logging=True, verbose=True):
-    """Automatically generate components based on a PDB file."""
-    pdb        = PDBFile (filename)
+def AminoComponents_FromPDB (filename, tolerance=_DEFAULT_TOLERANCE, toleranceLow=_DEFAULT_TOLERANCE_LOW, logging=True, verbose=True, debug=False, residues=None, library=None, rename=True):
+    """Automatically generate components based on a PDB file.
+
+    Filename can also be a PDBFile. Residues is an optional list of residues of the file (for example, from PDBFile.ResiduesWithin).
+
+    Library is an optional AminoLibrary or ResidueIndex. Residues that have the same bond graph as one
+    of its components are not generated, instead a copy of the component is used. With rename, atoms and
+    the label of such residues are renamed in the PDB file to match the component."""
+    pdb        = filename if isinstance (filename, PDBFile) else PDBFile (filename)
+    index      = ResidueIndex ([library, ], logging=logging) if isinstance (library, AminoLibrary) else library
     components = []
-    for residue in pdb.residues:
+    for residue in (pdb.residues if residues is None else residues):
         if logging:
             print ("*** Building component: %s %s %d ***" % (residue.chain, residue.label, residue.serial))
         # . Generate unique atom labels
@@ -132,7 +166,20 @@ def AminoComponents_FromPDB (filename, tolerance=_DEFAULT_TOLERANCE, toleranceLo
         bonds = residue.GetBonds ()
         if not bonds:
             # . Generate bonds
-            bonds = BondsFromDistances (residue.atoms, logging=logging, tolerance=tolerance, toleranceLow=toleranceLow)
+            bonds = BondsFromDistances (residue.atoms, logging=logging, tolerance=tolerance, toleranceLow=toleranceLow, debug=debug)
+        # . Use a component from the library, if there is one
+        if index is not None:
+            match = index.Match (residue, bonds=bonds)
+            if match:
+                if logging:
+                    labels  = [match.component.atoms[j].atomLabel for j in match.indices]
+                    renamed = ["%s->%s" % (label, other) for (label, other) in zip (uniqueLabels, labels) if (other != label)]
+                    print ("# . Residue matches component %s of the library%s" % (match.component.label, (", renamed atoms: %s" % " ".join (renamed)) if renamed else ""))
+                if rename:
+                    residue.atoms = [atom._replace (label=match.component.atoms[j].atomLabel) for (atom, j) in zip (residue.atoms, match.indices)]
+                    residue.label = match.component.label
+                components.append (copy.deepcopy (match.component))
+                continue
         aminoBonds  = []
         for (i, seriala, labela), (j, serialb, labelb) in bonds:
             pair    = (uniqueLabels[i], uniqueLabels[j])
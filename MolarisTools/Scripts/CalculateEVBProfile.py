@@ -0,0 +1,174 @@
+#-------------------------------------------------------------------------------
+# . File      : CalculateEVBProfile.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+import collections, exceptions
+
+import numpy
+
+from MolarisTools.Parser     import MolarisOutputFile, GapFileEVB
+from MolarisTools.Units      import GAS_CONSTANT_KCAL_MOL_K
+from CalculateFEP            import ExtractFEPWindows, CalculateFEPFromGaps
+
+
+EVBProfileResult = collections.namedtuple ("EVBProfileResult", "centers  profile  counts  activation  reaction  reactant  transition  product")
+
+_FEP_METHODS = ("forward", "backward", "bar", "mbar")
+
+
+class EVBProfile (object):
+    """A class to calculate the free energy profile of the EVB ground state along the energy gap (FEP/US mapping).
+
+    The energy gap of a sample is X = E1 - E2. The ground state energy is Eg = (E1 + E2) / 2 - sqrt (X^2 + 4 H12^2) / 2
+    and the mapping potential of window m is (1 - lambda_m) E1 + lambda_m E2. Because Eg minus the mapping potential
+    depends only on X, the profile is calculated from energy gaps and lambdas:
+
+        dg (X) = dG_m - kT ln < delta (X - X') exp (-(Eg - e_m) / kT) >_m
+
+    Values of windows with at least minSamples samples in a bin are averaged with weights of their numbers of samples.
+
+    Free energies of mapping dG_m are calculated once. A gas-phase shift alpha, added to E2, changes the mapping potential
+    of each window by a constant (lambda_m alpha), so that the profile for any H12 and alpha is obtained by reweighting
+    without sampling again. Energies are in kcal/mol."""
+
+    def __init__ (self, lambdas, gaps, temperature=300., method="bar", logging=True):
+        """Constructor.
+
+        Gaps are arrays of E2 - E1 sampled in each window (as from ExtractFEPWindows).
+        Method is the FEP estimator for free energies of mapping (forward, backward, bar or mbar)."""
+        if method not in _FEP_METHODS:
+            raise exceptions.StandardError ("Unknown FEP method %s." % method)
+        self.lambdas     = numpy.asarray (lambdas, dtype=numpy.float64)
+        self.temperature = temperature
+        self.kT          = GAS_CONSTANT_KCAL_MOL_K * temperature
+        self.counts      = numpy.array (map (len, gaps))
+        # . Samples of all windows in one array, X = E1 - E2
+        self.x           = -numpy.concatenate ([numpy.asarray (gap, dtype=numpy.float64) for gap in gaps])
+        self.windows     = numpy.repeat (numpy.arange (len (gaps)), self.counts)
+        fep = CalculateFEPFromGaps (self.lambdas, gaps, temperature=temperature, logging=False)
+        self.mapping     = numpy.concatenate (([0.], numpy.cumsum (getattr (fep, method).deltas)))
+        if logging:
+            print ("# . EVBProfile> %d windows, %d samples, mapping free energy %.2f kcal/mol (%s)" % (len (self.lambdas), len (self.x), self.mapping[-1], method))
+
+
+    @classmethod
+    def FromMolarisOutput (cls, filename="rs_fep.out", **keywordArguments):
+        """Collect windows from EVB breakdowns of a Molaris output file."""
+        windows = ExtractFEPWindows (MolarisOutputFile (filename=filename, logging=False))
+        return cls (windows.lambdas, windows.gaps, **keywordArguments)
+
+
+    @classmethod
+    def FromGapFiles (cls, filenames, lambdas, **keywordArguments):
+        """Collect windows from gap files of regular EVB simulations, one file for each lambda."""
+        gaps = []
+        for filename in filenames:
+            gapFile = GapFileEVB (filename, logging=False)
+            # . In gap files of regular EVB simulations, the target is state I and the reference is state II
+            gaps.append (gapFile.reference - gapFile.target)
+        return cls (lambdas, gaps, **keywordArguments)
+
+
+    @property
+    def limits (self):
+        return (self.x.min (), self.x.max ())
+
+
+    def Calculate (self, h12=0., shift=0., binWidth=2., limits=None, minSamples=10):
+        """Calculate the profile for coupling h12 and gas-phase shift (added to the energy of state II).
+
+        Returns an EVBProfileResult. The profile is relative to the minimum of the reactant state (X < 0).
+        Bins without enough samples are set to NaN."""
+        x       = self.x - shift
+        mapping = self.mapping + (self.lambdas - self.lambdas[0]) * shift
+        (lower, upper) = (x.min (), x.max ()) if (limits is None) else limits
+        nbins   = max (1, int (numpy.ceil ((upper - lower) / binWidth)))
+        edges   = lower + numpy.arange (nbins + 1) * binWidth
+        bins    = numpy.clip (((x - lower) / binWidth).astype (numpy.int64), 0, nbins - 1)
+        inside  = (x >= lower) & (x <= upper)
+        # . Exponents -(Eg - e_m) / kT of all samples
+        exponents = -((self.lambdas[self.windows] - .5) * x - .5 * numpy.sqrt (x ** 2 + 4. * h12 ** 2)) / self.kT
+        # . Samples are ordered by windows, so that exponents can be shifted by the largest one in each window
+        starts    = numpy.concatenate (([0], numpy.cumsum (self.counts)[:-1]))
+        largest   = numpy.maximum.reduceat (exponents, starts)
+        weights   = numpy.exp (exponents - largest[self.windows])
+        nwindows  = len (self.lambdas)
+        keys      = (self.windows * nbins + bins)[inside]
+        sums      = numpy.bincount (keys, weights=weights[inside], minlength=(nwindows * nbins)).reshape ((nwindows, nbins))
+        counts    = numpy.bincount (keys, minlength=(nwindows * nbins)).reshape ((nwindows, nbins))
+        valid     = (counts >= minSamples) & (sums > 0.)
+        # . Profile of each window in each bin
+        with numpy.errstate (divide="ignore"):
+            local = (mapping[:, numpy.newaxis] - self.kT * (numpy.log (sums) + largest[:, numpy.newaxis] - numpy.log (self.counts)[:, numpy.newaxis]))
+        local     = numpy.where (valid, local, 0.)
+        weightsWindows = numpy.where (valid, counts, 0)
+        total     = weightsWindows.sum (axis=0)
+        with numpy.errstate (invalid="ignore"):
+            profile = (local * weightsWindows).sum (axis=0) / total
+        profile[total < 1] = numpy.nan
+        centers   = .5 * (edges[:-1] + edges[1:])
+        return self._Analyze (centers, profile, counts.sum (axis=0))
+
+
+    def _Analyze (self, centers, profile, counts):
+        defined  = ~numpy.isnan (profile)
+        reactant = defined & (centers < 0.)
+        product  = defined & (centers > 0.)
+        if (not reactant.any ()) or (not product.any ()):
+            # . Reactant or product is not sampled, the barrier is not defined
+            (activation, reaction, irs, its, ips) = (numpy.nan, numpy.nan, None, None, None)
+            if defined.any ():
+                profile = profile - numpy.nanmin (profile)
+        else:
+            irs = numpy.nonzero (reactant)[0][numpy.argmin (profile[reactant])]
+            ips = numpy.nonzero (product )[0][numpy.argmin (profile[product ])]
+            profile = profile - profile[irs]
+            between = numpy.arange (irs, ips + 1)
+            between = between[defined[between]]
+            its     = between[numpy.argmax (profile[between])]
+            (activation, reaction) = (profile[its], profile[ips])
+        position = lambda index: (None if (index is None) else centers[index])
+        return EVBProfileResult (
+            centers     =   centers             ,
+            profile     =   profile             ,
+            counts      =   counts              ,
+            activation  =   activation          ,
+            reaction    =   reaction            ,
+            reactant    =   position (irs)      ,
+            transition  =   position (its)      ,
+            product     =   position (ips)      , )
+
+
+    def Scan (self, h12s, shifts, **keywordArguments):
+        """Calculate activation and reaction free energies on a grid of couplings and gas-phase shifts.
+
+        Returns a tuple of arrays (activations, reactions) of shape (len (h12s), len (shifts))."""
+        activations = numpy.empty ((len (h12s), len (shifts)))
+        reactions   = numpy.empty ((len (h12s), len (shifts)))
+        for (i, h12) in enumerate (h12s):
+            for (j, shift) in enumerate (shifts):
+                result = self.Calculate (h12=h12, shift=shift, **keywordArguments)
+                (activations[i, j], reactions[i, j]) = (result.activation, result.reaction)
+        return (activations, reactions)
+
+
+def CalculateEVBProfile (filename="rs_fep.out", h12=0., shift=0., temperature=300., binWidth=2., minSamples=10, method="bar", logging=True):
+    """Calculate the EVB free energy profile along the energy gap from a Molaris output file (see EVBProfile).
+
+    Returns an EVBProfileResult."""
+    evbProfile = EVBProfile.FromMolarisOutput (filename, temperature=temperature, method=method, logging=logging)
+    result     = evbProfile.Calculate (h12=h12, shift=shift, binWidth=binWidth, minSamples=minSamples)
+    if logging:
+        for (center, value, count) in zip (result.centers, result.profile, result.counts):
+            if not numpy.isnan (value):
+                print ("%10.2f  %10.2f  %8d" % (center, value, count))
+        print ("# . Activation free energy = %.2f kcal/mol, reaction free energy = %.2f kcal/mol" % (result.activation, result.reaction))
+    return result
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if __name__ == "__main__": pass
@@ -0,0 +1,129 @@
+#-------------------------------------------------------------------------------
+# . File      : CalculateFEP.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+import collections, exceptions
+
+import numpy
+
+from MolarisTools.Parser     import MolarisOutputFile
+from MolarisTools.Units      import GAS_CONSTANT_KCAL_MOL_K
+from MolarisTools.Utilities  import ExponentialAveraging, BennettAcceptanceRatio, MBAR, StatisticalInefficiency
+
+
+FEPWindows   = collections.namedtuple ("FEPWindows"   , "lambdas  gaps")
+FEPEstimates = collections.namedtuple ("FEPEstimates" , "deltas  errors  total  totalError")
+FEPResult    = collections.namedtuple ("FEPResult"    , "lambdas  nsamples  forward  backward  bar  mbar")
+
+
+def ExtractFEPWindows (molarisOutput):
+    """Collect energy gaps (E2 - E1) of each FEP window from EVB breakdowns of a Molaris output file.
+
+    The mapping potential of a window is (1 - lambda) E1 + lambda E2, where lambda is the density of state II.
+    Consecutive breakdowns with the same lambda belong to the same window."""
+    if not hasattr (molarisOutput, "evbComponentsII"):
+        raise exceptions.StandardError ("No EVB energies found in file %s." % molarisOutput.filename)
+    densities = numpy.array ([components.density for components in molarisOutput.evbComponentsII])
+    energiesI = numpy.array ([components.Etotal  for components in molarisOutput.evbComponentsI ])
+    energiesII = numpy.array ([components.Etotal for components in molarisOutput.evbComponentsII])
+    gaps      = energiesII - energiesI
+    # . Windows begin where lambda changes
+    starts    = numpy.concatenate (([0], numpy.nonzero (numpy.diff (densities))[0] + 1, [len (densities)]))
+    return FEPWindows (
+        lambdas =   densities[starts[:-1]]                                                   ,
+        gaps    =   [gaps[first:last] for (first, last) in zip (starts[:-1], starts[1:])]   , )
+
+
+def _Subsample (gaps):
+    """Keep uncorrelated samples, every g-th sample where g is the statistical inefficiency."""
+    if len (gaps) < 3:
+        return gaps
+    stride = int (numpy.ceil (StatisticalInefficiency (gaps)))
+    return gaps[::stride]
+
+
+def _ChainEstimates (deltas, errors):
+    deltas = numpy.array (deltas)
+    errors = numpy.array (errors)
+    return FEPEstimates (deltas=deltas, errors=errors, total=deltas.sum (), totalError=numpy.sqrt ((errors ** 2).sum ()))
+
+
+def CalculateFEPFromGaps (lambdas, gaps, temperature=300., subsample=True, maxMBARSamples=2000, logging=True):
+    """Calculate free energies of FEP windows from energy gaps (E2 - E1) sampled in each window.
+
+    The free energy between neighboring windows is calculated with forward and backward exponential averaging
+    and BAR, and for all windows at once with MBAR. Energies are in kcal/mol.
+
+    With subsample, only uncorrelated samples are used, so that the errors are meaningful.
+    MBAR evaluates every sample in every window, so it uses at most maxMBARSamples (evenly spaced) samples of each window.
+
+    Returns an FEPResult."""
+    lambdas  = numpy.asarray (lambdas, dtype=numpy.float64)
+    nwindows = len (lambdas)
+    if (nwindows < 2) or (len (gaps) != nwindows):
+        raise exceptions.StandardError ("At least two windows, each with its energy gaps, are needed.")
+    kT   = GAS_CONSTANT_KCAL_MOL_K * temperature
+    gaps = [numpy.asarray (gap, dtype=numpy.float64) for gap in gaps]
+    if subsample:
+        gaps = map (_Subsample, gaps)
+    # . Work between neighboring windows is linear in the energy gap
+    collect = {"forward" : ([], []), "backward" : ([], []), "bar" : ([], []), }
+    for window in range (nwindows - 1):
+        step     = lambdas[window + 1] - lambdas[window]
+        forward  = step * gaps[window]
+        backward = -step * gaps[window + 1]
+        for (label, estimate) in (
+                ("forward"  ,   ExponentialAveraging (forward, kT=kT)                       ),
+                ("backward" ,   ExponentialAveraging (backward, kT=kT)                      ),
+                ("bar"      ,   BennettAcceptanceRatio (forward, backward, kT=kT)           ), ):
+            (deltas, errors) = collect[label]
+            deltas.append (-estimate.deltaF if (label == "backward") else estimate.deltaF)
+            errors.append (estimate.error)
+    bar = _ChainEstimates (*collect["bar"])
+    # . Terms of energy that are common to all windows cancel in MBAR, so only lambda times gap is needed
+    samples = []
+    for gap in gaps:
+        stride = int (numpy.ceil (len (gap) / float (maxMBARSamples)))
+        samples.append (gap[::max (stride, 1)])
+    counts  = map (len, samples)
+    samples = numpy.concatenate (samples)
+    reducedPotentials = lambdas[:, numpy.newaxis] * samples[numpy.newaxis, :] / kT
+    # . BAR estimates are a good starting point
+    initialF = numpy.concatenate (([0.], numpy.cumsum (bar.deltas))) / kT
+    result   = MBAR (reducedPotentials, counts, initialF=initialF)
+    f        = result.f * kT
+    mbar     = FEPEstimates (
+        deltas      =   numpy.diff (f)                                                          ,
+        errors      =   numpy.array ([result.errors[i, i + 1] for i in range (nwindows - 1)]) * kT ,
+        total       =   f[-1]                                                                   ,
+        totalError  =   result.errors[0, -1] * kT                                               , )
+    fep = FEPResult (
+        lambdas     =   lambdas                                 ,
+        nsamples    =   numpy.array (map (len, gaps))           ,
+        forward     =   _ChainEstimates (*collect["forward" ])  ,
+        backward    =   _ChainEstimates (*collect["backward"])  ,
+        bar         =   bar                                     ,
+        mbar        =   mbar                                    , )
+    if logging:
+        print ("# . Window   lambda   nsamples    forward   backward        BAR       MBAR")
+        for window in range (nwindows - 1):
+            print ("# . %6d   %6.3f   %8d   %8.2f   %8.2f   %8.2f   %8.2f" % (window + 1, lambdas[window], fep.nsamples[window], fep.forward.deltas[window], fep.backward.deltas[window], bar.deltas[window], mbar.deltas[window]))
+        for (label, estimates) in (("forward", fep.forward), ("backward", fep.backward), ("BAR", bar), ("MBAR", mbar)):
+            print ("# . Total %-8s = %8.2f +/- %.2f kcal/mol" % (label, estimates.total, estimates.totalError))
+    return fep
+
+
+def CalculateFEP (filename="rs_fep.out", temperature=300., subsample=True, maxMBARSamples=2000, logging=True):
+    """Calculate the free energy of an FEP run from a Molaris output file (see CalculateFEPFromGaps)."""
+    windows = ExtractFEPWindows (MolarisOutputFile (filename=filename, logging=False))
+    if logging:
+        print ("# . Found %d FEP windows in file %s" % (len (windows.lambdas), filename))
+    return CalculateFEPFromGaps (windows.lambdas, windows.gaps, temperature=temperature, subsample=subsample, maxMBARSamples=maxMBARSamples, logging=logging)
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if __name__ == "__main__": pass
@@ -4,15 +4,43 @@
 # . Copyright : USC, Mikolaj Feliks (2015-2018)
 # . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
 #-------------------------------------------------------------------------------
-import os, glob
+import os, glob, collections
 
-from MolarisTools.Parser  import GapFile, GapFileEVB
+import numpy
 
+from MolarisTools.Parser     import GapFile, GapFileEVB
+from MolarisTools.Utilities  import LoadFiles, CheckBatchErrors, StatisticalInefficiency, BlockAveraging, BootstrapMeans, ConfidenceInterval
 
-def CalculateLRA (patha="lra_RS", pathb="lra_RS_qmmm", logging=True, verbose=False, skip=None, trim=None, returnTerms=False, gapFormat="QM"):
-    """Calculate LRA for two endpoint simulations."""
+
+LRAEndpoint         = collections.namedtuple ("LRAEndpoint"         , "term  nsteps  inefficiency  blockError  bootstrapError  interval")
+LRAStatistics       = collections.namedtuple ("LRAStatistics"       , "lra  error  interval  endpoints")
+LRAConvergencePoint = collections.namedtuple ("LRAConvergencePoint" , "ngap  nsteps  lra  error")
+
+# . Length of bootstrap blocks in units of the statistical inefficiency
+_BOOTSTRAP_BLOCK = 5.
+
+
+def _LoadGapFiles (gapfiles, gapFormat="QM", logging=False, nprocs=1, returnCounts=False):
+    """Load a series of gap files and merge them into one object.
+
+    With returnCounts, also return the number of steps read from each file."""
+    loader  = GapFile if (gapFormat == "QM") else GapFileEVB
+    results = LoadFiles (gapfiles, loader, nprocs=nprocs, keywordArguments={"logging" : logging})
+    CheckBatchErrors (results)
+    counts  = [batchResult.result.nsteps for batchResult in results]
+    gap     = results[0].result
+    gap.Merge (*[batchResult.result for batchResult in results[1:]])
+    if returnCounts:
+        return (gap, counts)
+    return gap
+
+
+def _FindGapFiles (paths, logging=True):
+    """Find gap files of each endpoint simulation.
+
+    The same number of gap files is used for each endpoint."""
     points = []
-    for path in (patha, pathb):
+    for path in paths:
         gapfiles = []
         logs     = glob.glob (os.path.join (path, "evb_equil_*out"))
         logs.sort ()
@@ -24,21 +52,20 @@ def CalculateLRA (patha="lra_RS", pathb="lra_RS_qmmm", logging=True, verbose=Fal
             ngap = len (gapfiles)
             print ("# . Found %d gap files at location %s" % (ngap, path))
         points.append (gapfiles)
-    (filesa, filesb) = points
-    lena, lenb = map (len, points)
-    ngap = lena
-    if lena > lenb:
-        ngap = lenb
+    ngap = min (map (len, points))
     if logging:
         print ("# . Using %d gap files" % ngap)
+    return [gapfiles[:ngap] for gapfiles in points]
+
+
+def CalculateLRA (patha="lra_RS", pathb="lra_RS_qmmm", logging=True, verbose=False, skip=None, trim=None, returnTerms=False, gapFormat="QM", nprocs=1):
+    """Calculate LRA for two endpoint simulations.
+
+    Gap files can be parsed in parallel by setting nprocs > 1."""
+    (filesa, filesb) = _FindGapFiles ((patha, pathb), logging=logging)
     points = []
     for gapfiles in (filesa, filesb):
-        if (gapFormat == "QM"):
-            gap = GapFile (gapfiles[0], logging=(True if (logging and verbose) else False))
-        else:
-            gap = GapFileEVB (gapfiles[0], logging=(True if (logging and verbose) else False))
-        for nextfile in gapfiles[1:ngap]:
-            gap.Extend (nextfile)
+        gap = _LoadGapFiles (gapfiles, gapFormat=gapFormat, logging=(True if (logging and verbose) else False), nprocs=nprocs)
         points.append (gap)
     (gapa, gapb) = points
     if logging:
@@ -65,26 +92,12 @@ def CalculateLRA (patha="lra_RS", pathb="lra_RS_qmmm", logging=True, verbose=Fal
     return lra
 
 
-def CalculateOneSidedLRA (path="lra_RS_qmmm", logging=True, verbose=False, skip=None, trim=None, gapFormat="QM"):
-    """Calculate LRA for one endpoint simulation."""
-    gapfiles = []
-    logs     = glob.glob (os.path.join (path, "evb_equil_*out"))
-    logs.sort ()
-    for log in logs:
-        (logfile, logext) = os.path.splitext (log)
-        gapfile = os.path.join (logfile, "gap.out")
-        gapfiles.append (gapfile)
-    ngap = len (gapfiles)
-    if logging:
-        print ("# . Found %d gap files at location %s" % (ngap, path))
-    if logging:
-        print ("# . Using %d gap files" % ngap)
-    if (gapFormat == "QM"):
-        gapa = GapFile (gapfiles[0], logging=(True if (logging and verbose) else False))
-    else:
-        gapa = GapFileEVB (gapfiles[0], logging=(True if (logging and verbose) else False))
-    for nextfile in gapfiles[1:ngap]:
-        gapa.Extend (nextfile)
+def CalculateOneSidedLRA (path="lra_RS_qmmm", logging=True, verbose=False, skip=None, trim=None, gapFormat="QM", nprocs=1):
+    """Calculate LRA for one endpoint simulation.
+
+    Gap files can be parsed in parallel by setting nprocs > 1."""
+    (gapfiles, ) = _FindGapFiles ((path, ), logging=logging)
+    gapa = _LoadGapFiles (gapfiles, gapFormat=gapFormat, logging=(True if (logging and verbose) else False), nprocs=nprocs)
     if logging:
         print ("# . Number of steps in endpoint is %d" % gapa.nsteps)
         if   isinstance (skip, int):
@@ -105,6 +118,115 @@ def CalculateOneSidedLRA (path="lra_RS_qmmm", logging=True, verbose=False, skip=
     return lra
 
 
+
+def _AnalyzeEndpoint (gaps, nresamples=1000, level=0.95, seed=None):
+    """Calculate an LRA term with its statistical errors.
+
+    Returns a tuple (endpoint, bootstrap), where bootstrap are the means of resamples."""
+    inefficiency = StatisticalInefficiency (gaps)
+    blocks       = BlockAveraging (gaps)
+    # . Blocks of a few statistical inefficiencies are nearly independent, shorter blocks underestimate errors
+    bootstrap    = BootstrapMeans (gaps, nresamples=nresamples, blockSize=(_BOOTSTRAP_BLOCK * inefficiency), seed=seed)
+    endpoint     = LRAEndpoint (
+        term            =   float (gaps.mean ())            ,
+        nsteps          =   len (gaps)                      ,
+        inefficiency    =   inefficiency                    ,
+        blockError      =   float (blocks.error)            ,
+        bootstrapError  =   float (bootstrap.std (ddof=1))  ,
+        interval        =   ConfidenceInterval (bootstrap, level=level) , )
+    return (endpoint, bootstrap)
+
+
+def _ReportEndpoint (endpoint, label):
+    print ("# . %s: term = %f +/- %f (bootstrap), +/- %f (blocks), g = %.1f, %d steps, interval (%f, %f)" % (
+        label, endpoint.term, endpoint.bootstrapError, endpoint.blockError, endpoint.inefficiency, endpoint.nsteps, endpoint.interval[0], endpoint.interval[1]))
+
+
+def AnalyzeLRA (patha="lra_RS", pathb="lra_RS_qmmm", logging=True, verbose=False, skip=None, trim=None, gapFormat="QM", nprocs=1, nresamples=1000, level=0.95, seed=None):
+    """Calculate LRA for two endpoint simulations with statistical errors.
+
+    For each endpoint, the statistical inefficiency is calculated from the autocorrelation function of the energy gap.
+    Standard errors are estimated by block averaging and by a block bootstrap. Confidence intervals at the given level
+    are taken from percentiles of the bootstrap, which is also done for the combined LRA value.
+
+    Returns an LRAStatistics tuple."""
+    (filesa, filesb) = _FindGapFiles ((patha, pathb), logging=logging)
+    collect   = []
+    bootstrap = []
+    for (index, gapfiles) in enumerate ((filesa, filesb)):
+        gap = _LoadGapFiles (gapfiles, gapFormat=gapFormat, logging=(True if (logging and verbose) else False), nprocs=nprocs)
+        (endpoint, means) = _AnalyzeEndpoint (gap.SelectGaps (skip=skip, trim=trim), nresamples=nresamples, level=level, seed=(None if (seed is None) else (seed + index)))
+        collect.append (endpoint)
+        bootstrap.append (means)
+    lras       = .5 * (bootstrap[0] + bootstrap[1])
+    statistics = LRAStatistics (
+        lra         =   .5 * (collect[0].term + collect[1].term)    ,
+        error       =   float (lras.std (ddof=1))                   ,
+        interval    =   ConfidenceInterval (lras, level=level)      ,
+        endpoints   =   tuple (collect)                             , )
+    if logging:
+        for (endpoint, path) in zip (collect, (patha, pathb)):
+            _ReportEndpoint (endpoint, path)
+        print ("# . Calculated LRA = %f +/- %f, %d%% interval (%f, %f)" % (statistics.lra, statistics.error, int (level * 100.), statistics.interval[0], statistics.interval[1]))
+    return statistics
+
+
+def AnalyzeOneSidedLRA (path="lra_RS_qmmm", logging=True, verbose=False, skip=None, trim=None, gapFormat="QM", nprocs=1, nresamples=1000, level=0.95, seed=None):
+    """Calculate LRA for one endpoint simulation with statistical errors (see AnalyzeLRA).
+
+    Returns an LRAStatistics tuple."""
+    (gapfiles, ) = _FindGapFiles ((path, ), logging=logging)
+    gap = _LoadGapFiles (gapfiles, gapFormat=gapFormat, logging=(True if (logging and verbose) else False), nprocs=nprocs)
+    (endpoint, means) = _AnalyzeEndpoint (gap.SelectGaps (skip=skip, trim=trim), nresamples=nresamples, level=level, seed=seed)
+    statistics = LRAStatistics (
+        lra         =   endpoint.term           ,
+        error       =   endpoint.bootstrapError ,
+        interval    =   endpoint.interval       ,
+        endpoints   =   (endpoint, )            , )
+    if logging:
+        _ReportEndpoint (endpoint, path)
+    return statistics
+
+
+def CalculateLRAConvergence (patha="lra_RS", pathb="lra_RS_qmmm", logging=True, verbose=False, skip=None, trim=None, gapFormat="QM", nprocs=1):
+    """Calculate LRA as a function of the number of gap files used for each endpoint.
+
+    Set pathb to None for a one-sided LRA. Configurations are skipped and trimmed with respect to all gap files.
+    Errors are standard errors of the mean corrected by the statistical inefficiency, sqrt (g * var / n).
+    A run can be stopped when the LRA value stays within its error for the last points.
+
+    Returns a list of LRAConvergencePoint tuples."""
+    paths  = (patha, ) if (pathb is None) else (patha, pathb)
+    points = _FindGapFiles (paths, logging=logging)
+    series = []
+    for gapfiles in points:
+        (gap, counts) = _LoadGapFiles (gapfiles, gapFormat=gapFormat, logging=(True if (logging and verbose) else False), nprocs=nprocs, returnCounts=True)
+        (start, stop) = gap._GetBounds (skip, trim)
+        series.append ((gap.gaps, numpy.cumsum (counts), start, stop))
+    ngap  = len (points[0])
+    curve = []
+    for igap in range (1, ngap + 1):
+        (terms, variances, nsteps) = ([], [], [])
+        for (gaps, ends, start, stop) in series:
+            selected = gaps[start:min (ends[igap - 1], stop)]
+            if len (selected) < 2:
+                break
+            inefficiency = StatisticalInefficiency (selected)
+            terms.append (selected.mean ())
+            variances.append (selected.var () * inefficiency / len (selected))
+            nsteps.append (len (selected))
+        else:
+            point = LRAConvergencePoint (
+                ngap    =   igap                                                    ,
+                nsteps  =   tuple (nsteps)                                          ,
+                lra     =   float (numpy.mean (terms))                              ,
+                error   =   float (numpy.sqrt (numpy.sum (variances))) / len (terms) , )
+            curve.append (point)
+            if logging:
+                print ("# . %3d gap files: LRA = %f +/- %f" % (point.ngap, point.lra, point.error))
+    return curve
+
+
 #===============================================================================
 # . Main program
 #===============================================================================
@@ -4,13 +4,39 @@
 # . Copyright : USC, Mikolaj Feliks (2015-2018)
 # . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
 #-------------------------------------------------------------------------------
-import os, math
+import os
+
+import numpy
 
 from MolarisTools.Units    import DEFAULT_EVB_LIB
 from MolarisTools.Parser   import MolarisInputFile, EVBDatFile
-from MolarisTools.Library  import EVBLibrary, EVBMorseAtom, EVBMorsePair
+from MolarisTools.Library  import EVBLibrary
+
+# . Keys of unique terms: bonds are the same in both directions, angles are identified
+#       by the central atom type and dihedral angles by the central pair of types
+_UNIQUE_KEYS = {
+    "bonds"     :   (lambda types: (min (types), max (types))                     ,   "Bond"          ),
+    "angles"    :   (lambda types: types[1]                                       ,   "Angle"         ),
+    "torsions"  :   (lambda types: (min (types[1:3]), max (types[1:3]))          ,   "Torsion angle" ), }
+
 
-_DEFAULT_BETA = 1.8
+def _UniqueTypes (dat, label, atypes, state, logging):
+    """Get a sorted list of unique tuples of atom types in bonds, angles or torsions of a state.
+
+    Of terms with the same key, the first one is kept."""
+    terms = dat.GetTerms (label, state=state)
+    if terms is None:
+        return []
+    (Key, title) = _UNIQUE_KEYS[label]
+    serials = terms.serials
+    valid   = ((serials > 0) & (serials < len (atypes))).all (axis=1)
+    if logging:
+        for missing in serials[~valid].tolist ():
+            print ("# . Warning: %s (%s) involves non-EVB atoms" % (title, ", ".join (map (str, missing))))
+    unique  = {}
+    for types in map (tuple, atypes[serials[valid]].tolist ()):
+        unique.setdefault (Key (types), types)
+    return sorted (unique.values ())
 
 
 def DetermineEVBParameters (filenameInput="heat_template.inp", filenameDat=os.path.join ("evb_heat_01", "evb.dat"), filenameEVBLibrary=DEFAULT_EVB_LIB, state=1, logging=True):
@@ -24,116 +50,26 @@ def DetermineEVBParameters (filenameInput="heat_template.inp", filenameDat=os.pa
     # . Library is used to pick up the currently used parameters
     library  = EVBLibrary       (filenameEVBLibrary , logging=logging)
 
-    convert  = {}
-    for (i, atom) in enumerate (mif.states[(state - 1)], 1):
-        # convert[atom.serial] = atom.atype
-        # . Molaris does not seem to use the serial numbers of atoms, 
-        #       but renumbers them in the order as they appear in the input file
-        convert[i] = atom.atype
-    # . Generate a unique list of atom types in bonds
-    bonds    = []
-    for bond in dat.bonds:
-        if bond.exist[(state - 1)]:
-            (seriala , serialb) = bond.serials
-            try:
-                (typea   , typeb  ) = (convert[seriala], convert[serialb])
-                pair = (typea, typeb)
-                riap = (typeb, typea)
-                if not ((pair in bonds) or (riap in bonds)):
-                    bonds.append (pair)
-            except:
-                if logging:
-                    print ("# . Warning: Bond (%d, %d, %d) involves non-EVB atoms" % (seriala, serialb))
-    bonds.sort ()
-    # . Generate a unique list of atom types in angles
-    angles   = []
-    for angle in dat.angles:
-        if angle.exist[(state - 1)]:
-            (seriala , serialb , serialc) = angle.serials
-            try:
-                (typea   , typeb   , typec  ) = (convert[seriala], convert[serialb], convert[serialc])
-                triplet = (typea, typeb, typec)
-                telpirt = (typec, typeb, typea)
-                # if not ((triplet in angles) or (telpirt in angles)):
-                found   = False
-                for (storeda, storedb, storedc) in angles:
-                    if storedb == typeb:
-                        found = True
-                        break
-                if not found:
-                    angles.append (triplet)
-            except:
-                if logging:
-                    print ("# . Warning: Angle (%d, %d, %d) involves non-EVB atoms" % (seriala, serialb, serialc))
-    angles.sort ()
-    # . Generate a unique list of atom types in dihedral angles
-    torsions = []
-    for torsion in dat.torsions:
-        if torsion.exist[(state - 1)]:
-            (seriala , serialb , serialc , seriald) = torsion.serials
-            try:
-                (typea   , typeb   , typec   , typed  ) = (convert[seriala], convert[serialb], convert[serialc], convert[seriald])
-                quartet = (typea, typeb, typec, typed)
-                tetrauq = (typed, typec, typeb, typea)
-                # if not ((quartet in torsions) or (tetrauq in torsions)):
-                found   = False
-                for (storeda, storedb, storedc, storedd) in torsions:
-                    if ((storedb == typeb) and (storedc == typec)) or ((storedb == typec) and (storedc == typeb)):
-                        found = True
-                        break
-                if not found:
-                    torsions.append (quartet)
-            except:
-                if logging:
-                    print ("# . Warning: Torsion angle (%d, %d, %d, %d) involves non-EVB atoms" % (seriala, serialb, serialc, seriald))
-    torsions.sort ()
+    # . Molaris does not seem to use the serial numbers of atoms,
+    #       but renumbers them in the order as they appear in the input file
+    atypes   = numpy.array ([None, ] + [atom.atype for atom in mif.states[(state - 1)]], dtype=object)
+    # . Generate unique lists of atom types in bonds, angles and dihedral angles
+    bonds    = _UniqueTypes (dat, "bonds"   , atypes, state, logging)
+    angles   = _UniqueTypes (dat, "angles"  , atypes, state, logging)
+    torsions = _UniqueTypes (dat, "torsions", atypes, state, logging)
 
-    # . Collect bond parameters from the EVB library
-    parBonds = []
-    for bond in bonds:
-        (typea, typeb) = bond
-        parameter = library.GetBond (typea, typeb)
-        if parameter:
-            if not isinstance (parameter, EVBMorsePair):
-                # . Convert individual EVB atoms to an EVB pair
-                if logging:
-                    print ("# . Applying combination rules for atom types (%s, %s)" % (typea, typeb))
-                (morsea, morseb) = parameter
-                morseD  = math.sqrt (morsea.morseD * morseb.morseD)
-                r0      = morsea.radius + morseb.radius
-                pair    = EVBMorsePair (
-                    typea           =  typea          ,
-                    typeb           =  typeb          ,
-                    morseAB         =  morseD         ,
-                    rab             =  r0             ,
-                    beta            =  _DEFAULT_BETA  ,
-                    forceHarmonic   =  400.           ,
-                    radiusHarmonic  =    1.4          , )
-                parameter = pair
-            parBonds.append (parameter)
-        else:
-            if logging:
-                print ("# . Warning: Bond parameters for atom types (%s, %s) not found" % (typea, typeb))
-    # . Collect angle parameters from the EVB library
-    parAngles = []
-    for angle in angles:
-        (typea, typeb, typec) = angle
-        parameter = library.GetAngle (typea, typeb, typec)
-        if parameter:
-            parAngles.append (parameter)
-        else:
-            if logging:
-                print ("# . Warning: Angle parameters for atom types (%s, %s, %s) not found" % (typea, typeb, typec))
-    # . Collect dihedral parameters from the EVB library
-    parTorsions = []
-    for torsion in torsions:
-        (typea, typeb, typec, typed) = torsion
-        parameter = library.GetTorsion (typeb, typec)
-        if parameter:
-            parTorsions.append (parameter)
-        else:
-            if logging:
-                print ("# . Warning: Torsion parameters for atom types (%s, %s, %s, %s) not found" % (typea, typeb, typec, typed))
+    # . Collect parameters from the EVB library in one pass,
+    #       Morse pairs missing in the library are made from one-atom parameters by combination rules
+    collect  = {}
+    for (label, terms) in (("Bond", bonds), ("Angle", angles), ("Torsion", torsions)):
+        parameters = []
+        for (term, parameter) in zip (terms, library.Resolve (terms, logging=logging)):
+            if parameter:
+                parameters.append (parameter)
+            elif logging:
+                print ("# . Warning: %s parameters for atom types (%s) not found" % (label, ", ".join (term)))
+        collect[label] = parameters
+    (parBonds, parAngles, parTorsions) = (collect["Bond"], collect["Angle"], collect["Torsion"])
 
     if logging:
         print ("\n-- EVB parameters for bonds --")
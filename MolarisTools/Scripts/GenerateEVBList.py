@@ -11,8 +11,10 @@ from MolarisTools.Library  import AminoLibrary
 _DEFAULT_FORCE  = 5.
 
 
-def GenerateEVBList (fileLibrary=DEFAULT_AMINO_LIB, fileMolarisOutput="determine_atoms.out", selectGroups={}, ntab=2, exceptions=("MG", "CL", "BR", "DE", ), overwriteCharges=[], constrainForce=_DEFAULT_FORCE, constrainAll=False, overwriteConstraints=[]):
-    """Generate a list of EVB atoms and bonds based on a Molaris output file."""
+def GenerateEVBList (fileLibrary=DEFAULT_AMINO_LIB, fileMolarisOutput="determine_atoms.out", selectGroups={}, ntab=2, exceptions=("MG", "CL", "BR", "DE", ), overwriteCharges=[], constrainForce=_DEFAULT_FORCE, constrainAll=False, overwriteConstraints=[], selectSerials=None):
+    """Generate a list of EVB atoms and bonds based on a Molaris output file.
+
+    SelectSerials is an optional collection of serials of atoms to include (for example, of atoms found by PDBFile.AtomsWithin)."""
     library    = AminoLibrary (fileLibrary, logging=False)
     
     mof        = MolarisOutputFile (fileMolarisOutput)
@@ -22,6 +24,8 @@ def GenerateEVBList (fileLibrary=DEFAULT_AMINO_LIB, fileMolarisOutput="determine
     evbSerials = []
     if overwriteCharges:
         charges     = iter (overwriteCharges)
+    if selectSerials is not None:
+        selectSerials = set (selectSerials)
     if overwriteConstraints:
         # . Do not use atomic coordinates from the PDB file, use a predefined list of positional constraints
         constraints = iter (overwriteConstraints)
@@ -56,6 +60,9 @@ def GenerateEVBList (fileLibrary=DEFAULT_AMINO_LIB, fileMolarisOutput="determine
                     groupLabels = selectGroups[residue.label]
                     if groupLabel in groupLabels:
                         includeAtom = True
+            if selectSerials is not None:
+                if atom.serial not in selectSerials:
+                    includeAtom = False
             charge = atom.charge
             if includeAtom:
                 if overwriteCharges != []:
@@ -6,25 +6,37 @@
 #-------------------------------------------------------------------------------
 import os, math, glob
 
-from MolarisTools.Parser  import MolarisOutputFile
+from MolarisTools.Parser     import MolarisOutputFile, MolarisInputFile
+from MolarisTools.Utilities  import LoadFiles, CheckBatchErrors
 
 
-def ParsePESScan (pattern="evb_scan_", filenameTotal="total_e.dat", filenameTotalRelative="total_e_rel.dat", patternChanges="changes_", baselineIndex=-1, maximumIndex=-1, logging=True):
-    """Parse a potential energy surface scan."""
-    steps = []
+def _ReadQMMMEnergies (filename):
+    """Return QM/MM energies of state I from a Molaris output file."""
+    mof     = MolarisOutputFile (filename=filename, logging=False)
+    collect = []
+    for step in mof.qmmmComponentsI:
+        collect.append (step.Eqmmm)
+    return collect
+
+
+def _ReportProgress (ndone, nfiles, batchResult):
+    print ("# . Parsed file %s (%d of %d)" % (batchResult.filename, ndone, nfiles))
+
+
+def ParsePESScan (pattern="evb_scan_", filenameTotal="total_e.dat", filenameTotalRelative="total_e_rel.dat", patternChanges="changes_", baselineIndex=-1, maximumIndex=-1, nprocs=1, logging=True):
+    """Parse a potential energy surface scan.
+
+    Output files can be parsed in parallel by setting nprocs > 1."""
     files = glob.glob ("%s*.out" % pattern)
     files.sort ()
-    for fn in files:
-        mof = MolarisOutputFile (filename=fn, logging=False)
-        if logging:
-            print ("# . Parsing file %s ..." % fn)
-        collect = []
-        for step in mof.qmmmComponentsI:
-            Eqmmm = step.Eqmmm
-            collect.append (Eqmmm)
+    results = LoadFiles (files, _ReadQMMMEnergies, nprocs=nprocs, progress=(_ReportProgress if logging else None))
+    CheckBatchErrors (results)
+    steps = []
+    for batchResult in results:
+        collect = batchResult.result
         if logging:
             nsteps = len (collect)
-            print ("# . Found %d steps" % nsteps)
+            print ("# . Found %d steps in file %s" % (nsteps, batchResult.filename))
         steps.append (collect)
     if logging:
         ntotal = 0
@@ -75,8 +87,10 @@ def ParsePESScan (pattern="evb_scan_", filenameTotal="total_e.dat", filenameTota
             print ("Wrote file %s" % filename)
 
 
-def ParsePESScan2D (pattern="evb_scan_", filenameTotal="total_e.dat", filenameTotalRelative="total_e_rel.dat", useDistances=False, zigzag=False, logging=True):
-    """Parse a two-dimensional potential energy surface scan."""
+def ParsePESScan2D (pattern="evb_scan_", filenameTotal="total_e.dat", filenameTotalRelative="total_e_rel.dat", useDistances=False, zigzag=False, nprocs=1, logging=True):
+    """Parse a two-dimensional potential energy surface scan.
+
+    Output files can be parsed in parallel by setting nprocs > 1."""
     files  = glob.glob ("%s*.inp" % pattern)
     nfiles = len (files)
     size   = int (math.sqrt (nfiles))
@@ -98,6 +112,19 @@ def ParsePESScan2D (pattern="evb_scan_", filenameTotal="total_e.dat", filenameTo
     if logging:
         print ("# . Base energy is %f" % base)
 
+    # . Collect the existing output files first and parse them in one batch
+    found  = []
+    for i in range (1, size + 1):
+        for j in range (1, size + 1):
+            filename = "%s%02d_%02d.out" % (pattern, i, j)
+            if os.path.exists (filename):
+                found.append (filename)
+    results = LoadFiles (found, _ReadQMMMEnergies, nprocs=nprocs, progress=(_ReportProgress if logging else None))
+    CheckBatchErrors (results)
+    energies = {}
+    for batchResult in results:
+        energies[batchResult.filename] = batchResult.result
+
     rows   = []
     pairs  = []
     nlogs  = 0
@@ -114,15 +141,12 @@ def ParsePESScan2D (pattern="evb_scan_", filenameTotal="total_e.dat", filenameTo
                     je = size - j + 1
             filename = "%s%02d_%02d.out" % (pattern, i, je)
             Eqmmm    = base
-            if os.path.exists (filename):
-                if logging:
-                    print ("# . Parsing file %s ..." % filename)
-                mof   = MolarisOutputFile (filename=filename, logging=False)
-                last  = mof.qmmmComponentsI[-1]
-                Eqmmm = last.Eqmmm
+            if energies.has_key (filename):
+                collect = energies[filename]
+                Eqmmm   = collect[-1]
                 if logging:
-                    nsteps = len (mof.qmmmComponentsI)
-                    print ("# . Found %d steps" % nsteps)
+                    nsteps = len (collect)
+                    print ("# . Found %d steps in file %s" % (nsteps, filename))
                 nlogs += 1
             columns.append (Eqmmm)
             if useDistances:
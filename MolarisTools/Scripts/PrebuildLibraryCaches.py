@@ -0,0 +1,58 @@
+#-------------------------------------------------------------------------------
+# . File      : PrebuildLibraryCaches.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+import exceptions, glob, os, sys
+
+from MolarisTools.Library    import AminoLibrary, ParametersLibrary, EVBLibrary, ResidueIndex
+from MolarisTools.Utilities  import GetLibraryCache
+
+# . Lines that start sections of EVB libraries
+_EVB_SECTIONS = ("morse_type", "m_pair", "angle_type", "torsion_type", "vdwevb", "solvdw", )
+
+
+def _DetectLibrary (filename):
+    """Guess the kind of a library from its contents."""
+    for line in open (filename):
+        if line.count ("BOND PARAMETERS"):
+            return ParametersLibrary
+        if line.startswith (_EVB_SECTIONS):
+            return EVBLibrary
+        if line.startswith ("---"):
+            return AminoLibrary
+    return None
+
+
+def PrebuildLibraryCaches (directory, pattern="*.lib", cache=True, logging=True):
+    """Parse all libraries in a directory and store them in the cache of libraries (see GetLibraryCache).
+
+    Libraries whose cache files are valid are only checked. For amino libraries, fingerprints
+    of components (see ResidueIndex) are also cached. Returns a list of libraries that were cached."""
+    cache    = GetLibraryCache (cache)
+    if cache is None:
+        raise exceptions.StandardError ("Cache of libraries is not available.")
+    filenames = sorted (glob.glob (os.path.join (directory, pattern)))
+    cached   = []
+    for filename in filenames:
+        libraryType = _DetectLibrary (filename)
+        if libraryType is None:
+            if logging:
+                print ("# . Skipping file %s of unknown format" % filename)
+            continue
+        library = libraryType (filename, logging=False, cache=cache)
+        if libraryType is AminoLibrary:
+            ResidueIndex ([library, ], cache=cache, logging=False)
+        cached.append (filename)
+        if logging:
+            print ("# . Cached %-20s %s" % (libraryType.__name__, filename))
+    return cached
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if (__name__ == "__main__"):
+    # . Usage: python -m MolarisTools.Scripts.PrebuildLibraryCaches [directory]
+    PrebuildLibraryCaches (sys.argv[1] if len (sys.argv) > 1 else ".")
@@ -6,6 +6,22 @@
 #-------------------------------------------------------------------------------
 import os, glob, time, datetime
 
+from MolarisTools.Parser  import MolarisOutputFollower
+
+
+def _ReadNumberOfSteps (filename):
+    """Read the number of MD steps from a Molaris input file."""
+    lines  = open (filename).readlines ()
+    nsteps = 0
+    for line in lines:
+        # if line.count ("nsteps"):
+        tokens = line.split ()
+        if len (tokens) >= 2:
+            if (tokens[0] == "nsteps"):
+                nsteps = int (line.split ()[1])
+                break
+    return nsteps
+
 
 def PredictSimulationTime (pattern="evb_*out"):
     """Calculate remaining time for a simulation consisting of multiple files."""
@@ -48,15 +64,7 @@ def PredictSimulationTime (pattern="evb_*out"):
     inputs.sort ()
     nleft = len (inputs) - nfiles
     
-    lines  = open (inputs[0]).readlines ()
-    nsteps = 0
-    for line in lines:
-        # if line.count ("nsteps"):
-        tokens = line.split ()
-        if len (tokens) >= 2:
-            if (tokens[0] == "nsteps"):
-                nsteps = int (line.split ()[1])
-                break
+    nsteps = _ReadNumberOfSteps (inputs[0])
     if (nsteps > 0):
         totalSteps = float (nfiles * nsteps)
         delta = float (times[-1] - times[0])
@@ -79,6 +87,53 @@ def PredictSimulationTime (pattern="evb_*out"):
         print ("Job will end on: %s (%s from now)" % (fmt, delta))
 
 
+def _ReadNumberOfFrames (filename):
+    """Read the number of FEP frames (lines evb_state) from a Molaris input file."""
+    nframes = 0
+    for line in open (filename):
+        tokens = line.split ()
+        if tokens and (tokens[0] == "evb_state"):
+            nframes += 1
+    return max (nframes, 1)
+
+
+def MonitorSimulation (filename, nsteps=None, nframes=None, interval=60., npolls=None):
+    """Follow a running simulation and print its step rate and the expected time of finishing.
+
+    Only new parts of the output file are read at each poll. Nsteps is the number of MD steps
+    of one FEP frame and nframes is the number of FEP frames. If they are not given, they are
+    read from the input file with the same name ending with .inp."""
+    (root, extension) = os.path.splitext (filename)
+    inputfile = root + ".inp"
+    if os.path.exists (inputfile):
+        if nsteps is None:
+            nsteps  = _ReadNumberOfSteps (inputfile)
+        if nframes is None:
+            nframes = _ReadNumberOfFrames (inputfile)
+    # . Steps are counted over all FEP frames
+    totalSteps = (nsteps * (nframes or 1)) if nsteps else None
+    pattern    = "%a %b %d %H:%M:%S %Y"
+
+    def _Report (follower, update):
+        ndone = follower.ncompleted
+        rate  = follower.Rate ()
+        if rate is None:
+            print ("Step %d, %d energy printout%s, waiting for more data..." % (ndone, follower.nmdSteps, "s" if follower.nmdSteps != 1 else ""))
+        else:
+            print ("Step %d, simulation is running at the rate of %d steps per hour." % (ndone, rate * 3600.))
+            if totalSteps and (ndone < totalSteps):
+                seconds = int ((totalSteps - ndone) / rate)
+                final   = datetime.datetime.fromtimestamp (time.time () + seconds)
+                delta   = str (datetime.timedelta (seconds=seconds))
+                print ("Job will end on: %s (%s from now)" % (final.strftime (pattern), delta))
+        if follower.isFinished:
+            print ("Simulation has finished.")
+        return follower.isFinished
+
+    follower = MolarisOutputFollower (filename)
+    follower.Follow (interval=interval, callback=_Report, npolls=npolls)
+
+
 #===============================================================================
 # . Main program
 #===============================================================================
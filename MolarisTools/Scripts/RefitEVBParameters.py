@@ -0,0 +1,167 @@
+#-------------------------------------------------------------------------------
+# . File      : RefitEVBParameters.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+import collections, exceptions
+
+import numpy
+
+from MolarisTools.Parser     import MolarisOutputFile
+from CalculateFEP            import ExtractFEPWindows
+from CalculateEVBProfile     import EVBProfile
+
+
+EVBRefitResult = collections.namedtuple ("EVBRefitResult", "h12  shift  activation  reaction  residual  nevaluations")
+
+_MODULE_LABEL = "EVBRefit"
+
+# . Residual of parameters for which the barrier is not defined
+_PENALTY = 1e6
+
+# . Labels in Molaris input templates that are replaced by refitted parameters
+_LABELS = {"shift" : "@GAS_SHIFT@", "h12" : "@H12@", }
+
+
+def _NelderMead (function, start, steps, tolerance=1e-3, maxEvaluations=200):
+    """Minimize a function of a few variables with the simplex method of Nelder and Mead.
+
+    Returns a tuple (best point, best value, number of evaluations)."""
+    start    = numpy.asarray (start, dtype=numpy.float64)
+    nvariables = len (start)
+    simplex  = numpy.vstack ([start] + [start + numpy.eye (nvariables)[i] * steps[i] for i in range (nvariables)])
+    values   = numpy.array ([function (point) for point in simplex])
+    nevaluations = len (values)
+    while nevaluations < maxEvaluations:
+        order   = numpy.argsort (values)
+        (simplex, values) = (simplex[order], values[order])
+        if (values[-1] - values[0]) < tolerance and (numpy.abs (simplex[1:] - simplex[0]).max () < tolerance):
+            break
+        centroid  = simplex[:-1].mean (axis=0)
+        reflected = centroid + (centroid - simplex[-1])
+        valueReflected = function (reflected)
+        nevaluations  += 1
+        if valueReflected < values[0]:
+            expanded = centroid + 2. * (centroid - simplex[-1])
+            valueExpanded = function (expanded)
+            nevaluations += 1
+            if valueExpanded < valueReflected:
+                (simplex[-1], values[-1]) = (expanded, valueExpanded)
+            else:
+                (simplex[-1], values[-1]) = (reflected, valueReflected)
+        elif valueReflected < values[-2]:
+            (simplex[-1], values[-1]) = (reflected, valueReflected)
+        else:
+            contracted = centroid + .5 * (simplex[-1] - centroid)
+            valueContracted = function (contracted)
+            nevaluations += 1
+            if valueContracted < values[-1]:
+                (simplex[-1], values[-1]) = (contracted, valueContracted)
+            else:
+                # . Shrink towards the best point
+                simplex[1:] = simplex[0] + .5 * (simplex[1:] - simplex[0])
+                values[1:]  = [function (point) for point in simplex[1:]]
+                nevaluations += nvariables
+    best = numpy.argmin (values)
+    return (simplex[best], values[best], nevaluations)
+
+
+class EVBRefit (object):
+    """A class to refit the gas-phase shift and the coupling H12 of a two-state EVB model without running Molaris again.
+
+    Energies of states sampled in the mapping windows are reweighted with trial parameters (see EVBProfile).
+    The shift is absolute: storedShift, the shift used in the simulation, is subtracted first."""
+
+    def __init__ (self, evbProfile, storedShift=0., h12=0., logging=True):
+        """Constructor."""
+        self.evbProfile  = evbProfile
+        self.storedShift = storedShift
+        self.h12         = h12
+        self.logging     = logging
+
+
+    @classmethod
+    def FromMolarisOutput (cls, filename="rs_fep.out", h12=0., temperature=300., logging=True):
+        """Prepare a refit from EVB breakdowns of a Molaris output file.
+
+        The stored gas-phase shift is taken from the Egas terms of the two states."""
+        molarisOutput = MolarisOutputFile (filename=filename, logging=False)
+        windows       = ExtractFEPWindows (molarisOutput)
+        egasI  = numpy.array ([components.Egas for components in molarisOutput.evbComponentsI ])
+        egasII = numpy.array ([components.Egas for components in molarisOutput.evbComponentsII])
+        storedShift   = float ((egasII - egasI).mean ())
+        evbProfile    = EVBProfile (windows.lambdas, windows.gaps, temperature=temperature, logging=logging)
+        return cls (evbProfile, storedShift=storedShift, h12=h12, logging=logging)
+
+
+    @classmethod
+    def FromGapFiles (cls, filenames, lambdas, storedShift=0., h12=0., temperature=300., logging=True):
+        """Prepare a refit from gap files of regular EVB simulations, one file for each lambda."""
+        evbProfile = EVBProfile.FromGapFiles (filenames, lambdas, temperature=temperature, logging=logging)
+        return cls (evbProfile, storedShift=storedShift, h12=h12, logging=logging)
+
+
+    def Evaluate (self, h12, shift, **keywordArguments):
+        """Calculate the free energy profile for an absolute gas-phase shift and coupling."""
+        return self.evbProfile.Calculate (h12=abs (h12), shift=(shift - self.storedShift), **keywordArguments)
+
+
+    def Fit (self, targetActivation, targetReaction, h12=None, shift=None, weights=(1., 1.), binWidth=1., minSamples=10, tolerance=1e-3, maxEvaluations=200):
+        """Find the shift and the coupling that reproduce target activation and reaction free energies.
+
+        Starting values default to the parameters of the simulation. Returns an EVBRefitResult."""
+        start = (self.h12 if (h12 is None) else h12, self.storedShift if (shift is None) else shift)
+        (weightActivation, weightReaction) = weights
+
+        def Residual (parameters):
+            (h12, shift) = parameters
+            result = self.Evaluate (h12, shift, binWidth=binWidth, minSamples=minSamples)
+            if numpy.isnan (result.activation) or numpy.isnan (result.reaction):
+                return _PENALTY
+            return (weightActivation * (result.activation - targetActivation) ** 2 + weightReaction * (result.reaction - targetReaction) ** 2)
+
+        (best, residual, nevaluations) = _NelderMead (Residual, start, steps=(5., 5.), tolerance=tolerance, maxEvaluations=maxEvaluations)
+        (h12, shift) = (abs (best[0]), best[1])
+        result = self.Evaluate (h12, shift, binWidth=binWidth, minSamples=minSamples)
+        refit  = EVBRefitResult (
+            h12             =   h12                 ,
+            shift           =   shift               ,
+            activation      =   result.activation   ,
+            reaction        =   result.reaction     ,
+            residual        =   residual            ,
+            nevaluations    =   nevaluations        , )
+        if self.logging:
+            print ("# . %s> H12 = %.2f, shift = %.2f kcal/mol after %d evaluations" % (_MODULE_LABEL, refit.h12, refit.shift, refit.nevaluations))
+            print ("# . %s> Activation = %.2f (target %.2f), reaction = %.2f (target %.2f) kcal/mol" % (_MODULE_LABEL, refit.activation, targetActivation, refit.reaction, targetReaction))
+        return refit
+
+
+def WriteEVBParameters (template, filename, refit):
+    """Write a Molaris input file from a template, in which labels @GAS_SHIFT@ and @H12@ are replaced by refitted parameters."""
+    text = open (template).read ()
+    if not any (text.count (label) for label in _LABELS.values ()):
+        raise exceptions.StandardError ("Template %s contains none of the labels %s." % (template, ", ".join (sorted (_LABELS.values ()))))
+    for (field, label) in _LABELS.items ():
+        text = text.replace (label, "%.2f" % getattr (refit, field))
+    output = open (filename, "w")
+    output.write (text)
+    output.close ()
+
+
+def RefitEVBParameters (filename="rs_fep.out", targetActivation=0., targetReaction=0., h12=0., temperature=300., binWidth=1., template=None, output=None, logging=True):
+    """Refit the gas-phase shift and H12 of an EVB run in a Molaris output file to target free energies.
+
+    If a template and output are given, a new Molaris input file with the refitted parameters is written.
+    Returns an EVBRefitResult."""
+    evbRefit = EVBRefit.FromMolarisOutput (filename, h12=h12, temperature=temperature, logging=logging)
+    refit    = evbRefit.Fit (targetActivation, targetReaction, binWidth=binWidth)
+    if template and output:
+        WriteEVBParameters (template, output, refit)
+    return refit
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if __name__ == "__main__": pass
@@ -5,11 +5,15 @@
 # . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
 #-------------------------------------------------------------------------------
 from AminoComponents_FromPDB  import AminoComponents_FromPDB, BondsFromDistances
-from CalculateLRA             import CalculateLRA, CalculateOneSidedLRA
+from CalculateEVBProfile      import CalculateEVBProfile, EVBProfile, EVBProfileResult
+from CalculateFEP             import CalculateFEP, CalculateFEPFromGaps, ExtractFEPWindows, FEPResult, FEPEstimates, FEPWindows
+from CalculateLRA             import CalculateLRA, CalculateOneSidedLRA, AnalyzeLRA, AnalyzeOneSidedLRA, CalculateLRAConvergence, LRAStatistics, LRAEndpoint, LRAConvergencePoint
 from DetermineBAT             import DetermineBAT
 from DetermineEVBParameters   import DetermineEVBParameters
 from GenerateEVBList          import GenerateEVBList
 from MolarisInput_ToEVBTypes  import MolarisInput_ToEVBTypes
 from ParseScans               import ParsePESScan, ParsePESScan2D
-from PredictSimulationTime    import PredictSimulationTime
+from PrebuildLibraryCaches    import PrebuildLibraryCaches
+from PredictSimulationTime    import PredictSimulationTime, MonitorSimulation
+from RefitEVBParameters       import RefitEVBParameters, EVBRefit, EVBRefitResult, WriteEVBParameters
 
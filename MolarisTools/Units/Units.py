@@ -18,6 +18,8 @@ HARTREE_TO_KCAL_MOL               = 627.509469
 HARTREE_BOHR_TO_KCAL_MOL_ANGSTROM = HARTREE_TO_KCAL_MOL / BOHR_TO_ANGSTROM       # 1185.8215096272136
 EV_TO_KCAL_MOL                    =  23.0609
 GRADIENT_TO_FORCE                 =  -1.
+# . Gas constant in kcal/(mol K)
+GAS_CONSTANT_KCAL_MOL_K           =   0.0019872041
 
 
 # . Typical bond lengths
@@ -4,5 +4,5 @@
 # . Copyright : USC, Mikolaj Feliks (2015-2018)
 # . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
 #-------------------------------------------------------------------------------
-from Units  import DEFAULT_AMINO_LIB, DEFAULT_PARM_LIB, DEFAULT_EVB_LIB, BOHR_TO_ANGSTROM, ANGSTROM_TO_BOHR, HARTREE_TO_KCAL_MOL, HARTREE_BOHR_TO_KCAL_MOL_ANGSTROM, EV_TO_KCAL_MOL, GRADIENT_TO_FORCE, typicalBonds, atomicNumberToSymbol, symbolToAtomicNumber
+from Units  import DEFAULT_AMINO_LIB, DEFAULT_PARM_LIB, DEFAULT_EVB_LIB, BOHR_TO_ANGSTROM, ANGSTROM_TO_BOHR, HARTREE_TO_KCAL_MOL, HARTREE_BOHR_TO_KCAL_MOL_ANGSTROM, EV_TO_KCAL_MOL, GRADIENT_TO_FORCE, GAS_CONSTANT_KCAL_MOL_K, typicalBonds, atomicNumberToSymbol, symbolToAtomicNumber
 
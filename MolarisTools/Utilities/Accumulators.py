@@ -0,0 +1,156 @@
+#-------------------------------------------------------------------------------
+# . File      : Accumulators.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+import  exceptions
+
+import  numpy
+
+
+def AssignBins (values, lefts, rights):
+    """Find the bin of each value.
+
+    The first bin is closed on the left, the last bin is closed on the right and the other bins are open.
+    Values that do not fall into any bin (for example, exactly on an inner boundary) are put into the last bin."""
+    values  = numpy.asarray (values)
+    nbins   = len (lefts)
+    # . Candidate bin: the last one that begins at or before the value
+    indices = numpy.searchsorted (lefts, values, side="right") - 1
+    found   = numpy.zeros (values.shape, dtype=numpy.bool_)
+    result  = numpy.empty (values.shape, dtype=numpy.int64)
+    # . Boundaries are calculated with rounding errors, so the previous bin may also hold the value
+    for shift in (1, 0):
+        candidates = numpy.clip (indices - shift, 0, nbins - 1)
+        left       = lefts [candidates]
+        right      = rights[candidates]
+        first      = (candidates == 0)
+        last       = (candidates == (nbins - 1)) & (~first)
+        inside     = (((values > left) | (first & (values == left))) & ((values < right) | (last & (values == right))))
+        inside    &= ((indices - shift) >= 0) & (~found)
+        result[inside] = candidates[inside]
+        found     |= inside
+    result[~found] = nbins - 1
+    return result
+
+
+def MakeBins (limits, sampling):
+    """Divide limits into bins of approximately the width of sampling.
+
+    Returns a tuple (lefts, rights, sampling), where sampling is the exact width of bins."""
+    (minc, maxc) = limits
+    spread   = maxc - minc
+    nbins    = int (spread / sampling)
+    if nbins < 1:
+        raise exceptions.StandardError ("Sampling %f is too large for limits (%f, %f)." % (sampling, minc, maxc))
+    sampling = spread / nbins
+    lefts    = numpy.arange (nbins) * sampling + minc
+    rights   = lefts + sampling
+    return (lefts, rights, sampling)
+
+
+class WelfordAccumulator (object):
+    """A class to calculate means and variances of samples in one pass and in constant memory.
+
+    Each sample is an array of a fixed shape (for example, charges of all atoms in one step).
+    Accumulators calculated separately (for example, for parts of a file) can be merged."""
+
+    def __init__ (self, shape=()):
+        """Constructor."""
+        self.count = 0
+        self.mean  = numpy.zeros (shape, dtype=numpy.float64)
+        self.m2    = numpy.zeros (shape, dtype=numpy.float64)
+
+    @property
+    def variance (self):
+        """Population variance (normalized by the number of samples)."""
+        if self.count < 1:
+            return numpy.zeros_like (self.m2) * numpy.nan
+        return self.m2 / self.count
+
+    @property
+    def std (self):
+        return numpy.sqrt (self.variance)
+
+
+    def _Combine (self, count, mean, m2):
+        # . Pairwise update of Chan et al.
+        total = self.count + count
+        if total < 1:
+            return
+        delta      = mean - self.mean
+        self.mean  = self.mean + delta * (float (count) / total)
+        self.m2    = self.m2 + m2 + (delta ** 2) * (float (self.count) * count / total)
+        self.count = total
+
+
+    def Add (self, sample):
+        """Add one sample."""
+        sample = numpy.asarray (sample, dtype=numpy.float64)
+        self.count += 1
+        delta       = sample - self.mean
+        self.mean   = self.mean + delta / self.count
+        self.m2     = self.m2 + delta * (sample - self.mean)
+
+
+    def AddBatch (self, samples):
+        """Add many samples at once, the first axis runs over samples."""
+        samples = numpy.asarray (samples, dtype=numpy.float64)
+        count   = samples.shape[0]
+        if count > 0:
+            mean = samples.mean (axis=0)
+            m2   = ((samples - mean) ** 2).sum (axis=0)
+            self._Combine (count, mean, m2)
+
+
+    def Merge (self, other):
+        """Add samples collected by another accumulator."""
+        if other.mean.shape != self.mean.shape:
+            raise exceptions.StandardError ("Cannot merge accumulators of different shapes.")
+        self._Combine (other.count, other.mean, other.m2)
+
+
+class HistogramAccumulator (object):
+    """A class to count values in fixed bins, separately for each element of a sample (for example, each atom).
+
+    Bins are defined in the same way as in XYZTrajectory.BinCharges."""
+
+    def __init__ (self, nelements, limits=(-1., 1.), sampling=0.1):
+        """Constructor."""
+        self.nelements = nelements
+        self.limits    = limits
+        (self.lefts, self.rights, self.sampling) = MakeBins (limits, sampling)
+        self.counts    = numpy.zeros ((nelements, self.nbins), dtype=numpy.int64)
+
+    @property
+    def nbins (self):
+        return len (self.lefts)
+
+
+    def AddBatch (self, samples):
+        """Add many samples at once, samples have the shape (nsamples, nelements)."""
+        samples = numpy.asarray (samples, dtype=numpy.float64)
+        if samples.shape[0] > 0:
+            indices  = AssignBins (samples, self.lefts, self.rights)
+            offsets  = numpy.arange (self.nelements) * self.nbins
+            counts   = numpy.bincount ((indices + offsets).ravel (), minlength=(self.nelements * self.nbins))
+            self.counts += counts.reshape ((self.nelements, self.nbins))
+
+
+    def Add (self, sample):
+        """Add one sample of nelements values."""
+        self.AddBatch (numpy.asarray (sample, dtype=numpy.float64)[numpy.newaxis])
+
+
+    def Merge (self, other):
+        """Add counts collected by another accumulator."""
+        if (other.counts.shape != self.counts.shape) or (not numpy.array_equal (other.lefts, self.lefts)):
+            raise exceptions.StandardError ("Cannot merge histograms with different bins.")
+        self.counts += other.counts
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if __name__ == "__main__": pass
@@ -0,0 +1,92 @@
+#-------------------------------------------------------------------------------
+# . File      : BatchLoader.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+import  collections, exceptions, multiprocessing
+
+
+BatchResult = collections.namedtuple ("BatchResult", "filename  result  error")
+
+_MODULE_LABEL = "Batch"
+
+
+def _LoadOne (arguments):
+    """Load one file and capture a possible error."""
+    (index, filename, loader, keywordArguments) = arguments
+    try:
+        result = loader (filename, **keywordArguments)
+        error  = None
+    except exceptions.Exception as exception:
+        result = None
+        error  = "%s: %s" % (exception.__class__.__name__, exception)
+    return (index, BatchResult (filename=filename, result=result, error=error))
+
+
+def LoadFiles (filenames, loader, nprocs=1, progress=None, keywordArguments=None, logging=False):
+    """Load many files, optionally in parallel.
+
+    The loader is called as loader (filename, **keywordArguments) and can be a class (for example, GapFile) or a function.
+    For nprocs > 1, the loader has to be defined at the top level of a module so that it can be sent to worker processes.
+
+    Results are returned as a list of BatchResult tuples in the same order as filenames.
+    Errors are not raised but stored as strings in the error field of each result.
+
+    The optional progress callback is called in the main process as progress (ndone, nfiles, batchResult)."""
+    if keywordArguments is None:
+        keywordArguments = {}
+    nfiles  = len (filenames)
+    tasks   = []
+    for (index, filename) in enumerate (filenames):
+        task = (index, filename, loader, keywordArguments)
+        tasks.append (task)
+    results = [None] * nfiles
+    nprocs  = max (1, min (nprocs, nfiles))
+    if logging:
+        print ("# . %s> Loading %d file%s using %d process%s" % (_MODULE_LABEL, nfiles, "s" if nfiles != 1 else "", nprocs, "es" if nprocs != 1 else ""))
+    if nprocs < 2:
+        # . Load files serially without the overhead of a pool
+        for (ndone, task) in enumerate (tasks, 1):
+            (index, batchResult) = _LoadOne (task)
+            results[index] = batchResult
+            if progress:
+                progress (ndone, nfiles, batchResult)
+    else:
+        pool = multiprocessing.Pool (processes=nprocs)
+        try:
+            # . Files are collected as they finish, then put back in order
+            for (ndone, (index, batchResult)) in enumerate (pool.imap_unordered (_LoadOne, tasks), 1):
+                results[index] = batchResult
+                if progress:
+                    progress (ndone, nfiles, batchResult)
+            pool.close ()
+        except:
+            pool.terminate ()
+            raise
+        finally:
+            pool.join ()
+    if logging:
+        nerrors = 0
+        for batchResult in results:
+            if batchResult.error is not None:
+                print ("# . %s> Warning: Loading file %s failed (%s)" % (_MODULE_LABEL, batchResult.filename, batchResult.error))
+                nerrors += 1
+        print ("# . %s> Loaded %d file%s, %d failed" % (_MODULE_LABEL, nfiles - nerrors, "s" if (nfiles - nerrors) != 1 else "", nerrors))
+    return results
+
+
+def CheckBatchErrors (results):
+    """Raise an exception if any of the files in a batch failed to load."""
+    failed = []
+    for batchResult in results:
+        if batchResult.error is not None:
+            failed.append ("%s (%s)" % (batchResult.filename, batchResult.error))
+    if failed:
+        raise exceptions.StandardError ("Unable to load file%s: %s" % ("s" if len (failed) > 1 else "", ", ".join (failed)))
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if __name__ == "__main__": pass
@@ -0,0 +1,175 @@
+#-------------------------------------------------------------------------------
+# . File      : CellList.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+import  exceptions, itertools, math
+
+import  numpy
+
+_DEFAULT_CELL_SIZE = 4.
+_BLOCK_SIZE        = 1 << 20
+
+
+def _Offsets (lows, highs):
+    """Offsets of a cell and of its neighbors, from lows to highs (inclusive) in each direction."""
+    steps = [range (low, high + 1) for (low, high) in zip (lows, highs)]
+    return numpy.array (list (itertools.product (*steps)), dtype=numpy.int64).reshape ((-1, 3))
+
+
+def _Empty ():
+    """Empty arrays of indices i, j and of distances."""
+    return (numpy.zeros (0, dtype=numpy.int64), numpy.zeros (0, dtype=numpy.int64), numpy.zeros (0))
+
+
+class CellList (object):
+    """A grid of cubic cells for finding atoms that are close to each other.
+
+    Only atoms in the same or in neighboring cells are compared, so distances up to the size of a cell
+    are found in a time that grows linearly with the number of atoms."""
+
+    def __init__ (self, coordinates, cellSize=_DEFAULT_CELL_SIZE):
+        """Constructor.
+
+        Coordinates are an array of shape (natoms, 3)."""
+        coordinates = numpy.asarray (coordinates, dtype=numpy.float64).reshape ((-1, 3))
+        if cellSize <= 0.:
+            raise exceptions.StandardError ("Size of a cell must be positive.")
+        self.coordinates = coordinates
+        self.cellSize    = float (cellSize)
+        if coordinates.shape[0] > 0:
+            self.origin  = coordinates.min (axis=0)
+            self.cells   = numpy.floor ((coordinates - self.origin) / self.cellSize).astype (numpy.int64)
+            self.dims    = self.cells.max (axis=0) + 1
+            self.upper   = coordinates.max (axis=0)
+        else:
+            self.origin  = numpy.zeros (3)
+            self.upper   = numpy.zeros (3)
+            self.cells   = numpy.zeros ((0, 3), dtype=numpy.int64)
+            self.dims    = numpy.ones (3, dtype=numpy.int64)
+        # . Atoms sorted by the serial number of their cell
+        keys             = self._CellKeys (self.cells)
+        self.order       = numpy.argsort (keys, kind="mergesort")
+        self.sortedKeys  = keys[self.order]
+
+    @property
+    def natoms (self):
+        return self.coordinates.shape[0]
+
+    def _CellsOf (self, points):
+        return numpy.floor ((points - self.origin) / self.cellSize).astype (numpy.int64)
+
+    def _CellKeys (self, cells):
+        return (cells[:, 0] * self.dims[1] + cells[:, 1]) * self.dims[2] + cells[:, 2]
+
+    def _Candidates (self, cells, offset):
+        """For each cell, find atoms in the cell shifted by offset.
+
+        Returns arrays of indices of cells and of atoms, one element per candidate."""
+        shifted = cells + offset
+        inside  = numpy.all ((shifted >= 0) & (shifted < self.dims), axis=1)
+        queries = numpy.flatnonzero (inside)
+        keys    = self._CellKeys (shifted[queries])
+        starts  = numpy.searchsorted (self.sortedKeys, keys, side="left")
+        counts  = numpy.searchsorted (self.sortedKeys, keys, side="right") - starts
+        total   = counts.sum ()
+        # . Expand (query, range of atoms) into pairs
+        queries = numpy.repeat (queries, counts)
+        shifts  = numpy.repeat (starts - (numpy.cumsum (counts) - counts), counts)
+        atoms   = self.order[numpy.arange (total) + shifts]
+        return (queries, atoms)
+
+    def Pairs (self, cutoff=None):
+        """Find pairs of atoms not farther apart than the cutoff (by default, the size of a cell).
+
+        Returns arrays of indices i, j (i > j, sorted by i, then by j) and of distances."""
+        if cutoff is None:
+            cutoff = self.cellSize
+        if cutoff > self.cellSize:
+            raise exceptions.StandardError ("Cutoff (%.2f) is larger than the size of a cell (%.2f)." % (cutoff, self.cellSize))
+        return self._Search (self.coordinates, self.cells, cutoff, 1, lowerOnly=True)
+
+    def _Search (self, points, cells, cutoff, reach, lowerOnly=False):
+        """Compare points with atoms in cells up to reach cells away. With lowerOnly, only atoms of lower indices than points are kept.
+
+        Offsets that lead outside of the grid from all cells of points are skipped. If there are still more offsets than atoms,
+        for example for points far away from the atoms, points are compared with all atoms instead."""
+        if (points.shape[0] < 1) or (self.natoms < 1):
+            return _Empty ()
+        lows  = numpy.maximum (-reach, -cells.max (axis=0))
+        highs = numpy.minimum ( reach, self.dims - 1 - cells.min (axis=0))
+        if numpy.any (lows > highs):
+            return _Empty ()
+        if numpy.prod (highs - lows + 1) > self.natoms:
+            return self._SearchAll (points, cutoff, lowerOnly=lowerOnly)
+        collectI = []
+        collectJ = []
+        collectD = []
+        for offset in _Offsets (lows.tolist (), highs.tolist ()):
+            (i, j)    = self._Candidates (cells, offset)
+            if lowerOnly:
+                keep   = (i > j)
+                (i, j) = (i[keep], j[keep])
+            vectors   = points[i] - self.coordinates[j]
+            distances = numpy.sqrt ((vectors * vectors).sum (axis=1))
+            keep      = (distances <= cutoff)
+            collectI.append (i[keep])
+            collectJ.append (j[keep])
+            collectD.append (distances[keep])
+        i = numpy.concatenate (collectI)
+        j = numpy.concatenate (collectJ)
+        d = numpy.concatenate (collectD)
+        order = numpy.lexsort ((j, i))
+        return (i[order], j[order], d[order])
+
+    def _SearchAll (self, points, cutoff, lowerOnly=False):
+        """Compare points with all atoms, in blocks of points to limit the use of memory."""
+        collectI = []
+        collectJ = []
+        collectD = []
+        block    = max (1, _BLOCK_SIZE // self.natoms)
+        for first in range (0, points.shape[0], block):
+            vectors   = points[first:first + block, None, :] - self.coordinates[None, :, :]
+            distances = numpy.sqrt ((vectors * vectors).sum (axis=2))
+            keep      = (distances <= cutoff)
+            if lowerOnly:
+                keep &= (numpy.arange (first, first + keep.shape[0])[:, None] > numpy.arange (self.natoms)[None, :])
+            (i, j)    = numpy.nonzero (keep)
+            collectI.append (i + first)
+            collectJ.append (j)
+            collectD.append (distances[i, j])
+        return (numpy.concatenate (collectI), numpy.concatenate (collectJ), numpy.concatenate (collectD))
+
+    def Within (self, points, radius):
+        """Find atoms within a radius of points (array of shape (npoints, 3)), the radius may exceed the size of a cell.
+
+        Returns arrays of indices of points and of atoms (sorted by point, then by atom) and of distances."""
+        points = numpy.asarray (points, dtype=numpy.float64).reshape ((-1, 3))
+        reach  = max (1, int (math.ceil (radius / self.cellSize)))
+        return self._Search (points, self._CellsOf (points), radius, reach)
+
+    def Nearest (self, point, k=1):
+        """Find k atoms nearest to a point.
+
+        Returns arrays of indices of atoms and of distances, sorted by distance."""
+        point  = numpy.asarray (point, dtype=numpy.float64).reshape ((1, 3))
+        k      = min (k, self.natoms)
+        # . The farthest corner of the box of atoms limits the search, the nearest side of the box starts it
+        corner = numpy.maximum (abs (point - self.origin), abs (point - self.upper))
+        extent = math.sqrt ((corner * corner).sum ())
+        side   = numpy.maximum (self.origin - point, 0.) + numpy.maximum (point - self.upper, 0.)
+        radius = math.sqrt ((side * side).sum ()) + self.cellSize
+        while True:
+            (i, j, d) = self.Within (point, radius)
+            if (j.shape[0] >= k) or (radius >= extent):
+                break
+            radius *= 2.
+        order = numpy.argsort (d, kind="mergesort")[:k]
+        return (j[order], d[order])
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if __name__ == "__main__": pass
@@ -0,0 +1,173 @@
+#-------------------------------------------------------------------------------
+# . File      : FreeEnergy.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+import  collections, exceptions
+
+import  numpy
+
+
+FreeEnergyEstimate = collections.namedtuple ("FreeEnergyEstimate" , "deltaF  error")
+MBARResult         = collections.namedtuple ("MBARResult"         , "f  errors  niterations")
+
+_MODULE_LABEL = "FreeEnergy"
+
+# . Maximum number of array elements (samples times states) processed at once in MBAR
+_MAX_ELEMENTS = 4000000
+
+
+def LogSumExp (values, axis=None):
+    """Calculate log (sum (exp (values))) without overflows."""
+    values  = numpy.asarray (values, dtype=numpy.float64)
+    largest = values.max (axis=axis, keepdims=True)
+    largest = numpy.where (numpy.isfinite (largest), largest, 0.)
+    result  = numpy.log (numpy.exp (values - largest).sum (axis=axis, keepdims=True)) + largest
+    if axis is None:
+        return float (result.ravel ()[0])
+    return numpy.squeeze (result, axis=axis)
+
+
+def ExponentialAveraging (work, kT=1.):
+    """Calculate a free energy difference from work values with the Zwanzig formula.
+
+    For forward work (energy of the target state minus energy of the sampled state), the result is F(target) - F(sampled).
+    The error is estimated with the delta method and assumes uncorrelated samples."""
+    work     = numpy.asarray (work, dtype=numpy.float64).ravel () / kT
+    nsamples = len (work)
+    if nsamples < 1:
+        raise exceptions.StandardError ("No work values.")
+    deltaF   = -(LogSumExp (-work) - numpy.log (nsamples))
+    # . Exponentials are scaled by the largest one
+    factors  = numpy.exp (-(work - work.min ()))
+    error    = factors.std () / (factors.mean () * numpy.sqrt (nsamples))
+    return FreeEnergyEstimate (deltaF=(deltaF * kT), error=(error * kT))
+
+
+def _FermiSums (workForward, workReverse, shift, deltaF):
+    """Difference of sums of Fermi functions of the BAR equation (zero at the solution) and its derivative."""
+    forward = 1. / (1. + numpy.exp (numpy.clip (shift + workForward - deltaF, -700., 700.)))
+    reverse = 1. / (1. + numpy.exp (numpy.clip (-shift + workReverse + deltaF, -700., 700.)))
+    return (forward.sum () - reverse.sum (), (forward * (1. - forward)).sum () + (reverse * (1. - reverse)).sum ())
+
+
+def BennettAcceptanceRatio (workForward, workReverse, kT=1., tolerance=1e-10, maxIterations=200):
+    """Calculate a free energy difference F(1) - F(0) with the Bennett acceptance ratio.
+
+    workForward are energy differences E1 - E0 from sampling state 0, workReverse are E0 - E1 from sampling state 1.
+    The equation is solved with Newton steps kept inside a bracket of the solution (bisection is used otherwise).
+    The error is the asymptotic estimate for uncorrelated samples."""
+    workForward = numpy.asarray (workForward, dtype=numpy.float64).ravel () / kT
+    workReverse = numpy.asarray (workReverse, dtype=numpy.float64).ravel () / kT
+    (nforward, nreverse) = (len (workForward), len (workReverse))
+    if (nforward < 1) or (nreverse < 1):
+        raise exceptions.StandardError ("BAR needs work values in both directions.")
+    shift = numpy.log (float (nforward) / nreverse)
+    # . Bracket the solution starting from the exponential averages
+    guessForward =  ExponentialAveraging (workForward).deltaF
+    guessReverse = -ExponentialAveraging (workReverse).deltaF
+    (lower, upper) = (min (guessForward, guessReverse) - 1., max (guessForward, guessReverse) + 1.)
+    # . The difference of sums grows with deltaF
+    while _FermiSums (workForward, workReverse, shift, lower)[0] > 0.:
+        lower -= (upper - lower)
+    while _FermiSums (workForward, workReverse, shift, upper)[0] < 0.:
+        upper += (upper - lower)
+    deltaF = .5 * (guessForward + guessReverse)
+    for iteration in range (maxIterations):
+        (value, derivative) = _FermiSums (workForward, workReverse, shift, deltaF)
+        if value < 0.:
+            lower = deltaF
+        else:
+            upper = deltaF
+        step = (-value / derivative) if (derivative > 0.) else 0.
+        if (not (lower < (deltaF + step) < upper)) or (step == 0.):
+            step = .5 * (lower + upper) - deltaF
+        deltaF += step
+        if (abs (step) < tolerance) or ((upper - lower) < tolerance):
+            break
+    # . Asymptotic variance (Shirts et al., Phys. Rev. Lett. 91, 140601 (2003))
+    fermiForward = 1. / (1. + numpy.exp (numpy.clip (shift + workForward - deltaF, -700., 700.)))
+    fermiReverse = 1. / (1. + numpy.exp (numpy.clip (-shift + workReverse + deltaF, -700., 700.)))
+    variance = 0.
+    for (fermi, nsamples) in ((fermiForward, nforward), (fermiReverse, nreverse)):
+        mean = fermi.mean ()
+        if mean > 0.:
+            variance += ((fermi ** 2).mean () / mean ** 2 - 1.) / nsamples
+    return FreeEnergyEstimate (deltaF=(deltaF * kT), error=(numpy.sqrt (max (variance, 0.)) * kT))
+
+
+def _MBARWeights (reducedPotentials, logCounts, f, chunk):
+    """Calculate sums of weights of each state, the matrix W^T W and the objective function of MBAR.
+
+    Samples are processed in chunks to limit memory."""
+    nstates  = len (f)
+    sums     = numpy.zeros (nstates)
+    products = numpy.zeros ((nstates, nstates))
+    objective = 0.
+    nsamples  = reducedPotentials.shape[1]
+    for first in range (0, nsamples, chunk):
+        exponents = (f[:, numpy.newaxis] - reducedPotentials[:, first:first + chunk])
+        logDenominators = LogSumExp (exponents + logCounts[:, numpy.newaxis], axis=0)
+        weights   = numpy.exp (exponents - logDenominators)
+        sums     += weights.sum (axis=1)
+        products += numpy.dot (weights, weights.T)
+        objective += logDenominators.sum ()
+    return (sums, products, objective)
+
+
+def MBAR (reducedPotentials, counts, initialF=None, tolerance=1e-10, maxIterations=100, logging=False):
+    """Solve the multistate Bennett acceptance ratio equations (Shirts and Chodera, J. Chem. Phys. 129, 124105 (2008)).
+
+    reducedPotentials is an array of shape (nstates, nsamples) of energies divided by kT, for samples from all states
+    evaluated in every state. Samples are ordered by state, counts are the numbers of samples from each state.
+
+    The convex MBAR objective is minimized with Newton steps and a backtracking line search.
+    Returns an MBARResult with dimensionless free energies f (f[0] = 0) and a matrix of errors of f[j] - f[i]."""
+    reducedPotentials = numpy.asarray (reducedPotentials, dtype=numpy.float64)
+    counts    = numpy.asarray (counts, dtype=numpy.float64)
+    nstates   = len (counts)
+    if reducedPotentials.shape != (nstates, counts.sum ()):
+        raise exceptions.StandardError ("Reduced potentials must have the shape (nstates, nsamples).")
+    logCounts = numpy.log (counts)
+    chunk     = max (1, _MAX_ELEMENTS / nstates)
+    f         = numpy.zeros (nstates) if (initialF is None) else (numpy.asarray (initialF, dtype=numpy.float64) - initialF[0])
+    (sums, products, objective) = _MBARWeights (reducedPotentials, logCounts, f, chunk)
+    objective -= (counts * f).sum ()
+    for iteration in range (maxIterations):
+        gradient = counts * (sums - 1.)
+        if numpy.abs (sums - 1.).max () < tolerance:
+            break
+        hessian  = numpy.diag (counts * sums) - (counts[:, numpy.newaxis] * counts[numpy.newaxis, :]) * products
+        # . Free energy of the first state is fixed
+        step     = numpy.zeros (nstates)
+        step[1:] = -numpy.linalg.solve (hessian[1:, 1:], gradient[1:])
+        scale    = 1.
+        while True:
+            trial = f + scale * step
+            (trialSums, trialProducts, trialObjective) = _MBARWeights (reducedPotentials, logCounts, trial, chunk)
+            trialObjective -= (counts * trial).sum ()
+            if (trialObjective <= objective) or (scale < 1e-6):
+                break
+            scale *= .5
+        (f, sums, products, objective) = (trial, trialSums, trialProducts, trialObjective)
+        if logging:
+            print ("# . %s> MBAR iteration %d, largest gradient %g" % (_MODULE_LABEL, iteration + 1, numpy.abs (gradient).max ()))
+    else:
+        raise exceptions.StandardError ("MBAR did not converge in %d iterations." % maxIterations)
+    # . Asymptotic covariance from W^T W = V S^2 V^T, the thin SVD of the weight matrix
+    (eigenvalues, vectors) = numpy.linalg.eigh (products)
+    singular   = numpy.sqrt (numpy.clip (eigenvalues, 0., None))
+    scaled     = vectors * singular
+    inner      = numpy.eye (nstates) - numpy.dot (scaled.T * counts, scaled)
+    covariance = numpy.dot (numpy.dot (scaled, numpy.linalg.pinv (inner)), scaled.T)
+    diagonal   = numpy.diag (covariance)
+    variances  = diagonal[:, numpy.newaxis] + diagonal[numpy.newaxis, :] - 2. * covariance
+    errors     = numpy.sqrt (numpy.clip (variances, 0., None))
+    return MBARResult (f=f, errors=errors, niterations=iteration)
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if __name__ == "__main__": pass
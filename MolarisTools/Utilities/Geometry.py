@@ -0,0 +1,71 @@
+#-------------------------------------------------------------------------------
+# . File      : Geometry.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+import  exceptions
+
+import  numpy
+
+
+def _Prepare (coordinates, indices, natomsTerm):
+    """Check arrays of coordinates (nsteps, natoms, 3) and of atom indices (nterms, natomsTerm)."""
+    coordinates = numpy.asarray (coordinates, dtype=numpy.float64)
+    if coordinates.ndim == 2:
+        coordinates = coordinates[numpy.newaxis]
+    indices = numpy.asarray (indices, dtype=numpy.int64).reshape ((-1, natomsTerm))
+    if indices.size and ((indices.min () < 0) or (indices.max () >= coordinates.shape[1])):
+        raise exceptions.StandardError ("Atom indices out of range (%d atoms)." % coordinates.shape[1])
+    return (coordinates, indices)
+
+
+def _Dot (a, b):
+    return (a * b).sum (axis=-1)
+
+
+def MeasureDistances (coordinates, pairs):
+    """Calculate distances between pairs of atoms in all steps.
+
+    Coordinates have the shape (nsteps, natoms, 3), pairs are indices (counted from zero) of shape (npairs, 2).
+    Returns an array of shape (nsteps, npairs)."""
+    (coordinates, pairs) = _Prepare (coordinates, pairs, 2)
+    vectors = coordinates[:, pairs[:, 1]] - coordinates[:, pairs[:, 0]]
+    return numpy.sqrt (_Dot (vectors, vectors))
+
+
+def MeasureAngles (coordinates, triplets):
+    """Calculate angles (in degrees) of triplets of atoms, the second atom is the vertex.
+
+    Returns an array of shape (nsteps, ntriplets)."""
+    (coordinates, triplets) = _Prepare (coordinates, triplets, 3)
+    a = coordinates[:, triplets[:, 0]] - coordinates[:, triplets[:, 1]]
+    b = coordinates[:, triplets[:, 2]] - coordinates[:, triplets[:, 1]]
+    # . The arctangent is accurate also for angles close to 0 and 180 degrees
+    cross = numpy.cross (a, b)
+    return numpy.degrees (numpy.arctan2 (numpy.sqrt (_Dot (cross, cross)), _Dot (a, b)))
+
+
+def MeasureDihedrals (coordinates, quartets, wrap=False):
+    """Calculate dihedral angles (in degrees, from -180 to 180) of quartets of atoms.
+
+    The sign follows the IUPAC convention, as in VMD. With wrap, negative angles are shifted by 360 degrees.
+    Returns an array of shape (nsteps, nquartets)."""
+    (coordinates, quartets) = _Prepare (coordinates, quartets, 4)
+    b1 = coordinates[:, quartets[:, 1]] - coordinates[:, quartets[:, 0]]
+    b2 = coordinates[:, quartets[:, 2]] - coordinates[:, quartets[:, 1]]
+    b3 = coordinates[:, quartets[:, 3]] - coordinates[:, quartets[:, 2]]
+    n1 = numpy.cross (b1, b2)
+    n2 = numpy.cross (b2, b3)
+    y  = numpy.sqrt (_Dot (b2, b2)) * _Dot (b1, n2)
+    x  = _Dot (n1, n2)
+    angles = numpy.degrees (numpy.arctan2 (y, x))
+    if wrap:
+        angles[angles < 0.] += 360.
+    return angles
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if __name__ == "__main__": pass
@@ -0,0 +1,124 @@
+#-------------------------------------------------------------------------------
+# . File      : LogFollower.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+import  os, time
+
+
+_MODULE_LABEL = "Follow"
+
+
+class LogFollower (object):
+    """Base class for incremental readers of growing files.
+
+    Each call to Poll reads only the bytes written since the previous call.
+    Lines are collected into blocks; a block is processed only when it is complete,
+    so that a block that is being written at the moment of reading is not lost.
+
+    Subclasses implement _ProcessLine (line) and collect their new items in self._items."""
+
+    def __init__ (self, filename, logging=False):
+        """Constructor."""
+        self.filename = filename
+        self.logging  = logging
+        self.Reset ()
+
+
+    def Reset (self):
+        """Start reading again from the beginning of the file."""
+        self.offset   = 0
+        self.nlines   = 0
+        self.polls    = []
+        self._partial = ""
+        self._block   = None
+        self._items   = []
+
+
+    @property
+    def isPending (self):
+        """True if an incomplete block is waiting for more data."""
+        return (self._block is not None) or (self._partial != "")
+
+
+    def _ReadNewLines (self):
+        if not os.path.exists (self.filename):
+            return []
+        size = os.path.getsize (self.filename)
+        if size < self.offset:
+            # . The file was truncated or replaced, start over
+            if self.logging:
+                print ("# . %s> File %s was truncated, reading from the beginning" % (_MODULE_LABEL, self.filename))
+            self.Reset ()
+        if size == self.offset:
+            return []
+        data = open (self.filename, "rb")
+        data.seek (self.offset)
+        text = data.read (size - self.offset)
+        data.close ()
+        self.offset += len (text)
+        text  = self._partial + text
+        lines = text.splitlines (True)
+        # . Keep the last line if it is not terminated yet
+        if lines and (not lines[-1].endswith ("\n")):
+            self._partial = lines.pop ()
+        else:
+            self._partial = ""
+        self.nlines += len (lines)
+        return lines
+
+
+    def _ProcessLine (self, line):
+        pass
+
+
+    def Poll (self):
+        """Read new data and return a list of new items."""
+        for line in self._ReadNewLines ():
+            self._ProcessLine (line)
+        (items, self._items) = (self._items, [])
+        self.polls.append ((time.time (), self.ncompleted))
+        if self.logging and items:
+            print ("# . %s> Read %d new item%s from file %s" % (_MODULE_LABEL, len (items), "s" if len (items) != 1 else "", self.filename))
+        return items
+
+
+    @property
+    def ncompleted (self):
+        """Number of items completed so far, used to calculate rates.
+
+        Subclasses may redefine it (for example, to count MD steps instead of printouts)."""
+        return 0
+
+
+    def Rate (self):
+        """Items completed per second since the first poll that found any data."""
+        polls = [(t, n) for (t, n) in self.polls if n > 0]
+        if len (polls) < 2:
+            return None
+        ((tfirst, nfirst), (tlast, nlast)) = (polls[0], polls[-1])
+        if (tlast <= tfirst) or (nlast <= nfirst):
+            return None
+        return (nlast - nfirst) / (tlast - tfirst)
+
+
+    def Follow (self, interval=10., callback=None, npolls=None):
+        """Poll the file every interval seconds and pass new items to a callback.
+
+        Runs until npolls polls are done (forever if npolls is None) or until the callback returns True."""
+        ipoll = 0
+        while (npolls is None) or (ipoll < npolls):
+            items = self.Poll ()
+            if callback:
+                if callback (self, items):
+                    break
+            ipoll += 1
+            if (npolls is None) or (ipoll < npolls):
+                time.sleep (interval)
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if __name__ == "__main__": pass
@@ -0,0 +1,448 @@
+#-------------------------------------------------------------------------------
+# . File      : ParseCache.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+# . Cache files are NumPy archives (npz).
+#
+# . Attributes of a parsed object are stored as:
+#     - NumPy arrays, which are written as they are,
+#     - long lists of namedtuples with numeric or string fields, which are
+#       converted to record arrays and converted back on loading,
+#     - everything else, which is pickled into a single byte array
+#       (namedtuples, which cannot be pickled by reference because their
+#       names differ from the names of their types in modules, are stored
+#       as persistent IDs).
+#
+# . Objects can choose the attributes to store by defining _GetCacheState,
+# . which returns a dictionary of attributes, and _SetCacheState, which sets
+# . attributes from such a dictionary.
+#
+# . A cache file is valid if the size and modification time (and optionally
+# . a checksum) of the source file, the version of the parser and the options
+# . passed to the parser are the same as when the cache file was written.
+#
+# . Pickled data can run code when loaded. Only cache files owned by the user
+# . and not writable by others are read, and only classes of MolarisTools (and
+# . a few types of Python and NumPy) can be loaded from them. Still, cache files
+# . (including sidecar files in shared directories) must be treated as code.
+#
+import  exceptions, cPickle, cStringIO, hashlib, json, os, stat, sys, tempfile
+
+import  numpy
+
+
+_MODULE_LABEL      = "Cache"
+_CACHE_FORMAT      = 1
+_CACHE_EXTENSION   = ".npz"
+_SIDECAR_PREFIX    = "."
+_DEFAULT_MAX_SIZE  = 1024 * 1024 * 1024
+_HASH_BLOCK        = 1024 * 1024
+_OPTIONS_DIGITS    = 8
+# . Shorter lists of namedtuples are pickled, reading many small arrays is slower
+_MIN_RECORDS       = 256
+_KEY_META          = "meta"
+_KEY_STATE         = "state"
+_PREFIX_ARRAY      = "array_"
+_PREFIX_RECORDS    = "records_"
+_LIBRARY_CACHE_DIR = os.path.join (os.path.expanduser ("~"), ".MolarisTools", "libraries")
+_LIBRARY_CACHE_ENV = "MOLARISTOOLS_LIBRARY_CACHE"
+_PACKAGE_PREFIX    = "MolarisTools."
+# . Globals other than classes of MolarisTools that may be loaded from cache files
+_SAFE_GLOBALS      = {
+    "__builtin__"           :   ("set", "frozenset", "object", "complex", ) ,
+    "copy_reg"              :   ("_reconstructor", )                        ,
+    "numpy"                 :   ("dtype", "ndarray", )                      ,
+    "numpy.core.multiarray" :   ("_reconstruct", "scalar", )                , }
+
+
+def _FileChecksum (filename):
+    """Calculate a SHA1 checksum of a file."""
+    checksum = hashlib.sha1 ()
+    data     = open (filename, "rb")
+    while True:
+        block = data.read (_HASH_BLOCK)
+        if not block:
+            break
+        checksum.update (block)
+    data.close ()
+    return checksum.hexdigest ()
+
+
+def _OptionsKey (options):
+    """Text representing options passed to a parser."""
+    return repr (sorted ((options or {}).items ()))
+
+
+def _IsRecordList (value):
+    """Check if a value is a list of namedtuples of the same type with numeric or string fields only."""
+    if not isinstance (value, list):
+        return False
+    if len (value) < _MIN_RECORDS:
+        return False
+    first = value[0]
+    if not (isinstance (first, tuple) and hasattr (first, "_fields")):
+        return False
+    for (field, item) in zip (first._fields, first):
+        if type (item) not in (int, long, float, bool, str):
+            return False
+    recordType = first.__class__
+    if _FindTypeName (recordType) is None:
+        return False
+    types      = map (type, first)
+    for item in value:
+        if item.__class__ is not recordType:
+            return False
+        if map (type, item) != types:
+            return False
+    return True
+
+
+def _FindTypeName (recordType):
+    """Find the name under which a type is accessible in its module (may differ from the name of a namedtuple)."""
+    module = sys.modules.get (recordType.__module__, None)
+    if module is None:
+        return None
+    if getattr (module, recordType.__name__, None) is recordType:
+        return recordType.__name__
+    for (name, value) in vars (module).iteritems ():
+        if value is recordType:
+            return name
+    return None
+
+
+def _ListToRecords (value):
+    """Convert a list of namedtuples to a record array."""
+    first  = value[0]
+    dtypes = []
+    for (field, item) in zip (first._fields, first):
+        if   isinstance (item, bool):
+            dtypes.append ((field, numpy.bool_))
+        elif isinstance (item, (int, long)):
+            dtypes.append ((field, numpy.int64))
+        elif isinstance (item, float):
+            dtypes.append ((field, numpy.float64))
+        else:
+            length = max (map (lambda record: len (getattr (record, field)), value))
+            dtypes.append ((field, "S%d" % max (1, length)))
+    return numpy.array (map (tuple, value), dtype=dtypes)
+
+
+def _RecordsToList (records, recordType, types):
+    """Convert a record array back to a list of namedtuples."""
+    converters = []
+    for name in types:
+        converters.append ({"bool" : bool, "int" : int, "long" : long, "float" : float, "str" : str}[name])
+    collect = []
+    for record in records.tolist ():
+        items = []
+        for (item, converter) in zip (record, converters):
+            items.append (converter (item))
+        collect.append (recordType._make (items))
+    return collect
+
+
+def _ImportType (moduleName, typeName):
+    """Find a type by its module and name."""
+    __import__ (moduleName)
+    module = sys.modules[moduleName]
+    return getattr (module, typeName)
+
+
+def _FindGlobal (moduleName, name):
+    """Find a global for unpickling. Only classes of MolarisTools and a few safe types are allowed."""
+    if name in _SAFE_GLOBALS.get (moduleName, ()):
+        return _ImportType (moduleName, name)
+    if moduleName.startswith (_PACKAGE_PREFIX):
+        value = _ImportType (moduleName, name)
+        if isinstance (value, type):
+            return value
+    raise cPickle.UnpicklingError ("Loading %s.%s from a cache file is not allowed." % (moduleName, name))
+
+
+def _ImportRecordType (moduleName, typeName):
+    """Find a type of namedtuples by its module and name, only namedtuples of MolarisTools are allowed."""
+    recordType = _FindGlobal (moduleName, typeName)
+    if not (issubclass (recordType, tuple) and hasattr (recordType, "_fields")):
+        raise cPickle.UnpicklingError ("Type %s.%s is not a namedtuple." % (moduleName, typeName))
+    return recordType
+
+
+def _IsTrusted (filename):
+    """Check if a file is owned by the user and not writable by others, so that loading it cannot run code of others."""
+    info = os.stat (filename)
+    if hasattr (os, "getuid") and (info.st_uid != os.getuid ()):
+        return False
+    return not (info.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+def _PersistentID (obj):
+    """Persistent ID of a namedtuple whose type is accessible in its module under a different name."""
+    if isinstance (obj, tuple) and hasattr (obj, "_fields"):
+        recordType = obj.__class__
+        typeName   = _FindTypeName (recordType)
+        if (typeName is not None) and (typeName != recordType.__name__):
+            return (recordType.__module__, typeName, tuple (obj))
+    return None
+
+
+def _PersistentLoad (persistentID):
+    (moduleName, typeName, items) = persistentID
+    return _ImportRecordType (moduleName, typeName)._make (items)
+
+
+def _Dumps (state):
+    output  = cStringIO.StringIO ()
+    pickler = cPickle.Pickler (output, cPickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = _PersistentID
+    pickler.dump (state)
+    return output.getvalue ()
+
+
+def _Loads (data):
+    unpickler = cPickle.Unpickler (cStringIO.StringIO (data))
+    unpickler.find_global     = _FindGlobal
+    unpickler.persistent_load = _PersistentLoad
+    return unpickler.load ()
+
+
+class ParseCache (object):
+    """A class to store parsed files on disk and load them back.
+
+    If directory is None, cache files are written next to the parsed files (sidecar files).
+    Otherwise, all cache files are kept in one directory limited to maxSize bytes.
+
+    Cache files contain pickled data. Files owned by other users or writable by others are ignored,
+    but a cache file must be trusted like code, since loading it creates objects of MolarisTools."""
+
+    def __init__ (self, directory=None, maxSize=_DEFAULT_MAX_SIZE, useHash=False, logging=False):
+        """Constructor."""
+        self.directory = directory
+        self.maxSize   = maxSize
+        self.useHash   = useHash
+        self.logging   = logging
+        if directory is not None:
+            if not os.path.exists (directory):
+                os.makedirs (directory)
+
+
+    def _GetCacheFilename (self, obj, filename, options=None):
+        # . Objects parsed with different options are kept in different cache files
+        className = obj.__class__.__name__
+        if self.directory is None:
+            (dirname, basename) = os.path.split (os.path.abspath (filename))
+            suffix = (".%s" % hashlib.sha1 (_OptionsKey (options)).hexdigest ()[:_OPTIONS_DIGITS]) if options else ""
+            return os.path.join (dirname, "%s%s.%s%s%s" % (_SIDECAR_PREFIX, basename, className, suffix, _CACHE_EXTENSION))
+        key = hashlib.sha1 ("%s:%s:%s" % (className, os.path.abspath (filename), _OptionsKey (options))).hexdigest ()
+        return os.path.join (self.directory, "%s%s" % (key, _CACHE_EXTENSION))
+
+
+    def _GetSignature (self, obj, filename, options):
+        info      = os.stat (filename)
+        signature = {
+            "format"        :   _CACHE_FORMAT                                   ,
+            "class"         :   obj.__class__.__name__                          ,
+            "parserVersion" :   getattr (obj.__class__, "_PARSER_VERSION", 0)   ,
+            "options"       :   _OptionsKey (options)                           ,
+            "source"        :   os.path.abspath (filename)                      ,
+            "size"          :   info.st_size                                    ,
+            "mtime"         :   repr (info.st_mtime)                            , }
+        if self.useHash:
+            signature["hash"] = _FileChecksum (filename)
+        return signature
+
+
+    def Restore (self, obj, filename, options=None):
+        """Restore the attributes of an object from the cache.
+
+        Attributes that the object already has (for example, set by its constructor) are not overwritten.
+        Returns True if a valid cache file was found."""
+        cacheFilename = self._GetCacheFilename (obj, filename, options)
+        if not os.path.exists (cacheFilename):
+            return False
+        if not _IsTrusted (cacheFilename):
+            if self.logging:
+                print ("# . %s> Warning: Ignoring cache file %s, which is not owned by the user or is writable by others" % (_MODULE_LABEL, cacheFilename))
+            return False
+        try:
+            archive = numpy.load (cacheFilename)
+            try:
+                meta      = json.loads (archive[_KEY_META].tostring ())
+                signature = self._GetSignature (obj, filename, options)
+                stored    = meta["signature"]
+                if not self.useHash:
+                    stored.pop ("hash", None)
+                if stored != signature:
+                    if self.logging:
+                        print ("# . %s> Cache file %s is out of date" % (_MODULE_LABEL, cacheFilename))
+                    return False
+                state = _Loads (archive[_KEY_STATE].tostring ())
+                for (attribute, (moduleName, typeName, types)) in meta["records"].iteritems ():
+                    recordType       = _ImportRecordType (str (moduleName), str (typeName))
+                    state[str (attribute)] = _RecordsToList (archive["%s%s" % (_PREFIX_RECORDS, attribute)], recordType, types)
+                for attribute in meta["arrays"]:
+                    state[str (attribute)] = archive["%s%s" % (_PREFIX_ARRAY, attribute)]
+            finally:
+                archive.close ()
+        except exceptions.Exception as error:
+            if self.logging:
+                print ("# . %s> Warning: Cannot read cache file %s (%s)" % (_MODULE_LABEL, cacheFilename, error))
+            return False
+        if hasattr (obj, "_SetCacheState"):
+            obj._SetCacheState (state)
+        else:
+            for (attribute, value) in state.iteritems ():
+                if not hasattr (obj, attribute):
+                    setattr (obj, attribute, value)
+        # . Mark the cache file as recently used
+        os.utime (cacheFilename, None)
+        if self.logging:
+            print ("# . %s> Loaded %s from cache file %s" % (_MODULE_LABEL, filename, cacheFilename))
+        return True
+
+
+    def Store (self, obj, filename, options=None):
+        """Write the attributes of an object to the cache."""
+        cacheFilename = self._GetCacheFilename (obj, filename, options)
+        signature     = self._GetSignature (obj, filename, options)
+        state   = {}
+        arrays  = {}
+        records = {}
+        meta    = {"signature" : signature, "arrays" : [], "records" : {}}
+        attributes = obj._GetCacheState () if hasattr (obj, "_GetCacheState") else obj.__dict__
+        for (attribute, value) in attributes.iteritems ():
+            if   isinstance (value, numpy.ndarray) and (value.dtype != numpy.object_):
+                arrays["%s%s" % (_PREFIX_ARRAY, attribute)] = value
+                meta["arrays"].append (attribute)
+            elif _IsRecordList (value):
+                recordType = value[0].__class__
+                records["%s%s" % (_PREFIX_RECORDS, attribute)] = _ListToRecords (value)
+                meta["records"][attribute] = (recordType.__module__, _FindTypeName (recordType), map (lambda item: type (item).__name__, value[0]))
+            else:
+                state[attribute] = value
+        collect = {}
+        collect.update (arrays)
+        collect.update (records)
+        collect[_KEY_META ] = numpy.frombuffer (json.dumps (meta), dtype=numpy.uint8)
+        try:
+            collect[_KEY_STATE] = numpy.frombuffer (_Dumps (state), dtype=numpy.uint8)
+        except (cPickle.PicklingError, exceptions.TypeError) as error:
+            if self.logging:
+                print ("# . %s> Warning: Cannot cache %s (%s)" % (_MODULE_LABEL, filename, error))
+            return
+        # . Write to a temporary file first so that other processes never see a partially written cache
+        (dirname, basename) = os.path.split (cacheFilename)
+        temporary = None
+        try:
+            (handle, temporary) = tempfile.mkstemp (suffix=_CACHE_EXTENSION, dir=dirname)
+            output = os.fdopen (handle, "wb")
+            try:
+                numpy.savez (output, **collect)
+            finally:
+                output.close ()
+            os.rename (temporary, cacheFilename)
+        except exceptions.Exception as error:
+            # . Do not leave partially written files behind, they would never be evicted
+            if (temporary is not None) and os.path.exists (temporary):
+                os.remove (temporary)
+            if self.logging:
+                print ("# . %s> Warning: Cannot write cache file %s (%s)" % (_MODULE_LABEL, cacheFilename, error))
+            return
+        if self.logging:
+            print ("# . %s> Wrote cache file %s" % (_MODULE_LABEL, cacheFilename))
+        if self.directory is not None:
+            self.Evict ()
+
+
+    def Evict (self):
+        """Remove the least recently used cache files until the cache fits in maxSize."""
+        if self.directory is None:
+            return
+        entries = []
+        total   = 0
+        for name in os.listdir (self.directory):
+            if name.endswith (_CACHE_EXTENSION):
+                path = os.path.join (self.directory, name)
+                info = os.stat (path)
+                entries.append ((info.st_mtime, info.st_size, path))
+                total += info.st_size
+        entries.sort ()
+        for (mtime, size, path) in entries:
+            if total <= self.maxSize:
+                break
+            os.remove (path)
+            total -= size
+            if self.logging:
+                print ("# . %s> Removed cache file %s" % (_MODULE_LABEL, path))
+
+
+    def Clear (self):
+        """Remove all cache files from the cache directory."""
+        if self.directory is not None:
+            for name in os.listdir (self.directory):
+                if name.endswith (_CACHE_EXTENSION):
+                    os.remove (os.path.join (self.directory, name))
+
+
+#-------------------------------------------------------------------------------
+_defaultCache = None
+
+def _GetCache (cache):
+    global _defaultCache
+    if isinstance (cache, ParseCache):
+        return cache
+    if cache:
+        if _defaultCache is None:
+            _defaultCache = ParseCache ()
+        return _defaultCache
+    return None
+
+
+def RestoreFromCache (obj, filename, cache, options=None):
+    """Restore an object from the cache, if caching is enabled.
+
+    Parameter cache can be False/None (no caching), True (sidecar files) or a ParseCache object.
+    Cache files are pickled data and must be trusted, see ParseCache."""
+    cache = _GetCache (cache)
+    if cache is None:
+        return False
+    return cache.Restore (obj, filename, options=options)
+
+
+def StoreInCache (obj, filename, cache, options=None):
+    """Store an object in the cache, if caching is enabled."""
+    cache = _GetCache (cache)
+    if cache is not None:
+        cache.Store (obj, filename, options=options)
+
+
+#-------------------------------------------------------------------------------
+_libraryCache = None
+
+def GetLibraryCache (cache=True):
+    """Get the cache of compiled libraries.
+
+    Libraries are shared by many projects and may be kept in read-only directories, so that
+    by default they are cached in one directory in the home directory (or in the directory
+    given by the environment variable MOLARISTOOLS_LIBRARY_CACHE). Checksums of libraries are verified.
+
+    Parameter cache can be False/None (no caching), True (default directory) or a ParseCache object."""
+    global _libraryCache
+    if isinstance (cache, ParseCache):
+        return cache
+    if cache:
+        if _libraryCache is None:
+            try:
+                _libraryCache = ParseCache (directory=os.environ.get (_LIBRARY_CACHE_ENV, _LIBRARY_CACHE_DIR), useHash=True)
+            except exceptions.EnvironmentError:
+                # . No writable place for the cache, libraries are parsed every time
+                return None
+        return _libraryCache
+    return None
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if __name__ == "__main__": pass
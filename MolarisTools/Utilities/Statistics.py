@@ -0,0 +1,114 @@
+#-------------------------------------------------------------------------------
+# . File      : Statistics.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+import  collections, exceptions
+
+import  numpy
+
+
+BlockAverage = collections.namedtuple ("BlockAverage", "blockSizes  errors  error")
+
+# . Maximum number of random blocks drawn at once in a bootstrap
+_MAX_DRAWS = 4000000
+
+
+def _AsSeries (series):
+    series = numpy.asarray (series, dtype=numpy.float64).ravel ()
+    if len (series) < 2:
+        raise exceptions.StandardError ("At least two samples are needed.")
+    return series
+
+
+def Autocorrelation (series):
+    """Calculate the normalized autocorrelation function of a time series with FFT.
+
+    Element t of the result is the correlation at lag t (the element 0 is 1)."""
+    series = _AsSeries (series)
+    nsamples  = len (series)
+    deviation = series - series.mean ()
+    # . Padding with zeros avoids the circular correlation
+    nfft      = 2 ** int (numpy.ceil (numpy.log2 (2 * nsamples)))
+    transform = numpy.fft.rfft (deviation, nfft)
+    function  = numpy.fft.irfft (transform * numpy.conjugate (transform), nfft)[:nsamples]
+    function /= (nsamples - numpy.arange (nsamples))
+    if function[0] <= 0.:
+        # . Constant series
+        return numpy.zeros (nsamples)
+    return function / function[0]
+
+
+def StatisticalInefficiency (series):
+    """Calculate the statistical inefficiency g of a time series.
+
+    The number of uncorrelated samples is nsamples / g. The autocorrelation function is integrated
+    up to its first non-positive value (Chodera et al., J. Chem. Theory Comput. 3, 26 (2007))."""
+    function = Autocorrelation (series)
+    nsamples = len (function)
+    negative = numpy.nonzero (function[1:] <= 0.)[0]
+    last     = (negative[0] + 1) if (len (negative) > 0) else nsamples
+    lags     = numpy.arange (1, last)
+    g        = 1. + 2. * ((1. - lags / float (nsamples)) * function[1:last]).sum ()
+    return max (1., g)
+
+
+def BlockAveraging (series, minBlocks=8):
+    """Calculate standard errors of the mean for blocks of increasing sizes (1, 2, 4, ...).
+
+    Errors grow with the block size until blocks become uncorrelated. The largest error
+    is returned as an estimate of the standard error (the plateau of a well-converged series)."""
+    series = _AsSeries (series)
+    nsamples   = len (series)
+    blockSizes = []
+    errors     = []
+    blockSize  = 1
+    while (nsamples / blockSize) >= max (minBlocks, 2):
+        nblocks = nsamples / blockSize
+        means   = series[:nblocks * blockSize].reshape ((nblocks, blockSize)).mean (axis=1)
+        blockSizes.append (blockSize)
+        errors.append (means.std (ddof=1) / numpy.sqrt (nblocks))
+        blockSize *= 2
+    if not errors:
+        raise exceptions.StandardError ("Too few samples (%d) for %d blocks." % (nsamples, minBlocks))
+    errors = numpy.array (errors)
+    return BlockAverage (blockSizes=numpy.array (blockSizes), errors=errors, error=errors.max ())
+
+
+def BootstrapMeans (series, nresamples=1000, blockSize=1, seed=None):
+    """Calculate means of bootstrap resamples of a time series.
+
+    Correlated samples are resampled in blocks of blockSize consecutive samples (moving block bootstrap),
+    for example of the size of the statistical inefficiency. All resamples are calculated at once."""
+    series    = _AsSeries (series)
+    nsamples  = len (series)
+    blockSize = min (max (int (numpy.ceil (blockSize)), 1), nsamples)
+    nblocks   = int (numpy.ceil (nsamples / float (blockSize)))
+    random    = numpy.random.RandomState (seed)
+    # . Sums of blocks are differences of cumulative sums
+    cumulated = numpy.concatenate (([0.], numpy.cumsum (series)))
+    means     = numpy.empty (nresamples)
+    # . Resamples are done in chunks to limit memory for long series
+    nchunk    = max (1, _MAX_DRAWS / nblocks)
+    for first in range (0, nresamples, nchunk):
+        last   = min (first + nchunk, nresamples)
+        starts = random.randint (0, nsamples - blockSize + 1, size=(last - first, nblocks))
+        sums   = cumulated[starts + blockSize] - cumulated[starts]
+        means[first:last] = sums.sum (axis=1) / (nblocks * blockSize)
+    return means
+
+
+def ConfidenceInterval (samples, level=0.95):
+    """Calculate a percentile confidence interval from bootstrap samples.
+
+    Returns a tuple (lower, upper)."""
+    percent = (1. - level) * 50.
+    (lower, upper) = numpy.percentile (samples, (percent, 100. - percent))
+    return (lower, upper)
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if __name__ == "__main__": pass
@@ -64,6 +64,26 @@ def Unpickle (filename):
     return obj
 
 
+class TableList (list):
+    """A list that keeps a table (for example, an index of its items) until the list is changed.
+
+    Any change of the list, including list[i] = item, sets the table back to None."""
+    table = None
+
+
+def _Clearing (name):
+    method = getattr (list, name)
+    def Clear (self, *arguments, **keywordArguments):
+        self.table = None
+        return method (self, *arguments, **keywordArguments)
+    Clear.__name__ = name
+    return Clear
+
+for name in ("__setitem__", "__delitem__", "__setslice__", "__delslice__", "__iadd__", "__imul__", "append", "extend", "insert", "pop", "remove", "reverse", "sort"):
+    setattr (TableList, name, _Clearing (name))
+del name
+
+
 #===============================================================================
 # . Main program
 #===============================================================================
@@ -4,5 +4,13 @@
 # . Copyright : USC, Mikolaj Feliks (2015-2018)
 # . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
 #-------------------------------------------------------------------------------
-from Utilities  import TokenizeLine, WriteData, Pickle, Unpickle
+from Utilities    import TokenizeLine, WriteData, Pickle, Unpickle, TableList
+from BatchLoader  import LoadFiles, CheckBatchErrors, BatchResult
+from ParseCache   import ParseCache, RestoreFromCache, StoreInCache, GetLibraryCache
+from LogFollower  import LogFollower
 
+from Accumulators import WelfordAccumulator, HistogramAccumulator, AssignBins, MakeBins
+from Statistics   import Autocorrelation, StatisticalInefficiency, BlockAveraging, BlockAverage, BootstrapMeans, ConfidenceInterval
+from FreeEnergy   import LogSumExp, ExponentialAveraging, BennettAcceptanceRatio, MBAR, FreeEnergyEstimate, MBARResult
+from Geometry     import MeasureDistances, MeasureAngles, MeasureDihedrals
+from CellList     import CellList
@@ -0,0 +1,42 @@
+#-------------------------------------------------------------------------------
+# . File      : BenchmarkBondPerception.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+# . Times finding bonds from distances in boxes of water molecules
+# . of increasing size, at the density of liquid water.
+#
+# . Usage: python BenchmarkBondPerception.py [largest]
+#
+import math, random, sys, time
+
+from MolarisTools.Parser   import PDBAtom
+from MolarisTools.Scripts  import BondsFromDistances
+
+
+largest = int (sys.argv[1]) if len (sys.argv) > 1 else 300000
+
+
+def MakeWaterBox (nmolecules):
+    """Place water molecules on a cubic lattice with a spacing of 3.1 Angstroms."""
+    side  = int (math.ceil (nmolecules ** (1. / 3.)))
+    atoms = []
+    for i in range (nmolecules):
+        (x, y, z) = (3.1 * (i % side), 3.1 * ((i / side) % side), 3.1 * (i / (side * side)))
+        angle     = random.uniform (0., 2. * math.pi)
+        atoms.append (PDBAtom (label="OH2", serial=(3 * i + 1), x=x, y=y, z=z))
+        atoms.append (PDBAtom (label="H1" , serial=(3 * i + 2), x=(x + 0.96 * math.cos (angle)), y=(y + 0.96 * math.sin (angle)), z=z))
+        atoms.append (PDBAtom (label="H2" , serial=(3 * i + 3), x=(x - 0.96 * math.sin (angle)), y=(y + 0.96 * math.cos (angle)), z=z))
+    return atoms
+
+
+random.seed (12345)
+print ("%8s %8s %10s" % ("natoms", "bonds", "time (s)"))
+nmolecules = 1000
+while (3 * nmolecules) <= largest:
+    atoms = MakeWaterBox (nmolecules)
+    start = time.time ()
+    bonds = BondsFromDistances (atoms, logging=False)
+    print ("%8d %8d %10.3f" % (len (atoms), len (bonds), time.time () - start))
+    nmolecules *= 2
@@ -0,0 +1,71 @@
+#-------------------------------------------------------------------------------
+# . File      : BenchmarkEVBLibrary.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+# . Times assigning parameters to random EVB terms, by linear searches
+# . of the lists of parameters and by the indexed EVBLibrary.Resolve.
+#
+# . Usage: python BenchmarkEVBLibrary.py [nterms [library]]
+#
+import os, random, sys, time
+
+from MolarisTools.Library  import EVBLibrary
+
+
+nterms   = int (sys.argv[1]) if len (sys.argv) > 1 else 20000
+filename = sys.argv[2] if len (sys.argv) > 2 else os.path.join (os.path.dirname (__file__), "..", "..", "data", "evb_poll_clean.lib")
+
+
+def ScanBond (library, typea, typeb):
+    for pair in library.pairs:
+        if (pair.typea == typea and pair.typeb == typeb) or (pair.typea == typeb and pair.typeb == typea):
+            return pair
+    (morsea, morseb) = (None, None)
+    for morse in library.morse:
+        if morse.evbType == typea:
+            morsea = morse
+        if morse.evbType == typeb:
+            morseb = morse
+    if morsea and morseb:
+        return (morsea, morseb)
+    return None
+
+
+def ScanAngle (library, typea, typeb, typec):
+    for angle in library.angles:
+        if angle.evbType == typeb:
+            return angle
+    return None
+
+
+def ScanTorsion (library, typea, typeb, typec, typed):
+    for torsion in library.torsions:
+        if (torsion.typea == typeb and torsion.typeb == typec) or (torsion.typea == typec and torsion.typeb == typeb):
+            return torsion
+    return None
+
+
+def Scan (library, terms):
+    functions = {2 : ScanBond, 3 : ScanAngle, 4 : ScanTorsion, }
+    return [functions[len (term)] (library, *term) for term in terms]
+
+
+def Timed (label, function, *arguments, **keywordArguments):
+    start  = time.time ()
+    result = function (*arguments, **keywordArguments)
+    print ("%-32s %8.3f s" % (label, time.time () - start))
+    return result
+
+
+random.seed (12345)
+library = Timed ("Reading library", EVBLibrary, filename, logging=False)
+types   = sorted (set ([atom.evbType for atom in library.morse] + [angle.evbType for angle in library.angles]))
+terms   = [tuple (random.choice (types) for i in range (random.randint (2, 4))) for j in range (nterms)]
+print ("Assigning parameters to %d terms of %d atom types" % (nterms, len (types)))
+
+scanned  = Timed ("Linear searches", Scan, library, terms)
+resolved = Timed ("Resolve", library.Resolve, terms)
+nfound   = sum (1 for parameter in resolved if parameter)
+print ("Found parameters for %d terms (%d by linear searches)" % (nfound, sum (1 for parameter in scanned if parameter)))
@@ -0,0 +1,35 @@
+#-------------------------------------------------------------------------------
+# . File      : BenchmarkFEP.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+# . Times the FEP estimators on synthetic windows, in which the energy gap
+# . is Gaussian and the exact free energy is known:
+# .     F(lambda) = lambda * mu - lambda^2 * sigma^2 / (2 kT)
+#
+# . Usage: python BenchmarkFEP.py [nwindows [nsamples]]
+#
+import sys, time
+
+import numpy
+
+from MolarisTools.Scripts  import CalculateFEPFromGaps
+from MolarisTools.Units    import GAS_CONSTANT_KCAL_MOL_K
+
+
+nwindows = int (sys.argv[1]) if len (sys.argv) > 1 else 100
+nsamples = int (sys.argv[2]) if len (sys.argv) > 2 else 100000
+(mu, sigma, temperature) = (20., 3., 300.)
+
+kT      = GAS_CONSTANT_KCAL_MOL_K * temperature
+lambdas = numpy.linspace (0., 1., nwindows)
+random  = numpy.random.RandomState (12345)
+gaps    = [random.normal (mu - l * sigma ** 2 / kT, sigma, nsamples) for l in lambdas]
+
+start   = time.time ()
+result  = CalculateFEPFromGaps (lambdas, gaps, temperature=temperature, logging=False)
+print ("%d windows of %d samples done in %.2f s" % (nwindows, nsamples, time.time () - start))
+print ("Exact            %8.3f kcal/mol" % (mu - sigma ** 2 / (2. * kT)))
+for (label, estimates) in (("Forward", result.forward), ("Backward", result.backward), ("BAR", result.bar), ("MBAR", result.mbar)):
+    print ("%-16s %8.3f +/- %.3f kcal/mol" % (label, estimates.total, estimates.totalError))
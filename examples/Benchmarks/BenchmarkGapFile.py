@@ -0,0 +1,47 @@
+#-------------------------------------------------------------------------------
+# . File      : BenchmarkGapFile.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+# . Times reading, merging and calculating LRA terms on synthetic gap
+# . files from an evb_to_qm_map type of simulation.
+#
+# . Usage: python BenchmarkGapFile.py [nfiles [nsteps]]
+#
+import os, random, sys, tempfile, time
+
+from MolarisTools.Parser  import GapFile
+
+
+nfiles = int (sys.argv[1]) if len (sys.argv) > 1 else 10
+nsteps = int (sys.argv[2]) if len (sys.argv) > 2 else 100000
+
+
+def WriteGapFile (filename):
+    output = open (filename, "w")
+    output.write ("                  0  0.00100000 0.00    2 0.0000 0.0000   0   0.0000000  -1.0000000\n")
+    for istep in range (nsteps + 1):
+        output.write ("%8d   %12.2f   %14.2f\n" % (istep, random.gauss (-7215., 10.), random.gauss (-1601300., 10.)))
+    output.close ()
+
+
+def Timed (label, function, *arguments, **keywordArguments):
+    start  = time.time ()
+    result = function (*arguments, **keywordArguments)
+    print ("%-32s %8.3f s" % (label, time.time () - start))
+    return result
+
+
+random.seed (12345)
+directory = tempfile.mkdtemp ()
+filenames = [os.path.join (directory, "gap%03d.out" % ifile) for ifile in range (nfiles)]
+print ("Writing %d gap files of %d steps to %s" % (nfiles, nsteps, directory))
+for filename in filenames:
+    WriteGapFile (filename)
+
+gaps = Timed ("Reading gap files"  , lambda: [GapFile (filename, logging=False) for filename in filenames])
+gap  = gaps[0]
+Timed ("Merging gap files"         , gap.Merge, *gaps[1:])
+term = Timed ("Calculating LRA term", gap.CalculateLRATerm, skip=0.1, trim=1000)
+print ("LRA term over %d configurations is %f" % (gap.nsteps, term))
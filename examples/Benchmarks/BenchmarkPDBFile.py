@@ -0,0 +1,49 @@
+#-------------------------------------------------------------------------------
+# . File      : BenchmarkPDBFile.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+# . Times reading a synthetic PDB file of small HETATM residues with
+# . full CONECT records and collecting the bonds of all residues.
+#
+# . Usage: python BenchmarkPDBFile.py [nresidues [filename]]
+#
+import random, sys, time
+
+from MolarisTools.Parser  import PDBFile
+
+
+nresidues = int (sys.argv[1]) if len (sys.argv) > 1 else 50000
+filename  = sys.argv[2] if len (sys.argv) > 2 else "benchmark.pdb"
+
+
+def WritePDB (filename, nresidues, natomsResidue=5):
+    """Write residues made of chains of atoms, each bond is listed in both directions."""
+    output = open (filename, "w")
+    serial = 0
+    bonds  = []
+    for residue in range (nresidues):
+        for atom in range (natomsResidue):
+            serial += 1
+            output.write ("%-6s%5d %-4s %3s %1s%4d    %8.3f%8.3f%8.3f  1.00  0.00\n" % ("HETATM", serial % 100000, "C%d" % atom, "LIG", "A", (residue % 9999) + 1, random.uniform (-99., 99.), random.uniform (-99., 99.), random.uniform (-99., 99.)))
+            if atom > 0:
+                bonds.extend (((serial, serial - 1), (serial - 1, serial)))
+    for (seriala, serialb) in bonds:
+        output.write ("CONECT%5d%5d\n" % (seriala % 100000, serialb % 100000))
+    output.write ("END\n")
+    output.close ()
+
+
+def Timed (label, function, *arguments, **keywordArguments):
+    start  = time.time ()
+    result = function (*arguments, **keywordArguments)
+    print ("%-32s %8.3f s" % (label, time.time () - start))
+    return result
+
+
+random.seed (12345)
+WritePDB (filename, nresidues)
+pdb    = Timed ("Reading PDB file", PDBFile, filename, logLevel=0)
+nbonds = Timed ("Collecting bonds of residues", lambda: sum (residue.nbonds for residue in pdb.residues))
+print ("%d atoms, %d residues, %d bonds (%d within residues)" % (pdb.natoms, pdb.nresidues, pdb.nbonds, nbonds))
@@ -0,0 +1,84 @@
+#-------------------------------------------------------------------------------
+# . File      : BenchmarkTopology.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+# . Times generating angles, torsions and impropers of synthetic branched
+# . alkanes of increasing size. For small sizes, angles are also generated
+# . by comparing all pairs of bonds, as was done before.
+#
+# . Usage: python BenchmarkTopology.py [largest [largestPairwise]]
+#
+import exceptions, sys, time
+
+from MolarisTools.Library  import AminoComponent, AminoAtom
+
+
+largest         = int (sys.argv[1]) if len (sys.argv) > 1 else 3000
+largestPairwise = int (sys.argv[2]) if len (sys.argv) > 2 else 300
+
+
+def MakeAlkane (ncarbons):
+    """Make a chain of carbons with a methyl branch on every third carbon, saturated with hydrogens."""
+    atoms = []
+    bonds = []
+    def Add (label, atomType, bondedTo=None):
+        atoms.append (AminoAtom (atomLabel=label, atomType=atomType, atomCharge=0.))
+        if bondedTo:
+            bonds.append ((bondedTo, label))
+    for i in range (ncarbons):
+        carbon = "C%d" % i
+        Add (carbon, "CT", "C%d" % (i - 1) if i > 0 else None)
+        nhydrogens = 1 if (i % 3 == 1) else 2
+        if i in (0, ncarbons - 1):
+            nhydrogens += 1
+        if i % 3 == 1:
+            Add ("M%d" % i, "CT", carbon)
+            for j in range (3):
+                Add ("HM%d%d" % (i, j), "HC", "M%d" % i)
+        for j in range (nhydrogens):
+            Add ("H%d%d" % (i, j), "HC", carbon)
+    return AminoComponent (serial=1, name="ALK", atoms=atoms, bonds=bonds, groups=[], connect=("", ""), logging=False, title="")
+
+
+def PairwiseAngles (bonds):
+    angles = []
+    for i, (bonda, bondb) in enumerate (bonds):
+        for j, (othera, otherb) in enumerate (bonds):
+            if i != j:
+                angle = None
+                if   bondb == othera:
+                    angle = (bonda, bondb, otherb)
+                elif bonda == otherb:
+                    angle = (othera, bonda, bondb)
+                elif bondb == otherb:
+                    angle = (bonda, bondb, othera)
+                elif bonda == othera:
+                    angle = (otherb, bonda, bondb)
+                if angle:
+                    if (angle not in angles) and (angle[::-1] not in angles):
+                        angles.append (angle)
+    return angles
+
+
+print ("%8s %8s %8s %10s %10s %10s %12s" % ("natoms", "angles", "torsions", "angles (s)", "tors. (s)", "impr. (s)", "pairwise (s)"))
+ncarbons = 10
+while True:
+    component = MakeAlkane (ncarbons)
+    if component.natoms > largest:
+        break
+    timings = []
+    for method in (component.GenerateAngles, component.GenerateTorsions, component.GenerateImpropers):
+        start = time.time ()
+        method (logging=False)
+        timings.append (time.time () - start)
+    pairwise = ""
+    if component.natoms <= largestPairwise:
+        start    = time.time ()
+        angles   = PairwiseAngles (component.bonds)
+        pairwise = "%12.4f" % (time.time () - start)
+        if angles != component.angles:
+            raise exceptions.StandardError ("Angles differ.")
+    print ("%8d %8d %8d %10.4f %10.4f %10.4f %s" % (component.natoms, component.nangles, component.ntorsions, timings[0], timings[1], timings[2], pairwise))
+    ncarbons *= 2
@@ -0,0 +1,126 @@
+#-------------------------------------------------------------------------------
+# . File      : BenchmarkXYZTrajectory.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+#-------------------------------------------------------------------------------
+# . Compares array-based analysis methods of XYZTrajectory with the
+# . loops they replaced, on a synthetic archive of charges and forces.
+#
+# . Usage: python BenchmarkXYZTrajectory.py [nsteps [natoms]]
+#
+import os, random, sys, tempfile, time
+
+from MolarisTools.Parser  import XYZTrajectory
+
+
+nsteps = int (sys.argv[1]) if len (sys.argv) > 1 else 100000
+natoms = int (sys.argv[2]) if len (sys.argv) > 2 else 20
+pairs  = ((2, 1), (5, 4))
+
+
+def WriteArchive (filename):
+    random.seed (12345)
+    output = open (filename, "w")
+    for istep in range (nsteps):
+        output.write ("%d\nStep %d\n" % (natoms, istep))
+        for iatom in range (natoms):
+            values = [random.uniform (-5., 5.) for i in range (7)] + [random.uniform (-1., 1.)]
+            output.write ("C   %8.3f   %8.3f   %8.3f   %8.3f   %8.3f   %8.3f   %8.3f   %8.3f\n" % tuple (values))
+    output.close ()
+
+
+# . Reference implementations based on loops over steps and atoms
+def LoopAverageCharges (steps, merged):
+    averages = []
+    for i in range (natoms):
+        collect = []
+        for step in steps:
+            collect.append (merged.get ((id (step), i), step.atoms[i].charge))
+        averages.append (sum (collect) / len (steps))
+    return averages
+
+
+def LoopAveragePositions (steps):
+    averages = [[0., 0., 0.]] * natoms
+    for step in steps:
+        for (i, atom) in enumerate (step.atoms):
+            (x, y, z) = averages[i]
+            averages[i] = [x + atom.x, y + atom.y, z + atom.z]
+    scale = 1. / len (steps)
+    return [(x * scale, y * scale, z * scale) for (x, y, z) in averages]
+
+
+def LoopMergeCharges (steps):
+    merged = {}
+    for step in steps:
+        for (serialLink, serialParent) in pairs:
+            (link, parent) = (serialLink - 1, serialParent - 1)
+            qlink   = merged.get ((id (step), link  ), step.atoms[link  ].charge)
+            qparent = merged.get ((id (step), parent), step.atoms[parent].charge)
+            merged[(id (step), parent)] = qparent + qlink
+            merged[(id (step), link  )] = 0.
+    return merged
+
+
+def LoopBinCharges (steps, merged, sampling=0.1):
+    atoms = []
+    for i in range (natoms):
+        atoms.append ([merged.get ((id (step), i), step.atoms[i].charge) for step in steps])
+    minc = min ( 999., min (map (min, atoms)))
+    maxc = max (-999., max (map (max, atoms)))
+    spread   = maxc - minc
+    nbins    = int (spread / sampling)
+    sampling = spread / nbins
+    boundaries = []
+    for i in range (nbins):
+        left = i * sampling + minc
+        boundaries.append ((left, left + sampling))
+    atomData = []
+    for charges in atoms:
+        bins = [0] * nbins
+        for charge in charges:
+            for iboundary, (left, right) in enumerate (boundaries):
+                if   iboundary < 1:
+                    if charge >= left and charge <  right:
+                        break
+                elif iboundary > (nbins - 2):
+                    if charge >  left and charge <= right:
+                        break
+                else:
+                    if charge >  left and charge <  right:
+                        break
+            bins[iboundary] += 1
+        atomData.append (bins)
+    return (boundaries, atomData)
+
+
+def Timed (label, function, *arguments):
+    start  = time.time ()
+    result = function (*arguments)
+    print ("%-32s %8.2f s" % (label, time.time () - start))
+    return result
+
+
+filename = os.path.join (tempfile.mkdtemp (), "archive.xyz")
+print ("Writing %d steps of %d atoms to %s" % (nsteps, natoms, filename))
+WriteArchive (filename)
+
+trajectory = Timed ("Reading trajectory"        , XYZTrajectory, filename)
+steps      = trajectory.steps
+Timed ("Building arrays"                        , trajectory._BuildArrays)
+
+merged     = Timed ("Loops: merging charges"    , LoopMergeCharges, steps)
+Timed ("Arrays: merging charges"                , trajectory.MergeLinkAtomCharges, pairs)
+
+charges    = Timed ("Loops: average charges"    , LoopAverageCharges, steps, merged)
+Timed ("Arrays: average charges"                , trajectory.AverageCharges)
+
+positions  = Timed ("Loops: average positions"  , LoopAveragePositions, steps)
+Timed ("Arrays: average positions"              , trajectory.AveragePositions)
+
+bins       = Timed ("Loops: binning charges"    , LoopBinCharges, steps, merged)
+Timed ("Arrays: binning charges"                , trajectory.BinCharges)
+
+identical  = ((charges == trajectory.averageCharges) and (positions == trajectory.averagePositions) and (bins == trajectory.bins))
+print ("Results are %s" % ("identical" if identical else "DIFFERENT"))
@@ -7,14 +7,200 @@
 #-------------------------------------------------------------------------------
 import unittest, sys, os
 
-from MolarisTools.Library  import AminoLibrary
+from MolarisTools.Library  import AminoLibrary, AminoComponent, AminoAtom, AminoGroup, MergeComponents, ResidueIndex
+
+_LIBRARY = os.path.join ("..", "data", "amino98_custom_small.lib")
+
+
+def _PairwiseAngles (bonds):
+    """Generate angles by comparing all pairs of bonds, as was done originally."""
+    angles = []
+    for i, (bonda, bondb) in enumerate (bonds):
+        for j, (othera, otherb) in enumerate (bonds):
+            if i != j:
+                angle = None
+                if   bondb == othera:
+                    angle = (bonda, bondb, otherb)
+                elif bonda == otherb:
+                    angle = (othera, bonda, bondb)
+                elif bondb == otherb:
+                    angle = (bonda, bondb, othera)
+                elif bonda == othera:
+                    angle = (otherb, bonda, bondb)
+                if angle:
+                    if (angle not in angles) and (angle[::-1] not in angles):
+                        angles.append (angle)
+    return angles
+
+
+def _PairwiseTorsions (angles):
+    """Generate torsions by comparing all pairs of angles, as was done originally."""
+    torsions = []
+    for i, (anglea, angleb, anglec) in enumerate (angles):
+        for j, (otherd, othere, otherf) in enumerate (angles):
+            if i != j:
+                torsion = None
+                if   (angleb == otherd) and (anglec == othere):
+                    torsion = (anglea, angleb, anglec, otherf)
+                elif (anglea == othere) and (angleb == otherf):
+                    torsion = (otherd, anglea, angleb, anglec)
+                elif (angleb == otherf) and (anglec == othere):
+                    torsion = (anglea, angleb, anglec, otherd)
+                elif (anglea == othere) and (angleb == otherd):
+                    torsion = (otherf, anglea, angleb, anglec)
+                if torsion:
+                    if (torsion not in torsions) and (torsion[::-1] not in torsions):
+                        torsions.append (torsion)
+    return torsions
+
+
+def _MakeComponent (atoms, bonds, name="TST"):
+    """Make a component from (label, type, charge) triplets and pairs of labels."""
+    aminoAtoms = [AminoAtom (atomLabel=label, atomType=atomType, atomCharge=charge) for (label, atomType, charge) in atoms]
+    return AminoComponent (serial=1, name=name, atoms=aminoAtoms, bonds=list (bonds), groups=[], connect=("", ""), logging=False, title="")
+
+
+def _MakeEthanol (prefix=""):
+    """Make a component of ethanol in two groups, labels of atoms can be prefixed."""
+    component = _MakeComponent (
+        atoms = [(prefix + label, atomType, charge) for (label, atomType, charge) in (("C1", "CT", -0.18), ("H11", "HC", 0.06), ("H12", "HC", 0.06), ("C2", "CT", 0.14), ("O", "OH", -0.66), ("HO", "HO", 0.42))],
+        bonds = [(prefix + labela, prefix + labelb) for (labela, labelb) in (("C1", "H11"), ("C1", "H12"), ("C1", "C2"), ("C2", "O"), ("O", "HO"))],
+        name  = "ETO", )
+    component.groups = [
+        AminoGroup (natoms=3, centralAtom=(prefix + "C1"), radius=3., labels=[prefix + "C1", prefix + "H11", prefix + "H12"], symbol="A"),
+        AminoGroup (natoms=3, centralAtom=(prefix + "O" ), radius=3., labels=[prefix + "C2", prefix + "O"  , prefix + "HO" ], symbol="B"), ]
+    return component
 
 
 class TestAminoLibrary (unittest.TestCase):
     def test_Read (self):
-        library  = AminoLibrary (filename=os.path.join ("..", "data", "amino98_custom_small.lib"), logging=True, verbose=False)
+        library  = AminoLibrary (filename=_LIBRARY, logging=True, verbose=False)
         self.assertEqual (len (library), 153)
 
+    def test_Lazy (self):
+        library  = AminoLibrary (filename=_LIBRARY, logging=False, lazy=True)
+        # . Checking membership does not parse components
+        position = library._nameIndex["MUR"]
+        self.assertTrue  ("MUR" in library)
+        self.assertTrue  (library.has_key (library._keys[position][0]))
+        self.assertFalse ("XXX" in library)
+        self.assertFalse (99999 in library)
+        self.assertEqual (library._components[position], None)
+        self.assertEqual (library["MUR"].label, "MUR")
+        self.assertEqual (library._components.count (None), len (library) - 1)
+        # . Components parsed on access are the same as those of the whole library
+        eager    = AminoLibrary (filename=_LIBRARY, logging=False)
+        self.assertEqual ([vars (component) for component in library.components], [vars (component) for component in eager.components])
+
+    def test_GenerateAngles (self):
+        library  = AminoLibrary (filename=_LIBRARY, logging=False)
+        for component in library.components:
+            component.GenerateAngles (logging=False)
+            self.assertEqual (component.angles, _PairwiseAngles (component.bonds))
+
+    def test_GenerateTorsions (self):
+        library  = AminoLibrary (filename=_LIBRARY, logging=False)
+        for component in library.components:
+            component.GenerateAngles   (logging=False)
+            component.GenerateTorsions (logging=False)
+            self.assertEqual (component.torsions, _PairwiseTorsions (component.angles))
+
+    def test_GenerateImpropers (self):
+        # . Acetamide: the carbonyl carbon and the nitrogen have three neighbors, the methyl carbon has four
+        component = _MakeComponent (
+            atoms = (("C1", "CT", -0.3), ("H1", "HC", 0.1), ("H2", "HC", 0.1), ("H3", "HC", 0.1), ("C2", "C", 0.5), ("O", "O", -0.5), ("N", "N", -0.4), ("HN1", "H", 0.15), ("HN2", "H", 0.15)),
+            bonds = (("C1", "H1"), ("C1", "H2"), ("C1", "H3"), ("C1", "C2"), ("C2", "O"), ("N", "C2"), ("N", "HN1"), ("N", "HN2")), )
+        component.GenerateImpropers (logging=False)
+        self.assertEqual (component.impropers, [("C2", "C1", "O", "N"), ("N", "C2", "HN1", "HN2")])
+        self.assertEqual (component.nimpropers, 2)
+
+    def test_TermsToTypes (self):
+        component = _MakeEthanol ()
+        component.GenerateAngles   (logging=False)
+        component.GenerateTorsions (logging=False)
+        self.assertEqual (component._BondsToTypes (), (
+            [("CT", "HC"), ("CT", "HC"), ("CT", "CT"), ("CT", "OH"), ("OH", "HO")],
+            [("CT", "HC"), ("CT", "CT"), ("CT", "OH"), ("OH", "HO")]))
+        self.assertEqual (component._AnglesToTypes (), (
+            [("HC", "CT", "HC"), ("CT", "CT", "HC"), ("CT", "CT", "HC"), ("CT", "CT", "OH"), ("CT", "OH", "HO")],
+            [("HC", "CT", "HC"), ("CT", "CT", "HC"), ("CT", "CT", "OH"), ("CT", "OH", "HO")]))
+        self.assertEqual (component._TorsionsToTypes (), (
+            [("OH", "CT", "CT", "HC"), ("OH", "CT", "CT", "HC"), ("CT", "CT", "OH", "HO")],
+            [("OH", "CT", "CT", "HC"), ("CT", "CT", "OH", "HO")],
+            [("CT", "CT"), ("CT", "OH")]))
+        # . Changes to the list of atoms clear the table of atoms
+        component.atoms[4] = AminoAtom (atomLabel="O", atomType="OS", atomCharge=-0.5)
+        self.assertEqual (component.atoms.table, None)
+        self.assertEqual (component._BondsToTypes ()[1], [("CT", "HC"), ("CT", "CT"), ("CT", "OS"), ("OS", "HO")])
+        self.assertEqual (component._TorsionsToTypes ()[2], [("CT", "CT"), ("CT", "OS")])
+        component.atoms.append (AminoAtom (atomLabel="X", atomType="XX", atomCharge=0.))
+        self.assertTrue ("X" in component)
+        del component.atoms[-1]
+        self.assertFalse ("X" in component)
+        # . The component keeps a copy of a list of atoms given to it
+        atoms = list (component.atoms)
+        component.atoms = atoms
+        atoms.pop ()
+        self.assertEqual ((component.natoms, component["HO"].atomType), (6, "HO"))
+
+    def test_KillAtom (self):
+        component = _MakeEthanol ()
+        component.KillAtom ("HO")
+        self.assertEqual ([atom.atomLabel for atom in component.atoms], ["C1", "H11", "H12", "C2", "O"])
+        self.assertEqual (component.bonds, [("C1", "H11"), ("C1", "H12"), ("C1", "C2"), ("C2", "O")])
+        self.assertEqual ([(group.natoms, group.centralAtom, group.labels) for group in component.groups], [(3, "C1", ["C1", "H11", "H12"]), (2, "O", ["C2", "O"])])
+        self.assertFalse ("HO" in component)
+        # . Killing a central atom moves the center of its group
+        component = _MakeEthanol ()
+        component.KillAtom ("C1")
+        self.assertEqual ((component.groups[0].centralAtom, component.groups[0].labels), ("H12", ["H11", "H12"]))
+        self.assertEqual (component["C2"].atomType, "CT")
+        self.assertRaises (StandardError, component.KillAtom, "C1")
+
+    def test_ReplaceAtom (self):
+        component = _MakeEthanol ()
+        component.ReplaceAtom ("O", "S", "SH", -0.3)
+        self.assertEqual (component.atoms[4], AminoAtom (atomLabel="S", atomType="SH", atomCharge=-0.3))
+        self.assertEqual (component.bonds, [("C1", "H11"), ("C1", "H12"), ("C1", "C2"), ("C2", "S"), ("S", "HO")])
+        self.assertEqual ((component.groups[1].centralAtom, component.groups[1].labels), ("S", ["C2", "S", "HO"]))
+        self.assertEqual (component["S"].atomType, "SH")
+        self.assertFalse ("O" in component)
+        self.assertEqual (component._BondsToTypes ()[1], [("CT", "HC"), ("CT", "CT"), ("CT", "SH"), ("SH", "HO")])
+
+    def test_MergeComponents (self):
+        merged = MergeComponents (_MakeEthanol (), _MakeEthanol (prefix="X"), logging=False)
+        self.assertEqual ([atom.atomLabel for atom in merged.atoms], ["C1", "H11", "H12", "C2", "O", "HO", "XC1", "XH11", "XH12", "XC2", "XO", "XHO"])
+        self.assertEqual (merged.bonds[5:], [("XC1", "XH11"), ("XC1", "XH12"), ("XC1", "XC2"), ("XC2", "XO"), ("XO", "XHO")])
+        self.assertEqual ([group.labels for group in merged.groups], [["C1", "H11", "H12"], ["C2", "O", "HO"], ["XC1", "XH11", "XH12"], ["XC2", "XO", "XHO"]])
+        self.assertEqual (merged.label, "NEW")
+        self.assertEqual (merged["XO"].atomType, "OH")
+        self.assertEqual (merged._BondsToTypes ()[1], [("CT", "HC"), ("CT", "CT"), ("CT", "OH"), ("OH", "HO")])
+        self.assertRaises (StandardError, MergeComponents, _MakeEthanol (), _MakeEthanol (), logging=False)
+
+    def test_MatchComponents (self):
+        library = AminoLibrary (_LIBRARY, logging=False)
+        index   = ResidueIndex ([library, ], logging=False)
+        # . Components of the same bond graph, that differ only in charges
+        for (label, alternatives) in (("MUR", ["MUP", ]), ("MUP", ["MUR", ]), ("TPA", ["LPR", "RPA"]), ("VPR", [])):
+            component = library[label]
+            match     = index.Match (component)
+            self.assertEqual (match.component.label, label)
+            self.assertEqual ([other.label for other in match.alternatives], alternatives)
+            self.assertEqual (match.indices, range (component.natoms))
+        # . A residue of renamed and reordered atoms
+        component = library["VPR"]
+        labels    = dict ((atom.atomLabel, "%sQ%d" % (atom.atomLabel[0], i)) for (i, atom) in enumerate (component.atoms))
+        residue   = _MakeComponent (
+            atoms = [(labels[atom.atomLabel], atom.atomType, atom.atomCharge) for atom in reversed (component.atoms)] ,
+            bonds = [(labels[labela], labels[labelb]) for (labela, labelb) in component.bonds if (labels.has_key (labela) and labels.has_key (labelb))] ,
+            name  = "UNK", )
+        match     = index.Match (residue)
+        self.assertEqual ((match.component.label, match.alternatives), ("VPR", []))
+        self.assertEqual ([match.mapping[atom.atomLabel] for atom in residue.atoms], [component.atoms[j].atomLabel for j in match.indices])
+        bonds     = set ((labela, labelb) for (labela, labelb) in component.bonds)
+        for (labela, labelb) in residue.bonds:
+            self.assertTrue (((match.mapping[labela], match.mapping[labelb]) in bonds) or ((match.mapping[labelb], match.mapping[labela]) in bonds))
+
 
 #===============================================================================
 # . Main program
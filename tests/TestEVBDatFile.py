@@ -0,0 +1,148 @@
+#-------------------------------------------------------------------------------
+# . File      : TestEVBDatFile.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+# . Test 09   : Reading EVB dat files
+#-------------------------------------------------------------------------------
+import unittest, sys, os, tempfile, shutil, math
+
+from MolarisTools.Utilities             import TokenizeLine
+from MolarisTools.Parser                import EVBDatFile
+from MolarisTools.Parser.EVBDatFile     import EVBContainer
+from MolarisTools.Library               import EVBLibrary
+from MolarisTools.Library.EVBLibrary    import EVBMorsePair
+from MolarisTools.Scripts               import DetermineEVBParameters
+
+_LIBRARY = os.path.join ("..", "data", "evb_poll_clean.lib")
+
+# . Methyl phosphate, atoms of state I and state II
+_ATOMS = (("P0", "P+"), ("O0", "O0"), ("C0", "C0"), ("H0", "H0"), ("O-", "O-"), ("O-", "Op"))
+
+# . Terms as (serials, types, exist), atom 9 is not an EVB atom
+_BONDS    = (((1, 2), (1, 1), (1, 1)), ((2, 3), (2, 2), (1, 1)), ((3, 4), (3, 3), (1, 1)), ((1, 5), (1, 1), (1, 1)), ((6, 1), (1, 1), (1, 0)), ((5, 1), (1, 1), (1, 1)), ((3, 9), (3, 3), (1, 1)))
+_ANGLES   = (((1, 2, 3), (1, 1), (1, 1)), ((2, 3, 4), (1, 1), (1, 1)), ((5, 1, 6), (1, 1), (0, 1)), ((2, 1, 5), (1, 1), (1, 1)))
+_TORSIONS = (((1, 2, 3, 4), (1, 1), (1, 1)), ((5, 1, 2, 3), (1, 1), (1, 1)), ((4, 3, 2, 1), (1, 1), (1, 1)))
+
+
+def _DatLines ():
+    """Lines of an evb.dat file, with an extra column in one line."""
+    natoms = len (_ATOMS)
+    lines  = ["%5d%5d   # of evb atoms, # of resforms\n" % (natoms, 2), "".join (["%5d" % i for i in range (1, natoms + 1)]) + "\n"]
+    for form in range (2):
+        lines.append ("".join (["%5d" % (i + form) for i in range (1, natoms + 1)]) + "\n")
+    for form in range (2):
+        lines.append ("".join (["%6.2f" % (.1 * i) for i in range (1, natoms + 1)]) + "\n")
+    for (label, terms) in (("bonds", _BONDS), ("angles", _ANGLES), ("torsions", _TORSIONS)):
+        lines.append ("%5d %s(atoms,types,exist)\n" % (len (terms), label))
+        for (serials, types, exist) in terms:
+            for values in (serials, types, exist):
+                lines.append ("".join (["%5d" % value for value in values]) + "\n")
+    lines[-2] = lines[-2].rstrip () + "    7\n"
+    lines.append ("    3 morse potential parameters(r0,alpha,diss,f_harm,r_harm,type)\n")
+    for i in range (1, 4):
+        lines.append ("  1.5000  2.0000  90.0000  0.0000  0.0000%5d\n" % i)
+    lines.append ("    1 angle parameters(angle0(radian),force,gausD,gausig,type\n")
+    lines.append ("  1.9100  50.0000  0.0000  0.0000    1\n")
+    lines.append ("    1 torsion parameters(force,n,phase_angle,type)\n")
+    lines.append ("  0.3000  3.0000  0.0000    1\n")
+    return lines
+
+
+def _InputLines ():
+    """Lines of a Molaris input file with EVB atoms, of serial numbers that are not their positions."""
+    return ["        evb_atm   %4d     0.00   %2s          0.00   %2s\n" % (100 + i, typeI, typeII) for (i, (typeI, typeII)) in enumerate (_ATOMS)]
+
+
+def _BaselineContainers (lines, label, natomsTerm, nforms=2):
+    """Read terms three lines at a time, as was done originally."""
+    (start, ) = [i for (i, line) in enumerate (lines) if (" %s(atoms,types,exist)" % label) in line]
+    nterms    = int (lines[start].split ()[0])
+    containers = []
+    for i in range (start + 1, start + 1 + 3 * nterms, 3):
+        containers.append (EVBContainer (
+            serials =   TokenizeLine (lines[i    ], converters=([int, ] * natomsTerm)) ,
+            types   =   TokenizeLine (lines[i + 1], converters=([int, ] * nforms    )) ,
+            exist   =   TokenizeLine (lines[i + 2], converters=([int, ] * nforms    )) , ))
+    return containers
+
+
+def _BaselineParameters (dat, library, state=1):
+    """Collect unique terms one by one and search the library term by term, as was done originally."""
+    atypes = dict ((i, atoms[state - 1]) for (i, atoms) in enumerate (_ATOMS, 1))
+    collect = []
+    for (containers, Same, Get) in (
+            (dat.bonds    , lambda types, other: other in (types, types[::-1])              , lambda types: library.GetBond    (*types     )) ,
+            (dat.angles   , lambda types, other: other[1] == types[1]                       , lambda types: library.GetAngle   (*types     )) ,
+            (dat.torsions , lambda types, other: other[1:3] in (types[1:3], types[2:0:-1])  , lambda types: library.GetTorsion (*types[1:3])) , ):
+        unique = []
+        for container in containers:
+            if container.exist[state - 1] and all ([atypes.has_key (serial) for serial in container.serials]):
+                types = tuple ([atypes[serial] for serial in container.serials])
+                if not any ([Same (types, other) for other in unique]):
+                    unique.append (types)
+        unique.sort ()
+        parameters = []
+        for types in unique:
+            parameter = Get (types)
+            if (len (types) == 2) and parameter and (not isinstance (parameter, EVBMorsePair)):
+                # . Combination rules
+                (morsea, morseb) = parameter
+                parameter = EVBMorsePair (types[0], types[1], math.sqrt (morsea.morseD * morseb.morseD), morsea.radius + morseb.radius, 1.8, 400., 1.4)
+            if parameter:
+                parameters.append (parameter)
+        collect.append (parameters)
+    return collect
+
+
+def _Rounded (parameters):
+    return [tuple ([round (value, 8) if isinstance (value, float) else value for value in parameter]) for parameter in parameters]
+
+
+class TestEVBDatFile (unittest.TestCase):
+    def setUp (self):
+        self.directory = tempfile.mkdtemp ()
+
+    def tearDown (self):
+        shutil.rmtree (self.directory)
+
+    def _Write (self, name, lines):
+        filename = os.path.join (self.directory, name)
+        fo = open (filename, "w")
+        fo.writelines (lines)
+        fo.close ()
+        return filename
+
+    def test_Containers (self):
+        lines = _DatLines ()
+        dat   = EVBDatFile (self._Write ("evb.dat", lines), logging=False)
+        self.assertEqual ((dat.natoms, dat.nforms, dat.types), (6, 2, [[1, 2, 3, 4, 5, 6], [2, 3, 4, 5, 6, 7]]))
+        for (label, natomsTerm) in (("bonds", 2), ("angles", 3), ("torsions", 4)):
+            containers = _BaselineContainers (lines, label, natomsTerm)
+            self.assertEqual (getattr (dat, label), containers)
+            # . Terms of a state
+            terms = dat.GetTerms (label, state=2)
+            self.assertEqual (terms.serials.tolist (), [container.serials for container in containers if container.exist[1]])
+        self.assertTrue (dat.bonds is dat.bonds)
+        self.assertEqual ((len (dat.parBonds), dat.parAngles[0].force, dat.parTorsions[0].n), (3, 50., 3.))
+
+    def test_DetermineEVBParameters (self):
+        filenameDat   = self._Write ("evb.dat", _DatLines ())
+        filenameInput = self._Write ("heat_template.inp", _InputLines ())
+        dat     = EVBDatFile (filenameDat, logging=False)
+        library = EVBLibrary (_LIBRARY, logging=False)
+        for state in (1, 2):
+            found    = DetermineEVBParameters (filenameInput=filenameInput, filenameDat=filenameDat, filenameEVBLibrary=_LIBRARY, state=state, logging=False)
+            expected = _BaselineParameters (dat, library, state=state)
+            self.assertEqual (map (_Rounded, found), map (_Rounded, expected))
+        (bonds, angles, torsions) = found
+        self.assertEqual ([(bond.typea, bond.typeb) for bond in bonds], [("C0", "H0"), ("O0", "C0"), ("P+", "O-"), ("P+", "O0")])
+        self.assertEqual ([angle.evbType for angle in angles], ["P+", "C0", "O0"])
+        self.assertEqual ([(torsion.typea, torsion.typeb) for torsion in torsions], [("P+", "O0")])
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if (__name__ == "__main__"):
+    unittest.main ()
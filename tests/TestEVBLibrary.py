@@ -5,16 +5,80 @@
 # . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
 # . Test 02   : Operations on EVB library
 #-------------------------------------------------------------------------------
-import unittest, sys, os
+import unittest, sys, os, math
 
-from MolarisTools.Library  import EVBLibrary
+from MolarisTools.Library             import EVBLibrary
+from MolarisTools.Library.EVBLibrary  import EVBMorsePair
+
+_LIBRARY = os.path.join ("..", "data", "evb_poll_clean.lib")
+
+
+def _LinearBond (library, typea, typeb):
+    """Search for parameters of a bond entry by entry, applying combination rules to the last one-atom parameters."""
+    for pair in library.pairs:
+        if (pair.typea, pair.typeb) in ((typea, typeb), (typeb, typea)):
+            return pair
+    morse = dict ((atom.evbType, atom) for atom in library.morse)
+    if (typea in morse) and (typeb in morse):
+        return (morse[typea], morse[typeb])
+    return None
+
+
+def _LinearAngle (library, typeb):
+    for angle in library.angles:
+        if angle.evbType == typeb:
+            return angle
+    return None
+
+
+def _LinearTorsion (library, typeb, typec):
+    for torsion in library.torsions:
+        if (torsion.typea, torsion.typeb) in ((typeb, typec), (typec, typeb)):
+            return torsion
+    return None
 
 
 class TestEVBLibrary (unittest.TestCase):
     def test_Read (self):
-        library  = EVBLibrary (filename=os.path.join ("..", "data", "evb_poll_clean.lib"), logging=True)
+        library  = EVBLibrary (filename=_LIBRARY, logging=True)
         self.assertEqual (len (library), 269)
 
+    def test_Resolve (self):
+        library  = EVBLibrary (filename=_LIBRARY, logging=False)
+        self._CompareLinear (library)
+        # . Direct changes of the lists of parameters are found by later searches
+        library.pairs.append (EVBMorsePair ("H0", "X0", 80., 1.1, 2., 400., 1.4))
+        library.angles[0] = library.angles[0]._replace (force=20.)
+        del library.torsions[1:]
+        library.morse = library.morse[:10]
+        self.assertEqual (library.GetBond ("X0", "H0").morseAB, 80.)
+        self.assertEqual (library.GetAngle (None, "H0", None).force, 20.)
+        self.assertEqual (library.Resolve ([("X0", "H0"), (None, "H0", None)]), [library.GetBond ("X0", "H0"), library.GetAngle (None, "H0", None)])
+        self._CompareLinear (library)
+        library.PurgeTypes (["H0", "O0", "P0"])
+        self._CompareLinear (library)
+
+    def _CompareLinear (self, library):
+        types    = sorted (set ([atom.evbType for atom in library.morse] + [pair.typea for pair in library.pairs] + [pair.typeb for pair in library.pairs] + [angle.evbType for angle in library.angles]))
+        bonds    = [(typea, typeb) for typea in types for typeb in types]
+        angles   = [("X", typeb, "X") for typeb in types]
+        torsions = [("X", typeb, typec, "X") for (typeb, typec) in bonds]
+        resolved = library.Resolve (bonds + angles + torsions)
+        for ((typea, typeb), parameter) in zip (bonds, resolved):
+            expected = _LinearBond (library, typea, typeb)
+            self.assertEqual (library.GetBond (typea, typeb), expected)
+            if isinstance (expected, tuple) and (not isinstance (expected, EVBMorsePair)):
+                # . Combination rules
+                (morsea, morseb) = expected
+                self.assertEqual ((parameter.typea, parameter.typeb, parameter.rab), (typea, typeb, morsea.radius + morseb.radius))
+                self.assertAlmostEqual (parameter.morseAB, math.sqrt (morsea.morseD * morseb.morseD))
+            else:
+                self.assertEqual (parameter, expected)
+        for ((typea, typeb, typec), parameter) in zip (angles, resolved[len (bonds):]):
+            self.assertEqual ((parameter, library.GetAngle (typea, typeb, typec)), (_LinearAngle (library, typeb), ) * 2)
+        for ((typea, typeb, typec, typed), parameter) in zip (torsions, resolved[len (bonds) + len (angles):]):
+            self.assertEqual ((parameter, library.GetTorsion (typeb, typec)), (_LinearTorsion (library, typeb, typec), ) * 2)
+
 
 #===============================================================================
 # . Main program
@@ -0,0 +1,84 @@
+#-------------------------------------------------------------------------------
+# . File      : TestEnergyTable.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+# . Test 10   : Tables of energies of MD steps
+#-------------------------------------------------------------------------------
+import unittest, sys, os, tempfile, shutil, collections
+
+import numpy
+
+from MolarisTools.Parser  import EnergyTable
+
+Water  = collections.namedtuple ("Water" , "evdw  eelec")
+System = collections.namedtuple ("System", "etot")
+Evb    = collections.namedtuple ("Evb"   , "egap")
+
+_FAMILIES = (("water", Water), ("system", System), ("evb", Evb))
+
+
+class _MDStep (object):
+    """An MD step, energies of water are missing in the second step of each window."""
+
+    def __init__ (self, i):
+        self.system = System (etot=float (i))
+        self.water  = Water (evdw=(-1. * i), eelec=(2. * i)) if (i % 3) != 1 else None
+
+
+def _FEPSteps ():
+    """Two windows of three MD steps and one of two MD steps."""
+    return [[_MDStep (i) for i in range (start, stop)] for (start, stop) in ((0, 3), (3, 6), (6, 8))]
+
+
+class TestEnergyTable (unittest.TestCase):
+    def setUp (self):
+        self.directory = tempfile.mkdtemp ()
+
+    def tearDown (self):
+        shutil.rmtree (self.directory)
+
+    def test_FromMDSteps (self):
+        table = EnergyTable.FromMDSteps (_FEPSteps (), _FAMILIES, ncomplete=2)
+        # . A family missing in all steps is skipped, missing rows are NaN
+        self.assertEqual (table.families.keys (), ["water", "system"])
+        self.assertEqual ((table.nsteps, table.nwindows, table.ncomplete), (8, 3, 2))
+        self.assertEqual (table.windows.tolist (), [0, 0, 0, 1, 1, 1, 2, 2])
+        water = table.Column ("water", "evdw")
+        self.assertEqual (numpy.isnan (water).tolist (), [(i % 3) == 1 for i in range (8)])
+        self.assertEqual (table.Column ("system", "etot", window=1).tolist (), [3., 4., 5.])
+        self.assertEqual (table.Average ("water", "evdw", window=0), -1.)
+        self.assertRaises (StandardError, table.Column, "evb", "egap")
+        self.assertRaises (StandardError, table.Column, "water", "egap", window=3)
+        # . The running mean skips missing values as the average does
+        running = table.RunningMean ("water", "evdw")
+        self.assertEqual (running.tolist (), [numpy.nanmean (water[:i]) for i in range (1, 9)])
+        self.assertEqual (running[-1], table.Average ("water", "evdw"))
+        self.assertEqual ([summary.mean for summary in table.Summarize ("water", "evdw")], [-1., -4., -6.])
+        self.assertEqual (table.RunningMean ("water", "evdw", window=1).tolist (), [-3., -3., -4.])
+        self.assertEqual (table.RunningMean ("water", "evdw", window=2).tolist (), [-6., -6.])
+        self.assertTrue (numpy.isnan (EnergyTable ({"water" : table.families["water"][1:2]}, [0, 1]).RunningMean ("water", "evdw")[0]))
+
+    def test_NPZ (self):
+        table    = EnergyTable.FromMDSteps (_FEPSteps (), _FAMILIES, ncomplete=2)
+        filename = os.path.join (self.directory, "energies.npz")
+        table.WriteNPZ (filename, logging=False)
+        other    = EnergyTable.FromNPZ (filename)
+        self.assertEqual (other.families.keys (), table.families.keys ())
+        self.assertEqual ((other.offsets.tolist (), other.ncomplete), (table.offsets.tolist (), 2))
+        for (family, rows) in table.families.iteritems ():
+            self.assertEqual (other.families[family].dtype, rows.dtype)
+            for term in rows.dtype.names:
+                self.assertTrue (numpy.array_equal (numpy.isnan (other.Column (family, term)), numpy.isnan (rows[term])))
+                self.assertEqual (numpy.nan_to_num (other.Column (family, term)).tolist (), numpy.nan_to_num (rows[term]).tolist ())
+        # . Archives without the order of families and the number of complete windows
+        numpy.savez (filename, offsets=table.offsets, water=table.families["water"], system=table.families["system"])
+        other    = EnergyTable.FromNPZ (filename)
+        self.assertEqual ((other.families.keys (), other.ncomplete), (["system", "water"], 3))
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if (__name__ == "__main__"):
+    unittest.main ()
@@ -0,0 +1,88 @@
+#-------------------------------------------------------------------------------
+# . File      : TestFreeEnergy.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+# . Test 07   : Free energy estimators
+#-------------------------------------------------------------------------------
+import unittest, sys, os
+
+import numpy
+
+from MolarisTools.Utilities  import ExponentialAveraging, BennettAcceptanceRatio, MBAR, LogSumExp
+
+# . Harmonic states U (x) = k / 2 (x - center)^2 + offset of the same force constant,
+# . so that F(j) - F(i) = offset(j) - offset(i) and work distributions are Gaussian
+_FORCE   = 4.
+_CENTERS = (0., .5, 1.)
+_OFFSETS = (0., 1.5, -.7)
+_SAMPLES = 2000
+
+
+def _Energies (x, kT=1.):
+    """Energies of samples x in all states, an array of shape (nstates, nsamples)."""
+    return numpy.array ([.5 * _FORCE * (x - center) ** 2 + offset for (center, offset) in zip (_CENTERS, _OFFSETS)]) * kT
+
+
+def _Sample (seed=11):
+    """Samples of all states, ordered by state."""
+    random = numpy.random.RandomState (seed)
+    return numpy.concatenate ([random.normal (center, numpy.sqrt (1. / _FORCE), _SAMPLES) for center in _CENTERS])
+
+
+class TestFreeEnergy (unittest.TestCase):
+    def _AssertAgree (self, estimate, exact, error, nerrors=4.):
+        self.assertTrue (0. < error < .2)
+        self.assertTrue (abs (estimate - exact) < nerrors * error, "%f differs from %f by more than %g times %f" % (estimate, exact, nerrors, error))
+
+    def test_LogSumExp (self):
+        values = numpy.array ([[1000., 1000.], [-1000., -1001.]])
+        self.assertAlmostEqual (LogSumExp (values[0]), 1000. + numpy.log (2.))
+        self.assertTrue (numpy.allclose (LogSumExp (values, axis=1), [1000. + numpy.log (2.), -1000. + numpy.log (1. + numpy.exp (-1.))]))
+
+    def test_Estimators (self):
+        x        = _Sample ()
+        energies = _Energies (x)
+        exact    = _OFFSETS[1] - _OFFSETS[0]
+        (samples0, samples1) = (slice (0, _SAMPLES), slice (_SAMPLES, 2 * _SAMPLES))
+        forward  = energies[1, samples0] - energies[0, samples0]
+        reverse  = energies[0, samples1] - energies[1, samples1]
+        exp      = ExponentialAveraging (forward)
+        bar      = BennettAcceptanceRatio (forward, reverse)
+        mbar     = MBAR (energies, [_SAMPLES, ] * 3)
+        self._AssertAgree (exp.deltaF, exact, exp.error)
+        self._AssertAgree (bar.deltaF, exact, bar.error)
+        self._AssertAgree (mbar.f[1], exact, mbar.errors[0, 1])
+        self._AssertAgree (mbar.f[2], _OFFSETS[2] - _OFFSETS[0], mbar.errors[0, 2])
+        # . Estimators agree with each other within their errors
+        self._AssertAgree (exp.deltaF, bar.deltaF, numpy.hypot (exp.error, bar.error))
+        self._AssertAgree (mbar.f[1], bar.deltaF, numpy.hypot (mbar.errors[0, 1], bar.error))
+        self.assertTrue (numpy.allclose (mbar.errors, mbar.errors.T))
+        self.assertTrue (numpy.allclose (numpy.diag (mbar.errors), 0.))
+        # . Units of kT
+        kT       = .6
+        scaled   = BennettAcceptanceRatio (forward * kT, reverse * kT, kT=kT)
+        self.assertAlmostEqual (scaled.deltaF, bar.deltaF * kT, places=8)
+        self.assertAlmostEqual (scaled.error , bar.error  * kT, places=8)
+
+    def test_TwoWindows (self):
+        # . With two states, MBAR is the same as BAR, also with different numbers of samples
+        x        = numpy.concatenate ((_Sample ()[:_SAMPLES], _Sample (seed=5)[_SAMPLES:_SAMPLES + 500]))
+        energies = _Energies (x)[:2]
+        forward  = energies[1, :_SAMPLES] - energies[0, :_SAMPLES]
+        reverse  = energies[0, _SAMPLES:] - energies[1, _SAMPLES:]
+        bar      = BennettAcceptanceRatio (forward, reverse)
+        mbar     = MBAR (energies, [_SAMPLES, 500])
+        self.assertAlmostEqual (mbar.f[0], 0.)
+        self.assertAlmostEqual (mbar.f[1], bar.deltaF, places=6)
+        self.assertAlmostEqual (mbar.errors[0, 1] / bar.error, 1., places=2)
+        self._AssertAgree (bar.deltaF, _OFFSETS[1] - _OFFSETS[0], bar.error)
+        self.assertRaises (StandardError, BennettAcceptanceRatio, forward, [])
+        self.assertRaises (StandardError, MBAR, energies, [_SAMPLES, 400])
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if (__name__ == "__main__"):
+    unittest.main ()
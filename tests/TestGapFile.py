@@ -0,0 +1,98 @@
+#-------------------------------------------------------------------------------
+# . File      : TestGapFile.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+# . Test 06   : Reading gap files
+#-------------------------------------------------------------------------------
+import unittest, sys, os, tempfile, shutil
+
+import numpy
+
+from MolarisTools.Parser  import GapFile, GapFileEVB, GapFileFollower
+
+_HEADER = "                  0  0.00100000 0.00    2 0.0000 0.0000   0   0.0000000  -1.0000000\n"
+
+
+def _GapLines (steps, shift=0.):
+    """Lines of a gap file from an evb_to_qm_map simulation, the gap of step i is 2 * i + shift."""
+    lines = [_HEADER, ]
+    for i in steps:
+        lines.append ("%8d %14.2f %14.2f\n" % (i, -i, i + shift))
+    return lines
+
+
+def _EVBLines (steps):
+    """Lines of a gap file from a regular EVB simulation, terms of state I are i + k and of state II are i + 2 * k."""
+    lines = []
+    for i in steps:
+        lines.append ("%3d  0.00100000 0.00    2 0.0000 1.0000   0   0.0000000  -1.0000000\n" % i)
+        lines.append (" ".join (["%.2f" % (i + k) for k in range (24)]) + "\n")
+        lines.append ("0.00     0.00    0.00 0  0\n")
+        lines.append (" ".join (["%.2f" % (i + 2 * k) for k in range (24)]) + "\n")
+        lines.append ("0.00     0.00    0.00 0  0\n")
+    return lines
+
+
+class TestGapFile (unittest.TestCase):
+    def setUp (self):
+        self.directory = tempfile.mkdtemp ()
+
+    def tearDown (self):
+        shutil.rmtree (self.directory)
+
+    def _Write (self, name, lines):
+        filename = os.path.join (self.directory, name)
+        fo = open (filename, "w")
+        fo.writelines (lines)
+        fo.close ()
+        return filename
+
+    def test_GapFile (self):
+        lines = _GapLines (range (7))
+        # . Extra columns are ignored
+        lines[3] = lines[3].rstrip () + "   99.00\n"
+        gap   = GapFile (self._Write ("gap.out", lines), logging=False)
+        self.assertEqual (gap.reference.tolist (), [-1., -2., -3., -4., -5., -6.])
+        self.assertEqual (gap.gaps.tolist (), [2., 4., 6., 8., 10., 12.])
+        self.assertEqual ([step.target - step.reference for step in gap.steps], gap.gaps.tolist ())
+        self.assertEqual (GapFile (self._Write ("gap.out", lines), logging=False, ignoreStepZero=False).nsteps, 7)
+        # . The mean of gaps of selected configurations
+        self.assertEqual (gap.CalculateLRATerm (), 7.)
+        self.assertEqual (gap.CalculateLRATerm (skip=1, trim=2), 6.)
+        self.assertEqual (gap.CalculateLRATerm (skip=.5), 10.)
+        self.assertRaises (StandardError, gap.CalculateLRATerm, skip=4, trim=2)
+        # . Extending concatenates arrays and rebuilds steps
+        gap.Extend (self._Write ("next.out", _GapLines (range (3), shift=100.)))
+        self.assertEqual (gap.gaps.tolist (), [2., 4., 6., 8., 10., 12., 102., 104.])
+        self.assertEqual (len (gap.steps), 8)
+        other = GapFile (self._Write ("other.out", _GapLines (range (2))), logging=False)
+        gap.Merge (other, other)
+        self.assertEqual (gap.nsteps, 10)
+
+    def test_GapFileEVB (self):
+        lines    = _EVBLines (range (4))
+        # . An incomplete last step is ignored
+        filename = self._Write ("gap.out", lines + lines[:3])
+        gap      = GapFileEVB (filename, logging=False)
+        self.assertEqual ((gap.termsI.shape, gap.termsII.shape), ((3, 24), (3, 24)))
+        self.assertEqual (gap.termsI[:, 0].tolist (), [1., 2., 3.])
+        self.assertEqual (gap.termsII[2].tolist (), [3. + 2. * k for k in range (24)])
+        self.assertEqual (gap.target.tolist (), gap.termsI[:, 16].tolist ())
+        self.assertEqual (gap.reference.tolist (), gap.termsII[:, 16].tolist ())
+        self.assertEqual (gap.CalculateLRATerm (), -16.)
+        # . Arrays agree with reading step by step
+        steps    = GapFileFollower (filename, evb=True).Poll ()
+        self.assertEqual (gap.steps, steps)
+        # . Extending concatenates all arrays
+        gap.Extend (self._Write ("next.out", _EVBLines (range (10, 12))))
+        self.assertEqual ((gap.termsI.shape, gap.termsII.shape, gap.nsteps), ((5, 24), (5, 24), 5))
+        self.assertEqual (gap.termsI[:, 0].tolist (), [1., 2., 3., 10., 11.])
+        self.assertEqual (len (gap.steps), 5)
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if (__name__ == "__main__"):
+    unittest.main ()
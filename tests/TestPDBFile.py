@@ -0,0 +1,157 @@
+#-------------------------------------------------------------------------------
+# . File      : TestPDBFile.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+# . Test 04   : Reading and editing of PDB files
+#-------------------------------------------------------------------------------
+import unittest, sys, os, tempfile
+
+import numpy
+
+from MolarisTools.Parser         import PDBFile
+from MolarisTools.Parser.PDBFile import PDBAtom, _CharacterTable, _Digits, _Integers, _Floats, _ParseBonds
+
+_ATOM_LINES = (
+    "ATOM      1  N   ALA A   1      11.104   6.134  -6.504  1.00  0.00      PRTA\n" ,
+    "ATOM      2  CA  ALA A   1    -999.999-200.000 -30.000  1.00  0.00      PRTA\n" ,
+    "ATOM      3  C   ALA A   1       1.500   2.250   3.125\n"                          ,
+    "ATOM  *****  O   ALA A   1       0.000  -0.001 100.000\n"                          ,
+    "ATOM  *****  OXT ALA A   1      -1.000  -2.000  -3.000  1.00  0.00      PRTA\n" ,
+    "ATOM  99999  N   GLY A  -1       1.000   2.000   3.000  1.00  0.00      PRTA\n" ,
+    "HETATM  123 CL1  LIG B 999      12.000  13.000  14.000"                            ,
+    )
+
+_CONECT_LINES = (
+    "CONECT    1    2\n"                   ,
+    "CONECT    2    1    3               \n" ,
+    "CONECT    3         2         4\n"    ,
+    "CONECT    4    3\n"                   ,
+    "CONECT    5\n"                        ,
+    "CONECT 1000 1001 1002 1003 1004\n"    ,
+    "CONECT 1004 1000\n"                   ,
+    )
+
+
+def _BaselineAtoms (lines):
+    """Parse atom lines with int () and float (), filling unreadable serials with the previous serial plus one."""
+    serials     = []
+    coordinates = []
+    labels      = []
+    for line in lines:
+        try:
+            serial = int (line[6:11])
+        except ValueError:
+            serial = (serials[-1] + 1) if serials else 1
+        serials.append (serial)
+        labels.append (line[12:16].strip ())
+        coordinates.append ([float (line[30:38]), float (line[38:46]), float (line[46:54])])
+    return (serials, labels, coordinates)
+
+
+def _BaselineBonds (lines):
+    """Parse CONECT lines with int (), skipping blank fields."""
+    pairs = []
+    for line in lines:
+        seriala = int (line[6:11])
+        for start in range (11, 31, 5):
+            field = line[start:start + 5].strip ()
+            if field:
+                serialb = int (field)
+                pair    = (min (seriala, serialb), max (seriala, serialb))
+                if pair not in pairs:
+                    pairs.append (pair)
+    return pairs
+
+
+class TestPDBFile (unittest.TestCase):
+    def test_Digits (self):
+        table = _CharacterTable (["  12", "1 2 ", "    ", "-1  ", " 007", "**  "], 4)
+        (values, valid) = _Digits (table)
+        self.assertEqual (valid.tolist (), [True, False, False, False, True, False])
+        self.assertEqual (values[valid].tolist (), [12, 7])
+
+    def test_Integers (self):
+        table = _CharacterTable ([line[22:26] for line in _ATOM_LINES], 4)
+        self.assertEqual (_Integers (table).tolist (), [int (line[22:26]) for line in _ATOM_LINES])
+        table = _CharacterTable (["*****", ], 5)
+        self.assertRaises (ValueError, _Integers, table)
+
+    def test_ParseAtoms (self):
+        (serials, labels, coordinates) = _BaselineAtoms (_ATOM_LINES)
+        table = _CharacterTable (list (_ATOM_LINES), 80)
+        self.assertEqual (_Integers (table[:, 6:11], fillGaps=True).tolist (), serials)
+        self.assertEqual (_Floats (table[:, 30:54], 8).tolist (), coordinates)
+        self.assertEqual (_Floats (table[:0, 30:54], 8).shape, (0, 3))
+        self.assertRaises (ValueError, _Floats, _CharacterTable (["  1.000 abc    2.000"], 24), 8)
+
+    def test_ParseBonds (self):
+        self.assertEqual (_ParseBonds (list (_CONECT_LINES)), _BaselineBonds (_CONECT_LINES))
+        self.assertEqual (_ParseBonds ([]), [])
+
+    def test_Read (self):
+        (serials, labels, coordinates) = _BaselineAtoms (_ATOM_LINES)
+        pdb = self._Read ()
+        self.assertEqual (pdb.serials.tolist (), serials)
+        self.assertEqual (pdb.labels.tolist (), labels)
+        self.assertEqual (pdb.coordinates.tolist (), coordinates)
+        self.assertEqual ([(other.label, other.serial, other.natoms) for other in pdb.residues], [("ALA", 1, 5), ("GLY", -1, 1), ("LIG", 999, 1)])
+        self.assertEqual (pdb.bonds, _BaselineBonds (_CONECT_LINES))
+        self.assertEqual (pdb.residues[0].bonds, [((0, 1, "N"), (1, 2, "CA")), ((1, 2, "CA"), (2, 3, "C")), ((2, 3, "C"), (3, 4, "O"))])
+
+    def test_EditAtoms (self):
+        pdb     = self._Read ()
+        residue = pdb.residues[0]
+        atoms   = residue.atoms
+        atoms[0] = atoms[0]._replace (label="NT")
+        atoms.append (PDBAtom ("HXT", 100000, 1., 1., 1.))
+        del atoms[3]
+        self.assertEqual ([atom.label for atom in residue.atoms], ["NT", "CA", "C", "OXT", "HXT"])
+        self.assertEqual (pdb.residues[1].atoms[0].label, "N")
+        self.assertEqual (pdb.labels.tolist (), ["NT", "CA", "C", "OXT", "HXT", "N", "CL1"])
+        self.assertEqual ([(other.start, other.stop) for other in pdb.residues], [(0, 5), (5, 6), (6, 7)])
+        pdb.residues[1].atoms = []
+        residue.KillAtom ("CA")
+        self.assertEqual (pdb.bonds, [(3, 4), (1000, 1001), (1000, 1002), (1000, 1003), (1000, 1004)])
+        self.assertEqual (pdb.natoms, 5)
+        self.assertEqual (pdb.GetAtom (123).label, "CL1")
+        self.assertEqual (pdb.residues[2].atoms[:], [PDBAtom ("CL1", 123, 12., 13., 14.)])
+        # . Atoms of a residue are a list
+        atoms   = residue.atoms
+        self.assertTrue (isinstance (atoms, list))
+        self.assertEqual ([atom.label for atom in ([pdb.residues[2].atoms[0], ] + atoms + atoms[1:3])], ["CL1", "NT", "C", "OXT", "HXT", "C", "OXT"])
+        del atoms[1:3]
+        atoms *= 2
+        self.assertEqual ([atom.label for atom in residue.atoms], ["NT", "HXT", "NT", "HXT"])
+        self.assertEqual (pdb.labels.tolist (), ["NT", "HXT", "NT", "HXT", "CL1"])
+
+    def test_NearestAtoms (self):
+        pdb = self._Read ()
+        for point in ((0., 0., 0.), (2000., -500., 0.), (-999., -200., -30.)):
+            distances = ((pdb.coordinates - point) ** 2).sum (axis=1)
+            expected  = pdb.serials[numpy.argsort (distances, kind="mergesort")[:3]].tolist ()
+            self.assertEqual ([atom.serial for atom in pdb.NearestAtoms (point, k=3)], expected)
+        self.assertEqual ([atom.label for atom in pdb.AtomsWithin (1500., point=(1000., 0., 0.))], ["N", "C", "O", "OXT", "N", "CL1"])
+
+    def _Read (self):
+        (handle, filename) = tempfile.mkstemp (suffix=".pdb")
+        fo = os.fdopen (handle, "w")
+        for line in _ATOM_LINES:
+            fo.write (line if line.endswith ("\n") else (line + "\n"))
+        fo.write ("TER\n")
+        for line in _CONECT_LINES:
+            fo.write (line)
+        fo.write ("END\n")
+        fo.close ()
+        try:
+            pdb = PDBFile (filename, logLevel=0)
+        finally:
+            os.remove (filename)
+        return pdb
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if (__name__ == "__main__"):
+    unittest.main ()
@@ -0,0 +1,167 @@
+#-------------------------------------------------------------------------------
+# . File      : TestParseCache.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+# . Test 05   : Storing parsed files in the cache
+#-------------------------------------------------------------------------------
+import unittest, sys, os, tempfile, shutil, cPickle
+
+import numpy
+
+from MolarisTools.Utilities      import ParseCache
+from MolarisTools.Parser.PDBFile import PDBAtom
+
+_MODULE = sys.modules["MolarisTools.Utilities.ParseCache"]
+
+
+class _Parsed (object):
+    """An object as left by a parser."""
+    _PARSER_VERSION = 1
+
+    def Fill (self):
+        self.coordinates = numpy.arange (12, dtype=numpy.float64).reshape ((4, 3))
+        self.atoms       = [PDBAtom (label=("C%d" % i), serial=i, x=(i * .5), y=0., z=-1.) for i in range (300)]
+        self.few         = self.atoms[:10]
+        self.title       = "A title"
+        self.table       = {"a" : [1, 2, 3], "b" : None}
+        return self
+
+
+class _Stateful (object):
+    """An object that chooses the attributes to store."""
+
+    def _GetCacheState (self):
+        return {"values" : numpy.ones (3), "count" : 3}
+
+    def _SetCacheState (self, state):
+        self.restored = state
+
+
+class TestParseCache (unittest.TestCase):
+    def setUp (self):
+        self.directory = tempfile.mkdtemp ()
+
+    def tearDown (self):
+        shutil.rmtree (self.directory)
+
+    def _Source (self, name="data.txt", text="1 2 3\n"):
+        filename = os.path.join (self.directory, name)
+        fo = open (filename, "w")
+        fo.write (text)
+        fo.close ()
+        return filename
+
+    def _CacheFiles (self, directory):
+        return sorted ([name for name in os.listdir (directory) if name.endswith (".npz") or name.startswith ("tmp")])
+
+    def test_StoreRestore (self):
+        source   = self._Source ()
+        cache    = ParseCache (directory=os.path.join (self.directory, "cache"))
+        parsed   = _Parsed ().Fill ()
+        cache.Store (parsed, source)
+        restored = _Parsed ()
+        self.assertTrue (cache.Restore (restored, source))
+        for attribute in ("atoms", "few", "title", "table"):
+            self.assertEqual (getattr (restored, attribute), getattr (parsed, attribute))
+        self.assertTrue ((restored.coordinates == parsed.coordinates).all ())
+        self.assertEqual (type (restored.atoms[0]), PDBAtom)
+        # . Only long lists of namedtuples become record arrays
+        (filename, ) = self._CacheFiles (cache.directory)
+        archive = numpy.load (os.path.join (cache.directory, filename))
+        self.assertTrue ("records_atoms" in archive.files)
+        self.assertFalse ("records_few" in archive.files)
+        archive.close ()
+        # . Attributes set by a constructor are kept
+        restored = _Parsed ()
+        restored.title = "Kept"
+        cache.Restore (restored, source)
+        self.assertEqual (restored.title, "Kept")
+
+    def test_CacheState (self):
+        source   = self._Source ()
+        cache    = ParseCache (directory=os.path.join (self.directory, "cache"))
+        cache.Store (_Stateful (), source)
+        restored = _Stateful ()
+        self.assertTrue (cache.Restore (restored, source))
+        self.assertEqual (sorted (restored.restored.keys ()), ["count", "values"])
+        self.assertEqual ((restored.restored["count"], restored.restored["values"].tolist ()), (3, [1., 1., 1.]))
+
+    def test_Invalidate (self):
+        source = self._Source ()
+        for cache in (ParseCache (directory=os.path.join (self.directory, "cache")), ParseCache ()):
+            cache.Store (_Parsed ().Fill (), source, options={"reorder" : True})
+            self.assertTrue  (cache.Restore (_Parsed (), source, options={"reorder" : True}))
+            # . Different options
+            self.assertFalse (cache.Restore (_Parsed (), source, options={"reorder" : False}))
+            self.assertFalse (cache.Restore (_Parsed (), source))
+            # . Different version of the parser
+            _Parsed._PARSER_VERSION = 2
+            try:
+                self.assertFalse (cache.Restore (_Parsed (), source, options={"reorder" : True}))
+            finally:
+                _Parsed._PARSER_VERSION = 1
+            # . Different modification time
+            mtime = os.stat (source).st_mtime
+            os.utime (source, (mtime + 10., mtime + 10.))
+            self.assertFalse (cache.Restore (_Parsed (), source, options={"reorder" : True}))
+        # . Different contents of the same size and modification time, noticed only with checksums
+        mtime  = 1000000000.
+        os.utime (source, (mtime, mtime))
+        cache  = ParseCache (directory=os.path.join (self.directory, "hashed"), useHash=True)
+        cache.Store (_Parsed ().Fill (), source)
+        self._Source (text="3 2 1\n")
+        os.utime (source, (mtime, mtime))
+        self.assertFalse (cache.Restore (_Parsed (), source))
+        self.assertTrue  (ParseCache (directory=os.path.join (self.directory, "hashed")).Restore (_Parsed (), source))
+
+    def test_Evict (self):
+        directory = os.path.join (self.directory, "cache")
+        sources   = [self._Source (name=("data%d.txt" % i)) for i in range (4)]
+        cache     = ParseCache (directory=directory)
+        filenames = []
+        for (i, source) in enumerate (sources[:3]):
+            cache.Store (_Parsed ().Fill (), source)
+            filename = cache._GetCacheFilename (_Parsed (), source)
+            os.utime (filename, (1000. + i, 1000. + i))
+            filenames.append (filename)
+        # . Restoring marks a file as recently used, so that the second file becomes the least recently used one
+        self.assertTrue (cache.Restore (_Parsed (), sources[0]))
+        cache.maxSize = os.stat (filenames[0]).st_size * 3 + 100
+        cache.Store (_Parsed ().Fill (), sources[3])
+        self.assertEqual ([os.path.exists (filename) for filename in filenames], [True, False, True])
+        self.assertTrue (os.path.exists (cache._GetCacheFilename (_Parsed (), sources[3])))
+
+    def test_FailedWrite (self):
+        source = self._Source ()
+        cache  = ParseCache ()
+        def Fail (output, **arrays):
+            output.write ("partial")
+            raise IOError ("No space left on device")
+        savez = _MODULE.numpy.savez
+        _MODULE.numpy.savez = Fail
+        try:
+            cache.Store (_Parsed ().Fill (), source)
+        finally:
+            _MODULE.numpy.savez = savez
+        self.assertEqual (self._CacheFiles (self.directory), [])
+        self.assertFalse (cache.Restore (_Parsed (), source))
+
+    def test_Untrusted (self):
+        source = self._Source ()
+        cache  = ParseCache ()
+        cache.Store (_Parsed ().Fill (), source)
+        filename = cache._GetCacheFilename (_Parsed (), source)
+        os.chmod (filename, 0666)
+        self.assertFalse (cache.Restore (_Parsed (), source))
+        os.chmod (filename, 0600)
+        self.assertTrue (cache.Restore (_Parsed (), source))
+        # . Only classes of MolarisTools can be loaded
+        self.assertRaises (cPickle.UnpicklingError, _MODULE._Loads, "cos\nsystem\n(S'true'\ntR.")
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if (__name__ == "__main__"):
+    unittest.main ()
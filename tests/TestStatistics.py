@@ -0,0 +1,72 @@
+#-------------------------------------------------------------------------------
+# . File      : TestStatistics.py
+# . Program   : MolarisTools
+# . Copyright : USC, Mikolaj Feliks (2015-2018)
+# . License   : GNU GPL v3.0       (http://www.gnu.org/licenses/gpl-3.0.en.html)
+# . Test 08   : Statistics of correlated time series
+#-------------------------------------------------------------------------------
+import unittest, sys, os
+
+import numpy
+
+from MolarisTools.Utilities  import Autocorrelation, StatisticalInefficiency, BlockAveraging, BootstrapMeans, ConfidenceInterval
+
+_PHI     = .8
+_SAMPLES = 100000
+
+
+def _AR1 (phi=_PHI, nsamples=_SAMPLES, seed=0):
+    """An AR(1) series x[t] = phi * x[t - 1] + noise, started from its stationary distribution."""
+    random = numpy.random.RandomState (seed)
+    noise  = random.normal (size=nsamples)
+    series = numpy.empty (nsamples)
+    series[0] = noise[0] / numpy.sqrt (1. - phi ** 2)
+    for t in range (1, nsamples):
+        series[t] = phi * series[t - 1] + noise[t]
+    return series
+
+
+class TestStatistics (unittest.TestCase):
+    def test_Autocorrelation (self):
+        function = Autocorrelation (_AR1 ())
+        self.assertEqual (function[0], 1.)
+        # . The autocorrelation of an AR(1) series decays as phi^t
+        self.assertTrue (numpy.allclose (function[1:4], [_PHI, _PHI ** 2, _PHI ** 3], atol=.02))
+        self.assertEqual (Autocorrelation (numpy.ones (10)).tolist (), [0.] * 10)
+
+    def test_StatisticalInefficiency (self):
+        g = StatisticalInefficiency (_AR1 ())
+        self.assertTrue (abs (g / ((1. + _PHI) / (1. - _PHI)) - 1.) < .15)
+        self.assertTrue (abs (StatisticalInefficiency (_AR1 (phi=0.)) - 1.) < .05)
+        self.assertEqual (StatisticalInefficiency (numpy.ones (10)), 1.)
+        self.assertRaises (StandardError, StatisticalInefficiency, [1., ])
+
+    def test_Errors (self):
+        series   = _AR1 ()
+        # . Analytic standard error of the mean, variance (1 / (1 - phi^2)) times g over the number of samples
+        g        = (1. + _PHI) / (1. - _PHI)
+        analytic = numpy.sqrt (g / ((1. - _PHI ** 2) * _SAMPLES))
+        naive    = series.std (ddof=1) / numpy.sqrt (_SAMPLES)
+        blocks   = BlockAveraging (series)
+        self.assertEqual (blocks.blockSizes[:3].tolist (), [1, 2, 4])
+        self.assertAlmostEqual (blocks.errors[0], naive)
+        means    = BootstrapMeans (series, nresamples=2000, blockSize=(10 * g), seed=1)
+        uncorrelated = BootstrapMeans (series, nresamples=2000, seed=1)
+        # . Errors that ignore correlation are too small, block averaging and block bootstrap find the analytic error
+        self.assertTrue (naive < .5 * analytic)
+        self.assertTrue (uncorrelated.std () < .5 * analytic)
+        self.assertTrue (abs (blocks.error / analytic - 1.) < .25)
+        self.assertTrue (abs (means.std () / analytic - 1.) < .25)
+        (lower, upper) = ConfidenceInterval (means)
+        self.assertTrue (lower < series.mean () < upper)
+        self.assertTrue ((upper - lower) > 2. * analytic)
+        # . Resamples are reproducible with a seed
+        self.assertEqual (BootstrapMeans (series[:100], nresamples=5, blockSize=3, seed=2).tolist (), BootstrapMeans (series[:100], nresamples=5, blockSize=3, seed=2).tolist ())
+        self.assertRaises (StandardError, BlockAveraging, series[:7])
+
+
+#===============================================================================
+# . Main program
+#===============================================================================
+if (__name__ == "__main__"):
+    unittest.main ()